@@ -0,0 +1,284 @@
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from typing import Any, AsyncIterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+SYLLABLES   = ['ka', 'lo', 'mi', 'ra', 'ven', 'tor', 'sel', 'an', 'dri', 'pu', 'lex', 'mor', 'ta', 'qui', 'ber', 'no', 'sha', 'vel', 'cor', 'fin',
+               'gra', 'ho', 'zen', 'ul', 'mar', 'ti', 'bro', 'ne', 'sar', 'dal', 'pe', 'ri', 'wan', 'ost', 'el', 'gu', 'fra', 'li', 'mon', 'ys']
+RANK_NAMES  = ['Family', 'Genre', 'Style', 'Movement', 'Period', 'Technique', 'Medium', 'School', 'Form', 'Region', 'Type', 'Subtype', 'Variety',
+               'Class', 'Order', 'Tradition', 'Material', 'Function', 'Origin', 'Scale']
+WORDS       = ['structure', 'origin', 'purpose', 'material', 'form', 'history', 'usage', 'tradition', 'method', 'quality', 'context', 'practice',
+               'classification', 'variation', 'property', 'relation', 'element', 'feature', 'pattern', 'principle']
+
+# Exception raised by the fake chat model for the injected failures (a server error, retried by the rate limiter)
+class FakeModelError(Exception):
+    status_code = 503
+
+# Class for the deterministic fake chat model of the offline benchmarks.
+#
+# The model recognizes the prompt templates of src/prompts/prompt_templates.py and returns responses
+# in their expected formats (pseudo-word concept names, definitions, ranks lists, +/- verifications),
+# so the whole pipeline runs without the OpenAI API. Every response depends only on the seed, the
+# prompt and how many times the same prompt was sent before, so a run is reproducible regardless of
+# the concurrency. token_usage is reported in response_metadata like ChatOpenAI (about 4 characters per token).
+# Streamed responses come in chunks of one such token, spread over the latency, with the usage in the last chunk.
+#   branching       - subconcepts per generated list
+#   ranks_lists     - taxonomical ranks lists returned by the ranks optimization
+#   ranks_per_list  - ranks per ranks list (taxonomy depth)
+#   accept_rate     - probability of a '+' verification
+#   redundancy_rate - probability of a candidate being reported as redundant
+#   latency         - mean response latency in seconds (+- latency_jitter of it)
+#   failure_rate    - probability of a FakeModelError instead of a response
+#   malformed_rate  - probability of a malformed answer: numbered list items or '+.' verdicts in the text answers,
+#                     code fences, numbered names or a missing closing brace in the JSON answers
+# With a response_format (the structured-output mode) the answers are JSON objects of the requested schema,
+# and the repair requests get the invalid answer back with its format fixed.
+# The provider's prompt cache is simulated like OpenAI's: the longest prompt prefix of prompt_cache_min_tokens plus a multiple
+# of prompt_cache_increment tokens that an earlier request of the model already had is reported as cached_tokens.
+class FakeChatModel(BaseChatModel):
+    model_name: str         = "fake-chat-model"
+    seed: int               = 0
+    branching: int          = 5
+    ranks_lists: int        = 1
+    ranks_per_list: int     = 3
+    accept_rate: float      = 0.9
+    redundancy_rate: float  = 0.05
+    latency: float          = 0.0
+    latency_jitter: float   = 0.5
+    failure_rate: float     = 0.0
+    malformed_rate: float   = 0.0
+    calls: int              = 0
+    failures: int           = 0
+    occurrences: dict       = {}
+    prompt_cache_min_tokens: int    = 1024
+    prompt_cache_increment: int     = 128
+    prompt_prefixes: dict   = {}
+    lock: Any               = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    # Method returning the random generator of a request (seed, prompt and occurrence of the same prompt)
+    def request_random(self, text) -> random.Random:
+        if self.lock is None:
+            self.lock = threading.Lock()
+        digest = hashlib.sha256(f"{self.seed}\n{text}".encode('utf-8')).hexdigest()
+        with self.lock:
+            self.calls += 1
+            occurrence = self.occurrences.get(digest, 0)
+            self.occurrences[digest] = occurrence + 1
+        return random.Random(f"{digest}:{occurrence}")
+
+    def pseudo_word(self, rng) -> str:
+        return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+
+    def concept_name(self, rng, rank) -> str:
+        return f"{self.pseudo_word(rng)} {self.pseudo_word(rng)} {rank.strip() or 'Concept'}"
+
+    def sentence(self, rng, words) -> str:
+        return ' '.join(rng.choice(WORDS) for _ in range(max(3, words))).capitalize()
+
+    def subconcepts(self, rng, rank) -> list:
+        return [self.concept_name(rng, rank) for _ in range(self.branching)]
+
+    def redundant(self, rng, candidates) -> str:
+        return ', '.join(candidate for candidate in candidates if rng.random() < self.redundancy_rate)
+
+    def verdict(self, rng) -> str:
+        return '+' if rng.random() < self.accept_rate else '-'
+
+    # Method generating the response of a prompt
+    def respond(self, messages, rng) -> str:
+        system = messages[0].content
+        human = messages[1].content if len(messages) > 1 else ""
+        amount = re.search(r'exactly (\d+)', human)
+        amount = int(amount.group(1)) if amount else 5
+        rank = re.search(r'in the context of \\?"(.*?)\\?"', human)
+        rank = rank.group(1) if rank else ""
+        if "Queries:\n" in human:
+            queries = re.findall(r'^\[(\d+)\]', human.split("Queries:\n")[1], re.M)
+            return '\n'.join(f"[{number}] {self.verdict(rng)}" for number in queries)
+        if "Concepts:\n" in human:
+            concepts = re.findall(r'^\[(\d+)\]', human.split("Concepts:\n")[1], re.M)
+            return '\n'.join(f"[{number}] " + ', '.join(self.subconcepts(rng, rank)) for number in concepts)
+        if "sub-concept candidates:\n" in human:
+            lists = re.findall(r'^\[(\d+)\] (.*)$', human.split("sub-concept candidates:\n")[1], re.M)
+            return '\n'.join(f"[{number}] " + candidates.replace("'", "") for number, candidates in lists)
+        if "taxonomy checker" in system:
+            return self.verdict(rng)
+        if "redundant subcategory" in system:
+            candidates = re.search(r'The list of candidates is "(.*)"\. Provide', human, re.S)
+            return self.redundant(rng, re.findall(r"'(.*?)'", candidates.group(1)) if candidates else [])
+        if "List only the most important subconcepts" in human:
+            return ', '.join(self.subconcepts(rng, rank))
+        if "sub-concept candidates:" in human:
+            candidates = re.search(r'sub-concept candidates: (.*)\. Provide true', human, re.S)
+            return candidates.group(1).replace("'", "") if candidates else ""
+        if "word length definition" in human:
+            length = re.search(r'Give a (\d+) word', human)
+            return self.sentence(rng, min(int(length.group(1)) if length else 10, 40))
+        if "different descriptions" in human or "different definitions" in human:
+            return '; '.join(self.sentence(rng, 12) for _ in range(amount))
+        if "differentiation criteria for the taxonomical classification" in human:
+            return ', '.join(rng.sample(WORDS, 4))
+        if "Redundant list IDs" in str(messages[-1].content) or "Candidates lists are" in human:
+            return ""
+        if "return ranks in a comma-separated list" in human:
+            return ', '.join(rng.sample(RANK_NAMES, self.ranks_per_list))
+        if "taxonomical ranks lists in a semicolon-separated format" in human:
+            return '; '.join(', '.join(rng.sample(RANK_NAMES, self.ranks_per_list)) for _ in range(self.ranks_lists))
+        if "Answer only with just yes or no" in human or "Answer with just yes or no" in human:
+            return "yes"
+        if "return only the root concept's name" in human:
+            return self.pseudo_word(rng)
+        return self.sentence(rng, 8)
+
+    # Method converting the text response of a prompt into the JSON answer of a schema
+    def structured_value(self, schema, content) -> dict:
+        properties = schema.get('properties', {})
+        split = lambda text, separator: [item.strip() for item in text.split(separator) if item.strip()]
+        if 'answer' in properties:
+            return {'answer': 'yes' in content.lower()}
+        if 'accepted' in properties:
+            if properties['accepted'].get('type') == 'array':
+                return {'accepted': [verdict == '+' for verdict in re.findall(r'^\[\d+\] ([+-])', content, re.M)]}
+            return {'accepted': content.strip() == '+'}
+        if 'lists' in properties:
+            return {'lists': [split(section, ',') for section in re.findall(r'^\[\d+\] (.*)$', content, re.M)]}
+        if 'ranks_lists' in properties:
+            return {'ranks_lists': [split(ranks, ',') for ranks in content.split(';')]}
+        if 'ids' in properties:
+            return {'ids': [int(number) for number in re.findall(r'\d+', content)]}
+        if 'text' in properties:
+            return {'text': content}
+        return {'items': split(content, ';' if '; ' in content else ',')}
+
+    # Method returning the JSON schema requested by the structured-output mode (None for a text request)
+    def requested_schema(self, messages, response_format):
+        if not response_format:
+            return None
+        if response_format.get('type') == 'json_schema':
+            return response_format['json_schema']['schema']
+        schema = re.search(r'(\{.*\})\s*$', messages[-1].content, re.S)
+        return json.loads(schema.group(1)) if schema else {}
+
+    # Method answering a repair request: the invalid answer with its format fixed
+    def repair(self, human) -> str:
+        answer = re.search(r'Invalid answer: (.*)\nValidation errors:', human, re.S)
+        answer = re.sub(r'^```(?:json)?\s*|\s*```$', '', answer.group(1).strip() if answer else "{}")
+        answer = re.sub(r'"\s*\d+[.)]\s+', '"', answer)
+        return answer + '}'*(answer.count('{') - answer.count('}'))
+
+    # Method malforming a text answer the way a model occasionally does (numbered items, punctuated verdicts)
+    def malform_text(self, content) -> str:
+        if content.strip() in ('+', '-'):
+            return content.strip() + '.'
+        if ', ' in content and '\n' not in content:
+            return ', '.join(f"{i + 1}. {item}" for i, item in enumerate(content.split(', ')))
+        return content
+
+    # Method malforming a JSON answer (code fences are fixed locally, numbered names and a missing brace need a repair)
+    def malform_json(self, content, rng) -> str:
+        kind = rng.randint(0, 2)
+        if kind == 0:
+            return f"```json\n{content}\n```"
+        if kind == 1 and re.search(r'\["[^"\d]', content):
+            return re.sub(r'\["', '["1. ', content, count = 1)
+        return content[:-1]
+
+    # Method returning the amount of prompt tokens read from the simulated prompt cache (and caching the prefixes of the prompt)
+    def cached_tokens(self, text) -> int:
+        boundaries = range(self.prompt_cache_min_tokens, len(text)//4 + 1, max(1, self.prompt_cache_increment))
+        digests = [hashlib.sha256(text[:tokens*4].encode('utf-8')).hexdigest() for tokens in boundaries]
+        cached = 0
+        with self.lock:
+            for tokens, digest in zip(boundaries, digests):
+                if digest in self.prompt_prefixes:
+                    cached = tokens
+                self.prompt_prefixes[digest] = True
+        return cached
+
+    def make_result(self, messages, rng, max_tokens, response_format = None) -> ChatResult:
+        if rng.random() < self.failure_rate:
+            self.failures += 1
+            raise FakeModelError("injected failure")
+        schema = self.requested_schema(messages, response_format)
+        if schema is not None and "strict JSON formatter" in messages[0].content:
+            content = self.repair(messages[-1].content)
+        elif schema is not None:
+            # the schema instructions are the last message of a structured request
+            content = json.dumps(self.structured_value(schema, self.respond(messages[:-1], rng)), ensure_ascii = False)
+            if self.malformed_rate and rng.random() < self.malformed_rate:
+                content = self.malform_json(content, rng)
+        else:
+            content = self.respond(messages, rng)
+            if self.malformed_rate and rng.random() < self.malformed_rate:
+                content = self.malform_text(content)
+        finish_reason = 'stop'
+        if max_tokens and len(content) > max_tokens*4:
+            content = content[:max_tokens*4]
+            finish_reason = 'length'
+        prompt_tokens = sum(len(message.content) for message in messages)//4 + 3*len(messages)
+        completion_tokens = max(1, len(content)//4)
+        token_usage = {'completion_tokens': completion_tokens, 'prompt_tokens': prompt_tokens, 'total_tokens': completion_tokens + prompt_tokens}
+        cached_tokens = self.cached_tokens(''.join(message.content for message in messages))
+        if cached_tokens:
+            token_usage['prompt_tokens_details'] = {'cached_tokens': min(cached_tokens, prompt_tokens)}
+        message = AIMessage(content = content, response_metadata = {'token_usage': token_usage, 'model_name': self.model_name, 'finish_reason': finish_reason})
+        return ChatResult(generations = [ChatGeneration(message = message)])
+
+    def delay(self, rng) -> float:
+        return max(0.0, self.latency*(1 + self.latency_jitter*(2*rng.random() - 1)))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager = None, **kwargs: Any) -> ChatResult:
+        rng = self.request_random('\n'.join(message.content for message in messages))
+        if self.latency:
+            time.sleep(self.delay(rng))
+        return self.make_result(messages, rng, kwargs.get('max_tokens'), kwargs.get('response_format'))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager = None, **kwargs: Any) -> ChatResult:
+        rng = self.request_random('\n'.join(message.content for message in messages))
+        if self.latency:
+            await asyncio.sleep(self.delay(rng))
+        return self.make_result(messages, rng, kwargs.get('max_tokens'), kwargs.get('response_format'))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        rng = self.request_random('\n'.join(message.content for message in messages))
+        delay = self.delay(rng) if self.latency else 0.0
+        message = self.make_result(messages, rng, kwargs.get('max_tokens'), kwargs.get('response_format')).generations[0].message
+        pieces = [message.content[i:i + 4] for i in range(0, len(message.content), 4)]
+        # a fifth of the latency until the first token, the rest spread over bursts of 8 tokens
+        if delay:
+            await asyncio.sleep(delay/5)
+        for i, piece in enumerate(pieces):
+            if delay and i % 8 == 0:
+                await asyncio.sleep(delay*4/5*min(8, len(pieces) - i)/len(pieces))
+            yield ChatGenerationChunk(message = AIMessageChunk(content = piece))
+        token_usage = message.response_metadata['token_usage']
+        usage_metadata = {'input_tokens': token_usage['prompt_tokens'], 'output_tokens': token_usage['completion_tokens'], 'total_tokens': token_usage['total_tokens']}
+        if 'prompt_tokens_details' in token_usage:
+            usage_metadata['input_token_details'] = {'cache_read': token_usage['prompt_tokens_details']['cached_tokens']}
+        yield ChatGenerationChunk(message = AIMessageChunk(content = "", usage_metadata = usage_metadata,
+                                                           response_metadata = {'model_name': self.model_name, 'finish_reason': message.response_metadata['finish_reason']}))
+
+# Function to create the three fake models of the pipeline (generate new, re-generate, verify) sharing the settings
+def init_fake_models(seed = 0, **settings):
+    return tuple(FakeChatModel(seed = seed + i, occurrences = {}, prompt_prefixes = {}, **settings) for i in range(3))
+
+#EXAMPLE USAGE:
+#______________________
+#from src.benchmarks.fake_chat_model import init_fake_models
+#from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+#model_generate_new, model_re_generate, model_verify = init_fake_models(seed = 42, branching = 5, latency = 0.2, failure_rate = 0.01)
+#tax_t = construct_taxonomy("Art", model_generate_new, model_re_generate, model_verify)
+#tax_t = iterate_level(tax_t, 0, model_generate_new, model_re_generate, model_verify, max_concurrency = 16)
+#______________________
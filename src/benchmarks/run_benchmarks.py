@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import datetime
+import contextlib
+import subprocess
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Benchmark scenarios: the fake models branch `branching` times per concept over `ranks_per_list` levels,
+# the expansion stops when the taxonomy has `target_concepts` concepts
+SCENARIOS = {
+    'small':    {'target_concepts': 10,     'branching': 3,     'ranks_lists': 1,   'ranks_per_list': 2,    'max_concurrency': 1,   'batch_size': 1,    'persistence': 'pickle',   'visualize': True},
+    'medium':   {'target_concepts': 1000,   'branching': 10,    'ranks_lists': 1,   'ranks_per_list': 3,    'max_concurrency': 16,  'batch_size': 1,    'persistence': 'journal',  'visualize': True},
+    'large':    {'target_concepts': 100000, 'branching': 10,    'ranks_lists': 1,   'ranks_per_list': 5,    'max_concurrency': 64,  'batch_size': 1,    'persistence': 'journal',  'visualize': True},
+}
+
+# Helper function returning the bytes written by the process so far (None where /proc is not available)
+def bytes_written():
+    try:
+        with open('/proc/self/io') as file:
+            for line in file:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+# Helper function returning the peak resident set size of the process in bytes (None without the resource module)
+def peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak*1024
+
+# Helper function measuring the wall time of a call, returns (result, seconds)
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def file_size(path):
+    return os.path.getsize(path) if path and os.path.exists(path) else None
+
+# Function to run a single scenario (in the current process, inside a temporary working directory)
+def run_scenario(name, scenario, seed = 0, latency = 0.0, failure_rate = 0.0, root_concept = "Art", stream_subconcepts = False, redundancy_filter = None, structured_output = None, malformed_rate = 0.0, prompt_cache_min_tokens = 1024, trace = False, speculation = None, adaptive_retries = False) -> dict:
+    from src.benchmarks.fake_chat_model import init_fake_models
+    from src.core.prompt_metrics import PromptMetrics, MeasuredChatModel
+    from src.core.tracing import Tracer, TracedChatModel
+    from src.core.taxonomy_model import load_taxonomy
+    from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+    from src.core.redundancy_filter import LexicalRedundancyFilter
+    from src.core.speculation import SpeculationPolicy
+    from src.core.retry_policy import AdaptiveRetryPolicy
+    from src.core.structured_output import structured_output_metrics
+    from src.visualisation.visualisation_functions import render_taxonomy
+    from src.visualisation.graph_export import export_taxonomy_graph
+
+    log = logging.getLogger(f"benchmark.{name}")
+    log.setLevel(logging.WARNING)
+    models = init_fake_models(seed = seed, branching = scenario['branching'], ranks_lists = scenario['ranks_lists'], ranks_per_list = scenario['ranks_per_list'],
+                              latency = latency, failure_rate = failure_rate, malformed_rate = malformed_rate, prompt_cache_min_tokens = prompt_cache_min_tokens)
+    working_directory = tempfile.mkdtemp(prefix = f"taxonomy_benchmark_{name}_")
+    tracer = Tracer(os.path.join(working_directory, "spans.jsonl"), prompt_log_sample_rate = 0.0, log = log) if trace else None
+    prompt_metrics = PromptMetrics()
+    models = tuple(MeasuredChatModel(model, prompt_metrics) for model in models)
+    if tracer:
+        models = tuple(TracedChatModel(model, tracer) for model in models)
+    previous_directory = os.getcwd()
+    timings = {}
+    result = {'scenario': name, 'config': dict(scenario, seed = seed, latency = latency, failure_rate = failure_rate, stream_subconcepts = stream_subconcepts, redundancy_filter = redundancy_filter,
+                                             structured_output = structured_output, malformed_rate = malformed_rate, prompt_cache_min_tokens = prompt_cache_min_tokens, trace = trace, speculation = speculation, adaptive_retries = adaptive_retries)}
+    local_redundancy_filter = LexicalRedundancyFilter(mode = redundancy_filter, log = log) if redundancy_filter else None
+    speculation_policy = SpeculationPolicy(max_waste = speculation, log = log) if speculation is not None else None
+    retry_policy = AdaptiveRetryPolicy(seed = seed, log = log) if adaptive_retries else None
+    structured_output_metrics.reset()
+    written_before = bytes_written()
+    try:
+        os.chdir(working_directory)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            taxonomy, timings['construct_taxonomy'] = timed(construct_taxonomy, root_concept, *models, log = log, persistence = scenario['persistence'], max_concurrency = scenario['max_concurrency'], structured_output = structured_output, tracer = tracer)
+            construct_calls = sum(model.calls for model in models)
+
+            timings['iterate_level'] = []
+            while len(taxonomy.concepts) < scenario['target_concepts'] and taxonomy.uninspected_concepts and taxonomy.uninspected_concepts[0]:
+                before = len(taxonomy.concepts)
+                taxonomy, seconds = timed(iterate_level, taxonomy, 0, *models, max_iter = scenario['target_concepts'], log = log,
+                                          max_concurrency = scenario['max_concurrency'], batch_size = scenario['batch_size'], stream_subconcepts = stream_subconcepts, redundancy_filter = local_redundancy_filter, structured_output = structured_output, tracer = tracer, speculation = speculation_policy, retry_policy = retry_policy)
+                timings['iterate_level'].append(seconds)
+                if len(taxonomy.concepts) == before:
+                    break
+
+            taxonomy_path, timings['save'] = timed(taxonomy.save)
+            taxonomy.close_journal()
+            loaded, timings['load_taxonomy'] = timed(load_taxonomy, taxonomy_path)
+            loaded.close_journal()
+            owl_path, timings['export_to_owl'] = timed(taxonomy.export_to_owl)
+            if scenario['visualize']:
+                _, timings['render_taxonomy'] = timed(render_taxonomy, taxonomy, "taxonomy.png", max_nodes_per_level = 2000)
+            else:
+                timings['render_taxonomy'] = None
+            _, timings['export_taxonomy_graph'] = timed(export_taxonomy_graph, taxonomy, "taxonomy.graphml")
+
+        calls = sum(model.calls for model in models)
+        accepted = len(taxonomy.concepts) - 1
+        written_after = bytes_written()
+        result.update({
+            'concepts':                         len(taxonomy.concepts),
+            'unknown_concepts':                 sum(len(concepts) for concepts in taxonomy.unknown_concepts),
+            'llm_calls':                        calls,
+            'llm_calls_construct':              construct_calls,
+            'llm_failures':                     sum(model.failures for model in models),
+            'llm_calls_per_accepted_concept':   (calls - construct_calls)/accepted if accepted else None,
+            'token_usage':                      taxonomy.token_usage,
+            'token_usage_by_stage':             taxonomy.token_usage_by_stage,
+            'redundancy_filter':                local_redundancy_filter.stats() if local_redundancy_filter else None,
+            'speculation':                      speculation_policy.stats() if speculation_policy else None,
+            'retry_policy':                     retry_policy.stats() if retry_policy else None,
+            'structured_output':                structured_output_metrics.stats(),
+            'prompt_metrics':                   prompt_metrics.stats()['total'],
+            'tracing':                          dict(spans = tracer.spans, levels = tracer.stats()) if tracer else None,
+            'timings':                          dict(timings, iterate_level_total = sum(timings['iterate_level']), total = sum(v for k, v in timings.items() if isinstance(v, float)) + sum(timings['iterate_level'])),
+            'bytes_written':                    written_after - written_before if written_before is not None and written_after is not None else None,
+            'taxonomy_file_bytes':              file_size(taxonomy_path),
+            'owl_file_bytes':                   file_size(owl_path),
+            'peak_rss_bytes':                   peak_rss(),
+        })
+    finally:
+        if tracer:
+            tracer.close()
+        os.chdir(previous_directory)
+        shutil.rmtree(working_directory, ignore_errors = True)
+    return result
+
+# Function to run the scenario in a fresh process, so the peak RSS is measured per scenario
+def run_scenario_isolated(name, scenario, **kwargs) -> dict:
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_scenario, (name, scenario), kwargs)
+
+# Helper function returning the version of the code being benchmarked (git commit if available)
+def code_version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, timeout = 10).stdout.strip() or None
+    except Exception:
+        return None
+
+# Function to run the benchmark suite, returns the JSON-serializable report
+def run_benchmarks(scenarios = ('small', 'medium'), seed = 0, latency = 0.0, failure_rate = 0.0, isolated = True, stream_subconcepts = False, redundancy_filter = None, structured_output = None, malformed_rate = 0.0, prompt_cache_min_tokens = 1024, trace = False, speculation = None, adaptive_retries = False, log = None) -> dict:
+    if not log:
+        log = logging.getLogger("run_benchmarks")
+        logging.basicConfig(level=logging.INFO)
+    report = {
+        'created_at':   datetime.datetime.now().isoformat(),
+        'version':      code_version(),
+        'python':       platform.python_version(),
+        'platform':     platform.platform(),
+        'scenarios':    {},
+    }
+    for name in scenarios:
+        log.info(f"running benchmark scenario '{name}': {SCENARIOS[name]}")
+        runner = run_scenario_isolated if isolated else run_scenario
+        report['scenarios'][name] = runner(name, SCENARIOS[name], seed = seed, latency = latency, failure_rate = failure_rate, stream_subconcepts = stream_subconcepts, redundancy_filter = redundancy_filter,
+                                           structured_output = structured_output, malformed_rate = malformed_rate, prompt_cache_min_tokens = prompt_cache_min_tokens, trace = trace, speculation = speculation, adaptive_retries = adaptive_retries)
+        log.info(f"scenario '{name}' finished: {report['scenarios'][name]['timings']}")
+    return report
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Offline benchmarks of the taxonomy construction pipeline (deterministic fake chat models).")
+    parser.add_argument('--scenarios', nargs = '+', default = ['small', 'medium'], choices = list(SCENARIOS))
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--latency', type = float, default = 0.0, help = "mean fake LLM latency in seconds")
+    parser.add_argument('--failure-rate', type = float, default = 0.0, help = "probability of an injected LLM failure")
+    parser.add_argument('--stream-subconcepts', action = 'store_true', help = "stream the subconcepts lists (incremental parsing and early cutoff)")
+    parser.add_argument('--redundancy-filter', default = None, choices = ['active', 'shadow'], help = "run the local lexical redundancy filter before the LLM redundancy call")
+    parser.add_argument('--structured-output', default = None, choices = ['json_schema', 'json_object'], help = "ask for JSON answers validated locally (repaired with a targeted request when invalid)")
+    parser.add_argument('--malformed-rate', type = float, default = 0.0, help = "probability of a malformed fake LLM answer")
+    parser.add_argument('--prompt-cache-min-tokens', type = int, default = 1024, help = "shortest prompt prefix cached by the simulated provider prompt cache")
+    parser.add_argument('--trace', action = 'store_true', help = "record the spans of the pipeline (their stats per level are added to the report)")
+    parser.add_argument('--speculative', type = float, default = None, metavar = 'MAX_WASTE', help = "overlap the verification with the redundancy call and the next attempt, wasting at most this share of the tokens")
+    parser.add_argument('--adaptive-retries', action = 'store_true', help = "tune the candidate count, max_tokens and retry cap per level from the observed acceptance and redundancy rates")
+    parser.add_argument('--in-process', action = 'store_true', help = "run all scenarios in this process (peak RSS is then cumulative)")
+    parser.add_argument('--output', default = None, help = "path of the JSON report (printed to stdout if not given)")
+    args = parser.parse_args(argv)
+    report = run_benchmarks(args.scenarios, seed = args.seed, latency = args.latency, failure_rate = args.failure_rate, isolated = not args.in_process, stream_subconcepts = args.stream_subconcepts, redundancy_filter = args.redundancy_filter,
+                            structured_output = args.structured_output, malformed_rate = args.malformed_rate, prompt_cache_min_tokens = args.prompt_cache_min_tokens, trace = args.trace, speculation = args.speculative, adaptive_retries = args.adaptive_retries)
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as file:
+            json.dump(report, file, indent = 2)
+    else:
+        print(json.dumps(report, indent = 2))
+    return report
+
+if __name__ == '__main__':
+    main()
+
+#EXAMPLE USAGE:
+#______________________
+#python -m src.benchmarks.run_benchmarks --scenarios small medium --latency 0.05 --output benchmark_results.json
+#______________________
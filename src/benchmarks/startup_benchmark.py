@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import datetime
+import statistics
+import subprocess
+
+# Heavy third-party packages that the load/inspect workflows should not import
+HEAVY_MODULES = ['openai', 'langchain_openai', 'langchain_core', 'nltk', 'rdflib', 'numpy', 'tiktoken', 'matplotlib', 'networkx']
+
+# Startup scenarios: the code is run in a fresh interpreter, the time is measured from before the first import
+STARTUP_SCENARIOS = {
+    'import_taxonomy_model':    "import src.core.taxonomy_model",
+    'import_helper_functions':  "import src.core.helper_functions",
+    'load_taxonomy':            "from src.core.taxonomy_model import load_taxonomy\ntaxonomy = load_taxonomy(TAXONOMY_PATH)\ntaxonomy.close_journal()",
+    'load_and_inspect':         "from src.core.taxonomy_model import load_taxonomy\ntaxonomy = load_taxonomy(TAXONOMY_PATH)\ntaxonomy.close_journal()\nnames = [concept.name for concept in taxonomy.root.children]",
+    # reference: the packages helper_functions used to import eagerly
+    'eager_dependencies':       "import openai\nimport langchain_openai\nimport nltk\nfrom nltk.stem import WordNetLemmatizer\nWordNetLemmatizer()\nimport rdflib",
+}
+
+# Code run in the child interpreter around the scenario code, prints the JSON measurement
+CHILD_TEMPLATE = '''import sys, time, json, io, contextlib
+start = time.perf_counter()
+TAXONOMY_PATH = {taxonomy_path!r}
+with contextlib.redirect_stdout(io.StringIO()):
+{code}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'heavy_modules': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+# Function to run the code of a scenario once in a fresh interpreter, returns {'seconds', 'heavy_modules', 'process_seconds'}
+def run_startup_once(code, taxonomy_path = None, cwd = None) -> dict:
+    script = CHILD_TEMPLATE.format(taxonomy_path = taxonomy_path, code = '\n'.join('    ' + line for line in code.split('\n')), heavy = HEAVY_MODULES)
+    environment = dict(os.environ, PYTHONPATH = os.pathsep.join([os.getcwd(), os.environ.get('PYTHONPATH', '')]), PYTHONDONTWRITEBYTECODE = '0')
+    start = datetime.datetime.now()
+    completed = subprocess.run([sys.executable, '-c', script], capture_output = True, text = True, cwd = cwd, env = environment)
+    process_seconds = (datetime.datetime.now() - start).total_seconds()
+    if completed.returncode != 0:
+        raise RuntimeError(f"startup scenario failed:\n{completed.stderr}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_seconds'] = process_seconds
+    return result
+
+# Helper function creating a small saved taxonomy to load (built with the fake chat models, no API calls)
+def create_sample_taxonomy(directory) -> str:
+    script = '''import io, contextlib, logging
+from src.benchmarks.fake_chat_model import init_fake_models
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+log = logging.getLogger("startup_benchmark")
+log.setLevel(logging.WARNING)
+models = init_fake_models(seed = 0, branching = 5, ranks_lists = 1, ranks_per_list = 2)
+with contextlib.redirect_stdout(io.StringIO()):
+    taxonomy = construct_taxonomy("Art", *models, log = log)
+    taxonomy = iterate_level(taxonomy, 0, *models, log = log)
+    taxonomy_path = taxonomy.save()
+    taxonomy.close_journal()
+with open("taxonomy_path.txt", "w") as file:
+    file.write(taxonomy_path)
+'''
+    environment = dict(os.environ, PYTHONPATH = os.pathsep.join([os.getcwd(), os.environ.get('PYTHONPATH', '')]))
+    subprocess.run([sys.executable, '-c', script], check = True, capture_output = True, cwd = directory, env = environment)
+    with open(os.path.join(directory, "taxonomy_path.txt")) as file:
+        return file.read().strip()
+
+# Function to run the startup benchmark, returns the JSON-serializable report (median of `repeat` fresh interpreters per scenario)
+def run_startup_benchmark(scenarios = tuple(STARTUP_SCENARIOS), repeat = 5, log = None) -> dict:
+    if not log:
+        log = logging.getLogger("run_startup_benchmark")
+        logging.basicConfig(level=logging.INFO)
+    directory = tempfile.mkdtemp(prefix = "taxonomy_startup_benchmark_")
+    report = {
+        'created_at':   datetime.datetime.now().isoformat(),
+        'python':       platform.python_version(),
+        'platform':     platform.platform(),
+        'repeat':       repeat,
+        'scenarios':    {},
+    }
+    try:
+        taxonomy_path = create_sample_taxonomy(directory)
+        for name in scenarios:
+            # the first run warms the bytecode and file system caches, it is not measured
+            run_startup_once(STARTUP_SCENARIOS[name], taxonomy_path, cwd = directory)
+            runs = [run_startup_once(STARTUP_SCENARIOS[name], taxonomy_path, cwd = directory) for _ in range(repeat)]
+            report['scenarios'][name] = {
+                'median_seconds':           statistics.median(run['seconds'] for run in runs),
+                'min_seconds':              min(run['seconds'] for run in runs),
+                'median_process_seconds':   statistics.median(run['process_seconds'] for run in runs),
+                'heavy_modules':            runs[-1]['heavy_modules'],
+            }
+            log.info(f"startup scenario '{name}': {report['scenarios'][name]}")
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+    return report
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Startup time of the taxonomy load/inspect workflows (fresh interpreter per run).")
+    parser.add_argument('--scenarios', nargs = '+', default = list(STARTUP_SCENARIOS), choices = list(STARTUP_SCENARIOS))
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--output', default = None, help = "path of the JSON report (printed to stdout if not given)")
+    args = parser.parse_args(argv)
+    report = run_startup_benchmark(args.scenarios, repeat = args.repeat)
+    if args.output:
+        with open(args.output, 'w', encoding = 'utf-8') as file:
+            json.dump(report, file, indent = 2)
+    else:
+        print(json.dumps(report, indent = 2))
+    return report
+
+if __name__ == '__main__':
+    main()
+
+#EXAMPLE USAGE:
+#______________________
+#python -m src.benchmarks.startup_benchmark --repeat 10 --output startup_results.json
+#______________________
@@ -0,0 +1,85 @@
+import re
+
+# Helper function to check if two strings are at most one edit (insertion, deletion, substitution) apart
+def within_one_edit(a: str, b: str) -> bool:
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i+1:] == b[i+1:]
+    return a[i:] == b[i+1:]
+
+# Helper function to check that a near match does not only differ in a short or numeric token ("type a" / "type b", "class 1" / "class 2")
+def differs_in_long_word(a: str, b: str) -> bool:
+    differing = set(a.split()) ^ set(b.split())
+    return all(len(token) >= 4 and not any(ch.isdigit() for ch in token) for token in differing)
+
+# Class for the normalized name index of the taxonomy concepts.
+#
+# Names are normalized by the given normalizer (case folding + lemmatization in the Taxonomy), so a
+# duplicate check is a single dict lookup. In the near-duplicate mode two more kinds of buckets are
+# kept: the sorted token set of the name ("modern art" / "art modern") and the half-name buckets
+# used for the one-edit matches ("colours" / "colors"): one edit leaves either the first or the
+# second half of the indexed name untouched, so 6 lookups find all the candidates.
+class ConceptNameIndex:
+    def __init__(self, normalizer, near_duplicates = False, min_fuzzy_length = 6) -> None:
+        self.normalizer         = normalizer
+        self.near_duplicates    = near_duplicates
+        self.min_fuzzy_length   = min_fuzzy_length
+        self.exact              = {}
+        self.token_sets         = {}
+        self.halves             = {}
+
+    def __len__(self) -> int:
+        return len(self.exact)
+
+    # Method to get the normalized key of a name
+    def key(self, name: str) -> str:
+        return self.normalizer(name)
+
+    @staticmethod
+    def token_set_key(key: str) -> str:
+        return ' '.join(sorted(set(re.findall(r'\w+', key))))
+
+    @staticmethod
+    def half_keys(key: str) -> list:
+        half = len(key)//2
+        return [('p', len(key), key[:half]), ('s', len(key), key[half:])]
+
+    # Method to add a concept name (concept_id is the concept's index in Taxonomy.concepts)
+    def add(self, name: str, concept_id: int, key = None) -> None:
+        if key is None:
+            key = self.key(name)
+        self.exact.setdefault(key, concept_id)
+        if self.near_duplicates:
+            self.token_sets.setdefault(self.token_set_key(key), concept_id)
+            if len(key) >= self.min_fuzzy_length:
+                for half_key in self.half_keys(key):
+                    self.halves.setdefault(half_key, []).append((key, concept_id))
+
+    # Method to find the id of an indexed concept duplicating the name (None if the name is new)
+    def find(self, name: str, key = None):
+        if key is None:
+            key = self.key(name)
+        concept_id = self.exact.get(key)
+        if concept_id is not None or not self.near_duplicates:
+            return concept_id
+        concept_id = self.token_sets.get(self.token_set_key(key))
+        if concept_id is not None:
+            return concept_id
+        if len(key) < self.min_fuzzy_length - 1:
+            return None
+        for length in (len(key) - 1, len(key), len(key) + 1):
+            half = length//2
+            for half_key in (('p', length, key[:half]), ('s', length, key[len(key) - (length - half):])):
+                for candidate, concept_id in self.halves.get(half_key, ()):
+                    if within_one_edit(key, candidate) and differs_in_long_word(key, candidate):
+                        return concept_id
+        return None
+
+    def __contains__(self, name: str) -> bool:
+        return self.find(name) is not None
@@ -0,0 +1,230 @@
+import sys
+from array import array
+
+NO_CONCEPT = -1
+
+# Class for the compact array-backed storage of the taxonomy concepts.
+#
+# Concepts are integer ids (the index in the store, the same as the old index in Taxonomy.concepts).
+# The tree is kept in parent / first child / last child / next sibling arrays, the ranks are interned
+# (one id per distinct rank string) and the names are utf-8 slices of one append-only blob, so a concept
+# costs a few dozen bytes instead of a full object with its own lists. The rarely set texts (definition,
+# descriptions, definitions) are kept in sparse dicts. The store is a sequence of Concept views:
+# store[i] returns a lightweight view object reading and writing the arrays, and like the old concepts
+# list it takes detached concepts with append, extend and += (they are attached under their parent).
+class ConceptStore:
+    def __init__(self, view_class) -> None:
+        self.view_class         = view_class
+        self.parent             = array('i')
+        self.first_child        = array('i')
+        self.last_child         = array('i')
+        self.next_sibling       = array('i')
+        self.child_count        = array('I')
+        self.level              = array('I')
+        self.ranks_list_number  = array('i')    # -1 for the 'root' ranks list number
+        self.rank_id            = array('I')
+        self.ranks              = []            # interned rank strings
+        self.rank_ids           = {}
+        self.name_blob          = bytearray()
+        self.name_start         = array('Q')
+        self.name_length        = array('i')    # -1 for a None name
+        self.definition         = {}
+        self.descriptions       = {}
+        self.definitions        = {}
+        self.version            = 0             # incremented on every re-link of the tree
+        self.observer           = None          # notified of the concepts attached and the children re-linked through the views (the Taxonomy journals them)
+
+    # The rank lookup dict is rebuilt on load
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['rank_ids']
+        state['observer'] = None
+        state['descriptions'] = {i: v for i, v in self.descriptions.items() if v}
+        state['definitions'] = {i: v for i, v in self.definitions.items() if v}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('version', 0)
+        self.__dict__.setdefault('observer', None)
+        self.rank_ids = {rank: i for i, rank in enumerate(self.ranks)}
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.view_class.view(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("concept id out of range")
+        return self.view_class.view(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.view_class.view(self, i)
+
+    def intern_rank(self, rank) -> int:
+        rank_id = self.rank_ids.get(rank)
+        if rank_id is None:
+            rank_id = self.rank_ids[rank] = len(self.ranks)
+            self.ranks.append(rank)
+        return rank_id
+
+    # Method to add a concept, returns its id
+    def add_concept(self, name, parent_id = NO_CONCEPT, taxonomical_rank = 'root', taxonomical_level = 0, taxonomical_ranks_list_number = 'root') -> int:
+        concept_id = len(self)
+        self.parent.append(NO_CONCEPT)
+        self.first_child.append(NO_CONCEPT)
+        self.last_child.append(NO_CONCEPT)
+        self.next_sibling.append(NO_CONCEPT)
+        self.child_count.append(0)
+        self.level.append(taxonomical_level)
+        self.ranks_list_number.append(-1 if taxonomical_ranks_list_number == 'root' else taxonomical_ranks_list_number)
+        self.rank_id.append(self.intern_rank(taxonomical_rank))
+        self.name_start.append(0)
+        self.name_length.append(-1)
+        self.set_name(concept_id, name)
+        if parent_id != NO_CONCEPT:
+            self.link_child(parent_id, concept_id)
+        return concept_id
+
+    # Method to attach detached concepts under their parents (the parent must be stored already or come earlier in the list),
+    # concepts already in the store are skipped
+    def extend(self, concepts) -> None:
+        attached = []
+        for concept in concepts:
+            if concept.store is self:
+                continue
+            if concept.store is not None:
+                raise ValueError(f"{concept!r} belongs to another taxonomy")
+            parent = concept.detached['parent']
+            if parent is not None and parent.store is not self:
+                raise ValueError(f"the parent of {concept!r} is not in the taxonomy, add the parent first")
+            concept.attach(self, NO_CONCEPT if parent is None else parent.concept_id)
+            attached.append(concept)
+        if attached and self.observer is not None:
+            self.observer.concepts_attached(attached)
+
+    def append(self, concept) -> None:
+        self.extend([concept])
+
+    def __iadd__(self, concepts):
+        self.extend(concepts)
+        return self
+
+    # Method to tell the observer that the children of a concept were re-linked through the views
+    def children_relinked(self, concept_id) -> None:
+        if concept_id is not None and self.observer is not None:
+            self.observer.children_relinked(concept_id)
+
+    def get_name(self, concept_id):
+        length = self.name_length[concept_id]
+        if length < 0:
+            return None
+        start = self.name_start[concept_id]
+        return self.name_blob[start:start + length].decode('utf-8')
+
+    # Renaming appends the new name to the blob (the old bytes are left unused)
+    def set_name(self, concept_id, name) -> None:
+        if name is None:
+            self.name_length[concept_id] = -1
+            return
+        encoded = name.encode('utf-8')
+        self.name_start[concept_id] = len(self.name_blob)
+        self.name_length[concept_id] = len(encoded)
+        self.name_blob += encoded
+
+    def get_rank(self, concept_id):
+        return self.ranks[self.rank_id[concept_id]]
+
+    def get_ranks_list_number(self, concept_id):
+        number = self.ranks_list_number[concept_id]
+        return 'root' if number < 0 else number
+
+    def get_parent(self, concept_id):
+        parent_id = self.parent[concept_id]
+        return None if parent_id == NO_CONCEPT else parent_id
+
+    def children_ids(self, concept_id):
+        child_id = self.first_child[concept_id]
+        while child_id != NO_CONCEPT:
+            yield child_id
+            child_id = self.next_sibling[child_id]
+
+    # Method to append a concept to the end of the children of the parent
+    def link_child(self, parent_id, concept_id) -> None:
+        self.version += 1
+        self.parent[concept_id] = parent_id
+        self.next_sibling[concept_id] = NO_CONCEPT
+        if self.last_child[parent_id] == NO_CONCEPT:
+            self.first_child[parent_id] = concept_id
+        else:
+            self.next_sibling[self.last_child[parent_id]] = concept_id
+        self.last_child[parent_id] = concept_id
+        self.child_count[parent_id] += 1
+
+    # Method to remove a concept from the children of its parent (the concept stays in the store)
+    def unlink_child(self, concept_id) -> None:
+        parent_id = self.parent[concept_id]
+        if parent_id == NO_CONCEPT:
+            return
+        self.version += 1
+        previous_id = NO_CONCEPT
+        for child_id in self.children_ids(parent_id):
+            if child_id == concept_id:
+                break
+            previous_id = child_id
+        if previous_id == NO_CONCEPT:
+            self.first_child[parent_id] = self.next_sibling[concept_id]
+        else:
+            self.next_sibling[previous_id] = self.next_sibling[concept_id]
+        if self.last_child[parent_id] == concept_id:
+            self.last_child[parent_id] = previous_id
+        self.child_count[parent_id] -= 1
+        self.parent[concept_id] = NO_CONCEPT
+        self.next_sibling[concept_id] = NO_CONCEPT
+
+    # Method to replace the children of a concept with the given concept ids (in the given order)
+    def set_children(self, concept_id, child_ids) -> None:
+        self.version += 1
+        for child_id in list(self.children_ids(concept_id)):
+            self.parent[child_id] = NO_CONCEPT
+            self.next_sibling[child_id] = NO_CONCEPT
+        self.first_child[concept_id] = NO_CONCEPT
+        self.last_child[concept_id] = NO_CONCEPT
+        self.child_count[concept_id] = 0
+        for child_id in child_ids:
+            if self.parent[child_id] != NO_CONCEPT:
+                self.unlink_child(child_id)
+            self.link_child(concept_id, child_id)
+
+    # Method to collect the ids of all the ancestors (nearest first)
+    def ancestor_ids(self, concept_id) -> list:
+        ancestors = []
+        parent_id = self.parent[concept_id]
+        while parent_id != NO_CONCEPT:
+            ancestors.append(parent_id)
+            parent_id = self.parent[parent_id]
+        return ancestors
+
+    # Method to collect the ids of all the descendants without recursion
+    # (the children of a concept, then the descendants of each child in turn)
+    def descendant_ids(self, concept_id) -> list:
+        descendants = []
+        stack = [concept_id]
+        while stack:
+            children = list(self.children_ids(stack.pop()))
+            descendants += children
+            stack += reversed(children)
+        return descendants
+
+    # Method to estimate the memory used by the store in bytes
+    def memory_usage(self) -> int:
+        arrays = [self.parent, self.first_child, self.last_child, self.next_sibling, self.child_count, self.level, self.ranks_list_number, self.rank_id, self.name_start, self.name_length]
+        texts = [self.definition, self.descriptions, self.definitions]
+        size = sum(sys.getsizeof(a) for a in arrays) + sys.getsizeof(self.name_blob) + sum(sys.getsizeof(rank) for rank in self.ranks)
+        for text in texts:
+            size += sys.getsizeof(text) + sum(sys.getsizeof(v) for v in text.values())
+        return size
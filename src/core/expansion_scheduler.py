@@ -0,0 +1,219 @@
+import time
+import heapq
+import logging
+import asyncio
+import datetime
+
+from src.core.helper_functions import run_sync, update_token_usage
+from src.core.pipeline_context import PipelineInterrupt, pipeline_scope
+from src.core.taxonomy_construction import ExpansionConfig, aexpand_concepts_batch, merge_concept_expansion, merge_interrupted_usage
+
+# Scheduling policies of the expansion scheduler:
+# 'breadth_first' - shallow concepts first (level by level over all ranks lists at once),
+# 'depth_limited' - deepest concepts first (depth-first), never below max_depth,
+# 'best_first'    - highest priority_function(taxonomy, rank_number, concept, stats) first
+EXPANSION_POLICIES = ('breadth_first', 'depth_limited', 'best_first')
+
+# Default best-first priority: prefer the ranks lists where the generation succeeds most often, then shallow concepts
+def default_best_first_priority(taxonomy, rank_number, concept, stats) -> float:
+    expanded = stats['expanded_per_ranks_list'].get(rank_number, 0)
+    failed = stats['failed_per_ranks_list'].get(rank_number, 0)
+    acceptance_rate = (expanded - failed + 1)/(expanded + 2)
+    return acceptance_rate - 0.1*concept.taxonomical_level
+
+# Class for the whole-taxonomy expansion scheduler.
+#
+# Every (ranks list, uninspected concept) pair of the taxonomy is a work unit in one priority queue.
+# max_concurrency workers take the units from the queue, expand them (aexpand_concept) and merge the
+# results into the taxonomy, pushing the new subconcepts back to the queue, so the model pool stays
+# busy until the whole taxonomy is built or a stop condition is met (max_concepts, max_depth, deadline).
+# With batch_size > 1 a worker takes up to batch_size queued siblings at once and expands them with batched requests.
+# Units that are not expanded when the run stops stay in taxonomy.uninspected_concepts.
+# A PipelineInterrupt (e.g. an exhausted token budget) stops the run like a stop condition, its stop_reason is reported
+# (and kept in taxonomy.stop_reason).
+class ExpansionScheduler:
+    def __init__(self, taxonomy, policy = 'breadth_first', max_concepts = None, max_depth = None, deadline = None, priority_function = None, batch_size = 1, log = None) -> None:
+        if policy not in EXPANSION_POLICIES:
+            raise ValueError(f"unknown expansion policy '{policy}', expected one of {EXPANSION_POLICIES}")
+        if policy == 'depth_limited' and max_depth is None:
+            max_depth = max([len(ranks.split(',')) for ranks in taxonomy.taxonomical_ranks], default = 0)
+        if isinstance(deadline, (int, float)):
+            deadline = datetime.datetime.now() + datetime.timedelta(seconds = deadline)
+        self.taxonomy           = taxonomy
+        self.policy             = policy
+        self.max_concepts       = max_concepts
+        self.max_depth          = max_depth
+        self.deadline           = deadline
+        self.priority_function  = priority_function if priority_function else default_best_first_priority
+        self.batch_size         = batch_size
+        self.log                = log if log else logging.getLogger("ExpansionScheduler")
+        self.queue              = []
+        self.sibling_queues     = {}
+        self.taken              = set()
+        self.pushed             = 0
+        self.in_flight          = 0
+        self.stop_reason        = None
+        self.stats              = {'expanded': 0, 'failed': 0, 'new_concepts': 0, 'expanded_per_ranks_list': {}, 'failed_per_ranks_list': {},
+                                   'token_usage': {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}}
+        for rank_number, concepts in enumerate(taxonomy.uninspected_concepts):
+            for concept in concepts:
+                self.push(rank_number, concept)
+
+    # Method to compute the queue priority of a work unit (lower is taken first)
+    def priority(self, rank_number, concept) -> float:
+        if self.policy == 'breadth_first':
+            return concept.taxonomical_level
+        if self.policy == 'depth_limited':
+            return -concept.taxonomical_level
+        return -self.priority_function(self.taxonomy, rank_number, concept, self.stats)
+
+    # Method to add a work unit to the queue (units below max_depth are left in the frontier)
+    def push(self, rank_number, concept) -> None:
+        if self.max_depth is not None and concept.taxonomical_level >= self.max_depth:
+            return
+        self.pushed += 1
+        item = (self.priority(rank_number, concept), self.pushed, rank_number, concept)
+        heapq.heappush(self.queue, item)
+        if self.batch_size > 1:
+            heapq.heappush(self.sibling_queues.setdefault((rank_number, concept.taxonomical_level), []), item)
+
+    # Helper method popping the next unit of a heap that was not taken from the other heap yet (the units taken
+    # from one heap stay in the other one until they reach its top)
+    def pop_untaken(self, queue):
+        while queue:
+            item = heapq.heappop(queue)
+            if item[1] in self.taken:
+                self.taken.discard(item[1])
+            else:
+                return item
+        return None
+
+    # Method to take the next work unit together with up to batch_size - 1 queued siblings (same ranks list and taxonomical level).
+    # With batch_size > 1 every unit is also in the heap of its (ranks list, level), so the siblings are taken without
+    # scanning the queue; the top of the queue is always a unit not taken yet (an empty queue means no units left)
+    def pop_batch(self):
+        priority, seq, rank_number, concept = self.pop_untaken(self.queue)
+        batch = [concept]
+        if self.batch_size > 1:
+            key = (rank_number, concept.taxonomical_level)
+            siblings = self.sibling_queues[key]
+            self.taken.add(seq)
+            while len(batch) < self.batch_size:
+                item = self.pop_untaken(siblings)
+                if item is None:
+                    break
+                self.taken.add(item[1])
+                batch.append(item[3])
+            if not siblings:
+                del self.sibling_queues[key]
+            while self.queue and self.queue[0][1] in self.taken:
+                self.taken.discard(heapq.heappop(self.queue)[1])
+        return rank_number, batch
+
+    # Method to check the stop conditions, returns the stop reason or None
+    def check_stop(self):
+        if self.stop_reason:
+            return self.stop_reason
+        if self.max_concepts is not None and len(self.taxonomy.concepts) >= self.max_concepts:
+            self.stop_reason = 'max_concepts'
+        elif self.deadline is not None and datetime.datetime.now() >= self.deadline:
+            self.stop_reason = 'deadline'
+        return self.stop_reason
+
+    # Method to merge an expansion into the taxonomy and schedule the new subconcepts
+    def complete(self, rank_number, expansion) -> None:
+        self.merge(rank_number, expansion)
+        self.taxonomy.checkpoint()
+
+    # Method to merge an expansion into the taxonomy, update the frontier and the stats and push the new subconcepts (no checkpoint)
+    def merge(self, rank_number, expansion) -> None:
+        taxonomy = self.taxonomy
+        new_concepts = merge_concept_expansion(taxonomy, rank_number, expansion, log = self.log)
+        taxonomy.update_uninspected_concepts(rank_number, removed = [expansion.concept], added = new_concepts)
+        if expansion.target_level and expansion.target_level > taxonomy.current_level[rank_number]:
+            taxonomy.set_current_level(rank_number, expansion.target_level)
+        self.stats['token_usage'] = update_token_usage(self.stats['token_usage'], expansion.token_usage)
+        if not expansion.skipped:
+            self.stats['expanded'] += 1
+            self.stats['expanded_per_ranks_list'][rank_number] = self.stats['expanded_per_ranks_list'].get(rank_number, 0) + 1
+        if expansion.failed:
+            self.stats['failed'] += 1
+            self.stats['failed_per_ranks_list'][rank_number] = self.stats['failed_per_ranks_list'].get(rank_number, 0) + 1
+        self.stats['new_concepts'] += len(new_concepts)
+        for concept in new_concepts:
+            self.push(rank_number, concept)
+
+    # Method to run the workers until the queue is exhausted or a stop condition is met
+    async def run(self, model_generate_new, model_re_generate, model_verify, config = None, max_concurrency = 8):
+        taxonomy = self.taxonomy
+        config = config if config else ExpansionConfig()
+        condition = asyncio.Condition()
+        start_time = time.time()
+        taxonomy.stop_reason = None
+
+        async def worker():
+            while True:
+                async with condition:
+                    while not self.queue and self.in_flight and not self.check_stop():
+                        await condition.wait()
+                    if self.check_stop() or not self.queue:
+                        condition.notify_all()
+                        return
+                    rank_number, batch = self.pop_batch()
+                    self.in_flight += 1
+                names = [concept.name for concept in batch]
+                try:
+                    ranks = taxonomy.taxonomical_ranks[rank_number].split(',')
+                    with pipeline_scope(ranks_list = rank_number, level = batch[0].taxonomical_level + 1):
+                        expansions = await aexpand_concepts_batch(batch, taxonomy.root.name, ranks, taxonomy.taxonomical_context[rank_number], model_generate_new, model_re_generate, model_verify, config = config, log = self.log)
+                    for expansion in expansions:
+                        self.complete(rank_number, expansion)
+                except PipelineInterrupt as e:
+                    # budget exhausted, model unavailable...: the run stops, the concepts stay uninspected (the tokens spent on them are counted)
+                    self.log.info(f"expansion of {names} (ranks list {rank_number}) interrupted: {e}")
+                    merge_interrupted_usage(taxonomy, e)
+                    taxonomy.stop_reason = e.stop_reason
+                    if not self.stop_reason:
+                        self.stop_reason = e.stop_reason
+                except Exception as e:
+                    self.log.info(f"expansion of {names} (ranks list {rank_number}) failed: {e}")
+                finally:
+                    async with condition:
+                        self.in_flight -= 1
+                        condition.notify_all()
+
+        await asyncio.gather(*[worker() for _ in range(max(1, max_concurrency))])
+        if not self.stop_reason:
+            self.stop_reason = 'frontier_exhausted' if not self.queue else 'stopped'
+        self.stats['elapsed_seconds'] = time.time() - start_time
+        self.stats['stop_reason'] = self.stop_reason
+        self.log.info(f"expansion scheduler finished ({self.stop_reason}): {self.stats}")
+        taxonomy_path = taxonomy.save()
+        self.log.info(f'taxonomy saved as {taxonomy_path}')
+        return taxonomy
+
+# Function to expand the whole taxonomy with the expansion scheduler (async)
+async def aexpand_taxonomy(taxonomy, model_generate_new, model_re_generate, model_verify, policy = 'breadth_first', max_concurrency = 8, max_concepts = None, max_depth = None, deadline = None, priority_function = None, batch_size = 1, log = None, iteration_amm = 5, max_words_context = 40, max_subconcept_lenght = 80, stream_subconcepts = False, stream_postprocess_chunk = None, redundancy_filter = None, structured_output = None, speculation = None, retry_policy = None, near_duplicates = False):
+    if not log:
+        log = logging.getLogger("expand_taxonomy")
+        logging.basicConfig(level=logging.INFO)
+    log.info(f"expand_taxonomy() policy: {policy}, max concurrency: {max_concurrency}, batch size: {batch_size}, max concepts: {max_concepts}, max depth: {max_depth}, deadline: {deadline}")
+    if near_duplicates:
+        taxonomy.enable_near_duplicate_detection()
+    scheduler = ExpansionScheduler(taxonomy, policy = policy, max_concepts = max_concepts, max_depth = max_depth, deadline = deadline, priority_function = priority_function, batch_size = batch_size, log = log)
+    config = ExpansionConfig(iteration_amm = iteration_amm, max_words_context = max_words_context, max_subconcept_lenght = max_subconcept_lenght, stream_subconcepts = stream_subconcepts, stream_postprocess_chunk = stream_postprocess_chunk, redundancy_filter = redundancy_filter, structured_output = structured_output, speculation = speculation, retry_policy = retry_policy)
+    return await scheduler.run(model_generate_new, model_re_generate, model_verify, config = config, max_concurrency = max_concurrency)
+
+# Function to expand the whole taxonomy with the expansion scheduler
+def expand_taxonomy(taxonomy, model_generate_new, model_re_generate, model_verify, policy = 'breadth_first', max_concurrency = 8, max_concepts = None, max_depth = None, deadline = None, priority_function = None, batch_size = 1, log = None, iteration_amm = 5, max_words_context = 40, max_subconcept_lenght = 80, stream_subconcepts = False, stream_postprocess_chunk = None, redundancy_filter = None, structured_output = None, speculation = None, retry_policy = None, near_duplicates = False):
+    return run_sync(aexpand_taxonomy(taxonomy, model_generate_new, model_re_generate, model_verify, policy = policy, max_concurrency = max_concurrency, max_concepts = max_concepts, max_depth = max_depth, deadline = deadline, priority_function = priority_function, batch_size = batch_size, log = log,
+                                     iteration_amm = iteration_amm, max_words_context = max_words_context, max_subconcept_lenght = max_subconcept_lenght, stream_subconcepts = stream_subconcepts, stream_postprocess_chunk = stream_postprocess_chunk, redundancy_filter = redundancy_filter, structured_output = structured_output, speculation = speculation, retry_policy = retry_policy, near_duplicates = near_duplicates))
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.taxonomy_construction import construct_taxonomy
+#from src.core.expansion_scheduler import expand_taxonomy
+#tax_t = construct_taxonomy(root_concept, model_generate_new, model_re_generate, model_verify, log = log)
+#tax_t = expand_taxonomy(tax_t, model_generate_new, model_re_generate, model_verify, policy = 'breadth_first', max_concurrency = 16, max_concepts = 5000, deadline = 3600, log = log)
+#tax_t.info()
+#______________________
@@ -1,38 +1,28 @@
 import os
 import logging
 import datetime
-import pickle
-import re
+import asyncio
+import threading
+import contextvars
 
-import openai
-from langchain_openai import ChatOpenAI
-import nltk
-from nltk.stem import WordNetLemmatizer 
-from rdflib import Graph, URIRef, Literal, Namespace
-from rdflib.namespace import RDF, RDFS, OWL
-
-def ensure_directory_exists(path):
-
-    # Validation
-    if not os.path.exists(path):
-        try:
-            # Direcrotry creation
-            os.makedirs(path)
-            print(f"Directory created: {path}")
-        except OSError as error:
-            print(f"Error creating directory: {error}")
-    else:
-        print(f"Directory already exists: {path}")
+# The taxonomy data model lives in src.core.taxonomy_model (importable without the LLM clients),
+# the names are re-exported here for the existing imports and the taxonomies pickled by older versions
+from src.core.taxonomy_model import Concept, Taxonomy, load_taxonomy, ensure_directory_exists, flatten, update_token_usage, update_token_usage_by_stage, token_usage_counters
+from src.core.name_normalization import lemmatize_word, normalize_concept_name, check_nltk_data
 
 # Class for initializing a Large Language Model (LLM) 
 class Model:
-    def __init__(self, name:str, model_checkpoint:str, temperature = 1, top_p = 1, presence_penalty = 1, frequency_penalty = 0) -> None:
+    def __init__(self, name:str, model_checkpoint:str, temperature = 1, top_p = 1, presence_penalty = 1, frequency_penalty = 0, max_retries = None) -> None:
+        from langchain_openai import ChatOpenAI
+        # max_retries None keeps the retries of the OpenAI client, 0 leaves them to the rate limiter
+        retry_settings          = {} if max_retries is None else {'max_retries': max_retries}
         self.model              = ChatOpenAI(
                 model               = model_checkpoint, 
                 temperature         = temperature, 
                 top_p               = top_p, 
                 presence_penalty    = presence_penalty, 
-                frequency_penalty   = frequency_penalty
+                frequency_penalty   = frequency_penalty,
+                **retry_settings
             )
         self.name               = name
         self.temperature        = temperature
@@ -47,199 +37,34 @@ top p: {top_p}
 presence penalty: {presence_penalty}
 frequency penalty: {frequency_penalty}'''
 
-# Class representing a concept within the taxonomy
-class Concept:
-    def __init__(self, concept_name: str, parent = None, taxonomical_rank = 'root', taxonomical_level = 0, taxonomical_ranks_list_number = 'root') -> None:
-        self.name = concept_name
-        self.descriptions = []
-        self.definitions = []
-        self.definition = ""
-        self.children = []
-        self.parent = parent
-        self.taxonomical_rank = taxonomical_rank
-        self.taxonomical_level = taxonomical_level
-        self.taxonomical_ranks_list_number = taxonomical_ranks_list_number
-    
-    # Method to print detailed information about the concept
-    def info(self, parent = None, i = 0) -> None:
-        print('\n\n'+'-+'*i+f"Concept\nname: {self.name}")
-        if self.definition:
-            print(f"definition: {self.definition}")
-        print(f"taxonomical rank:{self.taxonomical_rank}"+' '*i+f"\ntaxonomical level:{self.taxonomical_level}\ntaxonomical ranks list number = {self.taxonomical_ranks_list_number}")
-        if self.definitions:
-            print(f"has {len(self.definitions)} definitions: {self.definitions}")
-        if self.descriptions:
-            print(f"has {len(self.descriptions)} descriptions: {self.descriptions}")
-        i += 1
-        if self.parent:
-            print('---'*i+f"is subconcept of: {self.parent.name}")
-        if len(self.children) > 0:
-            print('---'*i+f"has {len(self.children)} subconcepts:")
-            for concept in self.children:
-                concept.info(parent = self, i = i)
-       
-    # Method to get the semantic cotopy (hypernyms and hyponyms)
-    def get_semantic_cotopy(self, lemmatized=True):
-        hypernyms = []
-        hyponyms = []
-        
-        # Helper function to recursively collect hypernyms
-        def get_hypernyms(self, hypernyms):
-            if self.parent:
-                hypernyms.append(self.parent)
-                get_hypernyms(self.parent, hypernyms)
-        
-        # Helper function to recursively collect hyponyms
-        def get_hyponyms(self, hyponyms):
-            if self.children:
-                hyponyms += self.children
-                for child in self.children:
-                    get_hyponyms(child, hyponyms)
-        
-        get_hypernyms(self, hypernyms)
-        get_hyponyms(self, hyponyms)
-        
-        if not lemmatized:
-            return hypernyms, hyponyms
-        else:
-            hypernyms_list = [lemmatize_word(hypernym.name) for hypernym in hypernyms]
-            hyponyms_list = [lemmatize_word(hyponym.name) for hyponym in hyponyms]
-            return hypernyms_list + hyponyms_list
-
-# Class representing the taxonomy structure    
-class Taxonomy:
-    
-    def __init__(self, root_concept_name:str) -> None:
-        self.created_at             = datetime.datetime.now()
-        self.last_edit_time         = datetime.datetime.now()
-        self.name                   = 'Taxonomy_'+str(self.created_at).replace(' ','_T').replace(':','-')[:22]
-        self.save_path              = os.getcwd()+"\\data\\taxonomies\\"
-        self.saved_to               = [self.save_path + self.name + '.pkl']
-        self.token_usage            = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-
-        self.root                   = Concept(root_concept_name)
-
-        self.taxonomical_criteria   = []
-        self.raw_criteria           = []
-        self.taxonomical_ranks_list = []
-        self.taxonomical_ranks      = []
-        self.taxonomical_context    = []
-        
-        self.current_level          = []
-        self.uninspected_concepts   = []
-        self.unknown_concepts       = [[]]
-        self.concepts               = [self.root]
-        
-        
-        fp = self.save()
-    
-    # Method to print detailed information about the taxonomy
-    def info(self) -> None:
-        print(f"--------INFO:-------\n\n--------ROOT:-------\nroot concept of the current taxonomy is: \"{self.root.name}\"\n")
-        print("---------CRITERIA:---")
-        #print(f"taxonomical criteria of the current taxonomy are: \nAll criteria:\n{self.raw_criteria}\n\ncriteria clusters:\n")
-        print(f"taxonomical criteria of the current taxonomy are: \nAll criteria:\n{self.taxonomical_criteria}\n\n")
-        
-        #for i,criteria in enumerate(self.taxonomical_criteria):
-        #    print(f"Cluster {i+1}/{len(self.taxonomical_criteria)}. Criteria:\n{criteria}\n")
-        print("\n\n---------RANKS:-----\n--------------------\n")
-        print(f"there are {len(self.taxonomical_ranks)} taxonomical ranks lists in the current taxonomy:\n")
-        for i,rank in enumerate(self.taxonomical_ranks):
-            #print(f"{rank}")
-            if i <= 1:
-                k = 0
-                
-            else:
-                k = i - 1
-            #try:
-            #    print(f" {i}. rank '{rank.replace(', ',',').split(',')[self.current_level[k]]}' in '{self.taxonomical_context[k]}'(taxonomical level is {self.current_level[i]})")
-            #except Exception as e:
-            #    print(f" {i}. rank '{rank.replace(', ',',').split(',')[self.current_level[i]]}' in '{self.taxonomical_context[i]}'(taxonomical level is {self.current_level[i]})")
-            try:
-                print(f" {i}. rank '{rank.replace(', ',',').split(',')[self.current_level[i]]}' in '{self.taxonomical_context[i]}'(taxonomical level is {self.current_level[i]})")
-            except Exception as e:
-                print(f" {i}. rank '{rank.replace(', ',',').split(',')[-1]}' in '{self.taxonomical_context[i]}'(taxonomical level is {self.current_level[i]})")
-        print("\n\n---------CONCEPTS:---\n--------------------\n")
-        print(f"total amount of concepts in the current taxonomy is {len(self.concepts)}")
-        print(f"total amount of uninspected concepts in the current taxonomy is {len(flatten(self.uninspected_concepts))}")
-        print(f"total amount of unknown concepts in the current taxonomy is {len(flatten(self.unknown_concepts))}")
-        print("\n--CREATED/EDITED----")
-        print(f"taxonomy creation time: {str(self.created_at)}\nlast_edit time: {str(self.last_edit_time)}")
-        print("\n---TOKEN USAGE:-----")
-        print(f"\n\ncurrent token usage total: \n{self.token_usage}\n")
-        #print(f"the current taxonomical level is {self.current_level} level\ncorresponding rank is {self.taxonomical_ranks[self.current_level]}")
-        print("\n------SAVED TO:-----")
-        if len(self.saved_to)>1:
-            print(f"taxonomy was saved to {len(self.saved_to)} diferent paths total: {self.saved_to}")
-        print(f"f'taxonomy last saved at '{self.save_path+self.name}.pkl'\n")
-        print(f"--------------------\n--------/INFO-------\n--------------------\n\n")
-
-    def update_last_edit_time(self) -> None:
-        self.last_edit_time              = datetime.datetime.now()
-
-    # Method to save the taxonomy to a file
-    def save(self, suffix = "") -> str:
-        ensure_directory_exists(self.save_path)
-        full_path = self.save_path + self.name + suffix + '.pkl'
-        with open(full_path, 'wb') as file:
-            pickle.dump(self, file)
-        if not full_path in self.saved_to:
-            self.saved_to.append(full_path) 
-        return full_path
-
-    # Method to export the taxonomy to an OWL file
-    def export_to_owl(self, suffix =''):
-        ensure_directory_exists(self.save_path)
-        file_path = self.save_path + self.name + suffix + '.owl'
-        g = Graph()
-
-        EX = Namespace("urn:ontology/")  # Replace with your URI base
-        g.bind("ex", EX)
-
-        # Add root concept
-        root_concept = URIRef(EX[self.root.name])
-        g.add((root_concept, RDF.type, OWL.Class))
-        g.add((root_concept, RDFS.label, Literal(self.root.name)))
-
-        # Recursively add all subconcepts
-        def add_concept_to_graph(concept):
-            concept_uri = URIRef(EX[concept.name])
-            g.add((concept_uri, RDF.type, OWL.Class))
-            g.add((concept_uri, RDFS.label, Literal(concept.name)))
-
-            for child in concept.children:
-                child_uri = URIRef(EX[child.name])
-                g.add((child_uri, RDF.type, OWL.Class))
-                g.add((child_uri, RDFS.label, Literal(child.name)))
-                g.add((child_uri, RDFS.subClassOf, concept_uri))
-                add_concept_to_graph(child)
-
-        # Start recursion from the root concept
-        add_concept_to_graph(self.root)
-
-        # Save the graph to an OWL file
-        g.serialize(destination=file_path, format='xml')
-        print(f"Taxonomy exported to {file_path}")
-
-# Helper function for flattening nested lists
-def flatten(xss):
-    return [x for xs in xss for x in xs]
-
-# Initialize the WordNet Lemmatizer
-lemmatizer = WordNetLemmatizer()
-
-# Helper function for lemmatizing words
-def lemmatize_word(word: str):
-    try:
-        try:
-            word_list = nltk.word_tokenize(word)
-        except:
-            nltk.download('punkt_tab')
-            word_list = nltk.word_tokenize(word)
-        lemmatized_output = ' '.join([lemmatizer.lemmatize(w.strip()) for w in word_list])#.lower()
-    except Exception as e:
-            lemmatized_output = word.strip()#.lower()
-    return lemmatized_output
+# Background event loop shared by the synchronous entry points that run concurrent LLM calls.
+# A single long-lived loop keeps the async HTTP clients of the models bound to one loop and
+# also works when the caller already runs inside an event loop (e.g. Jupyter).
+background_loop = None
+background_loop_lock = threading.Lock()
+
+# Helper function running a coroutine in the context variables of the caller (stage, ranks list, tracer...)
+async def run_in_context(coroutine, context):
+    for variable, value in context.items():
+        variable.set(value)
+    return await coroutine
+
+# Helper function for running a coroutine to completion from synchronous code
+def run_sync(coroutine):
+    global background_loop
+    with background_loop_lock:
+        if background_loop is None:
+            background_loop = asyncio.new_event_loop()
+            threading.Thread(target=background_loop.run_forever, name="TaxoRankConstruct-event-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(run_in_context(coroutine, contextvars.copy_context()), background_loop).result()
+
+# Helper function to await coroutines with at most max_concurrency of them running at once (results keep the input order)
+async def gather_with_concurrency(max_concurrency, coroutines):
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+    return await asyncio.gather(*[run(coroutine) for coroutine in coroutines])
 
 # Initialize logging and load API credentials
 def start_session(api_key = None): 
@@ -250,54 +75,91 @@ def start_session(api_key = None):
     log_name = 'TaxoRankConstruct_0.1__'+str(start_time).replace(' ','_').replace(':','-')[:21]+'.log'
     logging.basicConfig(filename=logs_path+log_name, level=logging.INFO)
     log.info("start_session()")
+    log.info(f"NLTK data available: {check_nltk_data(log = log)}")
     # Set your OpenAI API key
     if not api_key:
         log.info("OPENAI API KEY NOT PROVIDED!!")
     else:
         os.environ["OPENAI_API_KEY"] = api_key
+    import openai
     openai.api_key = os.environ["OPENAI_API_KEY"]
     return log
 
 # Initialize models for the taxonomy construction
-def init_models(log = None):
+# (with an LLMResponseCache all three models share the same persistent response cache,
+# with a TokenBudget every request is checked against the budget before it is sent; cache hits do not spend the budget,
+# with a RateLimiter the three models share its per-checkpoint request/token limits and the retries of the failed requests,
+# with PromptMetrics the prompt tokens, the provider's cached prompt tokens and the time to the first token are measured per stage,
+# with a Tracer every model request is recorded as a span of the stage it is made for).
+# The wrappers are applied from the innermost: prompt metrics, tracer, rate limiter, budget, cache
+# (every attempt of a request retried by the rate limiter is measured and traced, the cache hits are not)
+def init_models(log = None, cache = None, budget = None, rate_limiter = None, prompt_metrics = None, tracer = None):
     if not log:
         log = logging.getLogger("init_models()")
         logging.basicConfig(level=logging.INFO)
     log.info(f"init_models()..")
+    max_retries             = 0 if rate_limiter else None
     
     # Verification model
     llm_verify              = Model('verify',       'gpt-4o-mini',  
-                                    temperature = 0.9,    top_p = 0.9,   presence_penalty = 1,   frequency_penalty = 0) 
+                                    temperature = 0.9,    top_p = 0.9,   presence_penalty = 1,   frequency_penalty = 0,     max_retries = max_retries) 
     log.info(f"{llm_verify.info}\nmodel init successfully..")
     model_verify            = llm_verify.model
     
     # Re-Generation model
     llm_re_generate         = Model('re-generate',  'gpt-4o-mini',
-                                    temperature = 1.4,    top_p = 0.85,   presence_penalty = 0.50,   frequency_penalty = 1
+                                    temperature = 1.4,    top_p = 0.85,   presence_penalty = 0.50,   frequency_penalty = 1,  max_retries = max_retries)
     log.info(f"{llm_re_generate.info}\nmodel init successfully..")
     model_re_generate       = llm_re_generate.model
     
     # New concept generation model
     llm_generate_new        = Model('generate new',  'gpt-4o',
-                                    temperature = 1.4,    top_p = 0.98,   presence_penalty = 1.3,   frequency_penalty = 1.4)
+                                    temperature = 1.4,    top_p = 0.98,   presence_penalty = 1.3,   frequency_penalty = 1.4,    max_retries = max_retries)
     log.info(f"{llm_generate_new.info}\nmodel init successfully..")
     model_generate_new      = llm_generate_new.model
+    if prompt_metrics:
+        from src.core.prompt_metrics import MeasuredChatModel
+        model_verify        = MeasuredChatModel(model_verify, prompt_metrics)
+        model_re_generate   = MeasuredChatModel(model_re_generate, prompt_metrics)
+        model_generate_new  = MeasuredChatModel(model_generate_new, prompt_metrics)
+        log.info(f"prompt metrics enabled")
+    if tracer:
+        from src.core.tracing import TracedChatModel
+        model_verify        = TracedChatModel(model_verify, tracer)
+        model_re_generate   = TracedChatModel(model_re_generate, tracer)
+        model_generate_new  = TracedChatModel(model_generate_new, tracer)
+        log.info(f"tracing enabled: {tracer.path}")
+    if rate_limiter:
+        from src.core.rate_limiter import RateLimitedChatModel
+        model_verify        = RateLimitedChatModel(model_verify, rate_limiter)
+        model_re_generate   = RateLimitedChatModel(model_re_generate, rate_limiter)
+        model_generate_new  = RateLimitedChatModel(model_generate_new, rate_limiter)
+        log.info(f"rate limiter enabled (max retries: {rate_limiter.max_retries})")
+    if budget:
+        from src.core.token_budget import BudgetedChatModel
+        model_verify        = BudgetedChatModel(model_verify, budget)
+        model_re_generate   = BudgetedChatModel(model_re_generate, budget)
+        model_generate_new  = BudgetedChatModel(model_generate_new, budget)
+        log.info(f"token budget enabled (on exhausted: {budget.on_exhausted})")
+    if cache:
+        from src.core.llm_cache import CachedChatModel
+        model_verify        = CachedChatModel(model_verify, cache)
+        model_re_generate   = CachedChatModel(model_re_generate, cache)
+        model_generate_new  = CachedChatModel(model_generate_new, cache)
+        log.info(f"LLM response cache enabled: {cache.path}")
     log.info(f"model_generate_new, model_re_generate, model_verify models initialized")
     return model_generate_new, model_re_generate, model_verify
 
-# Function to load a saved taxonomy from a file
-def load_taxonomy(file_path:str) -> Taxonomy:
-    # Deserialize the object from the binary file
-    with open(file_path, 'rb') as file:
-        loaded_taxonomy = pickle.load(file)
-    return loaded_taxonomy
-
-# Function for the token usage update
-def update_token_usage(token_usage, token_usage_delta):
-    res = {}
-    for key in token_usage.keys():#['completion_tokens', 'prompt_tokens','total_tokens']:
-        res[key] = token_usage[key] + token_usage_delta[key]
-    return res
+# Helper function splitting the token usage of a batched request evenly between its amount of items (the parts sum up to the total)
+def split_token_usage(token_usage, amount) -> list:
+    parts = [{} for _ in range(amount)]
+    for key, value in token_usage_counters(token_usage).items():
+        for i, part in enumerate(parts):
+            if isinstance(value, int):
+                part[key] = value//amount + (1 if i < value % amount else 0)
+            else:
+                part[key] = value/amount
+    return parts
 
 #EXAMPLE USAGE:
 #______________________
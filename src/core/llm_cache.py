@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import contextlib
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from src.core.model_wrappers import ChatModelWrapper, get_model_params, serialize_messages, chunk_token_usage
+
+# Class for the persistent (SQLite) cache of LLM responses, shared by all models of a session.
+#
+# Entries are keyed on the model checkpoint, the sampling parameters, the invocation kwargs
+# (max_tokens, ...) and the rendered messages. Identical requests sent several times within one
+# session (e.g. the regeneration attempts of iterate_level) get successive cache slots, so a retry
+# still reaches the model while a rerun of the same run is replayed from the cache slot by slot.
+class LLMResponseCache:
+    def __init__(self, path = None, max_entries = 200000, max_age_days = 30, eviction_interval = 500) -> None:
+        if not path:
+            path = os.path.join(os.getcwd(), 'data', 'cache', 'llm_cache.sqlite')
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path               = path
+        self.max_entries        = max_entries
+        self.max_age_days       = max_age_days
+        self.eviction_interval  = eviction_interval
+        self.hits               = 0
+        self.misses             = 0
+        self.occurrences        = {}
+        self.puts               = 0
+        self.lock               = threading.Lock()
+        self.connection         = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            model_checkpoint TEXT,
+            content TEXT,
+            response_metadata TEXT,
+            created_at REAL,
+            last_access REAL,
+            hits INTEGER DEFAULT 0)''')
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    # Method to compute the cache key of a request (without the occurrence number)
+    def make_key(self, model, prompt, kwargs) -> str:
+        request = {
+            'params':   get_model_params(model),
+            'kwargs':   {key: kwargs[key] for key in sorted(kwargs)},
+            'messages': serialize_messages(prompt),
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    # Method to get the key of the next occurrence of a request in the current session
+    def next_key(self, request_key) -> str:
+        with self.lock:
+            occurrence = self.occurrences.get(request_key, 0)
+            self.occurrences[request_key] = occurrence + 1
+        return f"{request_key}:{occurrence}"
+
+    # Method to get a cached response, returns (content, response_metadata) or None
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT content, response_metadata, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and self.max_age_days and row[2] < time.time() - self.max_age_days*86400:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if not row:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        return row[0], json.loads(row[1])
+
+    # Method to store a response
+    def put(self, key, model_checkpoint, content, response_metadata) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO responses (key, model_checkpoint, content, response_metadata, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                                    (key, model_checkpoint, content, json.dumps(response_metadata, default=str), now, now))
+            self.puts += 1
+            evict = self.puts % self.eviction_interval == 0
+        if evict:
+            self.evict()
+
+    # Method to drop the entries older than max_age_days and the least recently used entries above max_entries
+    def evict(self) -> int:
+        with self.lock:
+            removed = 0
+            if self.max_age_days:
+                removed += self.connection.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_days*86400,)).rowcount
+            if self.max_entries:
+                count = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if count > self.max_entries:
+                    removed += self.connection.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)", (count - self.max_entries,)).rowcount
+        return removed
+
+    # Method to remove all cached responses
+    def clear(self) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.occurrences = {}
+
+    # Method to get the hit/miss counters
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        requests = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits/requests if requests else 0.0, 'entries': entries, 'path': self.path}
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+# Helper function to build the token usage of a cache hit: nothing is spent, the tokens saved are reported separately
+def cache_hit_token_usage(token_usage) -> dict:
+    return {
+        'completion_tokens':            0,
+        'prompt_tokens':                0,
+        'total_tokens':                 0,
+        'cache_hits':                   1,
+        'cache_hit_completion_tokens':  token_usage.get('completion_tokens', 0),
+        'cache_hit_prompt_tokens':      token_usage.get('prompt_tokens', 0),
+        'cache_hit_total_tokens':       token_usage.get('total_tokens', 0),
+    }
+
+# Class wrapping a chat model with the persistent response cache
+class CachedChatModel(ChatModelWrapper):
+    def __init__(self, model, cache: LLMResponseCache) -> None:
+        super().__init__(model)
+        self.cache = cache
+
+    def lookup(self, prompt, kwargs):
+        key = self.cache.next_key(self.cache.make_key(self.model, prompt, kwargs))
+        cached = self.cache.get(key)
+        if cached is None:
+            return key, None
+        content, response_metadata = cached
+        response_metadata['token_usage'] = cache_hit_token_usage(response_metadata.get('token_usage', {}))
+        response_metadata['cache_hit'] = True
+        return key, AIMessage(content=content, response_metadata=response_metadata)
+
+    def store(self, key, response) -> None:
+        # responses cut short by the token budget are not reused
+        if response.response_metadata.get('budget_clipped'):
+            return
+        response_metadata = {k: v for k, v in response.response_metadata.items() if k in ('token_usage', 'model_name', 'finish_reason', 'system_fingerprint')}
+        self.cache.put(key, get_model_params(self.model)['model_checkpoint'], response.content, response_metadata)
+
+    def invoke(self, prompt, **kwargs):
+        key, response = self.lookup(prompt, kwargs)
+        if response is None:
+            response = self.model.invoke(prompt, **kwargs)
+            self.store(key, response)
+        return response
+
+    async def ainvoke(self, prompt, **kwargs):
+        key, response = self.lookup(prompt, kwargs)
+        if response is None:
+            response = await self.model.ainvoke(prompt, **kwargs)
+            self.store(key, response)
+        return response
+
+    # A cache hit is replayed as a single chunk; only complete streams are stored (a stream stopped early by the consumer is not)
+    async def astream(self, prompt, **kwargs):
+        key, response = self.lookup(prompt, kwargs)
+        if response is not None:
+            yield AIMessageChunk(content=response.content, response_metadata=response.response_metadata)
+            return
+        content = []
+        response_metadata = {}
+        async with contextlib.aclosing(self.model.astream(prompt, **kwargs)) as stream:
+            async for chunk in stream:
+                content.append(chunk.content)
+                response_metadata.update(chunk.response_metadata)
+                if chunk_token_usage(chunk):
+                    response_metadata['token_usage'] = chunk_token_usage(chunk)
+                yield chunk
+        self.store(key, AIMessage(content=''.join(content), response_metadata=response_metadata))
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.helper_functions import start_session, init_models
+#from src.core.llm_cache import LLMResponseCache
+#log = start_session(api_key)
+#cache = LLMResponseCache()
+#model_generate_new, model_re_generate, model_verify = init_models(log, cache = cache)
+#...
+#print(cache.stats())
+#______________________
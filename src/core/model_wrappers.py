@@ -0,0 +1,63 @@
+import json
+import contextlib
+
+# Base class for the wrappers around the chat models (response cache, budgets, rate limits...).
+# A wrapper exposes `invoke`/`ainvoke` like the wrapped LangChain model and forwards every other
+# attribute to it, so wrappers can be stacked and passed to the generation functions instead of the model.
+class ChatModelWrapper:
+    def __init__(self, model) -> None:
+        self.model = model
+
+    def __getattr__(self, name):
+        if name == 'model':
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def invoke(self, prompt, **kwargs):
+        return self.model.invoke(prompt, **kwargs)
+
+    async def ainvoke(self, prompt, **kwargs):
+        return await self.model.ainvoke(prompt, **kwargs)
+
+    # the wrapped stream is closed explicitly, so a consumer stopping early also stops the request below
+    async def astream(self, prompt, **kwargs):
+        async with contextlib.aclosing(self.model.astream(prompt, **kwargs)) as stream:
+            async for chunk in stream:
+                yield chunk
+
+# Helper function returning the innermost chat model of a stack of wrappers
+def unwrap_model(model):
+    while isinstance(model, ChatModelWrapper):
+        model = model.model
+    return model
+
+# Helper function returning the checkpoint and the sampling parameters of a (possibly wrapped) chat model
+def get_model_params(model) -> dict:
+    model = unwrap_model(model)
+    return {
+        'model_checkpoint':     getattr(model, 'model_name', None) or type(model).__name__,
+        'temperature':          getattr(model, 'temperature', None),
+        'top_p':                getattr(model, 'top_p', None),
+        'presence_penalty':     getattr(model, 'presence_penalty', None),
+        'frequency_penalty':    getattr(model, 'frequency_penalty', None),
+        'seed':                 getattr(model, 'seed', None),
+    }
+
+# Helper function returning the token usage reported by a streamed chunk in the token_usage format of the responses
+# (the usage_metadata of the last chunk of a stream, or the token_usage of a replayed cache hit), None without usage
+def chunk_token_usage(chunk):
+    usage_metadata = getattr(chunk, 'usage_metadata', None)
+    if not usage_metadata:
+        return getattr(chunk, 'response_metadata', {}).get('token_usage')
+    token_usage = {'completion_tokens': usage_metadata.get('output_tokens', 0), 'prompt_tokens': usage_metadata.get('input_tokens', 0), 'total_tokens': usage_metadata.get('total_tokens', 0)}
+    cached_tokens = (usage_metadata.get('input_token_details') or {}).get('cache_read')
+    if cached_tokens:
+        token_usage['prompt_tokens_details'] = {'cached_tokens': cached_tokens}
+    return token_usage
+
+# Helper function converting a prompt (list of LangChain messages or a string) to a JSON-serializable form
+def serialize_messages(prompt) -> list:
+    if isinstance(prompt, str):
+        return [['human', prompt]]
+    messages = prompt.to_messages() if hasattr(prompt, 'to_messages') else prompt
+    return [[message.type, message.content if isinstance(message.content, str) else json.dumps(message.content, sort_keys=True)] for message in messages]
@@ -0,0 +1,199 @@
+import os
+import re
+import sqlite3
+import logging
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+
+# NLTK resources used by the lemmatization (checked once per process by check_nltk_data)
+NLTK_RESOURCES = {'punkt_tab': 'tokenizers/punkt_tab', 'wordnet': 'corpora/wordnet'}
+
+nltk_status         = None
+nltk_status_lock    = threading.Lock()
+lemmatizer          = None
+
+# NLTK is imported on the first lemmatization (importing it takes a large part of a second)
+def get_lemmatizer():
+    global lemmatizer
+    if lemmatizer is None:
+        from nltk.stem import WordNetLemmatizer
+        lemmatizer = WordNetLemmatizer()
+    return lemmatizer
+
+# Function to check (and if missing, try to download) the NLTK data once, returns {resource: available}.
+# Without the tokenizer data the names are split on words and punctuation, without WordNet the tokens are kept as they are
+def check_nltk_data(download = True, log = None) -> dict:
+    global nltk_status
+    if not log:
+        log = logging.getLogger("check_nltk_data")
+    with nltk_status_lock:
+        if nltk_status is not None:
+            return nltk_status
+        import nltk
+        status = {}
+        for resource, path in NLTK_RESOURCES.items():
+            try:
+                nltk.data.find(path)
+                status[resource] = True
+            except LookupError:
+                status[resource] = False
+                if download:
+                    try:
+                        status[resource] = bool(nltk.download(resource, quiet = True))
+                    except Exception as e:
+                        log.warning(f"NLTK resource '{resource}' could not be downloaded: {e}")
+        if status['wordnet']:
+            try:
+                get_lemmatizer().lemmatize('tests')
+            except LookupError:
+                status['wordnet'] = False
+        if not all(status.values()):
+            log.warning(f"NLTK data missing ({[resource for resource, available in status.items() if not available]}), names are normalized without it")
+        nltk_status = status
+        return nltk_status
+
+# Helper function splitting a name into tokens (nltk.word_tokenize, or words and punctuation without the tokenizer data)
+def tokenize(name: str) -> list:
+    if check_nltk_data()['punkt_tab']:
+        import nltk
+        return nltk.word_tokenize(name)
+    return re.findall(r"\w+(?:[-']\w+)*|[^\w\s]", name)
+
+# Helper function lemmatizing a single token (cached, the vocabulary of the names is small compared to the names)
+@lru_cache(maxsize = 200000)
+def lemmatize_token(token: str) -> str:
+    if not check_nltk_data()['wordnet']:
+        return token
+    return get_lemmatizer().lemmatize(token)
+
+# Class for the name normalization service (lemmatization memo shared by the cotopy and the duplicate detection).
+#
+# Lemmatized names are kept in a bounded LRU memo; with a path they are also kept in a persistent SQLite memo,
+# so the names of a reloaded or re-evaluated taxonomy are not lemmatized again. The batch methods look up
+# all the names at once (one query per chunk of the persistent memo) and lemmatize only the missing ones.
+# Results computed without the NLTK data are not persisted.
+class NameNormalizer:
+    def __init__(self, max_entries = 100000, path = None) -> None:
+        self.max_entries    = max_entries
+        self.memo           = OrderedDict()
+        self.hits           = 0
+        self.misses         = 0
+        self.lock           = threading.Lock()
+        self.path           = path
+        self.connection     = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS lemmas (name TEXT PRIMARY KEY, lemma TEXT)")
+
+    # Method computing the lemmatized name (the same output as the former lemmatize_word)
+    def compute(self, name: str) -> str:
+        return ' '.join(lemmatize_token(token.strip()) for token in tokenize(name))
+
+    def remember(self, name, lemma) -> None:
+        self.memo[name] = lemma
+        if len(self.memo) > self.max_entries:
+            self.memo.popitem(last = False)
+
+    # Method to lemmatize a name
+    def lemmatize(self, name: str) -> str:
+        with self.lock:
+            lemma = self.memo.get(name)
+            if lemma is not None:
+                self.memo.move_to_end(name)
+                self.hits += 1
+                return lemma
+        return self.lemmatize_batch([name])[0]
+
+    # Method to lemmatize a list of names in one pass, returns the lemmatized names in the same order
+    def lemmatize_batch(self, names) -> list:
+        results = {}
+        missing = []
+        with self.lock:
+            for name in dict.fromkeys(names):
+                lemma = self.memo.get(name)
+                if lemma is None:
+                    missing.append(name)
+                else:
+                    self.memo.move_to_end(name)
+                    results[name] = lemma
+            self.hits += len(results)
+        if missing and self.connection is not None:
+            stored = {}
+            with self.lock:
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i + 500]
+                    stored.update(self.connection.execute(f"SELECT name, lemma FROM lemmas WHERE name IN ({','.join('?'*len(chunk))})", chunk).fetchall())
+                self.hits += len(stored)
+            results.update(stored)
+            missing = [name for name in missing if name not in stored]
+        computed = {}
+        for name in missing:
+            try:
+                computed[name] = self.compute(name)
+            except Exception:
+                computed[name] = name.strip()
+        results.update(computed)
+        with self.lock:
+            self.misses += len(computed)
+            for name in dict.fromkeys(names):
+                self.remember(name, results[name])
+            if computed and self.connection is not None and all(check_nltk_data().values()):
+                self.connection.executemany("INSERT OR REPLACE INTO lemmas (name, lemma) VALUES (?, ?)", computed.items())
+        return [results[name] for name in names]
+
+    # Method to normalize a concept name for the duplicate detection (case folded and lemmatized)
+    def normalize(self, name: str) -> str:
+        return ' '.join(self.lemmatize(name.casefold()).split())
+
+    def normalize_batch(self, names) -> list:
+        return [' '.join(lemma.split()) for lemma in self.lemmatize_batch([name.casefold() for name in names])]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'entries': len(self.memo), 'hits': self.hits, 'misses': self.misses, 'path': self.path}
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+default_normalizer = None
+default_normalizer_lock = threading.Lock()
+
+# Function to get the shared name normalizer of the process
+def get_name_normalizer() -> NameNormalizer:
+    global default_normalizer
+    with default_normalizer_lock:
+        if default_normalizer is None:
+            default_normalizer = NameNormalizer()
+        return default_normalizer
+
+# Function to replace the shared name normalizer (e.g. with one using a persistent memo)
+def set_name_normalizer(normalizer: NameNormalizer) -> NameNormalizer:
+    global default_normalizer
+    with default_normalizer_lock:
+        default_normalizer = normalizer
+    return normalizer
+
+# Helper function for lemmatizing words (memoized by the shared name normalizer)
+def lemmatize_word(word: str):
+    return get_name_normalizer().lemmatize(word)
+
+# Helper function for the concept name normalization used by the duplicate detection (case folded and lemmatized)
+def normalize_concept_name(name: str) -> str:
+    return get_name_normalizer().normalize(name)
+
+#EXAMPLE USAGE:
+#______________________
+#import os
+#from src.core.name_normalization import NameNormalizer, set_name_normalizer, check_nltk_data
+#check_nltk_data()
+#normalizer = set_name_normalizer(NameNormalizer(max_entries = 500000, path = os.path.join(os.getcwd(), 'data', 'cache', 'lemma_cache.sqlite')))
+#normalizer.lemmatize_batch(["Paintings", "Modern Sculptures"])
+#print(normalizer.stats())
+#______________________
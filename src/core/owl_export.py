@@ -0,0 +1,141 @@
+from urllib.parse import quote
+
+BASE_IRI        = "urn:ontology/"
+RDF             = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+RDFS            = "http://www.w3.org/2000/01/rdf-schema#"
+OWL             = "http://www.w3.org/2002/07/owl#"
+SKOS            = "http://www.w3.org/2004/02/skos/core#"
+XSD             = "http://www.w3.org/2001/XMLSchema#"
+
+# Supported export formats and their file extensions
+OWL_EXPORT_FORMATS = {'xml': '.owl', 'nt': '.nt', 'turtle': '.ttl'}
+
+# Annotation properties of the concepts (written with include_annotations)
+ANNOTATION_PROPERTIES = {'definition': SKOS + 'definition', 'rank': BASE_IRI + 'taxonomicalRank', 'level': BASE_IRI + 'taxonomicalLevel'}
+
+# Helper function for the IRI of a concept name (percent-encoded, so names with spaces give valid IRIs)
+def concept_iri(name: str) -> str:
+    return BASE_IRI + quote(name, safe = "")
+
+# Helpers for the XML text and attribute values (xml.sax.saxutils would pull in urllib.request on import)
+def escape(text: str) -> str:
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def quoteattr(text: str) -> str:
+    return '"' + escape(text).replace('"', '&quot;').replace('\n', '&#10;').replace('\r', '&#13;').replace('\t', '&#9;') + '"'
+
+# Helper function for the N-Triples/Turtle string literal
+def nt_literal(text: str) -> str:
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r') + '"'
+
+# Function walking the concept tree from the root without recursion (pre-order),
+# yields (iri, label, parent iri, annotations) for every concept with a name
+def iterate_concept_rows(taxonomy, include_annotations = False):
+    store = taxonomy.concepts
+    stack = [taxonomy.root.concept_id]
+    while stack:
+        concept_id = stack.pop()
+        stack += reversed(list(store.children_ids(concept_id)))
+        name = store.get_name(concept_id)
+        if name is None:
+            continue
+        parent_id = store.get_parent(concept_id)
+        parent_name = None if parent_id is None else store.get_name(parent_id)
+        annotations = None
+        if include_annotations:
+            annotations = {'definition': store.definition.get(concept_id), 'rank': store.get_rank(concept_id).strip(), 'level': store.level[concept_id]}
+        yield concept_iri(name), name, None if parent_name is None else concept_iri(parent_name), annotations
+
+# Writers of the formats: header lines, lines of a concept, footer lines
+
+def rdf_xml_header(include_annotations) -> list:
+    lines = ['<?xml version="1.0" encoding="utf-8"?>',
+             f'<rdf:RDF xmlns:rdf="{RDF}" xmlns:rdfs="{RDFS}" xmlns:owl="{OWL}" xmlns:skos="{SKOS}" xmlns:ex="{BASE_IRI}">']
+    if include_annotations:
+        lines += [f'  <owl:AnnotationProperty rdf:about={quoteattr(iri)}/>' for iri in ANNOTATION_PROPERTIES.values()]
+    return lines
+
+def rdf_xml_concept(iri, label, parent_iri, annotations) -> list:
+    lines = [f'  <owl:Class rdf:about={quoteattr(iri)}>', f'    <rdfs:label>{escape(label)}</rdfs:label>']
+    if parent_iri:
+        lines.append(f'    <rdfs:subClassOf rdf:resource={quoteattr(parent_iri)}/>')
+    if annotations:
+        if annotations['definition']:
+            lines.append(f'    <skos:definition>{escape(annotations["definition"])}</skos:definition>')
+        lines.append(f'    <ex:taxonomicalRank>{escape(annotations["rank"])}</ex:taxonomicalRank>')
+        lines.append(f'    <ex:taxonomicalLevel rdf:datatype="{XSD}integer">{annotations["level"]}</ex:taxonomicalLevel>')
+    lines.append('  </owl:Class>')
+    return lines
+
+def rdf_xml_footer() -> list:
+    return ['</rdf:RDF>']
+
+def ntriples_header(include_annotations) -> list:
+    if not include_annotations:
+        return []
+    return [f'<{iri}> <{RDF}type> <{OWL}AnnotationProperty> .' for iri in ANNOTATION_PROPERTIES.values()]
+
+def ntriples_concept(iri, label, parent_iri, annotations) -> list:
+    lines = [f'<{iri}> <{RDF}type> <{OWL}Class> .', f'<{iri}> <{RDFS}label> {nt_literal(label)} .']
+    if parent_iri:
+        lines.append(f'<{iri}> <{RDFS}subClassOf> <{parent_iri}> .')
+    if annotations:
+        if annotations['definition']:
+            lines.append(f'<{iri}> <{ANNOTATION_PROPERTIES["definition"]}> {nt_literal(annotations["definition"])} .')
+        lines.append(f'<{iri}> <{ANNOTATION_PROPERTIES["rank"]}> {nt_literal(annotations["rank"])} .')
+        lines.append(f'<{iri}> <{ANNOTATION_PROPERTIES["level"]}> "{annotations["level"]}"^^<{XSD}integer> .')
+    return lines
+
+def turtle_header(include_annotations) -> list:
+    lines = [f'@prefix rdf: <{RDF}> .', f'@prefix rdfs: <{RDFS}> .', f'@prefix owl: <{OWL}> .', f'@prefix skos: <{SKOS}> .', f'@prefix xsd: <{XSD}> .', '']
+    if include_annotations:
+        lines += [f'<{iri}> a owl:AnnotationProperty .' for iri in ANNOTATION_PROPERTIES.values()] + ['']
+    return lines
+
+def turtle_concept(iri, label, parent_iri, annotations) -> list:
+    statements = ['a owl:Class', f'rdfs:label {nt_literal(label)}']
+    if parent_iri:
+        statements.append(f'rdfs:subClassOf <{parent_iri}>')
+    if annotations:
+        if annotations['definition']:
+            statements.append(f'skos:definition {nt_literal(annotations["definition"])}')
+        statements.append(f'<{ANNOTATION_PROPERTIES["rank"]}> {nt_literal(annotations["rank"])}')
+        statements.append(f'<{ANNOTATION_PROPERTIES["level"]}> "{annotations["level"]}"^^xsd:integer')
+    return [f'<{iri}> ' + ' ;\n    '.join(statements) + ' .', '']
+
+OWL_WRITERS = {
+    'xml':      (rdf_xml_header,    rdf_xml_concept,    rdf_xml_footer),
+    'nt':       (ntriples_header,   ntriples_concept,   lambda: []),
+    'turtle':   (turtle_header,     turtle_concept,     lambda: []),
+}
+
+# Function to export the taxonomy to an RDF/OWL file ('xml' - RDF/XML, 'nt' - N-Triples, 'turtle' - Turtle).
+# The concept tree is walked iteratively and the triples are written to the file in chunks of chunk_size concepts,
+# so the memory does not grow with the taxonomy size and deep taxonomies do not hit the recursion limit.
+# With include_annotations the definitions (skos:definition), taxonomical ranks and levels are exported too.
+# Returns the amount of exported concepts
+def export_taxonomy_to_owl(taxonomy, file_path, format = 'xml', include_annotations = False, chunk_size = 10000) -> int:
+    if format not in OWL_WRITERS:
+        raise ValueError(f"unknown export format '{format}', expected one of {list(OWL_WRITERS)}")
+    header, concept_lines, footer = OWL_WRITERS[format]
+    exported = 0
+    with open(file_path, 'w', encoding = 'utf-8', newline = '\n') as file:
+        chunk = header(include_annotations)
+        for row in iterate_concept_rows(taxonomy, include_annotations = include_annotations):
+            chunk += concept_lines(*row)
+            exported += 1
+            if exported % chunk_size == 0:
+                file.write('\n'.join(chunk) + '\n')
+                chunk = []
+        chunk += footer()
+        if chunk:
+            file.write('\n'.join(chunk) + '\n')
+    return exported
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.helper_functions import load_taxonomy
+#from src.core.owl_export import export_taxonomy_to_owl
+#tax_t = load_taxonomy(path)
+#export_taxonomy_to_owl(tax_t, "taxonomy.ttl", format = 'turtle', include_annotations = True)
+#______________________
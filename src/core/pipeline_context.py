@@ -0,0 +1,86 @@
+import asyncio
+import functools
+import contextlib
+import contextvars
+
+# Context of the model requests: the pipeline stage (subconcepts, verify, ...), the ranks list and the taxonomical
+# level (of the subconcepts) the request is made for. The generation functions set the stage (see pipeline_stage),
+# the expansion loops set the ranks list and the level; the model wrappers (budgets, ...) read them without any change
+# to the signatures of the generation functions. Every asyncio task gets its own copy of the context.
+# current_tracer is the active src.core.tracing.Tracer (None: the stages are not traced)
+current_stage       = contextvars.ContextVar('current_stage', default = None)
+current_ranks_list  = contextvars.ContextVar('current_ranks_list', default = None)
+current_level       = contextvars.ContextVar('current_level', default = None)
+current_tracer      = contextvars.ContextVar('current_tracer', default = None)
+
+# Base class of the exceptions stopping the pipeline cleanly (exhausted budget, unavailable model, ...).
+# It derives from BaseException like KeyboardInterrupt, so the `except Exception` fallbacks of the
+# generation functions do not turn it into an empty result: the expansion loops save the progress and re-raise it.
+#
+# The work it stops has spent tokens already (the finished requests of the interrupted expansion): every layer it passes
+# adds the token usage it collected (add_token_usage) and the expansion loops add the total to the taxonomy (take_token_usage)
+class PipelineInterrupt(BaseException):
+    stop_reason             = 'interrupted'
+    token_usage             = None
+    token_usage_by_stage    = None
+
+    # Method adding the token usage (and the token usage by stage) of the interrupted work
+    def add_token_usage(self, token_usage, token_usage_by_stage = None) -> 'PipelineInterrupt':
+        from src.core.taxonomy_model import update_token_usage, update_token_usage_by_stage
+        if token_usage:
+            self.token_usage = update_token_usage(self.token_usage or {}, token_usage)
+        if token_usage_by_stage:
+            self.token_usage_by_stage = update_token_usage_by_stage(self.token_usage_by_stage or {}, token_usage_by_stage)
+        return self
+
+    # Method returning the token usage and the token usage by stage added so far and clearing them (so they are counted once)
+    def take_token_usage(self) -> tuple:
+        token_usage, token_usage_by_stage = self.token_usage or {}, self.token_usage_by_stage or {}
+        self.token_usage = self.token_usage_by_stage = None
+        return token_usage, token_usage_by_stage
+
+# Context manager setting the stage, the ranks list and/or the level of the model requests made inside it
+@contextlib.contextmanager
+def pipeline_scope(stage = None, ranks_list = None, level = None):
+    tokens = []
+    if stage is not None:
+        tokens.append((current_stage, current_stage.set(stage)))
+    if ranks_list is not None:
+        tokens.append((current_ranks_list, current_ranks_list.set(ranks_list)))
+    if level is not None:
+        tokens.append((current_level, current_level.set(level)))
+    try:
+        yield
+    finally:
+        for variable, token in reversed(tokens):
+            variable.reset(token)
+
+# Decorator marking a (sync or async) generation function as a pipeline stage (with an active tracer every call is a span)
+def pipeline_stage(stage: str):
+    def decorator(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with pipeline_scope(stage = stage):
+                    tracer = current_tracer.get()
+                    if tracer is None:
+                        return await function(*args, **kwargs)
+                    with tracer.span(function.__name__, kind = 'stage') as span:
+                        return span.set_result(await function(*args, **kwargs))
+            async_wrapper.stage = stage
+            return async_wrapper
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with pipeline_scope(stage = stage):
+                tracer = current_tracer.get()
+                if tracer is None:
+                    return function(*args, **kwargs)
+                with tracer.span(function.__name__, kind = 'stage') as span:
+                    return span.set_result(function(*args, **kwargs))
+        wrapper.stage = stage
+        return wrapper
+    return decorator
+
+# Helper function returning the current stage, ranks list and level
+def get_pipeline_context() -> dict:
+    return {'stage': current_stage.get(), 'ranks_list': current_ranks_list.get(), 'level': current_level.get()}
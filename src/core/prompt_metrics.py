@@ -0,0 +1,88 @@
+import time
+import threading
+import contextlib
+
+from src.core.model_wrappers import ChatModelWrapper, chunk_token_usage
+from src.core.pipeline_context import current_stage
+from src.core.taxonomy_model import token_usage_counters
+
+# Class for the prompt metrics of a session, per pipeline stage: the requests, their prompt tokens, the prompt tokens read
+# from the provider's prompt cache (cached_prompt_tokens) and the time to the first token (for a request that is not
+# streamed: the time to the whole response). Compare the stats before and after a prompt change to see its effect on
+# the prompt-token cost and the latency. One PromptMetrics is shared by the models of init_models(prompt_metrics = ...)
+class PromptMetrics:
+    def __init__(self) -> None:
+        self.lock       = threading.Lock()
+        self.counters   = {}
+
+    # Method recording a response (stage None is counted as 'other')
+    def record(self, stage, token_usage, first_token_seconds, streamed = False) -> None:
+        token_usage = token_usage_counters(token_usage) if token_usage else {}
+        with self.lock:
+            counters = self.counters.setdefault(stage if stage else 'other', {'requests': 0, 'streamed': 0, 'prompt_tokens': 0, 'cached_prompt_tokens': 0, 'first_token_seconds': 0.0})
+            counters['requests'] += 1
+            counters['streamed'] += int(streamed)
+            counters['prompt_tokens'] += token_usage.get('prompt_tokens', 0)
+            counters['cached_prompt_tokens'] += token_usage.get('cached_prompt_tokens', 0)
+            counters['first_token_seconds'] += first_token_seconds
+
+    # Method to get the counters per stage and in total, with the cached share of the prompt tokens and the mean time to the first token
+    def stats(self) -> dict:
+        with self.lock:
+            stages = {stage: dict(counters) for stage, counters in self.counters.items()}
+        total = {'requests': 0, 'streamed': 0, 'prompt_tokens': 0, 'cached_prompt_tokens': 0, 'first_token_seconds': 0.0}
+        for counters in stages.values():
+            for key in total:
+                total[key] += counters[key]
+        for counters in list(stages.values()) + [total]:
+            counters['cached_prompt_share'] = round(counters['cached_prompt_tokens']/counters['prompt_tokens'], 4) if counters['prompt_tokens'] else 0.0
+            counters['mean_first_token_seconds'] = round(counters['first_token_seconds']/counters['requests'], 4) if counters['requests'] else 0.0
+        return {'stages': stages, 'total': total}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters = {}
+
+# Class wrapping a chat model with the prompt metrics. It measures the wrapped model only, so it is the innermost wrapper
+# (cache hits and the waits of the rate limiter are not counted, every retried attempt is)
+class MeasuredChatModel(ChatModelWrapper):
+    def __init__(self, model, metrics: PromptMetrics) -> None:
+        super().__init__(model)
+        self.metrics = metrics
+
+    def invoke(self, prompt, **kwargs):
+        start_time = time.perf_counter()
+        response = self.model.invoke(prompt, **kwargs)
+        self.metrics.record(current_stage.get(), response.response_metadata.get('token_usage'), time.perf_counter() - start_time)
+        return response
+
+    async def ainvoke(self, prompt, **kwargs):
+        start_time = time.perf_counter()
+        response = await self.model.ainvoke(prompt, **kwargs)
+        self.metrics.record(current_stage.get(), response.response_metadata.get('token_usage'), time.perf_counter() - start_time)
+        return response
+
+    async def astream(self, prompt, **kwargs):
+        start_time = time.perf_counter()
+        first_token_seconds = None
+        token_usage = None
+        try:
+            async with contextlib.aclosing(self.model.astream(prompt, **kwargs)) as stream:
+                async for chunk in stream:
+                    if first_token_seconds is None and chunk.content:
+                        first_token_seconds = time.perf_counter() - start_time
+                    token_usage = chunk_token_usage(chunk) or token_usage
+                    yield chunk
+        finally:
+            # a stream cut short before its usage was reported still counts its time to the first token
+            if first_token_seconds is not None:
+                self.metrics.record(current_stage.get(), token_usage, first_token_seconds, streamed = True)
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.prompt_metrics import PromptMetrics
+#prompt_metrics = PromptMetrics()
+#model_generate_new, model_re_generate, model_verify = init_models(log, prompt_metrics = prompt_metrics)
+#tax_t = iterate_level(tax_t, 0, model_generate_new, model_re_generate, model_verify, log = log)
+#print(prompt_metrics.stats())   # {'stages': {stage: {requests, prompt_tokens, cached_prompt_tokens, cached_prompt_share, mean_first_token_seconds...}}, 'total': {...}}
+#______________________
@@ -0,0 +1,272 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextlib
+import email.utils
+
+from src.core.model_wrappers import ChatModelWrapper, get_model_params, chunk_token_usage
+from src.core.pipeline_context import PipelineInterrupt, current_stage
+from src.core.tracing import count_span
+
+# Client-side (requests per minute, tokens per minute) limits, matched on the longest prefix of the model checkpoint.
+# Set them to the limits of your API tier; None means unlimited
+DEFAULT_RATE_LIMITS = {
+    'gpt-4o':           (500, 30000),
+    'gpt-4o-mini':      (500, 200000),
+    'gpt-4-turbo':      (500, 30000),
+    'gpt-4':            (500, 10000),
+    'gpt-3.5-turbo':    (500, 200000),
+}
+
+# HTTP status codes of the errors worth retrying (timeouts, conflicts, rate limits and server errors)
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Exception class names (openai, httpx and the builtins) of the transient network errors and the unusable models
+TRANSIENT_ERROR_NAMES   = {'APITimeoutError', 'APIConnectionError', 'InternalServerError', 'TimeoutException', 'NetworkError', 'RemoteProtocolError', 'TimeoutError', 'ConnectionError'}
+UNAVAILABLE_ERROR_NAMES = {'AuthenticationError', 'PermissionDeniedError'}
+
+# Raised when a model cannot be used any more: the retries of a transient error are exhausted,
+# or the error is not transient but concerns every request (invalid API key, exhausted quota).
+# Like an exhausted budget it stops the expansion cleanly (progress saved, the concepts left uninspected)
+# instead of being counted as a rejected generation
+class ModelUnavailableError(PipelineInterrupt):
+    stop_reason = 'model_unavailable'
+
+    def __init__(self, model_checkpoint, error, attempts) -> None:
+        super().__init__(f"model {model_checkpoint} unavailable after {attempts} attempts: {type(error).__name__}: {error}")
+        self.model_checkpoint   = model_checkpoint
+        self.error              = error
+        self.attempts           = attempts
+
+# Function to classify an exception raised by a model request:
+#   'rate_limit'    - 429, retried after the Retry-After time (the whole checkpoint is paused)
+#   'transient'     - timeouts, connection and server errors, retried with backoff
+#   'unavailable'   - invalid key, permissions, exhausted quota: retrying cannot help, the pipeline stops
+#   'fatal'         - errors of this request (bad request, context length...), raised to the generation function as before
+def classify_error(error) -> str:
+    names = {cls.__name__ for cls in type(error).__mro__}
+    status_code = getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    body = getattr(error, 'body', None)
+    code = getattr(error, 'code', None) or (body.get('code') if isinstance(body, dict) else None)
+    if code == 'insufficient_quota' or names & UNAVAILABLE_ERROR_NAMES or status_code in (401, 403):
+        return 'unavailable'
+    if status_code == 429 or 'RateLimitError' in names:
+        return 'rate_limit'
+    if status_code in RETRYABLE_STATUS_CODES or names & TRANSIENT_ERROR_NAMES:
+        return 'transient'
+    return 'fatal'
+
+# Helper function reading the Retry-After time (seconds) of an API error, None if the response has none
+def get_retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms'])/1000
+        retry_after = headers.get('retry-after')
+        if not retry_after:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Class for a token bucket refilled continuously at `limit` per minute (capacity: one minute of the limit).
+# take() reserves the amount at once and returns how long the caller has to wait for it: the level may go
+# below zero, so concurrent callers queue up behind each other instead of all waking up at the same time
+class TokenBucket:
+    def __init__(self, limit_per_minute) -> None:
+        self.capacity   = float(limit_per_minute)
+        self.rate       = limit_per_minute/60
+        self.level      = float(limit_per_minute)
+        self.updated    = time.monotonic()
+
+    def refill(self, now) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated)*self.rate)
+        self.updated = now
+
+    def take(self, amount, now) -> float:
+        self.refill(now)
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level/self.rate)
+
+    # Method returning the unused part of a reservation (e.g. the estimated completion tokens that were not generated)
+    def give_back(self, amount, now) -> None:
+        self.refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+# Class for the client-side scheduler of the model requests, shared by all models of a session.
+#
+# Every model checkpoint gets a requests/min and a tokens/min token bucket (limits from rate_limits, prefix matched).
+# A request waits until both buckets allow it; the tokens are estimated like the token budget does (prompt + max_tokens)
+# and corrected with the real usage after the response. Failed requests are classified (classify_error): rate limits
+# and transient errors are retried up to max_retries times with full-jitter exponential backoff (base_delay * 2^attempt,
+# at most max_delay, at least the Retry-After of the response), and a 429 pauses the whole checkpoint. A model that
+# stays unavailable raises ModelUnavailableError, so the failure is not mistaken for a rejected generation
+# (the expansion saves its progress and returns with taxonomy.stop_reason = 'model_unavailable').
+class RateLimiter:
+    def __init__(self, rate_limits = None, max_retries = 6, base_delay = 1.0, max_delay = 60.0, default_completion_tokens = 1024, seed = None, log = None) -> None:
+        self.rate_limits                = rate_limits if rate_limits is not None else DEFAULT_RATE_LIMITS
+        self.max_retries                = max_retries
+        self.base_delay                 = base_delay
+        self.max_delay                  = max_delay
+        self.default_completion_tokens  = default_completion_tokens
+        self.random                     = random.Random(seed)
+        self.log                        = log if log else logging.getLogger("RateLimiter")
+        self.lock                       = threading.Lock()
+        self.buckets                    = {}
+        self.paused_until               = {}
+        self.counters                   = {}
+
+    # Method returning the (requests/min, tokens/min) limits of a model checkpoint
+    def limits(self, model_checkpoint):
+        matches = [name for name in self.rate_limits if str(model_checkpoint).startswith(name)]
+        if not matches:
+            return (None, None)
+        return self.rate_limits[max(matches, key=len)]
+
+    def count(self, model_checkpoint, counter, amount = 1) -> None:
+        counters = self.counters.setdefault(model_checkpoint, {'requests': 0, 'retries': 0, 'rate_limited': 0, 'transient_errors': 0, 'unavailable': 0, 'waited_seconds': 0.0})
+        counters[counter] += amount
+
+    # Method reserving a request (one request and the estimated tokens) on the buckets of the checkpoint, returns the seconds to wait
+    def acquire(self, model_checkpoint, tokens) -> float:
+        with self.lock:
+            if model_checkpoint not in self.buckets:
+                requests_limit, tokens_limit = self.limits(model_checkpoint)
+                self.buckets[model_checkpoint] = (TokenBucket(requests_limit) if requests_limit else None, TokenBucket(tokens_limit) if tokens_limit else None)
+            request_bucket, token_bucket = self.buckets[model_checkpoint]
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until.get(model_checkpoint, now) - now)
+            if request_bucket:
+                wait = max(wait, request_bucket.take(1, now))
+            if token_bucket:
+                wait = max(wait, token_bucket.take(tokens, now))
+            self.count(model_checkpoint, 'requests')
+            self.count(model_checkpoint, 'waited_seconds', wait)
+        return wait
+
+    # Method correcting the token reservation of a request with the tokens it really used
+    def settle(self, model_checkpoint, reserved_tokens, token_usage = None) -> None:
+        used = (token_usage or {}).get('total_tokens', 0)
+        with self.lock:
+            token_bucket = self.buckets[model_checkpoint][1]
+            if token_bucket:
+                token_bucket.give_back(reserved_tokens - used, time.monotonic())
+
+    # Method deciding what to do about a failed request: returns the seconds to wait before the retry,
+    # raises ModelUnavailableError or the error itself if the request must not be retried
+    def on_error(self, model_checkpoint, error, attempt) -> float:
+        kind = classify_error(error)
+        with self.lock:
+            if kind == 'fatal':
+                raise error
+            if kind == 'unavailable' or attempt >= self.max_retries:
+                self.count(model_checkpoint, 'unavailable')
+                raise ModelUnavailableError(model_checkpoint, error, attempt + 1) from error
+            self.count(model_checkpoint, 'rate_limited' if kind == 'rate_limit' else 'transient_errors')
+            self.count(model_checkpoint, 'retries')
+            delay = self.random.uniform(0, min(self.max_delay, self.base_delay*2**attempt))
+            retry_after = get_retry_after(error)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if kind == 'rate_limit':
+                # the other requests of the checkpoint wait too, instead of hitting the limit again
+                self.paused_until[model_checkpoint] = max(self.paused_until.get(model_checkpoint, 0.0), time.monotonic() + delay)
+        count_span('retries')
+        self.log.info(f"{kind} error of {model_checkpoint} in stage '{current_stage.get()}' ({type(error).__name__}: {error}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        return delay
+
+    # Method to get the counters per model checkpoint
+    def stats(self) -> dict:
+        with self.lock:
+            return {model_checkpoint: dict(counters, waited_seconds = round(counters['waited_seconds'], 3)) for model_checkpoint, counters in self.counters.items()}
+
+# Class wrapping a chat model with the shared rate limiter (inside the budget and the cache wrappers: the retries happen below them)
+class RateLimitedChatModel(ChatModelWrapper):
+    def __init__(self, model, limiter: RateLimiter) -> None:
+        super().__init__(model)
+        self.limiter = limiter
+
+    def reserve(self, prompt, kwargs):
+        from src.core.token_budget import estimate_prompt_tokens
+        model_checkpoint = get_model_params(self.model)['model_checkpoint']
+        tokens = estimate_prompt_tokens(prompt, model_checkpoint) + (kwargs.get('max_tokens') or self.limiter.default_completion_tokens)
+        return model_checkpoint, tokens
+
+    def invoke(self, prompt, **kwargs):
+        model_checkpoint, tokens = self.reserve(prompt, kwargs)
+        attempt = 0
+        while True:
+            time.sleep(self.limiter.acquire(model_checkpoint, tokens))
+            try:
+                response = self.model.invoke(prompt, **kwargs)
+            except Exception as e:
+                self.limiter.settle(model_checkpoint, tokens)
+                time.sleep(self.limiter.on_error(model_checkpoint, e, attempt))
+                attempt += 1
+                continue
+            self.limiter.settle(model_checkpoint, tokens, response.response_metadata.get('token_usage'))
+            return response
+
+    async def ainvoke(self, prompt, **kwargs):
+        model_checkpoint, tokens = self.reserve(prompt, kwargs)
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.limiter.acquire(model_checkpoint, tokens))
+            try:
+                response = await self.model.ainvoke(prompt, **kwargs)
+            except Exception as e:
+                self.limiter.settle(model_checkpoint, tokens)
+                await asyncio.sleep(self.limiter.on_error(model_checkpoint, e, attempt))
+                attempt += 1
+                continue
+            self.limiter.settle(model_checkpoint, tokens, response.response_metadata.get('token_usage'))
+            return response
+
+    # A stream is retried only if it fails before its first chunk (the chunks already passed on cannot be taken back)
+    async def astream(self, prompt, **kwargs):
+        from src.core.token_budget import estimate_stream_token_usage
+        model_checkpoint, tokens = self.reserve(prompt, kwargs)
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.limiter.acquire(model_checkpoint, tokens))
+            token_usage = None
+            chunks = 0
+            error = None
+            try:
+                async with contextlib.aclosing(self.model.astream(prompt, **kwargs)) as stream:
+                    async for chunk in stream:
+                        chunks += 1
+                        token_usage = chunk_token_usage(chunk) or token_usage
+                        yield chunk
+            except Exception as e:
+                if chunks:
+                    raise
+                error = e
+            finally:
+                if not token_usage and chunks:
+                    token_usage = estimate_stream_token_usage(prompt, model_checkpoint, chunks)
+                self.limiter.settle(model_checkpoint, tokens, token_usage)
+            if error is None:
+                return
+            await asyncio.sleep(self.limiter.on_error(model_checkpoint, error, attempt))
+            attempt += 1
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.helper_functions import start_session, init_models
+#from src.core.rate_limiter import RateLimiter
+#log = start_session(api_key)
+#limiter = RateLimiter(rate_limits = {'gpt-4o': (500, 30000), 'gpt-4o-mini': (500, 200000)}, max_retries = 6, log = log)
+#model_generate_new, model_re_generate, model_verify = init_models(log, rate_limiter = limiter)
+#tax_t = iterate_level(tax_t, 0, model_generate_new, model_re_generate, model_verify, log = log, max_concurrency = 16)
+#if tax_t.stop_reason == 'model_unavailable':
+#    log.info("stopped")   # the progress is saved, the unexpanded concepts stay uninspected
+#print(limiter.stats())
+#______________________
@@ -0,0 +1,130 @@
+import re
+import logging
+import threading
+
+# Modes of the local redundancy filter:
+#   'active' - near-duplicate candidates are removed before the LLM redundancy call, and the call is skipped
+#              when no pair of candidates comes close to being a duplicate
+#   'shadow' - the candidates and the LLM call are left untouched, the local result is only compared with the LLM answer
+REDUNDANCY_FILTER_MODES = ('active', 'shadow')
+
+# Helper function normalizing a concept name for the n-grams (lower case, words separated by single spaces, padded,
+# plural 's' endings dropped so that "Sculpture" and "Sculptures" get the same n-grams)
+def normalize_for_ngrams(name: str) -> str:
+    words = re.sub(r'[^\w]+', ' ', name.lower()).split()
+    return ' ' + ' '.join(word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word for word in words) + ' '
+
+# Function computing the L2-normalized character n-gram TF-IDF vectors of a list of names (one row per name).
+# The vocabulary and the inverse document frequencies come from the names themselves, so the n-grams shared by
+# all of them (the common rank suffix, e.g. "school") weigh less than the distinctive ones
+def char_ngram_tfidf(names: list, n = 3):
+    import numpy as np
+    vocabulary = {}
+    rows, columns = [], []
+    for row, name in enumerate(names):
+        text = normalize_for_ngrams(name)
+        for start in range(max(1, len(text) - n + 1)):
+            rows.append(row)
+            columns.append(vocabulary.setdefault(text[start:start + n], len(vocabulary)))
+    counts = np.zeros((len(names), max(1, len(vocabulary))))
+    np.add.at(counts, (np.array(rows, dtype = np.int64), np.array(columns, dtype = np.int64)), 1.0)
+    document_frequency = (counts > 0).sum(axis = 0)
+    tfidf = counts*(np.log((1 + len(names))/(1 + document_frequency)) + 1)
+    norms = np.linalg.norm(tfidf, axis = 1, keepdims = True)
+    return tfidf/np.where(norms > 0, norms, 1.0)
+
+# Class for the outcome of a local redundancy check of a candidates list
+#   candidates - the candidates to keep (in the original order)
+#   redundant  - the candidates found to be near-duplicates of an earlier candidate or of an existing sibling
+#   max_similarity - highest cosine similarity between two kept candidates (or a kept candidate and a sibling)
+#   skip_llm   - the LLM redundancy call is not needed (active mode, max_similarity below the skip threshold)
+class RedundancyCheck:
+    def __init__(self, candidates, redundant, max_similarity, skip_llm) -> None:
+        self.candidates     = candidates
+        self.redundant      = redundant
+        self.max_similarity = max_similarity
+        self.skip_llm       = skip_llm
+
+# Class for the local, vectorized redundancy filter run before the LLM redundancy call (create_redundant_subconcepts_list).
+#
+# The candidates and the existing siblings are compared with the cosine similarity of their character n-gram TF-IDF
+# vectors. A candidate at least duplicate_threshold similar to an earlier candidate or to a sibling is an obvious
+# duplicate ("Oil painting"/"Oil Paintings"). When no remaining pair reaches skip_below, the list has no near-duplicates
+# and the LLM call is skipped (skip_below = None always calls the LLM). The LLM call also removes candidates that
+# do not belong to the taxonomy or the rank, which the lexical check cannot see: run the filter in the 'shadow' mode
+# first and compare the counters (shadow_skips_missed is the amount of skippable calls in which the LLM removed something).
+# One filter is shared by all the expansions of a session, its counters are returned by stats()
+class LexicalRedundancyFilter:
+    def __init__(self, mode = 'active', duplicate_threshold = 0.8, skip_below = 0.35, ngram_size = 3, log = None) -> None:
+        if mode not in REDUNDANCY_FILTER_MODES:
+            raise ValueError(f"unknown redundancy filter mode '{mode}', expected one of {REDUNDANCY_FILTER_MODES}")
+        self.mode                   = mode
+        self.duplicate_threshold    = duplicate_threshold
+        self.skip_below             = skip_below
+        self.ngram_size             = ngram_size
+        self.log                    = log if log else logging.getLogger("LexicalRedundancyFilter")
+        self.lock                   = threading.Lock()
+        self.counters               = {'checks': 0, 'candidates': 0, 'duplicates_removed': 0, 'llm_calls_skipped': 0,
+                                       'shadow_checks': 0, 'shadow_skippable': 0, 'shadow_skips_missed': 0, 'shadow_local_redundant': 0, 'shadow_llm_redundant': 0, 'shadow_both_redundant': 0}
+
+    # Method checking a candidates list against itself and the existing siblings (names of the concepts already under the same parent)
+    def check(self, candidates: list, siblings = ()) -> RedundancyCheck:
+        import numpy as np
+        siblings = list(siblings)
+        if not candidates:
+            return RedundancyCheck([], [], 0.0, False)
+        vectors = char_ngram_tfidf(siblings + list(candidates), self.ngram_size)
+        similarity = vectors @ vectors.T
+        np.fill_diagonal(similarity, 0.0)
+        kept = list(range(len(siblings)))
+        redundant = []
+        for index, candidate in enumerate(candidates, start = len(siblings)):
+            if kept and similarity[index, kept].max() >= self.duplicate_threshold:
+                redundant.append(candidate)
+            else:
+                kept.append(index)
+        kept_candidates = [candidates[index - len(siblings)] for index in kept[len(siblings):]]
+        # highest similarity of a kept candidate to any other kept name (sibling pairs are not the concern of this list)
+        new = kept[len(siblings):]
+        max_similarity = float(similarity[np.ix_(new, kept)].max()) if new and len(kept) > 1 else 0.0
+        skip_llm = self.mode == 'active' and self.skip_below is not None and max_similarity < self.skip_below
+        with self.lock:
+            self.counters['checks'] += 1
+            self.counters['candidates'] += len(candidates)
+            if self.mode == 'active':
+                self.counters['duplicates_removed'] += len(redundant)
+                self.counters['llm_calls_skipped'] += int(skip_llm)
+        self.log.info(f"local redundancy check: {len(redundant)} near-duplicates {redundant}, max similarity {max_similarity:.2f}, LLM call skipped: {skip_llm}")
+        if self.mode == 'shadow':
+            return RedundancyCheck(list(candidates), redundant, max_similarity, False)
+        return RedundancyCheck(kept_candidates, redundant, max_similarity, skip_llm)
+
+    # Method comparing a shadow check with the redundant candidates returned by the LLM call (only counted in the shadow mode)
+    def compare(self, check: RedundancyCheck, llm_redundant: list) -> None:
+        if self.mode != 'shadow':
+            return
+        llm_redundant = {name.strip().lower() for name in llm_redundant}
+        llm_flagged = {candidate.lower() for candidate in check.candidates if candidate.lower() in llm_redundant}
+        local_flagged = {candidate.lower() for candidate in check.redundant}
+        skippable = self.skip_below is not None and check.max_similarity < self.skip_below
+        with self.lock:
+            self.counters['shadow_checks'] += 1
+            self.counters['shadow_skippable'] += int(skippable)
+            self.counters['shadow_skips_missed'] += int(skippable and bool(llm_flagged))
+            self.counters['shadow_local_redundant'] += len(local_flagged)
+            self.counters['shadow_llm_redundant'] += len(llm_flagged)
+            self.counters['shadow_both_redundant'] += len(local_flagged & llm_flagged)
+        if local_flagged != llm_flagged:
+            self.log.info(f"redundancy filter shadow mismatch: local {sorted(local_flagged)}, LLM {sorted(llm_flagged)}")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.redundancy_filter import LexicalRedundancyFilter
+#redundancy_filter = LexicalRedundancyFilter(mode = 'shadow')
+#tax_t = iterate_level(tax_t, 0, *models, redundancy_filter = redundancy_filter)
+#print(redundancy_filter.stats())
+#______________________
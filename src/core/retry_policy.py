@@ -0,0 +1,182 @@
+import copy
+import math
+import time
+import random
+import logging
+import threading
+
+from src.core.pipeline_context import current_ranks_list
+
+# Class for the adaptive retry policy of the concept expansions (ExpansionConfig(retry_policy = ...)).
+#
+# Without a policy every concept gets the same subconcepts_amount, subconcepts max_tokens and iteration_amm retries. The
+# policy keeps the outcomes of the attempts and expansions per ranks list and level and, once a level has min_observations
+# attempts, tunes the settings of its next expansions (see plan):
+#   - the retry cap: after j failed attempts the expansion gives up (the concept goes to unknown_concepts) when the expansions
+#     of the level that went on after j failures succeeded less than give_up_below of the time. explore_rate of the
+#     expansions keep the full iteration_amm so the estimate follows changes
+#   - the candidate count: enough candidates to keep subconcepts_amount after the share found redundant by the redundancy call
+#   - the max_tokens of the subconcepts list: the completion tokens seen per candidate times max_tokens_headroom
+#     (at most config.subconcepts_max_tokens; the rate limiter and the token budget reserve max_tokens for every request)
+# The attempt that iteration_amm runs only to fail is not made. stats() reports the counters per level and the stage calls
+# per accepted concept of every window of expansions (calls_per_accepted_concept over time)
+class AdaptiveRetryPolicy:
+    def __init__(self, give_up_below = 0.1, min_observations = 20, explore_rate = 0.05, min_subconcepts_amount = 5, max_subconcepts_amount = 20, min_max_tokens = 100, max_tokens_headroom = 1.5, window = 50, seed = 0, log = None) -> None:
+        if not log:
+            log = logging.getLogger("AdaptiveRetryPolicy")
+            logging.basicConfig(level=logging.INFO)
+        self.give_up_below          = give_up_below
+        self.min_observations       = min_observations
+        self.explore_rate           = explore_rate
+        self.min_subconcepts_amount = min_subconcepts_amount
+        self.max_subconcepts_amount = max_subconcepts_amount
+        self.min_max_tokens         = min_max_tokens
+        self.max_tokens_headroom    = max_tokens_headroom
+        self.window                 = window
+        self.log                    = log
+        self.rng                    = random.Random(seed)
+        self.lock                   = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.levels             = {}
+        self.timeline           = []
+        self.start_time         = time.time()
+        self.current_window     = {'expansions': 0, 'calls': 0, 'accepted_concepts': 0}
+
+    # Helper method returning the counters of a (ranks list, level) key
+    def level_counters(self, key) -> dict:
+        if key not in self.levels:
+            self.levels[key] = {'expansions': 0, 'succeeded': 0, 'failed': 0, 'gave_up': 0, 'attempts': 0, 'accepted': 0, 'too_redundant': 0, 'candidates': 0, 'completion_tokens': 0,
+                                'checked_candidates': 0, 'redundant': 0, 'calls': 0, 'accepted_concepts': 0, 'retry_cap': None, 'successes_at': {}, 'failures_at': {}}
+        return self.levels[key]
+
+    # Method returning the retry cap of a level: the first number of failed attempts after which the expansions that went on
+    # succeeded less than give_up_below of the time (Laplace estimate, min_observations of them needed), else iteration_amm
+    def retry_cap(self, counters, iteration_amm) -> int:
+        for failures in range(1, iteration_amm):
+            successes_later = sum(count for attempts, count in counters['successes_at'].items() if attempts > failures)
+            went_on = successes_later + sum(count for attempts, count in counters['failures_at'].items() if attempts > failures)
+            if went_on < self.min_observations:
+                break
+            if (successes_later + 1)/(went_on + 2) < self.give_up_below:
+                return failures
+        return iteration_amm
+
+    # Method returning the RetryPlan of a concept expansion, with the settings of config tuned for the concept's level.
+    # The ranks list is the one being expanded (set by the expansion loops, see pipeline_scope): the root concept is shared
+    # by all the ranks lists, so its own ranks list number ('root') cannot tell their level-1 expansions apart
+    def plan(self, concept, config, rank_number = None) -> 'RetryPlan':
+        if rank_number is None:
+            rank_number = current_ranks_list.get()
+        key = (rank_number if rank_number is not None else concept.taxonomical_ranks_list_number, concept.taxonomical_level + 1)
+        tuned = copy.copy(config)
+        with self.lock:
+            counters = self.level_counters(key)
+            if counters['attempts'] >= self.min_observations:
+                if counters['checked_candidates']:
+                    redundant_share = min(counters['redundant']/counters['checked_candidates'], 0.8)
+                    tuned.subconcepts_amount = min(self.max_subconcepts_amount, max(self.min_subconcepts_amount, round(config.subconcepts_amount/(1 - redundant_share))))
+                if counters['candidates']:
+                    tokens_per_candidate = counters['completion_tokens']/counters['candidates']
+                    tuned.subconcepts_max_tokens = min(config.subconcepts_max_tokens, max(self.min_max_tokens, math.ceil(tuned.subconcepts_amount*tokens_per_candidate*self.max_tokens_headroom)))
+                counters['retry_cap'] = self.retry_cap(counters, config.iteration_amm)
+                if self.rng.random() >= self.explore_rate:
+                    tuned.iteration_amm = counters['retry_cap']
+        tuned.stream_max_candidates = max(config.stream_max_candidates, tuned.subconcepts_amount)
+        return RetryPlan(self, key, tuned, config.iteration_amm)
+
+    # Method recording an attempt of a plan
+    def record_attempt(self, key, candidates, accepted, completion_tokens, redundant = None, too_redundant = False, calls = 3) -> None:
+        with self.lock:
+            counters = self.level_counters(key)
+            counters['attempts'] += 1
+            counters['accepted'] += int(bool(accepted))
+            counters['too_redundant'] += int(too_redundant)
+            counters['candidates'] += candidates
+            counters['completion_tokens'] += completion_tokens
+            counters['calls'] += calls
+            if redundant is not None:
+                counters['checked_candidates'] += candidates
+                counters['redundant'] += min(redundant, candidates)
+
+    # Method recording a finished plan: its attempts, outcome and new concepts (and the calls made outside the attempts)
+    def record_expansion(self, key, attempts, accepted_concepts, failed, gave_up, calls, extra_calls = 0) -> None:
+        with self.lock:
+            counters = self.level_counters(key)
+            counters['expansions'] += 1
+            counters['failed' if failed else 'succeeded'] += 1
+            counters['gave_up'] += int(gave_up)
+            counters['calls'] += extra_calls
+            counters['accepted_concepts'] += accepted_concepts
+            outcomes = counters['failures_at' if failed else 'successes_at']
+            outcomes[attempts] = outcomes.get(attempts, 0) + 1
+            self.current_window['expansions'] += 1
+            self.current_window['calls'] += calls
+            self.current_window['accepted_concepts'] += accepted_concepts
+            if self.current_window['expansions'] >= self.window:
+                self.timeline.append(self.window_stats(self.current_window))
+                self.current_window = {'expansions': 0, 'calls': 0, 'accepted_concepts': 0}
+
+    # Helper method returning the stats of a window of expansions
+    def window_stats(self, window) -> dict:
+        calls_per_accepted_concept = round(window['calls']/window['accepted_concepts'], 3) if window['accepted_concepts'] else None
+        return dict(window, calls = round(window['calls'], 3), seconds = round(time.time() - self.start_time, 3), calls_per_accepted_concept = calls_per_accepted_concept)
+
+    # Method to get the counters per level (with the retry cap of its last plan) and the calls per accepted concept over time
+    # (one entry per window of expansions, the last one possibly incomplete)
+    def stats(self) -> dict:
+        with self.lock:
+            levels = {}
+            for (ranks_list, level), counters in sorted(self.levels.items(), key = lambda item: str(item[0])):
+                counters = {key: value for key, value in counters.items() if key not in ('successes_at', 'failures_at')}
+                counters['acceptance_rate'] = round(counters['accepted']/counters['attempts'], 4) if counters['attempts'] else None
+                counters['redundant_share'] = round(counters['redundant']/counters['checked_candidates'], 4) if counters['checked_candidates'] else None
+                counters['calls_per_accepted_concept'] = round(counters['calls']/counters['accepted_concepts'], 3) if counters['accepted_concepts'] else None
+                counters['calls'] = round(counters['calls'], 3)
+                levels[f"ranks_list {ranks_list}, level {level}"] = counters
+            timeline = self.timeline + ([self.window_stats(self.current_window)] if self.current_window['expansions'] else [])
+            return {'levels': levels, 'timeline': timeline}
+
+# Class holding the tuned settings (config) and the progress of a single concept expansion planned by an AdaptiveRetryPolicy.
+# The expansion loop reports every attempt (record_attempt), asks give_up before the next one and reports the end (finish)
+class RetryPlan:
+    def __init__(self, policy, key, config, iteration_amm) -> None:
+        self.policy         = policy
+        self.key            = key
+        self.config         = config
+        self.iteration_amm  = iteration_amm
+        self.attempts       = 0
+        self.calls          = 0
+        self.extra_calls    = 0
+
+    # Method recording an attempt: the postprocessed candidates, the verdict, the token usage of the subconcepts list and
+    # the redundant candidates (None without a redundancy call); calls: the stage calls of the attempt (a share of the
+    # batched requests), by default the subconcepts, postprocess and verify requests and the redundancy call if any
+    def record_attempt(self, candidates, accepted, subconcepts_usage, redundant_subconcepts = None, too_redundant = False, calls = None) -> None:
+        calls = calls if calls is not None else 3 + int(redundant_subconcepts is not None)
+        self.attempts += 1
+        self.calls += calls
+        self.policy.record_attempt(self.key, len(candidates), accepted, (subconcepts_usage or {}).get('completion_tokens', 0), redundant = len(redundant_subconcepts) if redundant_subconcepts is not None else None,
+                                   too_redundant = too_redundant, calls = calls)
+
+    # Method recording a call made outside the attempts (the definition of the concept)
+    def record_call(self, calls = 1) -> None:
+        self.calls += calls
+        self.extra_calls += calls
+
+    # Method telling whether the expansion gives up instead of making another attempt
+    def give_up(self) -> bool:
+        return self.attempts >= self.config.iteration_amm
+
+    # Method recording the end of the expansion
+    def finish(self, subconcepts, failed) -> None:
+        self.policy.record_expansion(self.key, self.attempts, len(subconcepts), failed, failed and self.attempts < self.iteration_amm, self.calls, extra_calls = self.extra_calls)
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.retry_policy import AdaptiveRetryPolicy
+#retry_policy = AdaptiveRetryPolicy(give_up_below = 0.1)
+#tax_t = iterate_level(tax_t, 0, model_generate_new, model_re_generate, model_verify, log = log, retry_policy = retry_policy)
+#print(retry_policy.stats())   # {'levels': {'ranks_list 0, level 1': {acceptance_rate, redundant_share, retry_cap, calls_per_accepted_concept...}}, 'timeline': [...]}
+#______________________
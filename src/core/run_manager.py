@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# States of a frontier item (a concept to expand in an iteration of iterate_level):
+#   'pending'   - registered, not started yet
+#   'in_flight' - its expansion was started (a restart expands it again)
+#   'done'      - expanded, the result is stored
+#   'unknown'   - expanded, the sub-concepts generation failed (the concept goes to the unknown concepts)
+WORK_ITEM_STATES = ('pending', 'in_flight', 'done', 'unknown')
+
+# Class for one iteration of iterate_level recorded by the run manager: the frontier (in its original order) and
+# the state of every item. The expansion results are stored as soon as they are complete, and the journal sequence
+# number of the taxonomy is stored before every merge, so after a restart every item is either restored from the
+# stored result (without LLM calls) or expanded again if it was still pending or in flight
+class LevelRun:
+    def __init__(self, manager, taxonomy, rank_number, iteration, frontier, items, loaded_seq, resumed = False) -> None:
+        self.manager        = manager
+        self.taxonomy       = taxonomy
+        self.rank_number    = rank_number
+        self.iteration      = iteration
+        self.frontier       = frontier
+        self.items          = items
+        self.loaded_seq     = loaded_seq
+        self.resumed        = resumed
+
+    # Method checking if the expansion of a concept is stored (no LLM work is left for it)
+    def is_expanded(self, concept) -> bool:
+        return self.items.get(concept.concept_id, {}).get('state') in ('done', 'unknown')
+
+    # Method marking the concepts whose expansion is started
+    def start(self, concepts) -> None:
+        self.manager.update_items(self, [concept.concept_id for concept in concepts], "state = 'in_flight', attempts = attempts + 1")
+        for concept in concepts:
+            self.items[concept.concept_id]['state'] = 'in_flight'
+
+    # Method storing the results of finished expansions (ConceptExpansion objects)
+    def complete(self, expansions) -> None:
+        rows = []
+        for expansion in expansions:
+            result = expansion.result()
+            state = 'unknown' if expansion.failed else 'done'
+            rows.append((state, json.dumps(result, ensure_ascii = False), expansion.concept.concept_id))
+            self.items[expansion.concept.concept_id].update(state = state, result = result)
+        self.manager.store_results(self, rows)
+
+    # Method returning the stored expansion result of a concept (the ConceptExpansion arguments)
+    def stored_expansion(self, concept) -> dict:
+        self.manager.restored += 1
+        return dict(self.items[concept.concept_id]['result'])
+
+    # Method recording the journal sequence number of the taxonomy before the merge of a concept's expansion
+    def merging(self, concept) -> None:
+        self.items[concept.concept_id]['merge_seq'] = self.taxonomy.journal_seq
+        self.manager.update_items(self, [concept.concept_id], "merge_seq = ?", (self.taxonomy.journal_seq,))
+
+    # Method checking if the merge of a stored expansion is (at least partly) in the taxonomy: the taxonomy had
+    # mutation records newer than the sequence number stored before the merge when the iteration was resumed
+    def merge_persisted(self, concept) -> bool:
+        merge_seq = self.items[concept.concept_id].get('merge_seq')
+        return merge_seq is not None and self.loaded_seq > merge_seq
+
+    # Method closing the iteration (the new frontier is in the saved taxonomy)
+    def finish(self) -> None:
+        self.manager.finish_iteration(self)
+
+# Class for the durable (SQLite) record of the expansion runs of taxonomies, for resuming iterate_level after a crash.
+#
+# Every iteration of iterate_level registers its frontier, and every frontier item goes through the states of
+# WORK_ITEM_STATES. The items are keyed on the taxonomy id (Taxonomy.taxonomy_id, the name only has the creation
+# time), the ranks list and the concept id, so registering them again is idempotent. When the process dies in the
+# middle of an iteration, the taxonomy file only has the state of its last checkpoint; the next iterate_level call
+# with the same run manager resumes the unfinished iteration instead of starting a new one: the taxonomical level
+# is restored, the finished expansions are merged from their stored results (or only recognized if the loaded
+# taxonomy already has them) and only the pending and in-flight concepts are expanded. The taxonomy file format is
+# not changed, the run manager is a separate file.
+# Use the same run manager for all the iterations of a taxonomy
+class RunManager:
+    def __init__(self, path = None, log = None) -> None:
+        if not path:
+            path = os.path.join(os.getcwd(), 'data', 'runs', 'run_manager.sqlite')
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path               = path
+        self.log                = log
+        self.restored           = 0
+        self.lock               = threading.Lock()
+        self.connection         = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS iterations (
+            taxonomy TEXT,
+            ranks_list INTEGER,
+            iteration INTEGER,
+            current_level INTEGER,
+            finished INTEGER DEFAULT 0,
+            started_at REAL,
+            finished_at REAL,
+            PRIMARY KEY (taxonomy, ranks_list, iteration))''')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS work_items (
+            taxonomy TEXT,
+            ranks_list INTEGER,
+            concept_id INTEGER,
+            concept_name TEXT,
+            iteration INTEGER,
+            position INTEGER,
+            state TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            result TEXT,
+            merge_seq INTEGER,
+            updated_at REAL,
+            PRIMARY KEY (taxonomy, ranks_list, concept_id))''')
+        self.connection.execute("CREATE INDEX IF NOT EXISTS work_items_iteration ON work_items (taxonomy, ranks_list, iteration, position)")
+
+    # Method returning the unfinished iteration of a ranks list as a LevelRun (None if the last iteration was finished).
+    # The taxonomical level of the ranks list is set back to the one of the iteration
+    def resume_iteration(self, taxonomy, rank_number):
+        with self.lock:
+            row = self.connection.execute("SELECT iteration, current_level FROM iterations WHERE taxonomy = ? AND ranks_list = ? AND finished = 0 ORDER BY iteration DESC LIMIT 1",
+                                          (taxonomy.taxonomy_id, rank_number)).fetchone()
+            if not row:
+                return None
+            iteration, current_level = row
+            loaded_seq = taxonomy.journal_seq
+            rows = self.connection.execute("SELECT concept_id, state, result, merge_seq FROM work_items WHERE taxonomy = ? AND ranks_list = ? AND iteration = ? ORDER BY position",
+                                           (taxonomy.taxonomy_id, rank_number, iteration)).fetchall()
+        if taxonomy.current_level[rank_number] != current_level:
+            taxonomy.set_current_level(rank_number, current_level)
+        items = {concept_id: {'state': state, 'result': json.loads(result) if result else None, 'merge_seq': merge_seq} for concept_id, state, result, merge_seq in rows}
+        frontier = [taxonomy.concepts[concept_id] for concept_id, _, _, _ in rows]
+        expanded = sum(1 for item in items.values() if item['state'] in ('done', 'unknown'))
+        if self.log:
+            self.log.info(f"resuming iteration {iteration} of ranks list {rank_number}: {expanded}/{len(frontier)} concepts already expanded")
+        return LevelRun(self, taxonomy, rank_number, iteration, frontier, items, loaded_seq, resumed = True)
+
+    # Method registering a new iteration of a ranks list with its frontier (after start_level_iteration), returns the LevelRun.
+    # A concept registered by an earlier iteration (left over by max_iter) is moved to the new one with its state
+    def start_iteration(self, taxonomy, rank_number, frontier):
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                iteration = self.connection.execute("SELECT COALESCE(MAX(iteration), -1) + 1 FROM iterations WHERE taxonomy = ? AND ranks_list = ?", (taxonomy.taxonomy_id, rank_number)).fetchone()[0]
+                self.connection.execute("INSERT INTO iterations (taxonomy, ranks_list, iteration, current_level, started_at) VALUES (?, ?, ?, ?, ?)",
+                                        (taxonomy.taxonomy_id, rank_number, iteration, taxonomy.current_level[rank_number], now))
+                self.connection.executemany('''INSERT INTO work_items (taxonomy, ranks_list, concept_id, concept_name, iteration, position, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+                                               ON CONFLICT (taxonomy, ranks_list, concept_id) DO UPDATE SET iteration = excluded.iteration, position = excluded.position''',
+                                            [(taxonomy.taxonomy_id, rank_number, concept.concept_id, concept.name, iteration, position, now) for position, concept in enumerate(frontier)])
+                rows = self.connection.execute("SELECT concept_id, state, result, merge_seq FROM work_items WHERE taxonomy = ? AND ranks_list = ? AND iteration = ?",
+                                               (taxonomy.taxonomy_id, rank_number, iteration)).fetchall()
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        items = {concept_id: {'state': state, 'result': json.loads(result) if result else None, 'merge_seq': merge_seq} for concept_id, state, result, merge_seq in rows}
+        return LevelRun(self, taxonomy, rank_number, iteration, list(frontier), items, taxonomy.journal_seq)
+
+    def update_items(self, run, concept_ids, assignments, parameters = ()) -> None:
+        with self.lock:
+            self.connection.executemany(f"UPDATE work_items SET {assignments}, updated_at = ? WHERE taxonomy = ? AND ranks_list = ? AND concept_id = ?",
+                                        [tuple(parameters) + (time.time(), run.taxonomy.taxonomy_id, run.rank_number, concept_id) for concept_id in concept_ids])
+
+    def store_results(self, run, rows) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.executemany("UPDATE work_items SET state = ?, result = ?, updated_at = ? WHERE taxonomy = ? AND ranks_list = ? AND concept_id = ?",
+                                        [(state, result, now, run.taxonomy.taxonomy_id, run.rank_number, concept_id) for state, result, concept_id in rows])
+
+    def finish_iteration(self, run) -> None:
+        with self.lock:
+            self.connection.execute("UPDATE iterations SET finished = 1, finished_at = ? WHERE taxonomy = ? AND ranks_list = ? AND iteration = ?",
+                                    (time.time(), run.taxonomy.taxonomy_id, run.rank_number, run.iteration))
+
+    # Method to get the amount of work items per state (of one taxonomy or all of them) and of the expansions restored without LLM calls
+    def stats(self, taxonomy = None) -> dict:
+        with self.lock:
+            if taxonomy is None:
+                rows = self.connection.execute("SELECT state, COUNT(*) FROM work_items GROUP BY state").fetchall()
+            else:
+                rows = self.connection.execute("SELECT state, COUNT(*) FROM work_items WHERE taxonomy = ? GROUP BY state", (taxonomy.taxonomy_id,)).fetchall()
+        counts = dict.fromkeys(WORK_ITEM_STATES, 0)
+        counts.update(dict(rows))
+        return dict(counts, restored = self.restored, path = self.path)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.run_manager import RunManager
+#run_manager = RunManager(log = log)
+#tax_t = iterate_level(tax_t, 0, model_generate_new, model_re_generate, model_verify, run_manager = run_manager)
+#...the process dies, after the restart:
+#tax_t = load_taxonomy(path)
+#tax_t = iterate_level(tax_t, 0, model_generate_new, model_re_generate, model_verify, run_manager = RunManager(log = log))
+#print(run_manager.stats(tax_t))
+#______________________
@@ -0,0 +1,100 @@
+import logging
+import threading
+
+# Kinds of the speculative requests of a concept expansion, started together with the verification of a candidates list:
+#   'redundancy'   - the redundancy call for the candidates, wasted when the verification rejects them
+#   'regeneration' - the subconcepts list (and postprocessing) of the next attempt, wasted when the candidates are used
+SPECULATION_KINDS = ('redundancy', 'regeneration')
+
+# Class for the cost ceiling and the counters of the speculative expansion (ExpansionConfig(speculation = ...)).
+#
+# Without speculation a concept expansion waits for the postprocessing, then the verification, then the redundancy call
+# (and after a rejection for the next subconcepts list). With a policy the redundancy call and the next attempt start at the
+# same time as the verification, so an attempt takes about as long as its longest stage; the result that the verification
+# makes useless is cancelled or dropped. A speculative request is only started while the expected tokens of the dropped ones
+# stay below max_waste of all the tokens spent by the expansions: the discard probability of each kind is estimated from the
+# verdicts seen so far (starting from prior_accept_rate) and its cost from the finished requests of that kind. With the usual
+# high acceptance rates the redundancy call is speculated almost always and the next attempt only within the ceiling.
+# One policy is shared by all the expansions of a session, its counters are returned by stats()
+class SpeculationPolicy:
+    def __init__(self, max_waste = 0.1, prior_accept_rate = 0.8, prior_weight = 4, log = None) -> None:
+        if not log:
+            log = logging.getLogger("SpeculationPolicy")
+            logging.basicConfig(level=logging.INFO)
+        self.max_waste          = max_waste
+        self.prior_accept_rate  = prior_accept_rate
+        self.prior_weight       = prior_weight
+        self.log                = log
+        self.lock               = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.attempts           = 0
+        self.verified           = 0
+        self.succeeded          = 0
+        self.spent_tokens       = 0
+        self.wasted_tokens      = 0
+        self.counters           = {kind: {'started': 0, 'used': 0, 'dropped': 0, 'cancelled': 0, 'skipped': 0, 'tokens': 0, 'requests': 0} for kind in SPECULATION_KINDS}
+
+    # Method returning the estimated probability that a speculative request of the kind is wasted
+    def discard_probability(self, kind) -> float:
+        accept_rate = (self.verified + self.prior_weight*self.prior_accept_rate)/(self.attempts + self.prior_weight)
+        if kind == 'redundancy':
+            return 1 - accept_rate
+        success_rate = (self.succeeded + self.prior_weight*self.prior_accept_rate)/(self.attempts + self.prior_weight)
+        return success_rate
+
+    # Method returning the mean tokens of the finished speculative requests of the kind (0 before the first one)
+    def estimated_tokens(self, kind) -> float:
+        counters = self.counters[kind]
+        return counters['tokens']/counters['requests'] if counters['requests'] else 0.0
+
+    # Method deciding whether a speculative request of the kind may start (it is counted as started if so).
+    # The redundancy calls are rarely wasted and save a whole request each, so the next attempts (mostly wasted) only get
+    # the part of the ceiling left after the expected waste of the redundancy calls
+    def allow(self, kind) -> bool:
+        with self.lock:
+            estimate = self.estimated_tokens(kind)
+            ceiling = self.max_waste
+            if kind == 'regeneration' and self.spent_tokens:
+                ceiling -= self.discard_probability('redundancy')*self.estimated_tokens('redundancy')*self.attempts/self.spent_tokens
+            allowed = ceiling > 0 and self.wasted_tokens + self.discard_probability(kind)*estimate <= ceiling*(self.spent_tokens + estimate)
+            self.counters[kind]['started' if allowed else 'skipped'] += 1
+            return allowed
+
+    # Method recording the outcome of a speculative request: used, dropped (finished but useless) or cancelled
+    # (its tokens are unknown, the mean of its kind is counted as wasted). tokens: the total tokens of a finished request
+    def finish(self, kind, outcome, tokens = None) -> None:
+        with self.lock:
+            counters = self.counters[kind]
+            counters[outcome] += 1
+            if tokens is not None:
+                counters['tokens'] += tokens
+                counters['requests'] += 1
+            if outcome != 'used':
+                self.wasted_tokens += tokens if tokens is not None else self.estimated_tokens(kind)
+
+    # Method recording a verified attempt: the verdict and whether its candidates were used (not too redundant)
+    def record_attempt(self, accepted, succeeded) -> None:
+        with self.lock:
+            self.attempts += 1
+            self.verified += int(bool(accepted))
+            self.succeeded += int(bool(succeeded))
+
+    # Method adding the tokens of a finished expansion (the base of the cost ceiling)
+    def spend(self, token_usage) -> None:
+        with self.lock:
+            self.spent_tokens += (token_usage or {}).get('total_tokens', 0)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'attempts': self.attempts, 'verified': self.verified, 'succeeded': self.succeeded, 'spent_tokens': self.spent_tokens, 'wasted_tokens': round(self.wasted_tokens),
+                    'waste_share': round(self.wasted_tokens/self.spent_tokens, 4) if self.spent_tokens else 0.0, 'kinds': {kind: dict(counters) for kind, counters in self.counters.items()}}
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.speculation import SpeculationPolicy
+#speculation = SpeculationPolicy(max_waste = 0.1)
+#tax_t = iterate_level(tax_t, 0, model_generate_new, model_re_generate, model_verify, log = log, max_concurrency = 8, speculation = speculation)
+#print(speculation.stats())   # attempts, wasted_tokens, waste_share, per kind: started, used, dropped, cancelled, skipped
+#______________________
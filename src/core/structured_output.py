@@ -0,0 +1,270 @@
+import re
+import json
+import logging
+import threading
+
+from src.core.pipeline_context import PipelineInterrupt, current_stage
+from src.core.taxonomy_model import update_token_usage
+from src.core.tracing import annotate_span
+
+# Structured-output modes of the generation functions (structured = ...):
+#   'json_schema' - strict JSON schema response format (gpt-4o-2024-08-06, gpt-4o-mini and later)
+#   'json_object' - JSON mode (gpt-3.5-turbo-1106, gpt-4-turbo and later), the schema is only given in the prompt
+# Either way the answer is validated locally against the full schema (validate_structured)
+STRUCTURED_OUTPUT_MODES = ('json_schema', 'json_object')
+
+# Schema keywords checked only locally: the strict mode of the API rejects them
+LOCAL_ONLY_KEYWORDS = {'minLength', 'maxLength', 'minItems', 'maxItems', 'pattern'}
+
+# A concept/rank name: one line, not empty, no list numbering ("1. ", "2) ")
+NAME_SCHEMA = {'type': 'string', 'minLength': 1, 'maxLength': 200, 'pattern': r'^(?!\s*\d+[.)]\s)[^\n]*\S[^\n]*$'}
+
+# Helper function for an object schema with the given (required) properties
+def object_schema(**properties) -> dict:
+    return {'type': 'object', 'properties': properties, 'required': list(properties), 'additionalProperties': False}
+
+# Answer schemas of the generation functions
+STRUCTURED_SCHEMAS = {
+    'yes_no':       object_schema(answer = {'type': 'boolean'}),
+    'verdict':      object_schema(accepted = {'type': 'boolean'}),
+    'text':         object_schema(text = {'type': 'string', 'minLength': 1}),
+    'texts':        object_schema(items = {'type': 'array', 'items': {'type': 'string', 'minLength': 1}}),
+    'names':        object_schema(items = {'type': 'array', 'items': NAME_SCHEMA}),
+    'ranks_lists':  object_schema(ranks_lists = {'type': 'array', 'minItems': 1, 'items': {'type': 'array', 'minItems': 1, 'items': NAME_SCHEMA}}),
+    'ids':          object_schema(ids = {'type': 'array', 'items': {'type': 'integer'}}),
+}
+
+# Answer schemas of the batched generation functions (one entry per concept of the batch)
+def batch_schema(name, amount) -> dict:
+    if name == 'names_lists':
+        return object_schema(lists = {'type': 'array', 'minItems': amount, 'maxItems': amount, 'items': {'type': 'array', 'items': NAME_SCHEMA}})
+    if name == 'verdicts':
+        return object_schema(accepted = {'type': 'array', 'minItems': amount, 'maxItems': amount, 'items': {'type': 'boolean'}})
+    raise KeyError(f"unknown batch schema '{name}'")
+
+# Model calls of a regeneration caused by an unusable answer of a stage: a rejected sub-concepts list runs the
+# subconcepts, postprocess and verify requests again, an unparsed batch section falls back to a single request
+REGENERATION_CALLS = {'subconcepts': 3, 'postprocess': 3, 'verify': 3}
+
+# Function to validate a JSON value against a schema (the subset of JSON schema used above), returns the errors
+def validate_structured(value, schema, path = '$') -> list:
+    errors = []
+    expected = schema.get('type')
+    if expected == 'object':
+        if not isinstance(value, dict):
+            return [f"{path}: expected an object"]
+        for key in schema.get('required', []):
+            if key not in value:
+                errors.append(f"{path}: missing field '{key}'")
+        if schema.get('additionalProperties') is False:
+            errors += [f"{path}: unexpected field '{key}'" for key in value if key not in schema.get('properties', {})]
+        for key, subschema in schema.get('properties', {}).items():
+            if key in value:
+                errors += validate_structured(value[key], subschema, f"{path}.{key}")
+    elif expected == 'array':
+        if not isinstance(value, list):
+            return [f"{path}: expected an array"]
+        if 'minItems' in schema and len(value) < schema['minItems']:
+            errors.append(f"{path}: expected at least {schema['minItems']} items, got {len(value)}")
+        if 'maxItems' in schema and len(value) > schema['maxItems']:
+            errors.append(f"{path}: expected at most {schema['maxItems']} items, got {len(value)}")
+        for i, item in enumerate(value):
+            errors += validate_structured(item, schema.get('items', {}), f"{path}[{i}]")
+    elif expected == 'string':
+        if not isinstance(value, str):
+            return [f"{path}: expected a string"]
+        if len(value) < schema.get('minLength', 0):
+            errors.append(f"{path}: empty string")
+        if 'maxLength' in schema and len(value) > schema['maxLength']:
+            errors.append(f"{path}: longer than {schema['maxLength']} characters")
+        if 'pattern' in schema and not re.search(schema['pattern'], value):
+            errors.append(f"{path}: {json.dumps(value)} is not a single unnumbered name")
+    elif expected == 'boolean':
+        if not isinstance(value, bool):
+            errors.append(f"{path}: expected true or false")
+    elif expected == 'integer':
+        if not isinstance(value, int) or isinstance(value, bool):
+            errors.append(f"{path}: expected an integer")
+    return errors
+
+# Helper function returning the schema without the keywords the API does not accept
+def api_schema(schema):
+    if isinstance(schema, dict):
+        return {key: api_schema(value) for key, value in schema.items() if key not in LOCAL_ONLY_KEYWORDS}
+    if isinstance(schema, list):
+        return [api_schema(value) for value in schema]
+    return schema
+
+# Helper function returning the response_format request parameter of a schema
+def response_format(name, schema, mode = 'json_schema') -> dict:
+    if mode == 'json_object':
+        return {'type': 'json_object'}
+    return {'type': 'json_schema', 'json_schema': {'name': name, 'strict': True, 'schema': api_schema(schema)}}
+
+# Function to parse a JSON answer. The harmless deviations (code fences, text around the object) are fixed locally,
+# returns (value or None, list of errors, locally fixed)
+def parse_structured(text: str):
+    text = text.strip()
+    try:
+        return json.loads(text), [], False
+    except ValueError as e:
+        error = f"invalid JSON: {e}"
+    unfenced = re.sub(r'^```(?:json)?\s*|\s*```$', '', text)
+    start, end = unfenced.find('{'), unfenced.rfind('}')
+    if start >= 0 and end > start:
+        try:
+            return json.loads(unfenced[start:end + 1]), [], True
+        except ValueError:
+            pass
+    return None, [error], False
+
+# Function checking the items of a comma/semicolon-separated text answer like validate_structured checks the names,
+# so the parse failures of the text mode are counted the same way (returns the errors)
+def validate_text_items(items: list) -> list:
+    return [f"item {i}: {json.dumps(item)} is not a single unnumbered name" for i, item in enumerate(items) if not re.search(NAME_SCHEMA['pattern'], item)]
+
+# Class for the counters of the structured and text answers per pipeline stage:
+#   responses       - answers checked
+#   parse_failures  - answers that failed the validation (before any repair)
+#   local_fixes     - answers made valid locally (code fences, text around the JSON object)
+#   repair_requests - targeted repair requests sent
+#   repaired        - answers made valid by a repair request
+#   unrepaired      - answers still invalid after the repairs (the caller's fallback is used)
+#   calls_saved     - model calls of the regenerations avoided by the local fixes and the repairs, minus the repair requests
+# One instance (structured_output_metrics) is shared by the generation functions
+class StructuredOutputMetrics:
+    COUNTERS = ('responses', 'parse_failures', 'local_fixes', 'repair_requests', 'repaired', 'unrepaired', 'calls_saved')
+
+    def __init__(self) -> None:
+        self.lock       = threading.Lock()
+        self.counters   = {}
+
+    def count(self, stage, counter, amount = 1, mode = 'structured') -> None:
+        with self.lock:
+            counters = self.counters.setdefault((stage or 'unknown', mode), dict.fromkeys(self.COUNTERS, 0))
+            counters[counter] += amount
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters = {}
+
+    # Method returning {mode: {stage: counters with the parse failure rate}} ('total' sums the stages of a mode)
+    def stats(self) -> dict:
+        with self.lock:
+            report = {}
+            for (stage, mode), counters in sorted(self.counters.items()):
+                report.setdefault(mode, {})[stage] = dict(counters)
+            for stages in report.values():
+                stages['total'] = {counter: sum(counters[counter] for counters in stages.values()) for counter in self.COUNTERS}
+                for counters in stages.values():
+                    counters['parse_failure_rate'] = counters['parse_failures']/counters['responses'] if counters['responses'] else None
+            return report
+
+structured_output_metrics = StructuredOutputMetrics()
+
+# Helper function counting a text answer of the current stage (valid: it could be parsed as expected, see validate_text_items)
+def record_text_answer(valid: bool) -> None:
+    stage = current_stage.get()
+    structured_output_metrics.count(stage, 'responses', mode = 'text')
+    if not valid:
+        structured_output_metrics.count(stage, 'parse_failures', mode = 'text')
+    annotate_span(parse = 'ok' if valid else 'failed')
+
+# Class for one structured request: the prompt with the schema instructions, the validation of the answers and the
+# targeted repair prompts (the invalid answer, the schema and the errors instead of the whole original prompt)
+class StructuredRequest:
+    def __init__(self, prompt, schema_name, mode = 'json_schema', amount = None, log = None) -> None:
+        from langchain_core.messages import HumanMessage
+        if mode not in STRUCTURED_OUTPUT_MODES:
+            raise ValueError(f"unknown structured output mode '{mode}', expected one of {STRUCTURED_OUTPUT_MODES}")
+        self.schema         = batch_schema(schema_name, amount) if amount is not None else STRUCTURED_SCHEMAS[schema_name]
+        self.stage          = current_stage.get()
+        self.regeneration   = 1 if amount is not None else REGENERATION_CALLS.get(self.stage, 0)
+        self.log            = log if log else logging.getLogger("StructuredRequest")
+        self.response_format = response_format(schema_name, self.schema, mode)
+        self.messages       = list(prompt) + [HumanMessage(content = f"Respond only with a JSON object matching this JSON schema, without explanations or code fences: {json.dumps(api_schema(self.schema))}")]
+        self.answer         = None
+        self.errors         = []
+        self.repairs        = 0
+
+    # Method validating an answer, returns the value or None
+    def check(self, text):
+        value, self.errors, fixed = parse_structured(text)
+        if value is not None:
+            self.errors = validate_structured(value, self.schema)
+        if not self.repairs:
+            structured_output_metrics.count(self.stage, 'responses')
+            if self.errors or fixed:
+                structured_output_metrics.count(self.stage, 'parse_failures')
+            if fixed and not self.errors:
+                structured_output_metrics.count(self.stage, 'local_fixes')
+                structured_output_metrics.count(self.stage, 'calls_saved', self.regeneration)
+            annotate_span(parse = 'failed' if self.errors else 'fixed' if fixed else 'ok')
+        elif not self.errors:
+            structured_output_metrics.count(self.stage, 'repaired')
+            structured_output_metrics.count(self.stage, 'calls_saved', self.regeneration)
+            annotate_span(parse = 'repaired')
+        self.answer = text
+        if self.errors:
+            self.log.info(f"structured answer invalid ({len(self.errors)} errors): {self.errors[:5]}")
+            return None
+        return value
+
+    # Method returning the messages of the next repair request
+    def repair_messages(self) -> list:
+        from src.prompts.prompt_templates import chat_template_repair_structured_output
+        self.repairs += 1
+        structured_output_metrics.count(self.stage, 'repair_requests')
+        structured_output_metrics.count(self.stage, 'calls_saved', -1)
+        return chat_template_repair_structured_output.format_messages(schema = json.dumps(api_schema(self.schema)), answer = self.answer, errors = '; '.join(self.errors[:20]))
+
+    def finish(self, value) -> None:
+        if value is None:
+            structured_output_metrics.count(self.stage, 'unrepaired')
+            annotate_span(parse = 'unrepaired')
+
+# Helper function for the completion tokens of a structured answer (the JSON syntax costs about a third more than the text list)
+def structured_max_tokens(max_tokens) -> int:
+    return int(max_tokens*1.5) + 20
+
+# Function to invoke a model for a structured answer. The answer is validated locally; an invalid answer gets up to
+# max_repairs targeted repair requests. Returns (the valid value or None, token usage of all the requests)
+def invoke_structured(model, prompt, schema_name, max_tokens, mode = 'json_schema', amount = None, max_repairs = 1, log = None):
+    request = StructuredRequest(prompt, schema_name, mode = mode, amount = amount, log = log)
+    response = model.invoke(request.messages, max_tokens = structured_max_tokens(max_tokens), response_format = request.response_format)
+    token_usage = response.response_metadata['token_usage']
+    value = request.check(response.content)
+    try:
+        while value is None and request.repairs < max_repairs:
+            response = model.invoke(request.repair_messages(), max_tokens = structured_max_tokens(max_tokens), response_format = request.response_format)
+            token_usage = update_token_usage(token_usage, dict(response.response_metadata['token_usage'], structured_repairs = 1))
+            value = request.check(response.content)
+    except PipelineInterrupt as e:
+        # a repair stopped by the budget: the tokens of the requests made so far are counted with the interrupt
+        raise e.add_token_usage(token_usage, {current_stage.get() or 'other': token_usage})
+    request.finish(value)
+    return value, token_usage
+
+# Async version of invoke_structured
+async def ainvoke_structured(model, prompt, schema_name, max_tokens, mode = 'json_schema', amount = None, max_repairs = 1, log = None):
+    request = StructuredRequest(prompt, schema_name, mode = mode, amount = amount, log = log)
+    response = await model.ainvoke(request.messages, max_tokens = structured_max_tokens(max_tokens), response_format = request.response_format)
+    token_usage = response.response_metadata['token_usage']
+    value = request.check(response.content)
+    try:
+        while value is None and request.repairs < max_repairs:
+            response = await model.ainvoke(request.repair_messages(), max_tokens = structured_max_tokens(max_tokens), response_format = request.response_format)
+            token_usage = update_token_usage(token_usage, dict(response.response_metadata['token_usage'], structured_repairs = 1))
+            value = request.check(response.content)
+    except PipelineInterrupt as e:
+        # a repair stopped by the budget: the tokens of the requests made so far are counted with the interrupt
+        raise e.add_token_usage(token_usage, {current_stage.get() or 'other': token_usage})
+    request.finish(value)
+    return value, token_usage
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.structured_output import structured_output_metrics
+#tax_t = iterate_level(tax_t, 0, model_generate_new, model_re_generate, model_verify, structured_output = 'json_schema')
+#print(structured_output_metrics.stats())
+#______________________
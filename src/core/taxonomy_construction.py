@@ -1,41 +1,63 @@
+import copy
 import logging
+import asyncio
 
-from src.core.helper_functions import Taxonomy, Concept, update_token_usage, flatten
+from src.core.helper_functions import Taxonomy, Concept, update_token_usage, update_token_usage_by_stage, split_token_usage, flatten, run_sync, gather_with_concurrency
+from src.core.pipeline_context import PipelineInterrupt, pipeline_scope
+from src.core.tracing import traced, trace_span, annotate_span
 from src.core.taxonomy_generation_functions import *
 
-def construct_taxonomy(root_concept, model_generate_new, model_re_generate, model_verify, definition_amount = 5, definition_max_words = 50, log = None, check_existance = False):
+# With max_concurrency > 1 the independent requests of the steps 1-3 (definitions/descriptions, criteria per definition,
+# ranks per criteria) are sent concurrently, at most max_concurrency at once; their results keep the original order.
+# With structured_output ('json_schema' or 'json_object', see src.core.structured_output) the answers are JSON objects validated locally.
+# With a tracer (src.core.tracing.Tracer) the construction and every call of a generation function are recorded as spans
+@traced()
+def construct_taxonomy(root_concept, model_generate_new, model_re_generate, model_verify, definition_amount = 5, definition_max_words = 50, log = None, check_existance = False, persistence = 'pickle', max_concurrency = 1, structured_output = None, tracer = None):
     if not log:
         log = logging.getLogger("create_taxonomy")
         logging.basicConfig(level=logging.INFO)
     log.info(f"create_taxonomy() function called!\nroot_concept candidate is {root_concept}\nstep 1 - check if {root_concept} is accepted ROOT concept of some taxonomy...")
     token_usage_total = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+    token_usage_by_stage = {}
+    taxonomy = None
     try:
         if check_existance:
-            accepted_root, token_usage = check_accepted_taxonomy(root_concept, model_verify, log = log)
+            accepted_root, token_usage = check_accepted_taxonomy(root_concept, model_verify, structured = structured_output, log = log)
             token_usage_total = update_token_usage(token_usage_total, token_usage)
+            token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'existence_check': token_usage})
         else:
             accepted_root = True
         if accepted_root: 
                 log.info(f"{root_concept} is accepted ROOT concept for taxonomy construction.")
-                taxonomy = Taxonomy(root_concept)
-                taxonomy.root.descriptions, taxonomy.root.definitions, token_usage = get_concept_descriptions_and_definitions(root_concept, model_generate_new, amount = definition_amount, max_length = definition_max_words, log = log)
+                taxonomy = Taxonomy(root_concept, persistence = persistence)
+                if max_concurrency > 1:
+                    taxonomy.root.descriptions, taxonomy.root.definitions, token_usage = run_sync(aget_concept_descriptions_and_definitions(root_concept, model_generate_new, amount = definition_amount, max_length = definition_max_words, structured = structured_output, log = log))
+                else:
+                    taxonomy.root.descriptions, taxonomy.root.definitions, token_usage = get_concept_descriptions_and_definitions(root_concept, model_generate_new, amount = definition_amount, max_length = definition_max_words, structured = structured_output, log = log)
                 token_usage_total = update_token_usage(token_usage_total, token_usage)
+                token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'descriptions': token_usage})
         if not accepted_root:
             log.info(f"{root_concept} is not accepted root concept for taxonomy construction!")
             log.info(f"step 1.1 - check if {root_concept} is accepted concept INSIDE of some taxonomy...")
             for i in range(0,5):
-                accepted_part, token_usage = check_super_taxonomy(root_concept,model_verify,log=log)
+                accepted_part, token_usage = check_super_taxonomy(root_concept,model_verify,structured = structured_output, log=log)
                 token_usage_total = update_token_usage(token_usage_total, token_usage)
+                token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'existence_check': token_usage})
                 if accepted_part:
                     log.info(f"{root_concept} is accepted concept INSIDE of some taxonomy. {i} iterations performed.")
                     log.info(f"step 1.2 - find accepted ROOT concept for such taxonomy...")
                     for i in range(0,5):
-                        new_root_concept, token_usage = find_super_taxonomy_root(root_concept,model_generate_new,log=log)
+                        new_root_concept, token_usage = find_super_taxonomy_root(root_concept,model_generate_new,structured = structured_output, log=log)
                         token_usage_total = update_token_usage(token_usage_total, token_usage)
+                        token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'existence_check': token_usage})
                         log.info(f"The accepted ROOT concept of the taxonomy is {new_root_concept}.. {i} \niterations performed.")
-                        taxonomy = Taxonomy(new_root_concept)
-                        taxonomy.root.descriptions, taxonomy.root.definitions, token_usage = get_concept_descriptions_and_definitions(root_concept, model_generate_new, amount = definition_amount, max_length = definition_max_words, log = log)
+                        taxonomy = Taxonomy(new_root_concept, persistence = persistence)
+                        if max_concurrency > 1:
+                            taxonomy.root.descriptions, taxonomy.root.definitions, token_usage = run_sync(aget_concept_descriptions_and_definitions(root_concept, model_generate_new, amount = definition_amount, max_length = definition_max_words, structured = structured_output, log = log))
+                        else:
+                            taxonomy.root.descriptions, taxonomy.root.definitions, token_usage = get_concept_descriptions_and_definitions(root_concept, model_generate_new, amount = definition_amount, max_length = definition_max_words, structured = structured_output, log = log)
                         token_usage_total = update_token_usage(token_usage_total, token_usage)
+                        token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'descriptions': token_usage})
                         break
                     break
             if not accepted_part:
@@ -45,13 +67,18 @@ def construct_taxonomy(root_concept, model_generate_new, model_re_generate, mode
                 log.info(f'finished - empty taxonomy created...')
                 return taxonomy
         log.info(f'step 1 finished - taxonomy with the root concept {taxonomy.root.name} created, {len(taxonomy.root.descriptions)} descriptions and {len(taxonomy.root.definitions)} definitions generated for the concept...\nstep 2 - for created taxonomy we will try to find taxonomical criteria...')
-        for definition in taxonomy.root.descriptions + taxonomy.root.definitions:
-            criteria, token_usage = find_taxonomical_criteria(taxonomy.root.name,model_generate_new, context = definition, log = log)
+        if max_concurrency > 1:
+            results = run_sync(gather_with_concurrency(max_concurrency, [afind_taxonomical_criteria(taxonomy.root.name, model_generate_new, context = definition, structured = structured_output, log = log) for definition in taxonomy.root.descriptions + taxonomy.root.definitions]))
+        else:
+            results = (find_taxonomical_criteria(taxonomy.root.name,model_generate_new, context = definition, structured = structured_output, log = log) for definition in taxonomy.root.descriptions + taxonomy.root.definitions)
+        for criteria, token_usage in results:
             token_usage_total = update_token_usage(token_usage_total, token_usage)
+            token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'criteria': token_usage})
             taxonomy.taxonomical_criteria.append(criteria)
         log.info(f'step 2 finished - taxonomical criteria are: {taxonomy.taxonomical_criteria}')
-        filtered_criteria, token_usage = create_redundant_criteria_list(taxonomy.taxonomical_criteria, taxonomy.root.name, model_re_generate, log = log)
+        filtered_criteria, token_usage = create_redundant_criteria_list(taxonomy.taxonomical_criteria, taxonomy.root.name, model_re_generate, structured = structured_output, log = log)
         token_usage_total = update_token_usage(token_usage_total, token_usage)
+        token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'criteria_filter': token_usage})
         try:
             try:
                 taxonomical_criteria = [criteria for criteria in taxonomy.taxonomical_criteria if ( criteria.lower() not in [str(v).lower() for v in filtered_criteria] and len(criteria)>3 )]
@@ -68,15 +95,20 @@ def construct_taxonomy(root_concept, model_generate_new, model_re_generate, mode
                 log.info(f"filtering failed: {e}")
         
         log.info(f'step 3 - for created taxonomy we will try to use our taxonomical criteria to find out taxonomical ranks...')
-        for i, criteria in enumerate(taxonomy.taxonomical_criteria):
-            log.info(f'criteria {i}/{len(taxonomy.taxonomical_criteria)}: {criteria}')
-            ranks, token_usage = find_taxonomical_ranks(taxonomy.root.name, model_generate_new, context = criteria, log = log)
+        if max_concurrency > 1:
+            results = run_sync(gather_with_concurrency(max_concurrency, [afind_taxonomical_ranks(taxonomy.root.name, model_generate_new, context = criteria, structured = structured_output, log = log) for criteria in taxonomy.taxonomical_criteria]))
+        else:
+            results = (find_taxonomical_ranks(taxonomy.root.name, model_generate_new, context = criteria, structured = structured_output, log = log) for criteria in taxonomy.taxonomical_criteria)
+        for i, (ranks, token_usage) in enumerate(results):
+            log.info(f'criteria {i}/{len(taxonomy.taxonomical_criteria)}: {taxonomy.taxonomical_criteria[i]}')
             token_usage_total = update_token_usage(token_usage_total, token_usage)
+            token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'ranks': token_usage})
             log.info(f'taxonomical ranks are: {ranks}')
             taxonomy.taxonomical_ranks.append(ranks)
         log.info(f'step 3 finished - taxonomical ranks are: {taxonomy.taxonomical_ranks}')
-        taxonomy.taxonomical_ranks, token_usage = optimize_ranks_lists(taxonomy.taxonomical_ranks, taxonomy.root.name, model_generate_new, log = log)
+        taxonomy.taxonomical_ranks, token_usage = optimize_ranks_lists(taxonomy.taxonomical_ranks, taxonomy.root.name, model_generate_new, structured = structured_output, log = log)
         token_usage_total = update_token_usage(token_usage_total, token_usage)
+        token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'ranks_optimization': token_usage})
         taxonomy.taxonomical_ranks = [el.replace('\n','') for el in taxonomy.taxonomical_ranks if len(el.replace('\n',''))>3]
         log.info(f'step 3.1 finished - optimized taxonomical ranks are: {taxonomy.taxonomical_ranks}')
         for ranks in taxonomy.taxonomical_ranks:
@@ -93,6 +125,15 @@ def construct_taxonomy(root_concept, model_generate_new, model_re_generate, mode
             except Exception as e:
                 log.info(f"fail: {e}")
                 print(f"fail: {e}")
+    except PipelineInterrupt as e:
+        # budget exhausted, model unavailable...: the taxonomy created so far is saved with all the tokens spent,
+        # its stop_reason tells why the creation stopped
+        log.info(f"taxonomy creation interrupted: {e}")
+        e.add_token_usage(token_usage_total, token_usage_by_stage)
+        if taxonomy is None:
+            taxonomy = Taxonomy(root_concept, persistence = persistence)
+        token_usage_total, token_usage_by_stage = e.take_token_usage()
+        taxonomy.stop_reason = e.stop_reason
     except Exception as e:
         log.info(f"taxonomy creation failed: {e}")
         taxonomy = Taxonomy(None)
@@ -100,109 +141,804 @@ def construct_taxonomy(root_concept, model_generate_new, model_re_generate, mode
         log.info(f'finished - empty taxonomy created...')
     log.info(f'total_token_usage: \n\n{token_usage_total}\n\n')
     taxonomy.token_usage = update_token_usage(taxonomy.token_usage, token_usage_total)
-    taxonomy_path = taxonomy.save()
+    taxonomy.token_usage_by_stage = update_token_usage_by_stage(taxonomy.token_usage_by_stage, token_usage_by_stage)
+    with trace_span('save'):
+        taxonomy_path = taxonomy.save()
     log.info(f'taxonomy saved as {taxonomy_path}')
     return taxonomy
 
-def iterate_level(taxonomy, rank_number, model_generate_new, model_re_generate, model_verify, max_iter = 100, log = None, iteration_amm = 5, max_words_context= 40, max_subconcept_lenght = 80):
+# Class holding the settings of a single concept expansion (shared by the sequential and the concurrent paths).
+# With stream_subconcepts the concurrent path streams the subconcepts lists (see astream_subconcept_candidates):
+# the stream is cut off after stream_max_candidates accepted candidates, and with stream_postprocess_chunk
+# the postprocessing of every that many candidates starts while the list is still streamed.
+# The redundancy_filter (a LexicalRedundancyFilter) checks the verified candidates locally before the LLM redundancy call.
+# With structured_output ('json_schema' or 'json_object') the generation requests ask for JSON answers validated against a schema
+# and repaired with a targeted request when invalid (the streamed subconcepts lists stay comma-separated text).
+# With speculation (a SpeculationPolicy, see src.core.speculation) the concurrent path starts the redundancy call and the next
+# attempt together with the verification, within the cost ceiling of the policy (batches of batch_size > 1 are not speculated).
+# With retry_policy (an AdaptiveRetryPolicy, see src.core.retry_policy) subconcepts_amount, subconcepts_max_tokens and
+# iteration_amm are tuned per ranks list and level from the outcomes seen so far, and unlikely expansions give up early
+class ExpansionConfig:
+    def __init__(self, iteration_amm = 5, max_words_context = 40, max_subconcept_lenght = 80, subconcepts_max_tokens = 2800, verify_max_tokens = 20, redundant_max_tokens = 400,
+                 stream_subconcepts = False, stream_max_candidates = 10, stream_postprocess_chunk = None, redundancy_filter = None, structured_output = None, speculation = None,
+                 subconcepts_amount = 10, retry_policy = None) -> None:
+        self.iteration_amm              = iteration_amm
+        self.max_words_context          = max_words_context
+        self.max_subconcept_lenght      = max_subconcept_lenght
+        self.subconcepts_max_tokens     = subconcepts_max_tokens
+        self.verify_max_tokens          = verify_max_tokens
+        self.redundant_max_tokens       = redundant_max_tokens
+        self.stream_subconcepts         = stream_subconcepts
+        self.stream_max_candidates      = stream_max_candidates
+        self.stream_postprocess_chunk   = stream_postprocess_chunk
+        self.redundancy_filter          = redundancy_filter
+        self.structured_output          = structured_output
+        self.speculation                = speculation
+        self.subconcepts_amount         = subconcepts_amount
+        self.retry_policy               = retry_policy
+
+# Class representing the outcome of a concept expansion, before it is merged into the taxonomy
+class ConceptExpansion:
+    def __init__(self, concept, target_rank = None, target_level = None, definition = "", subconcepts = None, failed = False, skipped = False, token_usage = None, token_usage_by_stage = None) -> None:
+        self.concept        = concept
+        self.target_rank    = target_rank
+        self.target_level   = target_level
+        self.definition     = definition
+        self.subconcepts    = subconcepts if subconcepts else []
+        self.failed         = failed
+        self.skipped        = skipped
+        self.token_usage    = token_usage if token_usage else {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+        self.token_usage_by_stage = token_usage_by_stage if token_usage_by_stage else {}
+
+    # Method returning the result as a JSON-serializable dict (the ConceptExpansion arguments without the concept)
+    def result(self) -> dict:
+        return {'target_rank': self.target_rank, 'target_level': self.target_level, 'definition': self.definition, 'subconcepts': self.subconcepts,
+                'failed': self.failed, 'skipped': self.skipped, 'token_usage': self.token_usage, 'token_usage_by_stage': self.token_usage_by_stage}
+
+# Helper function to filter the accepted sub-concepts against the redundant ones (None if too many are redundant)
+def filter_redundant_subconcepts(subconcepts, redundant_subconcepts, log):
+    log.info(f"redundant sub-concepts list generated: {redundant_subconcepts}")
+    if len(redundant_subconcepts)>len(subconcepts)*4/5:
+        log.info(f"more than 80 percent of sub-concepts are redundant, trying again.")
+        return None
+    redundant_subconcepts = [subconcept.lower() for subconcept in redundant_subconcepts]
+    subconcepts = [subconcept for subconcept in subconcepts if len(subconcept)<120]
+    subconcepts = [subconcept for subconcept in subconcepts if subconcept.lower() not in redundant_subconcepts]
+    log.info(f"sub-concepts list filtered: {subconcepts}")
+    return subconcepts
+
+# Helper function running the local redundancy filter of the config on the verified sub-concepts (None without a filter).
+# The check holds the candidates left for the LLM redundancy call and tells whether the call can be skipped
+def check_local_redundancy(concept, subconcepts, config):
+    if not config.redundancy_filter:
+        return None
+    return config.redundancy_filter.check(subconcepts, siblings = [child.name for child in concept.children])
+
+# Helper function returning the filter of the sub-concept candidates (duplicates and too long candidates dropped, new lines replaced)
+def make_candidate_filter(config):
+    seen = set()
+    def candidate_filter(candidate):
+        if candidate in seen or len(candidate) > config.max_subconcept_lenght:
+            return None
+        seen.add(candidate)
+        return candidate.replace("\n"," ")
+    return candidate_filter
+
+# Async function generating the postprocessed sub-concept candidates of a concept from a streamed subconcepts list.
+# The candidates are filtered while they arrive and the stream stops after config.stream_max_candidates of them.
+# With config.stream_postprocess_chunk every chunk of that many candidates is postprocessed (concurrently) as soon as it
+# is complete, otherwise the whole list is postprocessed after the stream. Returns the candidates and the token usage
+# of the subconcepts and the postprocess stages
+async def astream_subconcept_candidates(concept, root_concept, current_rank, taxonomical_context, definition, model_generate_new, config, log):
+    chunk_size = config.stream_postprocess_chunk
+    received = []
+    tasks = []
+
+    def on_candidate(candidate):
+        received.append(candidate)
+        if chunk_size and len(received) % chunk_size == 0:
+            tasks.append(asyncio.ensure_future(apostprocess_subconcepts(root_concept, current_rank, received[-chunk_size:], model_generate_new, structured = config.structured_output, log=log)))
+
+    subconcepts_usage = None
+    try:
+        candidates, subconcepts_usage = await astream_subconcepts_list(concept.name, root_concept, current_rank, taxonomical_context, definition, model_generate_new, max_tokens=config.subconcepts_max_tokens,
+                                                                       subconcepts_amount=config.subconcepts_amount, max_candidates=config.stream_max_candidates, candidate_filter=make_candidate_filter(config), on_candidate=on_candidate, log=log)
+        log.info(f"sub-concept candidates are {candidates}")
+        dispatched = len(tasks)*chunk_size if chunk_size else 0
+        rest = received[dispatched:] if received else candidates
+        if rest or not tasks:
+            tasks.append(asyncio.ensure_future(apostprocess_subconcepts(root_concept, current_rank, rest, model_generate_new, structured = config.structured_output, log=log)))
+        results = await asyncio.gather(*tasks)
+    except BaseException as e:
+        if isinstance(e, PipelineInterrupt):
+            # the tokens of the subconcepts list and of the chunks postprocessed before the interrupt
+            finished = {'subconcepts': subconcepts_usage} if subconcepts_usage else {}
+            for task in tasks:
+                finished = update_token_usage_by_stage(finished, interrupted_task_usage(task, e, lambda result: {'postprocess': result[1]}))
+            add_interrupted_usage(e, finished)
+        for task in tasks:
+            task.cancel()
+        raise
+    subconcepts = []
+    postprocess_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+    for subconcepts_chunk, token_usage in results:
+        subconcepts += subconcepts_chunk
+        postprocess_usage = update_token_usage(postprocess_usage, token_usage)
+    return subconcepts, subconcepts_usage, postprocess_usage
+
+# Async function generating the postprocessed sub-concept candidates of an attempt of aexpand_concept (streamed with
+# config.stream_subconcepts). Returns the candidates and the token usage of the subconcepts and the postprocess stages
+async def agenerate_subconcept_candidates(concept, root_concept, current_rank, taxonomical_context, definition, model_generate_new, config, log):
+    if config.stream_subconcepts:
+        return await astream_subconcept_candidates(concept, root_concept, current_rank, taxonomical_context, definition, model_generate_new, config, log)
+    subconcepts, subconcepts_usage = await acreate_subconcepts_list(concept.name, root_concept, current_rank, taxonomical_context, definition, model_generate_new, max_tokens=config.subconcepts_max_tokens, max_tokens_context=600, max_words_context=50, subconcepts_amount = config.subconcepts_amount, structured = config.structured_output, log=log)
+    subconcepts = [subconcept.replace("\n"," ") for subconcept in dict.fromkeys(subconcepts) if len(subconcept) <= config.max_subconcept_lenght]
+    subconcepts, postprocess_usage = await apostprocess_subconcepts(root_concept, current_rank, subconcepts, model_generate_new, structured = config.structured_output, log=log)
+    return subconcepts, subconcepts_usage, postprocess_usage
+
+# Helper function returning the token usage per stage of the result of a speculative task ('redundancy' or 'regeneration')
+def speculative_usage_by_stage(kind, result) -> dict:
+    if kind == 'redundancy':
+        return {'redundancy': result[1]}
+    return {'subconcepts': result[1], 'postprocess': result[2]}
+
+# Helper function recording a speculative task whose result is used, returns the result
+def use_speculative_result(task, kind, speculation):
+    result = task.result()
+    speculation.finish(kind, 'used', sum(token_usage.get('total_tokens', 0) for token_usage in speculative_usage_by_stage(kind, result).values()))
+    return result
+
+# Helper function dropping a speculative task made useless by the verification. A finished task is dropped and its token
+# usage per stage returned (it was paid for), a running one is cancelled (its tokens are unknown, returns {})
+def discard_speculative_task(task, kind, speculation) -> dict:
+    if not task.done():
+        task.cancel()
+        speculation.finish(kind, 'cancelled')
+        return {}
+    if task.cancelled() or task.exception() is not None:
+        speculation.finish(kind, 'cancelled')
+        return {}
+    token_usage_by_stage = speculative_usage_by_stage(kind, task.result())
+    speculation.finish(kind, 'dropped', sum(token_usage.get('total_tokens', 0) for token_usage in token_usage_by_stage.values()))
+    return token_usage_by_stage
+
+# Helper function adding the token usage by stage of the work finished before a PipelineInterrupt to it (the total is the sum of the stages)
+def add_interrupted_usage(interrupt, token_usage_by_stage) -> PipelineInterrupt:
+    token_usage = {}
+    for stage_token_usage in token_usage_by_stage.values():
+        token_usage = update_token_usage(token_usage, stage_token_usage)
+    return interrupt.add_token_usage(token_usage, token_usage_by_stage)
+
+# Helper function returning the token usage by stage of a task that finished before the PipelineInterrupt interrupt: of its
+# result (usage_by_stage(result)) or the one carried by its own interrupt. A running or cancelled task returns {}
+def interrupted_task_usage(task, interrupt, usage_by_stage) -> dict:
+    if task is None or not task.done() or task.cancelled():
+        return {}
+    error = task.exception()
+    if error is None:
+        return usage_by_stage(task.result())
+    if isinstance(error, PipelineInterrupt) and error is not interrupt:
+        return error.take_token_usage()[1]
+    return {}
+
+# Function to generate the sub-concepts of a single concept (without modifying the taxonomy)
+@traced()
+def expand_concept(concept, root_concept, ranks, taxonomical_context, model_generate_new, model_re_generate, model_verify, config = None, log = None) -> ConceptExpansion:
+    if not log:
+        log = logging.getLogger("expand_concept")
+        logging.basicConfig(level=logging.INFO)
+    if not config:
+        config = ExpansionConfig()
+    log.info(f'concept\'s taxonomical rank is: {concept.taxonomical_rank}')
+    log.info(f"ranks amount in current ranks list: {len(ranks)}")
+    log.info(f'concept\'s taxonomical level is: {concept.taxonomical_level}')
+    if concept.taxonomical_level>=len(ranks):
+        log.info(f'skipping concept {concept.name}')
+        return ConceptExpansion(concept, definition = concept.definition, skipped = True)
+    target_level = concept.taxonomical_level + 1
+    current_rank = ranks[target_level - 1]
+    plan = config.retry_policy.plan(concept, config) if config.retry_policy else None
+    if plan:
+        config = plan.config
+    token_usage_total = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+    token_usage_by_stage = {}
+    log.info(f'so sub-concept\'s target taxonomical rank must be: {current_rank}\ngenerating target subconcept definition... max lenght is {config.max_words_context}')
+    definition = concept.definition
+    if not definition:
+        definition, token_usage = get_concept_definition(concept.name, root_concept, concept.taxonomical_rank, taxonomical_context, model_generate_new, definition_max_words = config.max_words_context, structured = config.structured_output, log = log)
+        token_usage_total = update_token_usage(token_usage_total, token_usage)
+        token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'definition': token_usage})
+        if plan:
+            plan.record_call()
+    log.info(f'sub-concept\'s definition generated: {definition}')
+
+    subconcepts_suitable = False
+    failed = False
+    i=0
+    try:
+        while not subconcepts_suitable:
+            if plan and plan.give_up():
+                failed = True
+                subconcepts = []
+                log.info(f"sub-concepts list generation given up after {i} iterations...\nconcept {concept.name} added to unknown concepts list")
+                break
+            log.info(f'sub-concepts generation\n iteration: {i}/{config.iteration_amm}\n')
+            i+=1
+            redundancy_checked = None
+            subconcepts, token_usage = create_subconcepts_list(concept.name, root_concept, current_rank, taxonomical_context, definition, model_generate_new, max_tokens=config.subconcepts_max_tokens, max_tokens_context=600, max_words_context=50, subconcepts_amount = config.subconcepts_amount, structured = config.structured_output, log=log)
+            token_usage_total = update_token_usage(token_usage_total, token_usage)
+            token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'subconcepts': token_usage})
+            subconcepts_usage = token_usage
+            subconcepts = [subconcept.replace("\n"," ") for subconcept in dict.fromkeys(subconcepts) if len(subconcept) <= config.max_subconcept_lenght]
+            log.info(f"sub-concept candidates are {subconcepts}")
+            subconcepts, token_usage = postprocess_subconcepts(root_concept, current_rank, subconcepts, model_generate_new, structured = config.structured_output, log=log)
+            token_usage_total = update_token_usage(token_usage_total, token_usage)
+            token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'postprocess': token_usage})
+            log.info(f"sub-concept candidates postprocessed: {subconcepts}")
+            candidates = subconcepts
+            accepted, token_usage = check_subconcepts(subconcepts, root_concept, current_rank, model_verify, max_tokens = config.verify_max_tokens, structured = config.structured_output, log = log)
+            token_usage_total = update_token_usage(token_usage_total, token_usage)
+            token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'verify': token_usage})
+            if i>config.iteration_amm:
+                subconcepts_suitable = True
+                failed = True
+                subconcepts = []
+                log.info(f"sub-concepts list generation failed after {config.iteration_amm} iterations...\nconcept {concept.name} added to unknown concepts list")
+            elif accepted:
+                log.info(f"sub-concepts list generated: {subconcepts}")
+                local_check = check_local_redundancy(concept, subconcepts, config)
+                if local_check:
+                    subconcepts = local_check.candidates
+                if local_check and local_check.skip_llm:
+                    redundant_subconcepts = []
+                else:
+                    redundant_subconcepts, token_usage = create_redundant_subconcepts_list(subconcepts, root_concept, current_rank, taxonomical_context, model_re_generate, max_tokens = config.redundant_max_tokens, structured = config.structured_output, log=log)
+                    redundancy_checked = redundant_subconcepts
+                    token_usage_total = update_token_usage(token_usage_total, token_usage)
+                    token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'redundancy': token_usage})
+                    if local_check:
+                        config.redundancy_filter.compare(local_check, redundant_subconcepts)
+                filtered_subconcepts = filter_redundant_subconcepts(subconcepts, redundant_subconcepts, log)
+                if filtered_subconcepts is not None:
+                    subconcepts_suitable = True
+                    subconcepts = filtered_subconcepts
+            if plan:
+                plan.record_attempt(candidates, accepted, subconcepts_usage, redundant_subconcepts = redundancy_checked, too_redundant = bool(accepted) and not subconcepts_suitable)
+    except PipelineInterrupt as e:
+        # the tokens of the requests made before the interrupt
+        raise e.add_token_usage(token_usage_total, token_usage_by_stage)
+    if plan:
+        plan.finish(subconcepts, failed)
+    return ConceptExpansion(concept, current_rank, target_level, definition, subconcepts, failed = failed, token_usage = token_usage_total, token_usage_by_stage = token_usage_by_stage)
+
+# Async version of expand_concept, used by the concurrent expansion mode
+@traced()
+async def aexpand_concept(concept, root_concept, ranks, taxonomical_context, model_generate_new, model_re_generate, model_verify, config = None, log = None) -> ConceptExpansion:
+    if not log:
+        log = logging.getLogger("aexpand_concept")
+        logging.basicConfig(level=logging.INFO)
+    if not config:
+        config = ExpansionConfig()
+    log.info(f'concept\'s taxonomical rank is: {concept.taxonomical_rank}')
+    log.info(f'concept\'s taxonomical level is: {concept.taxonomical_level}')
+    if concept.taxonomical_level>=len(ranks):
+        log.info(f'skipping concept {concept.name}')
+        return ConceptExpansion(concept, definition = concept.definition, skipped = True)
+    target_level = concept.taxonomical_level + 1
+    current_rank = ranks[target_level - 1]
+    plan = config.retry_policy.plan(concept, config) if config.retry_policy else None
+    if plan:
+        config = plan.config
+    token_usage_total = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+    token_usage_by_stage = {}
+    definition = concept.definition
+    if not definition:
+        definition, token_usage = await aget_concept_definition(concept.name, root_concept, concept.taxonomical_rank, taxonomical_context, model_generate_new, definition_max_words = config.max_words_context, structured = config.structured_output, log = log)
+        token_usage_total = update_token_usage(token_usage_total, token_usage)
+        token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'definition': token_usage})
+        if plan:
+            plan.record_call()
+    log.info(f'sub-concept\'s definition generated: {definition}')
+
+    subconcepts_suitable = False
+    failed = False
+    i=0
+    speculation = config.speculation
+    verify_task = redundancy_task = regeneration_task = None
+    try:
+        while not subconcepts_suitable:
+            if plan and plan.give_up():
+                failed = True
+                subconcepts = []
+                log.info(f"sub-concepts list generation given up after {i} iterations...\nconcept {concept.name} added to unknown concepts list")
+                break
+            log.info(f'sub-concepts generation for {concept.name}\n iteration: {i}/{config.iteration_amm}\n')
+            i+=1
+            redundancy_checked = None
+            if regeneration_task is not None:
+                # the attempt was started together with the verification of the previous one
+                await asyncio.wait([regeneration_task])
+                subconcepts, token_usage, postprocess_token_usage = use_speculative_result(regeneration_task, 'regeneration', speculation)
+                regeneration_task = None
+            else:
+                subconcepts, token_usage, postprocess_token_usage = await agenerate_subconcept_candidates(concept, root_concept, current_rank, taxonomical_context, definition, model_generate_new, config, log)
+            token_usage_total = update_token_usage(token_usage_total, token_usage)
+            token_usage_total = update_token_usage(token_usage_total, postprocess_token_usage)
+            token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'subconcepts': token_usage, 'postprocess': postprocess_token_usage})
+            subconcepts_usage = token_usage
+            candidates = subconcepts
+            speculative = speculation is not None and i<=config.iteration_amm
+            if speculative:
+                # the redundancy call of the candidates and the next attempt start together with the verification,
+                # the one made useless by the verdict is dropped below
+                verify_task = asyncio.ensure_future(acheck_subconcepts(subconcepts, root_concept, current_rank, model_verify, max_tokens = config.verify_max_tokens, structured = config.structured_output, log = log))
+                local_check = check_local_redundancy(concept, subconcepts, config)
+                if not (local_check and local_check.skip_llm) and speculation.allow('redundancy'):
+                    redundancy_task = asyncio.ensure_future(acreate_redundant_subconcepts_list(local_check.candidates if local_check else subconcepts, root_concept, current_rank, taxonomical_context, model_re_generate, max_tokens = config.redundant_max_tokens, structured = config.structured_output, log=log))
+                if not (plan and i>=config.iteration_amm) and speculation.allow('regeneration'):
+                    regeneration_task = asyncio.ensure_future(agenerate_subconcept_candidates(concept, root_concept, current_rank, taxonomical_context, definition, model_generate_new, config, log))
+                accepted, token_usage = await verify_task
+                verify_task = None
+            else:
+                accepted, token_usage = await acheck_subconcepts(subconcepts, root_concept, current_rank, model_verify, max_tokens = config.verify_max_tokens, structured = config.structured_output, log = log)
+            token_usage_total = update_token_usage(token_usage_total, token_usage)
+            token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'verify': token_usage})
+            if i>config.iteration_amm:
+                subconcepts_suitable = True
+                failed = True
+                subconcepts = []
+                log.info(f"sub-concepts list generation failed after {config.iteration_amm} iterations...\nconcept {concept.name} added to unknown concepts list")
+            elif accepted:
+                if not speculative:
+                    local_check = check_local_redundancy(concept, subconcepts, config)
+                if local_check:
+                    subconcepts = local_check.candidates
+                if local_check and local_check.skip_llm:
+                    redundant_subconcepts = []
+                else:
+                    if redundancy_task is not None:
+                        await asyncio.wait([redundancy_task])
+                        redundant_subconcepts, token_usage = use_speculative_result(redundancy_task, 'redundancy', speculation)
+                        redundancy_task = None
+                    else:
+                        redundant_subconcepts, token_usage = await acreate_redundant_subconcepts_list(subconcepts, root_concept, current_rank, taxonomical_context, model_re_generate, max_tokens = config.redundant_max_tokens, structured = config.structured_output, log=log)
+                    redundancy_checked = redundant_subconcepts
+                    token_usage_total = update_token_usage(token_usage_total, token_usage)
+                    token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, {'redundancy': token_usage})
+                    if local_check:
+                        config.redundancy_filter.compare(local_check, redundant_subconcepts)
+                filtered_subconcepts = filter_redundant_subconcepts(subconcepts, redundant_subconcepts, log)
+                if filtered_subconcepts is not None:
+                    subconcepts_suitable = True
+                    subconcepts = filtered_subconcepts
+            if plan:
+                plan.record_attempt(candidates, accepted, subconcepts_usage, redundant_subconcepts = redundancy_checked, too_redundant = bool(accepted) and not subconcepts_suitable)
+            if speculative:
+                speculation.record_attempt(accepted, subconcepts_suitable)
+                # the tokens of the dropped requests that finished are part of the expansion's usage
+                discarded_usage = {}
+                if redundancy_task is not None:
+                    discarded_usage.update(discard_speculative_task(redundancy_task, 'redundancy', speculation))
+                    redundancy_task = None
+                if subconcepts_suitable and regeneration_task is not None:
+                    discarded_usage.update(discard_speculative_task(regeneration_task, 'regeneration', speculation))
+                    regeneration_task = None
+                for token_usage in discarded_usage.values():
+                    token_usage_total = update_token_usage(token_usage_total, token_usage)
+                token_usage_by_stage = update_token_usage_by_stage(token_usage_by_stage, discarded_usage)
+    except BaseException as e:
+        if isinstance(e, PipelineInterrupt):
+            # the tokens of the requests made before the interrupt, with the speculative ones that finished
+            for kind, task in (('redundancy', redundancy_task), ('regeneration', regeneration_task)):
+                add_interrupted_usage(e, interrupted_task_usage(task, e, lambda result: speculative_usage_by_stage(kind, result)))
+            e.add_token_usage(token_usage_total, token_usage_by_stage)
+        for task in (verify_task, redundancy_task, regeneration_task):
+            if task is not None:
+                task.cancel()
+        raise
+    if speculation is not None:
+        speculation.spend(token_usage_total)
+    if plan:
+        plan.finish(subconcepts, failed)
+    return ConceptExpansion(concept, current_rank, target_level, definition, subconcepts, failed = failed, token_usage = token_usage_total, token_usage_by_stage = token_usage_by_stage)
+
+# Helper function splitting the concepts into batches of up to batch_size consecutive concepts of the same taxonomical level
+def make_expansion_batches(concepts, batch_size = 1) -> list:
+    batches = []
+    for concept in concepts:
+        if batches and len(batches[-1]) < batch_size and batches[-1][0].taxonomical_level == concept.taxonomical_level:
+            batches[-1].append(concept)
+        else:
+            batches.append([concept])
+    return batches
+
+# Function to expand several sibling concepts (same ranks list and taxonomical level) with batched requests.
+# The subconcepts generation, the postprocessing and the verification of all the pending concepts are sent
+# as one request per stage (the token usage is split evenly between the concepts); the concepts whose
+# section of a batched response cannot be parsed fall back to the single-concept request of that stage.
+# The retry loop and the redundancy filter work per concept like in aexpand_concept.
+@traced()
+async def aexpand_concepts_batch(concepts, root_concept, ranks, taxonomical_context, model_generate_new, model_re_generate, model_verify, config = None, log = None) -> list:
+    if not log:
+        log = logging.getLogger("aexpand_concepts_batch")
+        logging.basicConfig(level=logging.INFO)
+    if not config:
+        config = ExpansionConfig()
+    if len(concepts) == 1:
+        return [await aexpand_concept(concepts[0], root_concept, ranks, taxonomical_context, model_generate_new, model_re_generate, model_verify, config = config, log = log)]
+    if concepts[0].taxonomical_level>=len(ranks):
+        log.info(f'skipping concepts {[concept.name for concept in concepts]}')
+        return [ConceptExpansion(concept, definition = concept.definition, skipped = True) for concept in concepts]
+    target_level = concepts[0].taxonomical_level + 1
+    current_rank = ranks[target_level - 1]
+    # with a retry policy the batched requests use the settings tuned for the first concept (the concepts of a batch share their level),
+    # the retry cap of every concept is checked by its plan
+    plans = [config.retry_policy.plan(concept, config) for concept in concepts] if config.retry_policy else None
+    if plans:
+        config = copy.copy(plans[0].config)
+        config.iteration_amm = max(plan.config.iteration_amm for plan in plans)
+    token_usage_totals = [{'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0} for _ in concepts]
+    token_usage_by_stages = [{} for _ in concepts]
+
+    def add_usage(indices, stage, token_usage):
+        for i, token_usage_share in zip(indices, split_token_usage(token_usage, len(indices))):
+            token_usage_totals[i] = update_token_usage(token_usage_totals[i], token_usage_share)
+            token_usage_by_stages[i] = update_token_usage_by_stage(token_usage_by_stages[i], {stage: token_usage_share})
+
+    definitions = [concept.definition for concept in concepts]
+    missing = [i for i, definition in enumerate(definitions) if not definition]
+    try:
+        results = await asyncio.gather(*[aget_concept_definition(concepts[i].name, root_concept, concepts[i].taxonomical_rank, taxonomical_context, model_generate_new, definition_max_words = config.max_words_context, structured = config.structured_output, log = log) for i in missing])
+        for i, (definition, token_usage) in zip(missing, results):
+            definitions[i] = definition
+            add_usage([i], 'definition', token_usage)
+            if plans:
+                plans[i].record_call()
+
+        subconcepts = [[] for _ in concepts]
+        failed = [False for _ in concepts]
+        pending = list(range(len(concepts)))
+        iteration = 0
+        while pending:
+            if plans:
+                for i in [i for i in pending if plans[i].give_up()]:
+                    failed[i] = True
+                    log.info(f"sub-concepts list generation given up after {plans[i].attempts} iterations...\nconcept {concepts[i].name} added to unknown concepts list")
+                pending = [i for i in pending if not failed[i]]
+                if not pending:
+                    break
+            subconcepts_completion_tokens = [token_usage_by_stages[i].get('subconcepts', {}).get('completion_tokens', 0) for i in pending]
+            log.info(f'batched sub-concepts generation for {[concepts[i].name for i in pending]}\n iteration: {iteration}/{config.iteration_amm}\n')
+            iteration += 1
+            candidates, token_usage = await acreate_subconcepts_lists_batch([concepts[i].name for i in pending], [definitions[i] for i in pending], root_concept, current_rank, taxonomical_context, model_generate_new, max_tokens = config.subconcepts_max_tokens, subconcepts_amount = config.subconcepts_amount, structured = config.structured_output, log = log)
+            add_usage(pending, 'subconcepts', token_usage)
+            fallback = [k for k in range(len(pending)) if k not in candidates]
+            results = await asyncio.gather(*[acreate_subconcepts_list(concepts[pending[k]].name, root_concept, current_rank, taxonomical_context, definitions[pending[k]], model_generate_new, max_tokens=config.subconcepts_max_tokens, max_tokens_context=600, max_words_context=50, subconcepts_amount = config.subconcepts_amount, structured = config.structured_output, log=log) for k in fallback])
+            for k, (subconcepts_list, token_usage) in zip(fallback, results):
+                candidates[k] = subconcepts_list
+                add_usage([pending[k]], 'subconcepts', token_usage)
+            candidates = [[subconcept.replace("\n"," ") for subconcept in dict.fromkeys(candidates[k]) if len(subconcept) <= config.max_subconcept_lenght] for k in range(len(pending))]
+
+            postprocessed, token_usage = await apostprocess_subconcepts_batch(root_concept, current_rank, candidates, model_generate_new, structured = config.structured_output, log = log)
+            add_usage(pending, 'postprocess', token_usage)
+            fallback = [k for k in range(len(pending)) if k not in postprocessed]
+            results = await asyncio.gather(*[apostprocess_subconcepts(root_concept, current_rank, candidates[k], model_generate_new, structured = config.structured_output, log = log) for k in fallback])
+            for k, (subconcepts_list, token_usage) in zip(fallback, results):
+                postprocessed[k] = subconcepts_list
+                add_usage([pending[k]], 'postprocess', token_usage)
+
+            accepted, token_usage = await acheck_subconcepts_batch([postprocessed[k] for k in range(len(pending))], root_concept, model_verify, max_tokens = config.verify_max_tokens, structured = config.structured_output, log = log)
+            add_usage(pending, 'verify', token_usage)
+            fallback = [k for k in range(len(pending)) if k not in accepted]
+            results = await asyncio.gather(*[acheck_subconcepts(postprocessed[k], root_concept, current_rank, model_verify, max_tokens = config.verify_max_tokens, structured = config.structured_output, log = log) for k in fallback])
+            for k, (is_accepted, token_usage) in zip(fallback, results):
+                accepted[k] = is_accepted
+                add_usage([pending[k]], 'verify', token_usage)
+
+            checked = [k for k in range(len(pending)) if accepted[k] and iteration <= config.iteration_amm]
+            verified_candidates = [postprocessed[k] for k in range(len(pending))]
+            redundant = {}
+            local_checks = {}
+            for k in checked:
+                local_checks[k] = check_local_redundancy(concepts[pending[k]], postprocessed[k], config)
+                if local_checks[k]:
+                    postprocessed[k] = local_checks[k].candidates
+                    if local_checks[k].skip_llm:
+                        redundant[k] = []
+            checked = [k for k in checked if k not in redundant]
+            results = await asyncio.gather(*[acreate_redundant_subconcepts_list(postprocessed[k], root_concept, current_rank, taxonomical_context, model_re_generate, max_tokens = config.redundant_max_tokens, structured = config.structured_output, log=log) for k in checked])
+            for k, (redundant_subconcepts, token_usage) in zip(checked, results):
+                redundant[k] = redundant_subconcepts
+                add_usage([pending[k]], 'redundancy', token_usage)
+                if local_checks[k]:
+                    config.redundancy_filter.compare(local_checks[k], redundant_subconcepts)
+
+            still_pending = []
+            for k, i in enumerate(pending):
+                if iteration>config.iteration_amm:
+                    failed[i] = True
+                    log.info(f"sub-concepts list generation failed after {config.iteration_amm} iterations...\nconcept {concepts[i].name} added to unknown concepts list")
+                elif k in redundant:
+                    filtered_subconcepts = filter_redundant_subconcepts(postprocessed[k], redundant[k], log)
+                    if filtered_subconcepts is not None:
+                        subconcepts[i] = filtered_subconcepts
+                    else:
+                        still_pending.append(i)
+                else:
+                    still_pending.append(i)
+                if plans:
+                    # the batched requests are shared by the pending concepts
+                    plans[i].record_attempt(verified_candidates[k], accepted[k], {'completion_tokens': token_usage_by_stages[i]['subconcepts'].get('completion_tokens', 0) - subconcepts_completion_tokens[k]},
+                                            redundant_subconcepts = redundant[k] if k in checked else None, too_redundant = bool(accepted[k]) and i in still_pending, calls = 3/len(pending) + int(k in checked))
+            pending = still_pending
+    except PipelineInterrupt as e:
+        # the tokens of the requests made before the interrupt (the ones of the gathered requests still running are lost)
+        for token_usage_total, token_usage_by_stage in zip(token_usage_totals, token_usage_by_stages):
+            e.add_token_usage(token_usage_total, token_usage_by_stage)
+        raise
+    if plans:
+        for i, plan in enumerate(plans):
+            plan.finish(subconcepts[i], failed[i])
+    return [ConceptExpansion(concept, current_rank, target_level, definitions[i], subconcepts[i], failed = failed[i], token_usage = token_usage_totals[i], token_usage_by_stage = token_usage_by_stages[i]) for i, concept in enumerate(concepts)]
+
+# Function to add the token usage carried by a PipelineInterrupt (the work of the interrupted expansions) to the taxonomy,
+# returns the token usage added
+def merge_interrupted_usage(taxonomy, interrupt) -> dict:
+    token_usage, token_usage_by_stage = interrupt.take_token_usage()
+    if token_usage:
+        taxonomy.add_token_usage(token_usage, token_usage_by_stage)
+    return token_usage
+
+# Function to merge an expansion result into the taxonomy, returns the list of new concepts
+@traced('merge')
+def merge_concept_expansion(taxonomy, rank_number, expansion, log = None) -> list:
+    if not log:
+        log = logging.getLogger("merge_concept_expansion")
+        logging.basicConfig(level=logging.INFO)
+    concept = expansion.concept
+    taxonomy.set_concept_definition(concept, expansion.definition)
+    if expansion.failed:
+        taxonomy.clear_children(concept, rank_number)
+        taxonomy.add_unknown_concept(rank_number, concept)
+    nc = [Concept(subconcept, parent=concept, taxonomical_rank=expansion.target_rank, taxonomical_level=expansion.target_level, taxonomical_ranks_list_number=rank_number) for subconcept in expansion.subconcepts]
+    nc = taxonomy.add_concepts(concept, nc, deduplicate = True)
+    taxonomy.add_token_usage(expansion.token_usage, expansion.token_usage_by_stage)
+    log.info(f'{len(nc)} new sub-concepts of {concept.name} merged into the taxonomy')
+    return nc
+
+# Helper function to merge an expansion of an iteration recorded by a run manager (run = None: no run manager),
+# the journal sequence number before the merge is stored first so that a restart knows whether the merge was saved
+def merge_run_expansion(taxonomy, rank_number, run, expansion, log) -> list:
+    if run:
+        run.merging(expansion.concept)
+    return merge_concept_expansion(taxonomy, rank_number, expansion, log = log)
+
+# Helper function to restore an expansion stored by the run manager (no LLM calls), returns the new concepts.
+# If the loaded taxonomy already has the merge, only its missing parts are added again (the sub-concepts are
+# deduplicated, the token usage is not counted twice)
+def restore_run_expansion(taxonomy, rank_number, run, concept, log) -> list:
+    expansion = ConceptExpansion(concept, **run.stored_expansion(concept))
+    if not run.merge_persisted(concept):
+        log.info(f'expansion of {concept.name} restored from the run manager')
+        return merge_run_expansion(taxonomy, rank_number, run, expansion, log)
+    if expansion.failed and concept not in taxonomy.unknown_concepts[rank_number]:
+        taxonomy.add_unknown_concept(rank_number, concept)
+    taxonomy.add_concepts(concept, [Concept(subconcept, parent=concept, taxonomical_rank=expansion.target_rank, taxonomical_level=expansion.target_level, taxonomical_ranks_list_number=rank_number) for subconcept in expansion.subconcepts], deduplicate = True)
+    log.info(f'expansion of {concept.name} already merged into the loaded taxonomy')
+    return list(concept.children)
+
+# Helper function that checks the current level of the ranks list, returns the target rank or None if the ranks list is exhausted
+def start_level_iteration(taxonomy, rank_number, log):
+    log.info(f'taxonomical ranks are {taxonomy.taxonomical_ranks[rank_number]}')
+    if taxonomy.current_level[rank_number]>len(taxonomy.taxonomical_ranks[rank_number].split(','))+1:
+        log.info('out of ranks.. finishing')
+        taxonomy.set_uninspected_concepts(rank_number, [])
+        return None
+    current_rank = taxonomy.taxonomical_ranks[rank_number].split(',')[taxonomy.current_level[rank_number]]
+    log.info(f'target taxonomical rank is {current_rank}')
+    taxonomy.set_current_level(rank_number, taxonomy.current_level[rank_number] + 1)
+    return current_rank
+
+# Helper function to start an iteration of a ranks list. With a run manager its unfinished iteration is resumed,
+# otherwise the level is started (and registered in the run manager). Returns (False if the ranks list is exhausted, LevelRun or None)
+def start_run_iteration(taxonomy, rank_number, run_manager, log):
+    run = run_manager.resume_iteration(taxonomy, rank_number) if run_manager else None
+    if run:
+        log.info(f'resuming the unfinished iteration {run.iteration} of the run manager')
+        return True, run
+    if start_level_iteration(taxonomy, rank_number, log) is None:
+        return False, None
+    return True, run_manager.start_iteration(taxonomy, rank_number, taxonomy.uninspected_concepts[rank_number]) if run_manager else None
+
+@traced()
+def iterate_level(taxonomy, rank_number, model_generate_new, model_re_generate, model_verify, max_iter = 100, log = None, iteration_amm = 5, max_words_context= 40, max_subconcept_lenght = 80, max_concurrency = 1, batch_size = 1, stream_subconcepts = False, stream_postprocess_chunk = None, redundancy_filter = None, structured_output = None, run_manager = None, tracer = None, speculation = None, retry_policy = None, near_duplicates = False):
+    annotate_span(ranks_list = rank_number, level = taxonomy.current_level[rank_number] + 1)
+    if max_concurrency > 1 or batch_size > 1 or stream_subconcepts or speculation is not None:
+        # Concurrent / batched / streaming / speculative expansion mode (see aiterate_level)
+        return run_sync(aiterate_level(taxonomy, rank_number, model_generate_new, model_re_generate, model_verify, max_iter = max_iter, log = log, iteration_amm = iteration_amm, max_words_context = max_words_context, max_subconcept_lenght = max_subconcept_lenght, max_concurrency = max_concurrency, batch_size = batch_size,
+                                       stream_subconcepts = stream_subconcepts, stream_postprocess_chunk = stream_postprocess_chunk, redundancy_filter = redundancy_filter, structured_output = structured_output, run_manager = run_manager, tracer = tracer, speculation = speculation, retry_policy = retry_policy, near_duplicates = near_duplicates))
     if not log:
         log = logging.getLogger("iterate_level")
         logging.basicConfig(level=logging.INFO)
     log.info(f'iterate_level() \ntarget current level is {taxonomy.current_level[rank_number] + 1}')
+    taxonomy.stop_reason = None
+    if near_duplicates:
+        taxonomy.enable_near_duplicate_detection()
+    config = ExpansionConfig(iteration_amm = iteration_amm, max_words_context = max_words_context, max_subconcept_lenght = max_subconcept_lenght, redundancy_filter = redundancy_filter, structured_output = structured_output, retry_policy = retry_policy)
     token_usage_total = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+    interrupt = None
+    run = None
+    completed = False
     try:
-        log.info(f'taxonomical ranks are {taxonomy.taxonomical_ranks[rank_number]}')
-        if taxonomy.current_level[rank_number]>len(taxonomy.taxonomical_ranks[rank_number].split(','))+1:
-            log.info('out of ranks.. finishing')
-            taxonomy.uninspected_concepts[rank_number] = []
+        started, run = start_run_iteration(taxonomy, rank_number, run_manager, log)
+        if not started:
             return taxonomy
+        annotate_span(ranks_list = rank_number, level = taxonomy.current_level[rank_number])
+        ranks = taxonomy.taxonomical_ranks[rank_number].split(',')
+        frontier = run.frontier if run else list(taxonomy.uninspected_concepts[rank_number])
         new_concepts = []
-        current_rank = taxonomy.taxonomical_ranks[rank_number].split(',')[taxonomy.current_level[rank_number]]
-        log.info(f'target taxonomical rank is {current_rank}')
-        taxonomy.current_level[rank_number] += 1
         inspected_subconcepts = []
-        print(f'{taxonomy.uninspected_concepts[rank_number]}')
-        for j, concept in enumerate(taxonomy.uninspected_concepts[rank_number]):
+        interrupted = False
+        for j, concept in enumerate(frontier):
             log.info(f'processing concept: {concept.name}')
-            log.info(f'{j}/{len(taxonomy.uninspected_concepts[rank_number])-1} uninspected')
-            log.info(f'concept\'s taxonomical rank is: {concept.taxonomical_rank}')
-            log.info(f"ranks amount in current ranks list: {len(taxonomy.taxonomical_ranks[rank_number].split(','))}")
-            log.info(f'concept\'s taxonomical level is: {concept.taxonomical_level}')
-            if concept.taxonomical_level>=len(taxonomy.taxonomical_ranks[rank_number].split(',')):
-                log.info(f'skipping concept {concept.name}')
-                pass
+            log.info(f'{j}/{len(frontier)-1} uninspected')
+            expansion = None
+            try:
+                if not (run and run.is_expanded(concept)):
+                    if run:
+                        run.start([concept])
+                    with pipeline_scope(ranks_list = rank_number, level = concept.taxonomical_level + 1):
+                        expansion = expand_concept(concept, taxonomy.root.name, ranks, taxonomy.taxonomical_context[rank_number], model_generate_new, model_re_generate, model_verify, config = config, log = log)
+                    if run:
+                        run.complete([expansion])
+            except PipelineInterrupt as e:
+                # budget exhausted, model unavailable...: the concept and the rest of the level stay uninspected,
+                # the tokens spent on the concept are counted
+                token_usage_total = update_token_usage(token_usage_total, merge_interrupted_usage(taxonomy, e))
+                taxonomy.set_uninspected_concepts(rank_number, new_concepts + [c for c in frontier if c not in inspected_subconcepts])
+                log.info(f'{e}\n{j} uninspected concepts proceed, stopping generation....')
+                interrupt = e
+                taxonomy.stop_reason = e.stop_reason
+                interrupted = True
+                break
+            if expansion is None:
+                new_concepts += restore_run_expansion(taxonomy, rank_number, run, concept, log)
             else:
-                target_level = concept.taxonomical_level + 1
-                current_rank = taxonomy.taxonomical_ranks[rank_number].split(',')[target_level - 1]
-            log.info(f'so sub-concept\'s target taxonomical rank must be: {current_rank}\ngenerating target subconcept definition... max lenght is {max_words_context}')
-            if not concept.definition:
-                concept.definition, token_usage = get_concept_definition(concept.name, taxonomy.root.name, concept.taxonomical_rank, taxonomy.taxonomical_context[rank_number], model_generate_new, definition_max_words = max_words_context, log = log)
-                token_usage_total = update_token_usage(token_usage_total, token_usage)
-            log.info(f'sub-concept\'s definition generated: {concept.definition}')
-            
-            subconcepts_suitable = False
-            i=0
-            while not subconcepts_suitable:
-                log.info(f'sub-concepts generation\n iteration: {i}/{iteration_amm}\n')
+                token_usage_total = update_token_usage(token_usage_total, expansion.token_usage)
                 log.info(f'total_token_usage: \n\n{token_usage_total}\n\n')
-                i+=1
-                subconcepts, token_usage = create_subconcepts_list(concept.name, taxonomy.root.name, current_rank, taxonomy.taxonomical_context[rank_number], concept.definition, model_generate_new, max_tokens=2800, max_tokens_context=600, max_words_context=50, log=log)
-                token_usage_total = update_token_usage(token_usage_total, token_usage)
-                subconcepts = [subconcept.replace("\n"," ") for subconcept in set(subconcepts) if len(subconcept) <= max_subconcept_lenght]  
-                log.info(f"sub-concept candidates are {subconcepts}")
-                subconcepts, token_usage = postprocess_subconcepts(taxonomy.root.name, current_rank, subconcepts, model_generate_new, log=log)
-                token_usage_total = update_token_usage(token_usage_total, token_usage)
-                log.info(f"sub-concept candidates postprocessed: {subconcepts}")
-                validation_prompt = chat_template_check_subconcepts.format_messages(response = subconcepts, root_concept = taxonomy.root.name, taxonomical_rank = current_rank)
-                log.info(f"sub-concept candidates validation prompt: {validation_prompt}")
-                check_result = model_verify.invoke(validation_prompt, max_tokens = 20)
-                log.info(f"sub-concept candidates validation result: {check_result}")
-                token_usage = check_result.response_metadata['token_usage']
-                token_usage_total = update_token_usage(token_usage_total, token_usage)
-                if i>iteration_amm:
-                    subconcepts_suitable = True
-                    subconcepts = []
-                    log.info(f"sub-concepts list generation failed after {iteration_amm} iterations...\nconcept {concept.name} added to unknown concepts list")
-                    concept.children = []
-                    taxonomy.unknown_concepts[rank_number].append(concept)
-                elif check_result.content.replace(' ','') == "+":
-                    subconcepts_suitable = True
-                    log.info(f"sub-concepts list generated: {subconcepts}")
-                    redundant_subconcepts, token_usage = create_redundant_subconcepts_list(subconcepts, taxonomy.root.name, current_rank, taxonomy.taxonomical_context[rank_number], model_re_generate, max_tokens = 400, log=log)
-                    token_usage_total = update_token_usage(token_usage_total, token_usage)
-                    log.info(f"redundant sub-concepts list generated: {redundant_subconcepts}")
-                    if len(redundant_subconcepts)>len(subconcepts)*4/5:
-                        log.info(f"more than 80 percent of sub-concepts are redundant, trying again.")
-                        subconcepts_suitable = False
-                    else:
-                        redundant_subconcepts = [subconcept.lower() for subconcept in redundant_subconcepts]
-                        subconcepts = [subconcept for subconcept in subconcepts if len(subconcept)<120]
-                        subconcepts = [subconcept for subconcept in subconcepts if subconcept.lower() not in redundant_subconcepts]
-                        log.info(f"sub-concepts list filtered: {subconcepts}")
-            known_subconcepts = [c.name.lower() for c in taxonomy.concepts]
-            nc = [Concept(subconcept, parent=concept, taxonomical_rank=current_rank, taxonomical_level=target_level, taxonomical_ranks_list_number=rank_number) for subconcept in subconcepts if subconcept.lower() not in known_subconcepts]
-            concept.children += nc
-            new_concepts += nc
+                new_concepts += merge_run_expansion(taxonomy, rank_number, run, expansion, log)
+                with trace_span('checkpoint'):
+                    taxonomy_path = taxonomy.checkpoint()
+                log.info(f'taxonomy saved as {taxonomy_path}')
             inspected_subconcepts.append(concept)
-            taxonomy.concepts += nc
-            taxonomy.token_usage = update_token_usage(taxonomy.token_usage, token_usage_total)
-            taxonomy_path = taxonomy.save()
-            log.info(f'taxonomy saved as {taxonomy_path}')
             if j>= max_iter:
-                taxonomy.uninspected_concepts[rank_number] = new_concepts + [c for c in taxonomy.uninspected_concepts[rank_number] if c not in inspected_subconcepts]
+                taxonomy.set_uninspected_concepts(rank_number, new_concepts + [c for c in frontier if c not in inspected_subconcepts])
                 log.info(f'{j} uninspected concepts proceed. {len(taxonomy.uninspected_concepts[rank_number])} new concepts found, breaking generation....')
+                interrupted = True
                 break
-        log.info(f'all currently unexplored concepts processed! {len(taxonomy.uninspected_concepts[rank_number])} new concepts found..')
-        taxonomy.uninspected_concepts[rank_number] = new_concepts
+        if not interrupted:
+            log.info(f'all currently unexplored concepts processed! {len(new_concepts)} new concepts found..')
+            taxonomy.set_uninspected_concepts(rank_number, new_concepts)
         u_l = [c.name for c in flatten(taxonomy.uninspected_concepts)]
         log.info(f"finish!\nuninspected concepts (total) after the iteration: {u_l}")
+        completed = interrupt is None
     except Exception as e:
         log.info(f"iterate_level() failed: {e}")
     log.info('iterate_level proceed..')
     log.info(f'total_token_usage: \n\n{token_usage_total}\n\n')
-    taxonomy.token_usage = update_token_usage(taxonomy.token_usage, token_usage_total)
-    taxonomy_path = taxonomy.save()
+    with trace_span('save'):
+        taxonomy_path = taxonomy.save()
+    log.info(f'taxonomy saved as {taxonomy_path}')
+    if run and completed:
+        run.finish()
+    return taxonomy
+
+# Concurrent version of iterate_level: up to max_concurrency concepts of the level are expanded at once with `ainvoke`,
+# the results are merged into the taxonomy in the original frontier order, so the outcome matches the sequential path.
+# With batch_size > 1 every task expands a batch of up to batch_size sibling concepts (see aexpand_concepts_batch).
+# From a running event loop (e.g. Jupyter) it can be awaited directly: `tax_t = await aiterate_level(tax_t, 0, ...)`
+# With a run_manager (src.core.run_manager.RunManager) the iteration is recorded durably and resumed after a restart
+# With a tracer (src.core.tracing.Tracer) the level, the expansions, merges and checkpoints and every generation call are spans
+# With speculation (src.core.speculation.SpeculationPolicy) the stages of an expansion overlap, see ExpansionConfig
+# With a retry_policy (src.core.retry_policy.AdaptiveRetryPolicy) the settings and the retries of the expansions adapt per level
+# With near_duplicates the new subconcepts are also deduplicated against near-duplicate names (word order, one edit), see Taxonomy.enable_near_duplicate_detection
+@traced()
+async def aiterate_level(taxonomy, rank_number, model_generate_new, model_re_generate, model_verify, max_iter = 100, log = None, iteration_amm = 5, max_words_context= 40, max_subconcept_lenght = 80, max_concurrency = 8, batch_size = 1, stream_subconcepts = False, stream_postprocess_chunk = None, redundancy_filter = None, structured_output = None, run_manager = None, tracer = None, speculation = None, retry_policy = None, near_duplicates = False):
+    if not log:
+        log = logging.getLogger("aiterate_level")
+        logging.basicConfig(level=logging.INFO)
+    log.info(f'aiterate_level() \ntarget current level is {taxonomy.current_level[rank_number] + 1}\nmax concurrency is {max_concurrency}, batch size is {batch_size}, streaming is {stream_subconcepts}')
+    taxonomy.stop_reason = None
+    if near_duplicates:
+        taxonomy.enable_near_duplicate_detection()
+    config = ExpansionConfig(iteration_amm = iteration_amm, max_words_context = max_words_context, max_subconcept_lenght = max_subconcept_lenght, stream_subconcepts = stream_subconcepts, stream_postprocess_chunk = stream_postprocess_chunk, redundancy_filter = redundancy_filter, structured_output = structured_output, speculation = speculation, retry_policy = retry_policy)
+    token_usage_total = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+    tasks = []
+    interrupt = None
+    run = None
+    completed = False
+    try:
+        started, run = start_run_iteration(taxonomy, rank_number, run_manager, log)
+        if not started:
+            return taxonomy
+        annotate_span(ranks_list = rank_number, level = taxonomy.current_level[rank_number])
+        ranks = taxonomy.taxonomical_ranks[rank_number].split(',')
+        frontier = run.frontier if run else list(taxonomy.uninspected_concepts[rank_number])
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def expand(batch):
+            async with semaphore:
+                if interrupt is not None:
+                    return None
+                log.info(f'processing concepts: {[concept.name for concept in batch]}')
+                if run:
+                    run.start(batch)
+                with pipeline_scope(ranks_list = rank_number, level = batch[0].taxonomical_level + 1):
+                    expansions = await aexpand_concepts_batch(batch, taxonomy.root.name, ranks, taxonomy.taxonomical_context[rank_number], model_generate_new, model_re_generate, model_verify, config = config, log = log)
+                if run:
+                    run.complete(expansions)
+                return expansions
+
+        processed = frontier[:max_iter + 1]
+        # the concepts expanded before a restart are restored from the run manager instead
+        batches = make_expansion_batches([concept for concept in processed if not (run and run.is_expanded(concept))], batch_size)
+        tasks = [asyncio.ensure_future(expand(batch)) for batch in batches]
+        batch_positions = {concept.concept_id: (task, k, len(batch)) for task, batch in zip(tasks, batches) for k, concept in enumerate(batch)}
+        new_concepts = []
+        unmerged = []
+        merged = 0
+        for concept in processed:
+            if concept.concept_id not in batch_positions:
+                new_concepts += restore_run_expansion(taxonomy, rank_number, run, concept, log)
+                merged += 1
+                continue
+            task, k, batch_length = batch_positions[concept.concept_id]
+            try:
+                expansions = await task
+            except PipelineInterrupt as e:
+                if interrupt is None:
+                    # budget exhausted, model unavailable...: no more expansions start and the running ones are awaited,
+                    # the finished expansions are still merged, the tokens of the interrupted ones are counted
+                    interrupt = e
+                    taxonomy.stop_reason = e.stop_reason
+                    log.info(f'{e}\n{merged} uninspected concepts proceed, stopping generation....')
+                    await asyncio.gather(*tasks, return_exceptions = True)
+                token_usage_total = update_token_usage(token_usage_total, merge_interrupted_usage(taxonomy, e))
+                expansions = None
+            if expansions is None:
+                # interrupted or not started, the concept stays uninspected
+                unmerged.append(concept)
+                continue
+            token_usage_total = update_token_usage(token_usage_total, expansions[k].token_usage)
+            new_concepts += merge_run_expansion(taxonomy, rank_number, run, expansions[k], log)
+            merged += 1
+            if k == batch_length - 1:
+                with trace_span('checkpoint'):
+                    taxonomy_path = taxonomy.checkpoint()
+                log.info(f'{merged}/{len(frontier)} concepts merged, taxonomy saved as {taxonomy_path}')
+        if interrupt:
+            taxonomy.set_uninspected_concepts(rank_number, new_concepts + unmerged + frontier[len(processed):])
+        elif len(frontier) > len(processed):
+            taxonomy.set_uninspected_concepts(rank_number, new_concepts + frontier[len(processed):])
+            log.info(f'{len(processed)} uninspected concepts proceed. {len(new_concepts)} new concepts found, breaking generation....')
+        else:
+            log.info(f'all currently unexplored concepts processed! {len(new_concepts)} new concepts found..')
+            taxonomy.set_uninspected_concepts(rank_number, new_concepts)
+        u_l = [c.name for c in flatten(taxonomy.uninspected_concepts)]
+        log.info(f"finish!\nuninspected concepts (total) after the iteration: {u_l}")
+        completed = interrupt is None
+    except Exception as e:
+        log.info(f"aiterate_level() failed: {e}")
+    finally:
+        for task in tasks:
+            task.cancel()
+    log.info('aiterate_level proceed..')
+    log.info(f'total_token_usage: \n\n{token_usage_total}\n\n')
+    with trace_span('save'):
+        taxonomy_path = taxonomy.save()
     log.info(f'taxonomy saved as {taxonomy_path}')
+    if run and completed:
+        run.finish()
     return taxonomy
 
 #EXAMPLE USAGE:
@@ -1,280 +1,299 @@
 import re
 import logging
+import asyncio
+import contextlib
 
 from src.prompts.prompt_templates import *
 from src.core.helper_functions import update_token_usage
+from src.core.pipeline_context import PipelineInterrupt, pipeline_stage
+from src.core.model_wrappers import chunk_token_usage, get_model_params
+from src.core.structured_output import invoke_structured, ainvoke_structured, record_text_answer, validate_text_items
+from src.core.tracing import log_sampled
+
+# Class for a single-request generation step, shared by the sync generation functions and their async versions:
+# the prompt, the schema of the structured answer, the parsing of the answer and the fallback result.
+# invoke/ainvoke send the request (invoke_structured with structured, the plain text answer otherwise) and return
+# (result, token usage); on a failed request the fallback is returned with zero token usage.
+# amount is the number of entries of a batched structured answer (one per concept of the batch)
+class GenerationRequest:
+    def __init__(self, name, model, prompt, max_tokens, schema_name, from_value, from_response, fallback, structured = None, amount = None, log = None) -> None:
+        self.name           = name
+        self.model          = model
+        self.prompt         = prompt
+        self.max_tokens     = max_tokens
+        self.schema_name    = schema_name
+        self.from_value     = from_value
+        self.from_response  = from_response
+        self.fallback       = fallback
+        self.structured     = structured
+        self.amount         = amount
+        self.log            = log
+        log_sampled(log, "%s prompt:\n\n-------------------------------\n%s\n\nInvoking LLM...", name, prompt)
+
+    def invoke(self):
+        try:
+            if self.structured:
+                return self.structured_result(*invoke_structured(self.model, self.prompt, self.schema_name, self.max_tokens, mode = self.structured, amount = self.amount, log = self.log))
+            return self.text_result(self.model.invoke(self.prompt, max_tokens = self.max_tokens))
+        except Exception as e:
+            return self.failed(e)
+
+    async def ainvoke(self):
+        try:
+            if self.structured:
+                return self.structured_result(*await ainvoke_structured(self.model, self.prompt, self.schema_name, self.max_tokens, mode = self.structured, amount = self.amount, log = self.log))
+            return self.text_result(await self.model.ainvoke(self.prompt, max_tokens = self.max_tokens))
+        except Exception as e:
+            return self.failed(e)
+
+    # Method parsing a structured answer (value is None when no valid answer was given)
+    def structured_result(self, value, token_usage):
+        result = self.from_value(value)
+        log_sampled(self.log, "Structured %s %s! Result: %s", self.name.lower(), 'successful' if value else 'failed', result)
+        return result, token_usage
+
+    # Method parsing a plain text answer
+    def text_result(self, response):
+        token_usage = response.response_metadata['token_usage']
+        result = self.from_response(response)
+        log_sampled(self.log, "%s successful! Response: \n%s\n\nResult: %s", self.name, response, result)
+        return result, token_usage
+
+    def failed(self, error):
+        self.log.info("%s failed: %s", self.name, error)
+        return self.fallback, {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+
+# Helper function splitting a comma-separated list answer
+def split_list_answer(content: str) -> list:
+    return content.replace(', ', ',').split(",")
+
+# Helper function parsing a yes/no answer (the answer contains 'yes')
+def parse_yes_answer(content: str) -> bool:
+    return 'yes' in content.lower().replace(" ", '')
 
 # Function to check if a taxonomy for the given root concept exists in the model
-def check_accepted_taxonomy(root_concept:str, model_verify, context = "", max_tokens = 5, log = None) -> bool:
+@pipeline_stage('existence_check')
+def check_accepted_taxonomy(root_concept:str, model_verify, context = "", max_tokens = 5, structured = None, log = None) -> bool:
     if not log:
         log = logging.getLogger("check_accepted_taxonomy")
         logging.basicConfig(level=logging.INFO)
-    log.info("check_accepted_taxonomy() function called!")
-    log.info(f'Root concept: {root_concept}')
-    log.info(f"Max tokens set to: {max_tokens}")
+    log_sampled(log, "check_accepted_taxonomy() function called!")
+    log_sampled(log, 'Root concept: %s', root_concept)
+    log_sampled(log, "Max tokens set to: %s", max_tokens)
 
     # Prepare the prompt for the LLM based on the root concept and context
     prompt = chat_template_accepted_taxonomy_existance_check.format_messages(root_concept = root_concept, context = context)
-    log.info(f"Accepted taxonomy check prompt:\n\n-------------------------------\n{prompt}\n\nInvoking LLM...")
-
-    try:
-        # Invoke the model to check for the existence of the accepted taxonomy
-        response = model_verify.invoke(prompt, max_tokens=max_tokens)
-        log.info(f"Accepted taxonomy check successful! Response: \n\n{response}\n\n")
-        token_usage = response.response_metadata['token_usage']
-        # Check if the response contains 'yes', indicating the existence of the taxonomy
-        if len(re.findall('yes', response.content.lower().replace(" ", ''))) > 0:
-            return True, token_usage
-        else:
-            log.info(f"Accepted taxonomy check successful! But taxonomy not found, response is: \n\n{response.content.lower().replace(' ','')}\n\n")
-            return False, token_usage 
-    except Exception as e:
-        log.info(f"Accepted taxonomy check failed: {e}")
-        token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-        return False, token_usage
+    # With structured the answer is a JSON yes/no object, otherwise the taxonomy exists if the answer contains 'yes'
+    return GenerationRequest("Accepted taxonomy check", model_verify, prompt, max_tokens, 'yes_no', from_value = lambda value: bool(value and value['answer']),
+                             from_response = lambda response: parse_yes_answer(response.content), fallback = False, structured = structured, log = log).invoke()
         
 # Function to check if a super-taxonomy (a higher-level taxonomy) exists for a given concept
-def check_super_taxonomy(concept: str, model_verify, max_tokens = 5, log = None) -> bool:
+@pipeline_stage('existence_check')
+def check_super_taxonomy(concept: str, model_verify, max_tokens = 5, structured = None, log = None) -> bool:
     if not log:
         log = logging.getLogger("check_super_taxonomy")
         logging.basicConfig(level=logging.INFO)
-    log.info("check_super_taxonomy() function called!")
-    log.info(f'Concept: {concept}')
-    log.info(f"Max tokens set to: {max_tokens}")
+    log_sampled(log, "check_super_taxonomy() function called!")
+    log_sampled(log, 'Concept: %s', concept)
+    log_sampled(log, "Max tokens set to: %s", max_tokens)
 
     # Prepare the prompt for the LLM based on the concept
     prompt = chat_template_super_taxonomy_existance_check.format_messages(concept=concept)
-    log.info(f"Super taxonomy check prompt:\n\n-------------------------------\n{prompt}\n\nInvoking LLM...")
-
-    try:
-        # Invoke the model to check for the existence of a super-taxonomy
-        response = model_verify.invoke(prompt, max_tokens=max_tokens)
-        log.info(f"Super taxonomy check successful! Response: \n\n{response}\n\n")
-        token_usage = response.response_metadata['token_usage']
-        # Check if the response contains 'yes', indicating the existence of the super-taxonomy
-        if len(re.findall('yes', response.content.lower().replace(" ", ''))) > 0:
-            return True, token_usage
-        else:
-            log.info(f"Super taxonomy check successful! But super-taxonomy not found, response is: \n\n{response.content.lower().replace(' ','')}\n\n")
-            return False, token_usage
-    except Exception as e:
-        log.info(f"Super taxonomy check failed: {e}")
-        token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-        return False, token_usage
+    # With structured the answer is a JSON yes/no object, otherwise the super-taxonomy exists if the answer contains 'yes'
+    return GenerationRequest("Super taxonomy check", model_verify, prompt, max_tokens, 'yes_no', from_value = lambda value: bool(value and value['answer']),
+                             from_response = lambda response: parse_yes_answer(response.content), fallback = False, structured = structured, log = log).invoke()
         
 # Function to find the root of a super-taxonomy for a given concept
-def find_super_taxonomy_root(concept: str, model_generate_new, max_tokens = 10, log = None) -> str:
+@pipeline_stage('existence_check')
+def find_super_taxonomy_root(concept: str, model_generate_new, max_tokens = 10, structured = None, log = None) -> str:
     if not log:
         log = logging.getLogger("find_super_taxonomy_root")
         logging.basicConfig(level=logging.INFO)
-    log.info("find_super_taxonomy_root() function called!")
-    log.info(f'Concept: {concept}')
-    log.info(f"Max tokens set to: {max_tokens}")
+    log_sampled(log, "find_super_taxonomy_root() function called!")
+    log_sampled(log, 'Concept: %s', concept)
+    log_sampled(log, "Max tokens set to: %s", max_tokens)
 
     # Prepare the prompt to find the super-taxonomy root for the given concept
     prompt = chat_template_super_taxonomy_find.format_messages(concept=concept)
-    log.info(f"Super taxonomy root find prompt:\n\n-------------------------------\n{prompt}\n\nInvoking LLM...")
-
-    try:
-        # Invoke the model to find the root of the super-taxonomy
-        response = model_generate_new.invoke(prompt, max_tokens=max_tokens)
-        log.info(f"Super taxonomy root find successful! Response: \n\n{response}\n\n")
-        token_usage = response.response_metadata['token_usage']
-        found_root = response.content
-    except Exception as e:
-        log.info(f"Super taxonomy root find failed: {e}")
-        token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-        found_root = "None"
-    return found_root, token_usage
+    return GenerationRequest("Super taxonomy root find", model_generate_new, prompt, max_tokens, 'text', from_value = lambda value: value['text'] if value else "None",
+                             from_response = lambda response: response.content, fallback = "None", structured = structured, log = log).invoke()
         
+# Helper function building the request of find_taxonomical_criteria and afind_taxonomical_criteria
+def taxonomical_criteria_request(root_concept: str, model_generate_new, context, max_tokens, structured, log) -> GenerationRequest:
+    log_sampled(log, 'Root concept: %s', root_concept)
+    log_sampled(log, "Max tokens set to: %s", max_tokens)
+    # Prepare the prompt to find taxonomical criteria based on the root concept and context
+    prompt = chat_template_find_taxonomical_criteria.format_messages(root_concept=root_concept, context=context)
+    return GenerationRequest("Find taxonomical criteria", model_generate_new, prompt, max_tokens, 'text', from_value = lambda value: value['text'] if value else "None",
+                             from_response = lambda response: response.content, fallback = "None", structured = structured, log = log)
+
 # Function to find taxonomical criteria for a given root concept
-def find_taxonomical_criteria(root_concept: str, model_generate_new, context = "", max_tokens = 50, log = None) -> str:
+@pipeline_stage('criteria')
+def find_taxonomical_criteria(root_concept: str, model_generate_new, context = "", max_tokens = 50, structured = None, log = None) -> str:
     if not log:
         log = logging.getLogger("find_taxonomical_criteria")
         logging.basicConfig(level=logging.INFO)
-    log.info("find_taxonomical_criteria() function called!")
-    log.info(f'Root concept: {root_concept}')
-    log.info(f"Max tokens set to: {max_tokens}")
+    log_sampled(log, "find_taxonomical_criteria() function called!")
+    return taxonomical_criteria_request(root_concept, model_generate_new, context, max_tokens, structured, log).invoke()
 
-    # Prepare the prompt to find taxonomical criteria based on the root concept and context
-    prompt = chat_template_find_taxonomical_criteria.format_messages(root_concept=root_concept, context=context)
-    log.info(f"Find taxonomical criteria prompt:\n\n-------------------------------\n{prompt}\n\nInvoking LLM...")
+# Helper function parsing the ranks lists answer ("rank, rank, ...; rank, rank, ...")
+def parse_ranks_lists(content: str) -> list:
+    ranks_lists = content.replace('\n', ' ').replace('; ',';').split(';')
+    ranks = [v.strip() for v in ranks_lists]
+    #ranks_list = [v.strip() for v in response.content.replace('\n', ' ').replace('/', ',').replace(';',',').replace('. ',', ').replace(', ', ',').replace(',,',',').replace('  ', ' ').replace("'","").split(",")]
+    #ranks_list = [el for el in ranks_list  if len(el) > 3]
+    return [v.replace(', ',',').split(',') for v in ranks]
+
+# Helper function building the request of find_taxonomical_ranks and afind_taxonomical_ranks
+def taxonomical_ranks_request(root_concept: str, model_generate_new, context, max_tokens, structured, log) -> GenerationRequest:
+    log_sampled(log, 'Root concept: %s', root_concept)
+    log_sampled(log, 'Context: %s', context)
+    log_sampled(log, "Max tokens set to: %s", max_tokens)
+    # Prepare the prompt to find taxonomical ranks based on the root concept and context
+    prompt = chat_template_find_taxonomical_ranks.format_messages(root_concept=root_concept, criteria=context)
+    return GenerationRequest("Find taxonomical ranks", model_generate_new, prompt, max_tokens, 'ranks_lists', from_value = lambda value: value['ranks_lists'] if value else [["None"]],
+                             from_response = lambda response: parse_ranks_lists(response.content), fallback = [["None"]], structured = structured, log = log)
 
-    try:
-        # Invoke the model to find taxonomical criteria
-        response = model_generate_new.invoke(prompt, max_tokens=max_tokens)
-        log.info(f"Taxonomical criteria found successfully! Response: \n\n{response}\n\n")
-        token_usage = response.response_metadata['token_usage']
-        criteria = response.content
-    except Exception as e:
-        log.info(f"Taxonomical criteria find failed: {e}")
-        token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-        criteria = "None"
-    return criteria, token_usage
-        
 # Function to find taxonomical ranks for a given root concept
-def find_taxonomical_ranks(root_concept: str, model_generate_new, context = "", max_tokens = 50, log = None) -> list:
+@pipeline_stage('ranks')
+def find_taxonomical_ranks(root_concept: str, model_generate_new, context = "", max_tokens = 50, structured = None, log = None) -> list:
     if not log:
         log = logging.getLogger("find_taxonomical_ranks")
         logging.basicConfig(level=logging.INFO)
-    log.info("find_taxonomical_ranks() function called!")
-    log.info(f'Root concept: {root_concept}')
-    log.info(f'Context: {context}')
-    log.info(f"Max tokens set to: {max_tokens}")
-
-    # Prepare the prompt to find taxonomical ranks based on the root concept and context
-    prompt = chat_template_find_taxonomical_ranks.format_messages(root_concept=root_concept, criteria=context)
-    log.info(f"Find taxonomical ranks prompt:\n\n-------------------------------\n{prompt}\n\nInvoking LLM...")
+    log_sampled(log, "find_taxonomical_ranks() function called!")
+    return taxonomical_ranks_request(root_concept, model_generate_new, context, max_tokens, structured, log).invoke()
 
-    try:
-        # Invoke the model to find taxonomical ranks
-        response = model_generate_new.invoke(prompt, max_tokens=max_tokens)
-        ranks_lists = response.content.replace('\n', ' ').replace('; ',';').split(';')
-        ranks = [v.strip() for v in ranks_lists]
-        ranks_lists = [v.replace(', ',',').split(',') for v in ranks]
-        #ranks_list = [v.strip() for v in response.content.replace('\n', ' ').replace('/', ',').replace(';',',').replace('. ',', ').replace(', ', ',').replace(',,',',').replace('  ', ' ').replace("'","").split(",")]
-        #ranks_list = [el for el in ranks_list  if len(el) > 3]
-        log.info(f"Taxonomical ranks found successfully! Response: \n{response}\n\nTaxonomical ranks lists: {ranks_lists}")
-        token_usage = response.response_metadata['token_usage']
-    except Exception as e:
-        log.info(f"Taxonomical ranks generation failed: {e}")
-        ranks_list = ["None"]
-        ranks_lists = [["None"]]
-        token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-    return ranks_lists, token_usage
-    #return ranks_list, token_usage
+# Helper function parsing the descriptions or definitions answer (items separated by ";")
+def parse_descriptions(items: list) -> list:
+    return [el.strip() for el in items if len(el.strip()) > 5]
 
-# Function to get descriptions for a given concept
-def get_concept_descriptions_and_definitions(root_concept: str, model_generate_new, amount = 5, max_length = 50, max_tokens = 300, log = None) -> str:
-    if not log:
-        log = logging.getLogger("get_concept_descriptions_and_definitions")
-        logging.basicConfig(level=logging.INFO)
-    log.info("get_concept_descriptions_and_definitions() function called!")
-    log.info(f'Max tokens set to: {max_tokens}. \nTarget concept: {root_concept}.\n')
-    token_usage_total = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+# Helper function building the two requests of get_concept_descriptions_and_definitions and its async version
+# (the answer to the definitions prompt is used as the descriptions and vice versa, a failed request gives None)
+def descriptions_and_definitions_requests(root_concept: str, model_generate_new, amount, max_length, max_tokens, structured, log) -> list:
+    log_sampled(log, 'Max tokens set to: %s. \nTarget concept: %s.\n', max_tokens, root_concept)
     # generate definitions
     prompt_generate_definitions = chat_template_definitions.format_messages(root_concept=root_concept, definitions_amount=amount, definition_length = max_length)
     # generate descriptions
     prompt_generate_descriptions = chat_template_descriptions.format_messages(root_concept=root_concept, descriptions_amount=amount, description_length = max_length)
-    try:
-        # Generate expert and linguist descriptions using the model
-        response = model_generate_new.invoke(prompt_generate_definitions, max_tokens=max_tokens)
-        token_usage_total = update_token_usage(token_usage_total, response.response_metadata['token_usage'])
-        descriptions = [el.strip() for el in response.content.split(";") if len(el.strip()) > 5]
-        log.info(f"Concept descriptions generation successful! Response: \n\n{response}\n\n")
-        response = model_generate_new.invoke(prompt_generate_descriptions, max_tokens=max_tokens)
-        token_usage_total = update_token_usage(token_usage_total, response.response_metadata['token_usage'])
-        definitions = [el.strip() for el in response.content.split(";") if len(el.strip()) > 5]
-        log.info(f"Concept definitions generation successful! Response: \n\n{response}\n\n")
-    except Exception as e:
-        log.info(f"Concept definitions and descriptions generation failed: {e}") 
-        descriptions = ["The description can not be generated!"]
-        definitions =  ["The definition can not be generated!"]
-    return descriptions, definitions, token_usage_total
+    return [GenerationRequest(name, model_generate_new, prompt, max_tokens, 'texts', from_value = lambda value: parse_descriptions(value['items']) if value else None,
+                              from_response = lambda response: parse_descriptions(response.content.split(";")), fallback = None, structured = structured, log = log)
+            for name, prompt in (("Concept descriptions generation", prompt_generate_definitions), ("Concept definitions generation", prompt_generate_descriptions))]
 
-# Function to generate a defined-length definition for a given concept
-def get_concept_definition(concept: str, root_concept: str, taxonomical_rank: str, taxonomical_context: str, model_generate_new, definition_max_words = 10, max_tokens = 100, log = None) -> str:
+# Helper function combining the results of the descriptions and definitions requests (a request stopped by an exception
+# is re-raised, a PipelineInterrupt with the token usage of the other one); any failure gives the fallback texts
+def descriptions_and_definitions_result(results, log):
+    token_usage_total = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+    for result in results:
+        if not isinstance(result, BaseException):
+            token_usage_total = update_token_usage(token_usage_total, result[1])
+    for result in results:
+        if isinstance(result, PipelineInterrupt):
+            raise result.add_token_usage(token_usage_total, {'descriptions': token_usage_total})
+        if isinstance(result, BaseException):
+            raise result
+    if len(results) < 2 or any(result[0] is None for result in results):
+        log.info("Concept definitions and descriptions generation failed!")
+        return ["The description can not be generated!"], ["The definition can not be generated!"], token_usage_total
+    return results[0][0], results[1][0], token_usage_total
+
+# Function to get descriptions for a given concept
+@pipeline_stage('descriptions')
+def get_concept_descriptions_and_definitions(root_concept: str, model_generate_new, amount = 5, max_length = 50, max_tokens = 300, structured = None, log = None) -> str:
     if not log:
-        log = logging.getLogger("get_concept_definition")
+        log = logging.getLogger("get_concept_descriptions_and_definitions")
         logging.basicConfig(level=logging.INFO)
-    log.info("get_concept_definition() function called!")
-    log.info(f'Definition max words: {definition_max_words}, Max tokens set to: {max_tokens}. \nTarget concept: {concept}.\nRoot concept: {root_concept}')
+    log_sampled(log, "get_concept_descriptions_and_definitions() function called!")
+    results = []
+    for request in descriptions_and_definitions_requests(root_concept, model_generate_new, amount, max_length, max_tokens, structured, log):
+        try:
+            results.append(request.invoke())
+        except BaseException as e:
+            results.append(e)
+        if isinstance(results[-1], BaseException) or results[-1][0] is None:
+            break
+    return descriptions_and_definitions_result(results, log)
 
+# Helper function building the request of get_concept_definition and aget_concept_definition
+def concept_definition_request(concept: str, root_concept: str, taxonomical_rank: str, taxonomical_context: str, model_generate_new, definition_max_words, max_tokens, structured, log) -> GenerationRequest:
+    log_sampled(log, 'Definition max words: %s, Max tokens set to: %s. \nTarget concept: %s.\nRoot concept: %s', definition_max_words, max_tokens, concept, root_concept)
     # Prepare the prompt to generate a concise definition for the concept
     prompt = chat_template_define.format_messages(root_concept=root_concept, concept = concept, taxonomical_rank=taxonomical_rank, taxonomical_context=taxonomical_context, definition_length = definition_max_words)
-    log.info(f"Definition generation prompt:\n\n-------------------------------\n{prompt}\n\nInvoking LLM...")
+    return GenerationRequest("Concept definition generation", model_generate_new, prompt, max_tokens, 'text', from_value = lambda value: value['text'] if value else "The definition cannot be generated!",
+                             from_response = lambda response: response.content, fallback = "The definition cannot be generated!", structured = structured, log = log)
 
-    try:
-        # Generate the definition using the model
-        response = model_generate_new.invoke(prompt, max_tokens=max_tokens)
-        log.info(f"Concept definition generation successful! Response: \n\n{response}\n\n")
-        token_usage = response.response_metadata['token_usage']
-        return response.content, token_usage
-    except Exception as e:
-        log.info(f"Concept definition generation failed: {e}")
-        token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-        return "The definition cannot be generated!", token_usage
-  
-# Function to create a list of subconcepts for a given concept
-def create_subconcepts_list(concept: str, root_concept: str, taxonomical_rank: str, taxonomical_context: str, concept_definition: str, model_generate_new, max_tokens = 80, max_tokens_context = 100, max_words_context = 40, subconcepts_amount = 10, log = None) -> list:
+# Function to generate a defined-length definition for a given concept
+@pipeline_stage('definition')
+def get_concept_definition(concept: str, root_concept: str, taxonomical_rank: str, taxonomical_context: str, model_generate_new, definition_max_words = 10, max_tokens = 100, structured = None, log = None) -> str:
     if not log:
-        log = logging.getLogger("create_subconcepts_list")
+        log = logging.getLogger("get_concept_definition")
         logging.basicConfig(level=logging.INFO)
-    log.info(f'''create_subconcepts_list() \nTarget concept: {concept}\nRoot concept: {root_concept}..''')
-    log.info(f"Selected taxonomical rank: {taxonomical_rank}\n({taxonomical_context})\nDefinition max words: {max_words_context}")
-    
+    log_sampled(log, "get_concept_definition() function called!")
+    return concept_definition_request(concept, root_concept, taxonomical_rank, taxonomical_context, model_generate_new, definition_max_words, max_tokens, structured, log).invoke()
+
+# Helper function parsing the subconcepts list answer (the answers that are not a clean list are counted, see record_text_answer)
+def parse_subconcepts_answer(content: str) -> list:
+    subcat_list = split_list_answer(content)
+    record_text_answer(not validate_text_items(subcat_list))
+    return subcat_list
+
+# Helper function building the request of create_subconcepts_list and acreate_subconcepts_list
+def subconcepts_list_request(concept: str, root_concept: str, taxonomical_rank: str, taxonomical_context: str, concept_definition: str, model_generate_new, max_tokens, max_words_context, subconcepts_amount, structured, log) -> GenerationRequest:
+    log_sampled(log, "Selected taxonomical rank: %s\n(%s)\nDefinition max words: %s", taxonomical_rank, taxonomical_context, max_words_context)
     # Prepare the context and prompt to generate subconcepts
     context_string = " " + concept_definition
     prompt = chat_template_list_subconcepts.format_messages(root_concept=root_concept, concept=concept, context_string=context_string, taxonomical_rank=taxonomical_rank, taxonomical_context=taxonomical_context, subconcepts_amount=subconcepts_amount)
-    log.info(f"Subconcept listing generation prompt:\n\n-------------------------------\n{prompt}\n\nInvoking LLM...")
+    # With structured the list is generated as a JSON object (validated and repaired locally)
+    return GenerationRequest("Subconcept listing generation", model_generate_new, prompt, max_tokens, 'names', from_value = lambda value: value['items'] if value else ["None"],
+                             from_response = lambda response: parse_subconcepts_answer(response.content), fallback = ["None"], structured = structured, log = log)
 
-    try:
-        # Generate the list of subconcepts using the model
-        response = model_generate_new.invoke(prompt, max_tokens=max_tokens)
-        subcat_list = response.content.replace(', ', ',').split(",")
-        log.info(f"Subconcept listing generation successful! Response: \n{response}\n\nSubconcepts list: {subcat_list}")
-        token_usage = response.response_metadata['token_usage']
-    except Exception as e:
-        log.info(f"Subconcept listing generation failed: {e}")
-        subcat_list = ["None"]
-        token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-    return subcat_list, token_usage
-
-# Function to create a list of redundant subconcepts that can be discarded
-def create_redundant_subconcepts_list(candidate_list: list, root_concept: str, taxonomical_rank: str, taxonomical_context: str, model_re_generate, max_tokens = 80, log = None) -> list:
+# Function to create a list of subconcepts for a given concept
+@pipeline_stage('subconcepts')
+def create_subconcepts_list(concept: str, root_concept: str, taxonomical_rank: str, taxonomical_context: str, concept_definition: str, model_generate_new, max_tokens = 80, max_tokens_context = 100, max_words_context = 40, subconcepts_amount = 10, structured = None, log = None) -> list:
     if not log:
-        log = logging.getLogger("create_redundant_subconcepts_list")
+        log = logging.getLogger("create_subconcepts_list")
         logging.basicConfig(level=logging.INFO)
-    log.info(f'''create_redundant_subconcepts_list() \nRoot concept: {root_concept}..''')
-    log.info(f"Selected taxonomical rank: {taxonomical_rank}\nTaxonomical context: {taxonomical_context}")
+    log_sampled(log, '''create_subconcepts_list() \nTarget concept: %s\nRoot concept: %s..''', concept, root_concept)
+    return subconcepts_list_request(concept, root_concept, taxonomical_rank, taxonomical_context, concept_definition, model_generate_new, max_tokens, max_words_context, subconcepts_amount, structured, log).invoke()
 
+# Helper function building the request of create_redundant_subconcepts_list and acreate_redundant_subconcepts_list
+def redundant_subconcepts_request(candidate_list: list, root_concept: str, taxonomical_rank: str, taxonomical_context: str, model_re_generate, max_tokens, structured, log) -> GenerationRequest:
+    log_sampled(log, "Selected taxonomical rank: %s\nTaxonomical context: %s", taxonomical_rank, taxonomical_context)
     # Prepare the prompt to identify and discard redundant subconcepts
     prompt = chat_template_discard_subconcepts.format_messages(root_concept=root_concept, taxonomical_rank=taxonomical_rank, taxonomical_context=taxonomical_context, candidate_list=candidate_list)
-    log.info(f"Redundant subconcepts listing filter prompt:\n\n-------------------------------\n{prompt}\n\nInvoking LLM...")
+    return GenerationRequest("Redundant subconcept listing generation", model_re_generate, prompt, max_tokens, 'names', from_value = lambda value: value['items'] if value else ["None"],
+                             from_response = lambda response: split_list_answer(response.content), fallback = ["None"], structured = structured, log = log)
 
-    try:
-        # Generate the list of redundant subconcepts using the model
-        response = model_re_generate.invoke(prompt, max_tokens=max_tokens)
-        subcat_list = response.content.replace(', ', ',').split(",")
-        log.info(f"Redundant subconcept listing generation successful! Response: \n{response}\n\nRedundant subconcepts list: {subcat_list}")
-        token_usage = response.response_metadata['token_usage']
-    except Exception as e:
-        log.info(f"Redundant subconcept listing generation failed: {e}")
-        subcat_list = ["None"]
-        token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-    return subcat_list, token_usage
+# Function to create a list of redundant subconcepts that can be discarded
+@pipeline_stage('redundancy')
+def create_redundant_subconcepts_list(candidate_list: list, root_concept: str, taxonomical_rank: str, taxonomical_context: str, model_re_generate, max_tokens = 80, structured = None, log = None) -> list:
+    if not log:
+        log = logging.getLogger("create_redundant_subconcepts_list")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, '''create_redundant_subconcepts_list() \nRoot concept: %s..''', root_concept)
+    return redundant_subconcepts_request(candidate_list, root_concept, taxonomical_rank, taxonomical_context, model_re_generate, max_tokens, structured, log).invoke()
 
 # Function to create a list of redundant criteria lists
-def create_redundant_criteria_list(candidate_lists: list, root_concept: str, model_re_generate, max_tokens = 20, log = None) -> list:
+@pipeline_stage('criteria_filter')
+def create_redundant_criteria_list(candidate_lists: list, root_concept: str, model_re_generate, max_tokens = 20, structured = None, log = None) -> list:
     if not log:
         log = logging.getLogger("create_redundant_criteria_list")
         logging.basicConfig(level=logging.INFO)
-    log.info(f'''create_redundant_criteria_list() \nRoot concept: {root_concept}..''')
+    log_sampled(log, '''create_redundant_criteria_list() \nRoot concept: %s..''', root_concept)
     context = ''
     for i,v in enumerate(candidate_lists):
         context+=str(i)+'. '+str(v)+'\n'
     # Prepare the prompt to identify and discard redundant criteria lists
     prompt = chat_template_discard_criteria.format_messages(root_concept=root_concept, candidate_lists=context)
-    log.info(f"Redundant criteria listing filter prompt:\n\n-------------------------------\n{prompt}\n\nInvoking LLM...")
-
-    try:
-        # Generate the list of redundant criteria using the model
-        response = model_re_generate.invoke(prompt, max_tokens=max_tokens)
-        subcat_list = response.content.replace(', ', ',').split(",")
-        log.info(f"Redundant criteria generation successful! Response: \n{response}\n\nRedundant criteria list: {subcat_list}")
-        token_usage = response.response_metadata['token_usage']
-    except Exception as e:
-        log.info(f"Redundant criteria generation failed: {e}")
-        subcat_list = ["None"]
-        token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-    return subcat_list, token_usage
+    return GenerationRequest("Redundant criteria generation", model_re_generate, prompt, max_tokens, 'ids', from_value = lambda value: [str(i) for i in value['ids']] if value else ["None"],
+                             from_response = lambda response: split_list_answer(response.content), fallback = ["None"], structured = structured, log = log).invoke()
 
 # Function to optimize multiple ranks lists
-def optimize_ranks_lists(candidate_lists: list, root_concept: str, model_generate_new, max_tokens = 50, log = None) -> list:
+@pipeline_stage('ranks_optimization')
+def optimize_ranks_lists(candidate_lists: list, root_concept: str, model_generate_new, max_tokens = 50, structured = None, log = None) -> list:
     if not log:
         log = logging.getLogger("optimize_ranks_lists")
         logging.basicConfig(level=logging.INFO)
-    log.info(f'''optimize_ranks_lists() \nRoot concept: {root_concept}..''')
+    log_sampled(log, '''optimize_ranks_lists() \nRoot concept: %s..''', root_concept)
 
     # Prepare the input by concatenating candidate lists from different experts
     lists_string = "Candidate lists:\n"
@@ -283,41 +302,286 @@ def optimize_ranks_lists(candidate_lists: list, root_concept: str, model_generat
     
     # Prepare the prompt to optimize the ranks lists
     prompt = chat_template_optimize_ranks_lists.format_messages(root_concept=root_concept, candidate_lists=lists_string)
-    log.info(f"Rank lists optimization prompt:\n\n-------------------------------\n{prompt}\n\nInvoking LLM...")
+    return GenerationRequest("Optimizing ranks list", model_generate_new, prompt, max_tokens, 'ranks_lists', from_value = lambda value: [', '.join(ranks) for ranks in value['ranks_lists']] if value else ["None"],
+                             from_response = lambda response: [el.strip() for el in response.content.split(";") if len(el) > 0], fallback = ["None"], structured = structured, log = log).invoke()
 
-    try:
-        # Optimize the ranks lists using the model
-        response = model_generate_new.invoke(prompt, max_tokens=max_tokens)
-        subcat_list = [el.strip() for el in response.content.split(";") if len(el) > 0]
-        log.info(f"Optimizing ranks list successful! Response: \n{response}\n\nOptimized ranks lists: {subcat_list}")
-        token_usage = response.response_metadata['token_usage']
-    except Exception as e:
-        log.info(f"Optimizing ranks list failed: {e}")
-        subcat_list = ["None"]
-        token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-    log.info("Optimizing finished")
-    return subcat_list, token_usage
+# Helper function building the request of postprocess_subconcepts and apostprocess_subconcepts (a failed request keeps the candidates)
+def postprocess_subconcepts_request(root_concept: str, taxonomical_rank: str, subconcept_candidates: list, model_generate_new, max_tokens, structured, log) -> GenerationRequest:
+    log_sampled(log, 'Root concept: %s, Taxonomical rank: %s, Candidates: %s', root_concept, taxonomical_rank, subconcept_candidates)
+    log_sampled(log, "Max tokens set to: %s", max_tokens)
+    # Prepare the prompt to postprocess the subconcepts list
+    prompt = chat_template_postprocess_subconcepts.format_messages(root_concept = root_concept, taxonomical_rank = taxonomical_rank, subconcept_candidates = str(subconcept_candidates)[1:-1])
+    return GenerationRequest("Postprocess subconcepts", model_generate_new, prompt, max_tokens, 'names', from_value = lambda value: value['items'] if value else subconcept_candidates,
+                             from_response = lambda response: parse_subconcepts_answer(response.content), fallback = subconcept_candidates, structured = structured, log = log)
 
 # Function to postprocess the subconcepts list
-def postprocess_subconcepts(root_concept: str, taxonomical_rank: str, subconcept_candidates: list, model_generate_new, max_tokens = 60, log = None) -> list:
+@pipeline_stage('postprocess')
+def postprocess_subconcepts(root_concept: str, taxonomical_rank: str, subconcept_candidates: list, model_generate_new, max_tokens = 60, structured = None, log = None) -> list:
     if not log:
         log = logging.getLogger("postprocess_subconcepts")
         logging.basicConfig(level=logging.INFO)
-    log.info("postprocess_subconcepts() function called!")
-    log.info(f'Root concept: {root_concept}, Taxonomical rank: {taxonomical_rank}, Candidates: {subconcept_candidates}')
-    log.info(f"Max tokens set to: {max_tokens}")
+    log_sampled(log, "postprocess_subconcepts() function called!")
+    return postprocess_subconcepts_request(root_concept, taxonomical_rank, subconcept_candidates, model_generate_new, max_tokens, structured, log).invoke()
+
+# Helper function parsing the verdict answer ("+" accepted, "-" rejected)
+def parse_verdict_answer(content: str) -> bool:
+    record_text_answer(content.replace(' ','') in ("+", "-"))
+    return content.replace(' ','') == "+"
+
+# Helper function building the request of check_subconcepts and acheck_subconcepts
+def check_subconcepts_request(subconcepts: list, root_concept: str, taxonomical_rank: str, model_verify, max_tokens, structured, log) -> GenerationRequest:
+    # Prepare the prompt to validate the subconcepts list
+    prompt = chat_template_check_subconcepts.format_messages(response = subconcepts, root_concept = root_concept, taxonomical_rank = taxonomical_rank)
+    return GenerationRequest("Sub-concept candidates validation", model_verify, prompt, max_tokens, 'verdict', from_value = lambda value: bool(value and value['accepted']),
+                             from_response = lambda response: parse_verdict_answer(response.content), fallback = False, structured = structured, log = log)
+
+# Function to check if all candidates are true subconcepts of the root concept at the given taxonomical rank
+@pipeline_stage('verify')
+def check_subconcepts(subconcepts: list, root_concept: str, taxonomical_rank: str, model_verify, max_tokens = 20, structured = None, log = None) -> bool:
+    if not log:
+        log = logging.getLogger("check_subconcepts")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, "check_subconcepts() function called!")
+    return check_subconcepts_request(subconcepts, root_concept, taxonomical_rank, model_verify, max_tokens, structured, log).invoke()
+
+#______________________________________________________________________________
+# Asynchronous variants of the generation functions used for the concurrent
+# concept expansion. They build the same requests as the synchronous functions
+# above (see GenerationRequest), but call `ainvoke`.
+
+# Async version of get_concept_definition
+@pipeline_stage('definition')
+async def aget_concept_definition(concept: str, root_concept: str, taxonomical_rank: str, taxonomical_context: str, model_generate_new, definition_max_words = 10, max_tokens = 100, structured = None, log = None) -> str:
+    if not log:
+        log = logging.getLogger("aget_concept_definition")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, "aget_concept_definition() function called!")
+    return await concept_definition_request(concept, root_concept, taxonomical_rank, taxonomical_context, model_generate_new, definition_max_words, max_tokens, structured, log).ainvoke()
+
+# Async version of create_subconcepts_list
+@pipeline_stage('subconcepts')
+async def acreate_subconcepts_list(concept: str, root_concept: str, taxonomical_rank: str, taxonomical_context: str, concept_definition: str, model_generate_new, max_tokens = 80, max_tokens_context = 100, max_words_context = 40, subconcepts_amount = 10, structured = None, log = None) -> list:
+    if not log:
+        log = logging.getLogger("acreate_subconcepts_list")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, '''acreate_subconcepts_list() \nTarget concept: %s\nRoot concept: %s..''', concept, root_concept)
+    return await subconcepts_list_request(concept, root_concept, taxonomical_rank, taxonomical_context, concept_definition, model_generate_new, max_tokens, max_words_context, subconcepts_amount, structured, log).ainvoke()
+
+# Async version of postprocess_subconcepts
+@pipeline_stage('postprocess')
+async def apostprocess_subconcepts(root_concept: str, taxonomical_rank: str, subconcept_candidates: list, model_generate_new, max_tokens = 60, structured = None, log = None) -> list:
+    if not log:
+        log = logging.getLogger("apostprocess_subconcepts")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, "apostprocess_subconcepts() function called!")
+    return await postprocess_subconcepts_request(root_concept, taxonomical_rank, subconcept_candidates, model_generate_new, max_tokens, structured, log).ainvoke()
+
+# Async version of check_subconcepts
+@pipeline_stage('verify')
+async def acheck_subconcepts(subconcepts: list, root_concept: str, taxonomical_rank: str, model_verify, max_tokens = 20, structured = None, log = None) -> bool:
+    if not log:
+        log = logging.getLogger("acheck_subconcepts")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, "acheck_subconcepts() function called!")
+    return await check_subconcepts_request(subconcepts, root_concept, taxonomical_rank, model_verify, max_tokens, structured, log).ainvoke()
+
+# Async version of create_redundant_subconcepts_list
+@pipeline_stage('redundancy')
+async def acreate_redundant_subconcepts_list(candidate_list: list, root_concept: str, taxonomical_rank: str, taxonomical_context: str, model_re_generate, max_tokens = 80, structured = None, log = None) -> list:
+    if not log:
+        log = logging.getLogger("acreate_redundant_subconcepts_list")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, '''acreate_redundant_subconcepts_list() \nRoot concept: %s..''', root_concept)
+    return await redundant_subconcepts_request(candidate_list, root_concept, taxonomical_rank, taxonomical_context, model_re_generate, max_tokens, structured, log).ainvoke()
+
+# Async version of find_taxonomical_criteria
+@pipeline_stage('criteria')
+async def afind_taxonomical_criteria(root_concept: str, model_generate_new, context = "", max_tokens = 50, structured = None, log = None) -> str:
+    if not log:
+        log = logging.getLogger("afind_taxonomical_criteria")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, "afind_taxonomical_criteria() function called!")
+    return await taxonomical_criteria_request(root_concept, model_generate_new, context, max_tokens, structured, log).ainvoke()
+
+# Async version of find_taxonomical_ranks
+@pipeline_stage('ranks')
+async def afind_taxonomical_ranks(root_concept: str, model_generate_new, context = "", max_tokens = 50, structured = None, log = None) -> list:
+    if not log:
+        log = logging.getLogger("afind_taxonomical_ranks")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, "afind_taxonomical_ranks() function called!")
+    return await taxonomical_ranks_request(root_concept, model_generate_new, context, max_tokens, structured, log).ainvoke()
+
+# Async version of get_concept_descriptions_and_definitions (both requests are sent at once)
+@pipeline_stage('descriptions')
+async def aget_concept_descriptions_and_definitions(root_concept: str, model_generate_new, amount = 5, max_length = 50, max_tokens = 300, structured = None, log = None) -> str:
+    if not log:
+        log = logging.getLogger("aget_concept_descriptions_and_definitions")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, "aget_concept_descriptions_and_definitions() function called!")
+    requests = descriptions_and_definitions_requests(root_concept, model_generate_new, amount, max_length, max_tokens, structured, log)
+    results = await asyncio.gather(*[request.ainvoke() for request in requests], return_exceptions=True)
+    return descriptions_and_definitions_result(results, log)
+
+#______________________________________________________________________________
+# Batched variants: K concepts of the same taxonomical rank are packed into one
+# request per stage. The response has one "[n] ..." line per concept; the
+# functions return {concept index: result} only for the sections that could be
+# parsed, so the caller can fall back to the single-concept functions for the rest.
+
+# Helper function to split a batched response into its numbered sections, returns {0-based index: section text}
+def parse_batch_sections(text: str, amount: int) -> dict:
+    sections = {}
+    for line in text.splitlines():
+        match = re.match(r'^\s*[\[(]?(\d+)[\]).:]\s*(.*)$', line)
+        if match and 1 <= int(match.group(1)) <= amount and int(match.group(1)) - 1 not in sections:
+            sections[int(match.group(1)) - 1] = match.group(2).strip()
+    return sections
+
+# Helper function parsing a batched lists answer: {0-based index: list} of the non-empty sections
+# (an answer without a clean list for every concept is counted, see record_text_answer)
+def parse_batch_lists_answer(content: str, amount: int) -> dict:
+    lists = {i: split_list_answer(section) for i, section in parse_batch_sections(content, amount).items() if section}
+    record_text_answer(len(lists) == amount and not any(validate_text_items(items) for items in lists.values()))
+    return lists
+
+# Helper function parsing a batched verdicts answer: {0-based index: accepted} of the "+"/"-" sections
+def parse_batch_verdicts_answer(content: str, amount: int) -> dict:
+    accepted = {i: section.replace(' ','') == "+" for i, section in parse_batch_sections(content, amount).items() if section.replace(' ','') in ("+", "-")}
+    record_text_answer(len(accepted) == amount)
+    return accepted
+
+# Helper function returning the non-empty lists of a structured batch answer as {0-based index: list}
+def parse_batch_value(value, key) -> dict:
+    return {i: items for i, items in enumerate(value[key]) if items} if value else {}
+
+# Async function to create the subconcepts lists of several concepts in one request
+@pipeline_stage('subconcepts')
+async def acreate_subconcepts_lists_batch(concepts: list, concept_definitions: list, root_concept: str, taxonomical_rank: str, taxonomical_context: str, model_generate_new, max_tokens = 2800, subconcepts_amount = 10, structured = None, log = None) -> dict:
+    if not log:
+        log = logging.getLogger("acreate_subconcepts_lists_batch")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, '''acreate_subconcepts_lists_batch() \nTarget concepts: %s\nRoot concept: %s..''', concepts, root_concept)
+
+    concepts_block = "\n".join(f'[{i+1}] "{concept}" - {definition}' for i, (concept, definition) in enumerate(zip(concepts, concept_definitions)))
+    prompt = chat_template_list_subconcepts_batch.format_messages(root_concept=root_concept, taxonomical_rank=taxonomical_rank, taxonomical_context=taxonomical_context, subconcepts_amount=subconcepts_amount, concepts=concepts_block)
+    return await GenerationRequest("Batched subconcept listing generation", model_generate_new, prompt, max_tokens, 'names_lists', from_value = lambda value: parse_batch_value(value, 'lists'),
+                                   from_response = lambda response: parse_batch_lists_answer(response.content, len(concepts)), fallback = {}, structured = structured, amount = len(concepts), log = log).ainvoke()
+
+# Async function to postprocess the subconcepts lists of several concepts in one request
+@pipeline_stage('postprocess')
+async def apostprocess_subconcepts_batch(root_concept: str, taxonomical_rank: str, subconcept_candidates_lists: list, model_generate_new, max_tokens = 60, structured = None, log = None) -> dict:
+    if not log:
+        log = logging.getLogger("apostprocess_subconcepts_batch")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, "apostprocess_subconcepts_batch() function called!")
+    log_sampled(log, 'Root concept: %s, Taxonomical rank: %s, Candidates lists: %s', root_concept, taxonomical_rank, subconcept_candidates_lists)
+
+    candidate_lists_block = "\n".join(f"[{i+1}] {str(candidates)[1:-1]}" for i, candidates in enumerate(subconcept_candidates_lists))
+    prompt = chat_template_postprocess_subconcepts_batch.format_messages(root_concept = root_concept, taxonomical_rank = taxonomical_rank, candidate_lists = candidate_lists_block)
+    amount = len(subconcept_candidates_lists)
+    return await GenerationRequest("Batched postprocess subconcepts", model_generate_new, prompt, max_tokens*amount, 'names_lists', from_value = lambda value: parse_batch_value(value, 'lists'),
+                                   from_response = lambda response: parse_batch_lists_answer(response.content, amount), fallback = {}, structured = structured, amount = amount, log = log).ainvoke()
+
+# Async function to check several subconcepts lists in one request
+@pipeline_stage('verify')
+async def acheck_subconcepts_batch(subconcepts_lists: list, root_concept: str, model_verify, max_tokens = 20, structured = None, log = None) -> dict:
+    if not log:
+        log = logging.getLogger("acheck_subconcepts_batch")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, "acheck_subconcepts_batch() function called!")
+
+    queries_block = "\n".join(f"[{i+1}] [{subconcepts}]" for i, subconcepts in enumerate(subconcepts_lists))
+    prompt = chat_template_check_subconcepts_batch.format_messages(root_concept = root_concept, queries = queries_block)
+    amount = len(subconcepts_lists)
+    return await GenerationRequest("Batched sub-concept candidates validation", model_verify, prompt, max_tokens + 6*amount, 'verdicts', from_value = lambda value: dict(enumerate(value['accepted'])) if value else {},
+                                   from_response = lambda response: parse_batch_verdicts_answer(response.content, amount), fallback = {}, structured = structured, amount = amount, log = log).ainvoke()
+
+#______________________________________________________________________________
+# Streaming variant: the subconcepts list is parsed while the completion is
+# still being generated, the candidates are passed on as soon as they are
+# complete and the stream is cancelled once enough of them have been accepted.
+
+# Class for the incremental parsing of a streamed comma-separated list (the same items as text.replace(', ', ',').split(','))
+class CommaSeparatedStreamParser:
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.items  = 0
+
+    def clean(self, item: str) -> str:
+        # the space after a comma belongs to the separator
+        if self.items and item.startswith(' '):
+            item = item[1:]
+        self.items += 1
+        return item
+
+    # Method to add the text of a chunk, returns the items completed by it
+    def feed(self, text: str) -> list:
+        *items, self.buffer = (self.buffer + text).split(',')
+        return [self.clean(item) for item in items]
+
+    # Method returning the last item at the end of the stream
+    def close(self) -> list:
+        item, self.buffer = self.buffer, ""
+        return [self.clean(item)]
+
+# Async function to create the list of subconcepts of a concept from a streamed completion.
+# Every candidate goes through candidate_filter (returns the cleaned candidate, or None to drop it) as soon as it is complete,
+# the accepted ones are passed to on_candidate (e.g. to start their postprocessing), and once max_candidates are accepted
+# the stream is cancelled, so the rest of the completion is neither waited for nor generated.
+# Returns the accepted candidates and the token usage (estimated from the received chunks if the stream was cancelled)
+@pipeline_stage('subconcepts')
+async def astream_subconcepts_list(concept: str, root_concept: str, taxonomical_rank: str, taxonomical_context: str, concept_definition: str, model_generate_new, max_tokens = 2800, subconcepts_amount = 10, max_candidates = None, candidate_filter = None, on_candidate = None, log = None) -> list:
+    if not log:
+        log = logging.getLogger("astream_subconcepts_list")
+        logging.basicConfig(level=logging.INFO)
+    log_sampled(log, '''astream_subconcepts_list() \nTarget concept: %s\nRoot concept: %s..''', concept, root_concept)
+    log_sampled(log, "Selected taxonomical rank: %s\n(%s)\nMax candidates: %s", taxonomical_rank, taxonomical_context, max_candidates)
+
+    context_string = " " + concept_definition
+    prompt = chat_template_list_subconcepts.format_messages(root_concept=root_concept, concept=concept, context_string=context_string, taxonomical_rank=taxonomical_rank, taxonomical_context=taxonomical_context, subconcepts_amount=subconcepts_amount)
+    log_sampled(log, "Subconcept listing generation prompt:\n\n-------------------------------\n%s\n\nStreaming LLM...", prompt)
+
+    parser = CommaSeparatedStreamParser()
+    candidates = []
+    token_usage = None
+    chunks = 0
+    cutoff = False
+
+    # returns True once enough candidates are accepted
+    def accept(items) -> bool:
+        for item in items:
+            candidate = candidate_filter(item) if candidate_filter else item
+            if candidate is None:
+                continue
+            candidates.append(candidate)
+            if on_candidate:
+                on_candidate(candidate)
+            if max_candidates and len(candidates) >= max_candidates:
+                return True
+        return False
 
-    # Prepare the prompt to postprocess the subconcepts list
-    prompt = chat_template_postprocess_subconcepts.format_messages(root_concept = root_concept, taxonomical_rank = taxonomical_rank, subconcept_candidates = str(subconcept_candidates)[1:-1])
-    log.info(f"Postprocess subconcepts prompt:\n\n-------------------------------\n{prompt}\n\nInvoking LLM...")
     try:
-        # Postprocess the subconcepts list using the model
-        response = model_generate_new.invoke(prompt, max_tokens=max_tokens)
-        subcat_list = response.content.replace(', ',',').split(",")
-        log.info(f"Postprocess subconcepts successful! Response:\n{response}\n\nPostprocessed subconcepts list: {subcat_list}")
-        token_usage = response.response_metadata['token_usage']
+        async with contextlib.aclosing(model_generate_new.astream(prompt, max_tokens=max_tokens, stream_usage=True)) as stream:
+            async for chunk in stream:
+                chunks += 1
+                token_usage = chunk_token_usage(chunk) or token_usage
+                if accept(parser.feed(chunk.content)):
+                    cutoff = True
+                    break
+        if not cutoff:
+            accept(parser.close())
+        log_sampled(log, "Subconcept listing generation successful! %s chunks streamed%s\n\nSubconcepts list: %s", chunks, ', stream cut off' if cutoff else '', candidates)
     except Exception as e:
-        log.info(f"Postprocess subconcepts failed: {e}")
-        subcat_list = subconcept_candidates
-        token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
-    return subcat_list, token_usage
+        log.info("Subconcept listing generation failed after %s chunks: %s", chunks, e)
+        if not candidates:
+            candidates = ["None"]
+    if not token_usage:
+        if chunks:
+            from src.core.token_budget import estimate_stream_token_usage
+            token_usage = estimate_stream_token_usage(prompt, get_model_params(model_generate_new)['model_checkpoint'], chunks)
+        else:
+            token_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+    if cutoff:
+        token_usage = dict(token_usage, stream_cutoffs = 1)
+    return candidates, token_usage
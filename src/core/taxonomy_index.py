@@ -0,0 +1,97 @@
+import numpy as np
+
+from src.core.concept_store import NO_CONCEPT
+
+# Class for the ancestor/descendant interval index of a concept tree (NumPy arrays indexed by concept id).
+#
+# One iterative DFS numbers the concepts in pre-order: a concept's subtree is the pre-order interval
+# [pre, last], so "a is an ancestor of b" is two comparisons and the descendants of a concept are a slice
+# of the pre-order. Together with the depth array the ancestor, descendant and cotopy sizes are O(1),
+# and the same tests run vectorized over arrays of concept pairs (the taxonomy evaluation).
+# Concepts not reachable from the root get pre = last = -1.
+class TaxonomyIntervalIndex:
+    def __init__(self, store, root_id = 0) -> None:
+        size = len(store)
+        self.root_id    = root_id
+        self.size       = size
+        self.version    = getattr(store, 'version', 0)
+        self.parent     = np.frombuffer(store.parent, dtype = np.int32).astype(np.int64) if size else np.zeros(0, dtype = np.int64)
+        if size:
+            self.parent[root_id] = NO_CONCEPT
+        self.pre        = np.full(size, -1, dtype = np.int64)
+        self.last       = np.full(size, -1, dtype = np.int64)
+        self.depth      = np.zeros(size, dtype = np.int64)
+        order = []
+        if size:
+            depth = [0]*size
+            stack = [root_id]
+            while stack:
+                concept_id = stack.pop()
+                order.append(concept_id)
+                children = list(store.children_ids(concept_id))
+                for child_id in children:
+                    depth[child_id] = depth[concept_id] + 1
+                stack += reversed(children)
+            self.order = np.array(order, dtype = np.int64)
+            self.pre[self.order] = np.arange(len(order))
+            self.depth[:] = depth
+            # last = pre + subtree size - 1, the subtree sizes are accumulated bottom-up one depth level at a time
+            subtree = np.zeros(size, dtype = np.int64)
+            subtree[self.order] = 1
+            reached = self.order[1:]
+            for level in range(int(self.depth.max()), 0, -1):
+                nodes = reached[self.depth[reached] == level]
+                np.add.at(subtree, self.parent[nodes], subtree[nodes])
+            self.subtree_size = subtree
+            self.last[self.order] = self.pre[self.order] + subtree[self.order] - 1
+        else:
+            self.order = np.zeros(0, dtype = np.int64)
+            self.subtree_size = np.zeros(0, dtype = np.int64)
+
+    # Method to check whether the index is still valid for the store (no concepts added or re-linked since the build)
+    def is_current(self, store) -> bool:
+        return self.size == len(store) and self.version == getattr(store, 'version', 0)
+
+    # Vectorized test: is ancestor[i] a (strict) ancestor of descendant[i] (arrays or single ids)
+    def is_ancestor(self, ancestor, descendant):
+        ancestor, descendant = np.asarray(ancestor), np.asarray(descendant)
+        return (self.pre[ancestor] < self.pre[descendant]) & (self.last[descendant] <= self.last[ancestor]) & (self.pre[ancestor] >= 0)
+
+    # Vectorized test: are the concepts on one root path (equal, ancestor or descendant)
+    def is_comparable(self, a, b):
+        a, b = np.asarray(a), np.asarray(b)
+        return ((self.pre[a] <= self.pre[b]) & (self.last[b] <= self.last[a]) | (self.pre[b] <= self.pre[a]) & (self.last[a] <= self.last[b])) & (self.pre[a] >= 0) & (self.pre[b] >= 0)
+
+    # Method returning the ids of the descendants (pre-order, a view of the pre-order array)
+    def descendants(self, concept_id):
+        return self.order[self.pre[concept_id] + 1:self.last[concept_id] + 1]
+
+    # Method returning the ids of the ancestors (nearest first)
+    def ancestors(self, concept_id):
+        ancestors = np.empty(self.depth[concept_id], dtype = np.int64)
+        parent_id = self.parent[concept_id]
+        for i in range(len(ancestors)):
+            ancestors[i] = parent_id
+            parent_id = self.parent[parent_id]
+        return ancestors
+
+    # Method returning the ids of the semantic cotopy (ancestors and descendants, the same concepts as Concept.get_semantic_cotopy)
+    def cotopy(self, concept_id):
+        return np.concatenate([self.ancestors(concept_id), self.descendants(concept_id)])
+
+    # Vectorized cotopy size (ancestors + descendants, with include_self the concept itself too)
+    def cotopy_size(self, concept_ids, include_self = False):
+        concept_ids = np.asarray(concept_ids)
+        return self.depth[concept_ids] + self.subtree_size[concept_ids] - (0 if include_self else 1)
+
+    # Method enumerating all (descendant, ancestor) pairs of the tree, one array pair per ancestor distance
+    # (N x depth pairs in total, without a Python loop over the concepts)
+    def ancestor_pairs(self, concept_ids = None):
+        descendants = np.flatnonzero(self.pre >= 0) if concept_ids is None else np.asarray(concept_ids)
+        ancestors = self.parent[descendants]
+        while len(descendants):
+            valid = ancestors != NO_CONCEPT
+            descendants, ancestors = descendants[valid], ancestors[valid]
+            if len(descendants):
+                yield descendants, ancestors
+            ancestors = self.parent[ancestors]
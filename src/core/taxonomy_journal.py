@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+
+# Class for the append-only journal of taxonomy mutations.
+#
+# Records are JSON lines ({'seq': ..., 'op': ..., ...}) queued by the generation loop and written
+# by a background thread in batches, so the loop never waits for the disk. Every batch is flushed
+# and fsync-ed at most once per `fsync_interval` seconds. The journal is truncated whenever the
+# taxonomy is compacted into a pickle snapshot (see Taxonomy.save).
+class TaxonomyJournal:
+    def __init__(self, path: str, fsync_interval = 1.0) -> None:
+        self.path           = path
+        self.fsync_interval = fsync_interval
+        self.records        = 0
+        self.queue          = queue.Queue()
+        self.file_lock      = threading.Lock()
+        self.file           = open(path, 'a', encoding='utf-8')
+        self.closed         = False
+        self.writer         = threading.Thread(target=self.write_loop, name="TaxonomyJournal-writer", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    # Method to queue a record (never blocks on disk I/O)
+    def append(self, record: dict) -> None:
+        self.records += 1
+        self.queue.put(json.dumps(record, ensure_ascii=False))
+
+    # Background thread: writes queued records in batches
+    def write_loop(self) -> None:
+        last_fsync = time.time()
+        dirty = False
+        while True:
+            try:
+                lines = [self.queue.get(timeout=self.fsync_interval)]
+            except queue.Empty:
+                lines = []
+            while True:
+                try:
+                    lines.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in lines
+            records = [line for line in lines if line is not None]
+            with self.file_lock:
+                if records:
+                    self.file.write('\n'.join(records) + '\n')
+                    self.file.flush()
+                    dirty = True
+                if dirty and (stop or time.time() - last_fsync >= self.fsync_interval):
+                    os.fsync(self.file.fileno())
+                    last_fsync = time.time()
+                    dirty = False
+            for _ in lines:
+                self.queue.task_done()
+            if stop:
+                return
+
+    # Method to wait until all queued records are written to the file
+    def flush(self) -> None:
+        if not self.closed:
+            self.queue.join()
+
+    # Method to drop all written records (called after a snapshot containing them was saved)
+    def truncate(self) -> None:
+        self.flush()
+        with self.file_lock:
+            self.file.truncate(0)
+            self.file.seek(0)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.records = 0
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.queue.put(None)
+        self.writer.join()
+        self.closed = True
+        self.file.close()
+
+# Function to read the records of a journal file (a torn last line left by a crash is ignored)
+def read_journal(path: str) -> list:
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return records
@@ -0,0 +1,695 @@
+import os
+import uuid
+import datetime
+import pickle
+
+from src.core.taxonomy_journal import TaxonomyJournal, read_journal
+from src.core.concept_index import ConceptNameIndex
+from src.core.concept_store import ConceptStore, NO_CONCEPT
+from src.core.owl_export import export_taxonomy_to_owl, OWL_EXPORT_FORMATS
+from src.core.name_normalization import get_name_normalizer, normalize_concept_name
+
+# The taxonomy data model (Concept, Taxonomy, load_taxonomy and the token usage helpers).
+# The module only depends on the standard library and the storage modules of src.core, so loading and
+# inspecting a taxonomy does not import the LLM clients (openai, LangChain) or NLTK.
+
+def ensure_directory_exists(path):
+
+    # Validation
+    if not os.path.exists(path):
+        try:
+            # Direcrotry creation
+            os.makedirs(path)
+            print(f"Directory created: {path}")
+        except OSError as error:
+            print(f"Error creating directory: {error}")
+    else:
+        print(f"Directory already exists: {path}")
+
+# Class representing a concept within the taxonomy.
+#
+# A concept added to a taxonomy is a lightweight view (concept id) over the taxonomy's ConceptStore,
+# all the attributes are read from and written to the store arrays. A concept created with Concept(...)
+# is detached: it keeps its attributes itself until Taxonomy.add_concepts attaches it to the store.
+class Concept:
+    __slots__ = ('store', 'concept_id', 'detached')
+
+    def __init__(self, concept_name: str, parent = None, taxonomical_rank = 'root', taxonomical_level = 0, taxonomical_ranks_list_number = 'root') -> None:
+        self.store = None
+        self.concept_id = None
+        self.detached = {'name': concept_name, 'descriptions': [], 'definitions': [], 'definition': "", 'children': [], 'parent': parent,
+                         'taxonomical_rank': taxonomical_rank, 'taxonomical_level': taxonomical_level, 'taxonomical_ranks_list_number': taxonomical_ranks_list_number}
+
+    # Method creating the view of a stored concept
+    @classmethod
+    def view(cls, store, concept_id):
+        concept = cls.__new__(cls)
+        concept.store = store
+        concept.concept_id = concept_id
+        concept.detached = None
+        return concept
+
+    # Method to move a detached concept into the store (the concept becomes a view of the stored concept)
+    def attach(self, store, parent_id) -> int:
+        data = self.detached
+        self.concept_id = store.add_concept(data['name'], parent_id, data['taxonomical_rank'], data['taxonomical_level'], data['taxonomical_ranks_list_number'])
+        self.store = store
+        self.detached = None
+        self.definition = data['definition']
+        self.descriptions = data['descriptions']
+        self.definitions = data['definitions']
+        return self.concept_id
+
+    # Views of the same stored concept are equal
+    def __eq__(self, other):
+        if self.store is None or not isinstance(other, Concept):
+            return self is other
+        return self.store is other.store and self.concept_id == other.concept_id
+
+    def __hash__(self):
+        return id(self) if self.store is None else hash((id(self.store), self.concept_id))
+
+    def __repr__(self):
+        return f"Concept({self.name!r}, id={self.concept_id})"
+
+    # Taxonomies pickled by older versions contain concepts with a __dict__ state, they are loaded detached
+    # (Taxonomy.__setstate__ moves them into a store)
+    def __getstate__(self):
+        return {'store': self.store, 'concept_id': self.concept_id, 'detached': self.detached}
+
+    def __setstate__(self, state):
+        if 'store' in state:
+            self.store, self.concept_id, self.detached = state['store'], state['concept_id'], state['detached']
+        else:
+            self.store = None
+            self.concept_id = state.get('concept_id')
+            self.detached = {'name': state.get('name'), 'descriptions': state.get('descriptions', []), 'definitions': state.get('definitions', []),
+                             'definition': state.get('definition', ""), 'children': state.get('children', []), 'parent': state.get('parent'),
+                             'taxonomical_rank': state.get('taxonomical_rank', 'root'), 'taxonomical_level': state.get('taxonomical_level', 0),
+                             'taxonomical_ranks_list_number': state.get('taxonomical_ranks_list_number', 'root')}
+
+    @property
+    def name(self):
+        return self.detached['name'] if self.store is None else self.store.get_name(self.concept_id)
+
+    @name.setter
+    def name(self, value):
+        if self.store is None:
+            self.detached['name'] = value
+        else:
+            self.store.set_name(self.concept_id, value)
+
+    @property
+    def definition(self):
+        return self.detached['definition'] if self.store is None else self.store.definition.get(self.concept_id, "")
+
+    @definition.setter
+    def definition(self, value):
+        if self.store is None:
+            self.detached['definition'] = value
+        elif value:
+            self.store.definition[self.concept_id] = value
+        else:
+            self.store.definition.pop(self.concept_id, None)
+
+    # The description/definition lists of a stored concept are read without creating entries in the sparse dicts,
+    # their changes are written back like the ones of the children list
+    @property
+    def descriptions(self):
+        return self.detached['descriptions'] if self.store is None else ConceptList(self, 'descriptions', self.store.descriptions.get(self.concept_id, ()))
+
+    @descriptions.setter
+    def descriptions(self, value):
+        if self.store is None:
+            self.detached['descriptions'] = value
+        elif value:
+            self.store.descriptions[self.concept_id] = list(value)
+        else:
+            self.store.descriptions.pop(self.concept_id, None)
+
+    @property
+    def definitions(self):
+        return self.detached['definitions'] if self.store is None else ConceptList(self, 'definitions', self.store.definitions.get(self.concept_id, ()))
+
+    @definitions.setter
+    def definitions(self, value):
+        if self.store is None:
+            self.detached['definitions'] = value
+        elif value:
+            self.store.definitions[self.concept_id] = list(value)
+        else:
+            self.store.definitions.pop(self.concept_id, None)
+
+    # The children list of a stored concept is built from the sibling links, its changes and an assigned list re-link the
+    # children in the store (detached concepts in the list are attached to the store first)
+    @property
+    def children(self):
+        if self.store is None:
+            return self.detached['children']
+        return ConceptList(self, 'children', [Concept.view(self.store, i) for i in self.store.children_ids(self.concept_id)])
+
+    @children.setter
+    def children(self, value):
+        if self.store is None:
+            self.detached['children'] = value
+            return
+        value = list(value)
+        detached = [child for child in value if child.store is None]
+        for child in detached:
+            child.detached['parent'] = self
+        self.store.extend(detached)
+        child_ids = [child.concept_id for child in value]
+        if child_ids != list(self.store.children_ids(self.concept_id)):
+            self.store.set_children(self.concept_id, child_ids)
+            self.store.children_relinked(self.concept_id)
+
+    @property
+    def parent(self):
+        if self.store is None:
+            return self.detached['parent']
+        parent_id = self.store.get_parent(self.concept_id)
+        return None if parent_id is None else Concept.view(self.store, parent_id)
+
+    @parent.setter
+    def parent(self, value):
+        if self.store is None:
+            self.detached['parent'] = value
+            return
+        parent_id = self.store.get_parent(self.concept_id)
+        self.store.unlink_child(self.concept_id)
+        if value is not None:
+            self.store.link_child(value.concept_id, self.concept_id)
+            parent_id = value.concept_id
+        self.store.children_relinked(parent_id)
+
+    @property
+    def taxonomical_rank(self):
+        return self.detached['taxonomical_rank'] if self.store is None else self.store.get_rank(self.concept_id)
+
+    @taxonomical_rank.setter
+    def taxonomical_rank(self, value):
+        if self.store is None:
+            self.detached['taxonomical_rank'] = value
+        else:
+            self.store.rank_id[self.concept_id] = self.store.intern_rank(value)
+
+    @property
+    def taxonomical_level(self):
+        return self.detached['taxonomical_level'] if self.store is None else self.store.level[self.concept_id]
+
+    @taxonomical_level.setter
+    def taxonomical_level(self, value):
+        if self.store is None:
+            self.detached['taxonomical_level'] = value
+        else:
+            self.store.level[self.concept_id] = value
+
+    @property
+    def taxonomical_ranks_list_number(self):
+        return self.detached['taxonomical_ranks_list_number'] if self.store is None else self.store.get_ranks_list_number(self.concept_id)
+
+    @taxonomical_ranks_list_number.setter
+    def taxonomical_ranks_list_number(self, value):
+        if self.store is None:
+            self.detached['taxonomical_ranks_list_number'] = value
+        else:
+            self.store.ranks_list_number[self.concept_id] = -1 if value == 'root' else value
+    
+    # Method to print detailed information about the concept
+    def info(self, parent = None, i = 0) -> None:
+        print('\n\n'+'-+'*i+f"Concept\nname: {self.name}")
+        if self.definition:
+            print(f"definition: {self.definition}")
+        print(f"taxonomical rank:{self.taxonomical_rank}"+' '*i+f"\ntaxonomical level:{self.taxonomical_level}\ntaxonomical ranks list number = {self.taxonomical_ranks_list_number}")
+        if self.definitions:
+            print(f"has {len(self.definitions)} definitions: {self.definitions}")
+        if self.descriptions:
+            print(f"has {len(self.descriptions)} descriptions: {self.descriptions}")
+        i += 1
+        if self.parent:
+            print('---'*i+f"is subconcept of: {self.parent.name}")
+        if len(self.children) > 0:
+            print('---'*i+f"has {len(self.children)} subconcepts:")
+            for concept in self.children:
+                concept.info(parent = self, i = i)
+       
+    # Method to get the semantic cotopy (hypernyms and hyponyms)
+    def get_semantic_cotopy(self, lemmatized=True):
+        hypernyms = []
+        hyponyms = []
+        
+        # Helper function to recursively collect hypernyms
+        def get_hypernyms(self, hypernyms):
+            if self.parent:
+                hypernyms.append(self.parent)
+                get_hypernyms(self.parent, hypernyms)
+        
+        # Helper function to recursively collect hyponyms
+        def get_hyponyms(self, hyponyms):
+            if self.children:
+                hyponyms += self.children
+                for child in self.children:
+                    get_hyponyms(child, hyponyms)
+        
+        # Stored concepts walk the store arrays (no recursion, deep taxonomies do not hit the recursion limit)
+        if self.store is not None:
+            hypernyms = [Concept.view(self.store, i) for i in self.store.ancestor_ids(self.concept_id)]
+            hyponyms = [Concept.view(self.store, i) for i in self.store.descendant_ids(self.concept_id)]
+        else:
+            get_hypernyms(self, hypernyms)
+            get_hyponyms(self, hyponyms)
+        
+        if not lemmatized:
+            return hypernyms, hyponyms
+        else:
+            return get_name_normalizer().lemmatize_batch([concept.name for concept in hypernyms + hyponyms])
+
+# Class for the list attributes of a stored concept (children, descriptions, definitions).
+#
+# The list is a snapshot of the attribute, its changes (append, extend, +=, insert, remove, ...) are assigned back
+# to the attribute, so the list idioms of the detached concepts (concept.children.append(child)) keep working.
+class ConceptList(list):
+    __slots__ = ('concept', 'attribute')
+
+    def __init__(self, concept, attribute, items) -> None:
+        super().__init__(items)
+        self.concept    = concept
+        self.attribute  = attribute
+
+    # Method to write the list back to the concept's attribute
+    def write(self) -> None:
+        setattr(self.concept, self.attribute, self)
+
+    def append(self, child) -> None:
+        super().append(child)
+        self.write()
+
+    def extend(self, children) -> None:
+        super().extend(children)
+        self.write()
+
+    def __iadd__(self, children):
+        super().__iadd__(children)
+        self.write()
+        return self
+
+    def insert(self, index, child) -> None:
+        super().insert(index, child)
+        self.write()
+
+    def remove(self, child) -> None:
+        super().remove(child)
+        self.write()
+
+    def pop(self, index = -1):
+        child = super().pop(index)
+        self.write()
+        return child
+
+    def clear(self) -> None:
+        super().clear()
+        self.write()
+
+    def __setitem__(self, index, value) -> None:
+        super().__setitem__(index, value)
+        self.write()
+
+    def __delitem__(self, index) -> None:
+        super().__delitem__(index)
+        self.write()
+
+    def sort(self, *args, **kwargs) -> None:
+        super().sort(*args, **kwargs)
+        self.write()
+
+    def reverse(self) -> None:
+        super().reverse()
+        self.write()
+
+# Class representing the taxonomy structure    
+class Taxonomy:
+    
+    def __init__(self, root_concept_name:str, persistence = 'pickle') -> None:
+        self.created_at             = datetime.datetime.now()
+        self.last_edit_time         = datetime.datetime.now()
+        self.name                   = 'Taxonomy_'+str(self.created_at).replace(' ','_T').replace(':','-')[:22]
+        self.save_path              = os.getcwd()+"\\data\\taxonomies\\"
+        self.saved_to               = [self.save_path + self.name + '.pkl']
+        self.token_usage            = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+        self.token_usage_by_stage   = {}
+        self.taxonomy_id            = uuid.uuid4().hex    # stable identity of the taxonomy (the name only has the creation time)
+        self.stop_reason            = None                # why the last expansion stopped early ('budget_exhausted', 'model_unavailable'), None if it finished
+
+
+        self.taxonomical_criteria   = []
+        self.raw_criteria           = []
+        self.taxonomical_ranks_list = []
+        self.taxonomical_ranks      = []
+        self.taxonomical_context    = []
+        
+        self.current_level          = []
+        self.uninspected_concepts   = []
+        self.unknown_concepts       = [[]]
+        self.concepts               = ConceptStore(Concept)
+        self.concepts.observer      = self
+        self.root                   = Concept(root_concept_name)
+        self.root.attach(self.concepts, NO_CONCEPT)
+        self.name_index             = self.build_name_index()
+        self.interval_index         = None
+
+        # 'pickle' - every checkpoint pickles the whole taxonomy,
+        # 'journal' - checkpoints only append the mutations to a journal, compacted into the pickle from time to time
+        self.persistence            = persistence
+        self.journal                = None
+        self.journal_seq            = 0
+        self.journal_compact_every  = 5000
+
+        fp = self.save()
+        if persistence == 'journal':
+            self.enable_journal()
+
+    # The journal (open file and writer thread) is not part of the pickled state
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['journal'] = None
+        state['interval_index'] = None
+        return state
+
+    # Taxonomies pickled by older versions miss the newer attributes
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('persistence', 'pickle')
+        self.__dict__.setdefault('journal_seq', 0)
+        self.__dict__.setdefault('journal_compact_every', 5000)
+        self.__dict__.setdefault('token_usage_by_stage', {})
+        self.__dict__.setdefault('taxonomy_id', f"{self.name}_{self.created_at.timestamp()}")
+        self.__dict__.setdefault('stop_reason', None)
+        self.journal = None
+        self.interval_index = None
+        if isinstance(self.concepts, list):
+            self.concepts = self.migrate_concepts(self.concepts)
+        self.concepts.observer = self
+        if 'name_index' not in state:
+            self.name_index = self.build_name_index()
+    
+    # Method to move the concepts of a taxonomy pickled by an older version (a list of concept objects) into a ConceptStore,
+    # the loaded concept objects become views of the stored concepts (so the uninspected/unknown lists keep pointing to them)
+    def migrate_concepts(self, concepts) -> ConceptStore:
+        store = ConceptStore(Concept)
+        ids = {}
+        for concept in concepts:
+            parent = concept.detached['parent']
+            ids[id(concept)] = concept.attach(store, ids.get(id(parent), NO_CONCEPT))
+        return store
+
+    # Method to print detailed information about the taxonomy
+    def info(self) -> None:
+        print(f"--------INFO:-------\n\n--------ROOT:-------\nroot concept of the current taxonomy is: \"{self.root.name}\"\n")
+        print("---------CRITERIA:---")
+        #print(f"taxonomical criteria of the current taxonomy are: \nAll criteria:\n{self.raw_criteria}\n\ncriteria clusters:\n")
+        print(f"taxonomical criteria of the current taxonomy are: \nAll criteria:\n{self.taxonomical_criteria}\n\n")
+        
+        #for i,criteria in enumerate(self.taxonomical_criteria):
+        #    print(f"Cluster {i+1}/{len(self.taxonomical_criteria)}. Criteria:\n{criteria}\n")
+        print("\n\n---------RANKS:-----\n--------------------\n")
+        print(f"there are {len(self.taxonomical_ranks)} taxonomical ranks lists in the current taxonomy:\n")
+        for i,rank in enumerate(self.taxonomical_ranks):
+            #print(f"{rank}")
+            if i <= 1:
+                k = 0
+                
+            else:
+                k = i - 1
+            #try:
+            #    print(f" {i}. rank '{rank.replace(', ',',').split(',')[self.current_level[k]]}' in '{self.taxonomical_context[k]}'(taxonomical level is {self.current_level[i]})")
+            #except Exception as e:
+            #    print(f" {i}. rank '{rank.replace(', ',',').split(',')[self.current_level[i]]}' in '{self.taxonomical_context[i]}'(taxonomical level is {self.current_level[i]})")
+            try:
+                print(f" {i}. rank '{rank.replace(', ',',').split(',')[self.current_level[i]]}' in '{self.taxonomical_context[i]}'(taxonomical level is {self.current_level[i]})")
+            except Exception as e:
+                print(f" {i}. rank '{rank.replace(', ',',').split(',')[-1]}' in '{self.taxonomical_context[i]}'(taxonomical level is {self.current_level[i]})")
+        print("\n\n---------CONCEPTS:---\n--------------------\n")
+        print(f"total amount of concepts in the current taxonomy is {len(self.concepts)}")
+        print(f"total amount of uninspected concepts in the current taxonomy is {len(flatten(self.uninspected_concepts))}")
+        print(f"total amount of unknown concepts in the current taxonomy is {len(flatten(self.unknown_concepts))}")
+        print("\n--CREATED/EDITED----")
+        print(f"taxonomy creation time: {str(self.created_at)}\nlast_edit time: {str(self.last_edit_time)}")
+        print("\n---TOKEN USAGE:-----")
+        print(f"\n\ncurrent token usage total: \n{self.token_usage}\n")
+        for stage, token_usage in self.token_usage_by_stage.items():
+            print(f"  {stage}: {token_usage}")
+        #print(f"the current taxonomical level is {self.current_level} level\ncorresponding rank is {self.taxonomical_ranks[self.current_level]}")
+        print("\n------SAVED TO:-----")
+        if len(self.saved_to)>1:
+            print(f"taxonomy was saved to {len(self.saved_to)} diferent paths total: {self.saved_to}")
+        print(f"f'taxonomy last saved at '{self.save_path+self.name}.pkl'\n")
+        print(f"--------------------\n--------/INFO-------\n--------------------\n\n")
+
+    def update_last_edit_time(self) -> None:
+        self.last_edit_time              = datetime.datetime.now()
+
+    # Method to save the taxonomy to a file
+    # (in the journal mode saving the main file is the compaction: the journal records are now part of the snapshot)
+    def save(self, suffix = "") -> str:
+        ensure_directory_exists(self.save_path)
+        full_path = self.save_path + self.name + suffix + '.pkl'
+        compaction = self.journal is not None and not suffix
+        if compaction:
+            self.journal.flush()
+        with open(full_path + '.tmp', 'wb') as file:
+            pickle.dump(self, file)
+        os.replace(full_path + '.tmp', full_path)
+        if compaction:
+            self.journal.truncate()
+        if not full_path in self.saved_to:
+            self.saved_to.append(full_path) 
+        return full_path
+
+    # Method to persist the progress after a processed concept:
+    # a full save in the pickle mode, a (non-blocking) journal append with periodic compaction in the journal mode
+    def checkpoint(self) -> str:
+        if self.journal is None:
+            return self.save()
+        if self.journal.records >= self.journal_compact_every:
+            return self.save()
+        return self.journal.path
+
+    # Method to switch the taxonomy to the journal persistence mode
+    def enable_journal(self, compact_every = None, fsync_interval = 1.0) -> None:
+        if compact_every:
+            self.journal_compact_every = compact_every
+        self.persistence = 'journal'
+        if self.journal is None:
+            ensure_directory_exists(self.save_path)
+            self.journal = TaxonomyJournal(self.save_path + self.name + '.journal', fsync_interval = fsync_interval)
+            self.save()
+
+    # Method to close the journal (all queued records are written)
+    def close_journal(self) -> None:
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    # Method to append a mutation record to the journal
+    def record(self, op, **payload) -> None:
+        self.journal_seq += 1
+        if self.journal is not None:
+            payload['op'] = op
+            payload['seq'] = self.journal_seq
+            self.journal.append(payload)
+
+    # Method to (re)build the normalized name index of all concepts
+    def build_name_index(self, near_duplicates = False) -> ConceptNameIndex:
+        index = ConceptNameIndex(normalize_concept_name, near_duplicates = near_duplicates)
+        names = [(concept_id, self.concepts.get_name(concept_id)) for concept_id in range(len(self.concepts))]
+        names = [(concept_id, name) for concept_id, name in names if name]
+        keys = get_name_normalizer().normalize_batch([name for _, name in names])
+        for (concept_id, name), key in zip(names, keys):
+            index.add(name, concept_id, key = key)
+        return index
+
+    # Method to get the ancestor/descendant interval index of the concepts (rebuilt when the tree changed since the last call)
+    def get_interval_index(self):
+        from src.core.taxonomy_index import TaxonomyIntervalIndex
+        if self.interval_index is None or not self.interval_index.is_current(self.concepts):
+            self.interval_index = TaxonomyIntervalIndex(self.concepts, self.root.concept_id)
+        return self.interval_index
+
+    # Method to switch on the near-duplicate detection (token-set and one-edit matches) of the name index
+    def enable_near_duplicate_detection(self) -> None:
+        if not self.name_index.near_duplicates:
+            self.name_index = self.build_name_index(near_duplicates = True)
+
+    # Method to find a known concept with the same (normalized) name, returns None if the name is new
+    def find_known_concept(self, name: str):
+        concept_id = self.name_index.find(name)
+        return None if concept_id is None else self.concepts[concept_id]
+
+    # Methods mutating the taxonomy during the expansion (all mutations are journaled)
+
+    # Method to add subconcepts of the parent concept, returns the added concepts
+    # (with deduplicate, concepts duplicating a known concept or an earlier concept of the list are dropped)
+    def add_concepts(self, parent, concepts, deduplicate = False) -> list:
+        added = []
+        first_id = len(self.concepts)
+        for concept in concepts:
+            key = self.name_index.key(concept.name)
+            if deduplicate and self.name_index.find(concept.name, key = key) is not None:
+                continue
+            concept.attach(self.concepts, parent.concept_id)
+            self.name_index.add(concept.name, concept.concept_id, key = key)
+            added.append(concept)
+        if not added:
+            return added
+        self.record('add_concepts', parent = parent.concept_id, first_id = first_id,
+                    concepts = [[c.name, c.taxonomical_rank, c.taxonomical_level, c.taxonomical_ranks_list_number] for c in added])
+        return added
+
+    # Method to remove the children added by a ranks list from a concept (the concept is shared by all the ranks lists,
+    # the children of the other lists stay)
+    def clear_children(self, concept, rank_number) -> None:
+        removed = [i for i in self.concepts.children_ids(concept.concept_id) if self.concepts.get_ranks_list_number(i) == rank_number]
+        if not removed:
+            return
+        for child_id in removed:
+            self.concepts.unlink_child(child_id)
+        self.record('clear_children', concept = concept.concept_id, rank_number = rank_number)
+
+    def set_concept_definition(self, concept, definition) -> None:
+        if concept.definition != definition:
+            concept.definition = definition
+            self.record('set_definition', concept = concept.concept_id, definition = definition)
+
+    def add_token_usage(self, token_usage_delta, token_usage_by_stage = None) -> None:
+        self.token_usage = update_token_usage(self.token_usage, token_usage_delta)
+        if token_usage_by_stage:
+            self.token_usage_by_stage = update_token_usage_by_stage(self.token_usage_by_stage, token_usage_by_stage)
+        self.record('token_usage', delta = {k: v for k, v in token_usage_delta.items() if isinstance(v, (int, float)) and not isinstance(v, bool)},
+                    by_stage = token_usage_by_stage if token_usage_by_stage else {})
+
+    def set_uninspected_concepts(self, rank_number, concepts) -> None:
+        self.uninspected_concepts[rank_number] = concepts
+        self.record('set_uninspected', rank_number = rank_number, concepts = [c.concept_id for c in concepts])
+
+    # Method to remove processed concepts from and add new concepts to the uninspected concepts of a ranks list
+    def update_uninspected_concepts(self, rank_number, removed = (), added = ()) -> None:
+        removed_ids = set(c.concept_id for c in removed)
+        self.uninspected_concepts[rank_number] = [c for c in self.uninspected_concepts[rank_number] if c.concept_id not in removed_ids] + list(added)
+        self.record('update_uninspected', rank_number = rank_number, removed = sorted(removed_ids), added = [c.concept_id for c in added])
+
+    def add_unknown_concept(self, rank_number, concept) -> None:
+        self.unknown_concepts[rank_number].append(concept)
+        self.record('add_unknown', rank_number = rank_number, concept = concept.concept_id)
+
+    def set_current_level(self, rank_number, level) -> None:
+        self.current_level[rank_number] = level
+        self.record('set_current_level', rank_number = rank_number, level = level)
+
+    # Methods journaling the changes made through the list idioms of the concepts (taxonomy.concepts += [...], concept.children.append(...)),
+    # called by the ConceptStore
+    def concepts_attached(self, concepts) -> None:
+        for concept in concepts:
+            if concept.name:
+                self.name_index.add(concept.name, concept.concept_id)
+            parent_id = self.concepts.get_parent(concept.concept_id)
+            self.record('add_concepts', parent = NO_CONCEPT if parent_id is None else parent_id, first_id = concept.concept_id,
+                        concepts = [[concept.name, concept.taxonomical_rank, concept.taxonomical_level, concept.taxonomical_ranks_list_number]])
+
+    def children_relinked(self, concept_id) -> None:
+        self.record('set_children', concept = concept_id, children = list(self.concepts.children_ids(concept_id)))
+
+    # Method to apply a journal record (journal replay in load_taxonomy)
+    def apply_journal_record(self, record) -> None:
+        op = record['op']
+        if op == 'add_concepts':
+            if record['first_id'] != len(self.concepts):
+                raise ValueError(f"journal record {record['seq']} does not match the snapshot ({len(self.concepts)} concepts, record starts at {record['first_id']})")
+            parent = None if record['parent'] == NO_CONCEPT else self.concepts[record['parent']]
+            concepts = [Concept(name, parent = parent, taxonomical_rank = rank, taxonomical_level = level, taxonomical_ranks_list_number = ranks_list_number) for name, rank, level, ranks_list_number in record['concepts']]
+            if parent is None:
+                self.concepts.extend(concepts)
+            else:
+                self.add_concepts(parent, concepts)
+        elif op == 'set_definition':
+            self.set_concept_definition(self.concepts[record['concept']], record['definition'])
+        elif op == 'token_usage':
+            self.add_token_usage(record['delta'], record.get('by_stage'))
+        elif op == 'set_uninspected':
+            self.set_uninspected_concepts(record['rank_number'], [self.concepts[i] for i in record['concepts']])
+        elif op == 'update_uninspected':
+            self.update_uninspected_concepts(record['rank_number'], [self.concepts[i] for i in record['removed']], [self.concepts[i] for i in record['added']])
+        elif op == 'add_unknown':
+            self.add_unknown_concept(record['rank_number'], self.concepts[record['concept']])
+        elif op == 'set_current_level':
+            self.set_current_level(record['rank_number'], record['level'])
+        elif op == 'clear_children':
+            self.clear_children(self.concepts[record['concept']], record['rank_number'])
+        elif op == 'set_children':
+            self.concepts.set_children(record['concept'], record['children'])
+        self.journal_seq = record['seq']
+
+    # Method to export the taxonomy to an OWL file, returns the file path
+    # (format: 'xml' - RDF/XML .owl, 'nt' - N-Triples .nt, 'turtle' - Turtle .ttl; the file is written by the streaming exporter)
+    def export_to_owl(self, suffix ='', format = 'xml', include_annotations = False) -> str:
+        ensure_directory_exists(self.save_path)
+        file_path = self.save_path + self.name + suffix + OWL_EXPORT_FORMATS[format]
+        exported = export_taxonomy_to_owl(self, file_path, format = format, include_annotations = include_annotations)
+        print(f"Taxonomy exported to {file_path} ({exported} concepts)")
+        return file_path
+
+# Helper function for flattening nested lists
+def flatten(xss):
+    return [x for xs in xss for x in xs]
+
+# Function to load a saved taxonomy from a file
+# (if a journal exists next to the snapshot, its records newer than the snapshot are replayed)
+def load_taxonomy(file_path:str) -> Taxonomy:
+    # Deserialize the object from the binary file
+    with open(file_path, 'rb') as file:
+        loaded_taxonomy = pickle.load(file)
+    journal_path = os.path.splitext(file_path)[0] + '.journal'
+    for record in read_journal(journal_path):
+        if record['seq'] > loaded_taxonomy.journal_seq:
+            loaded_taxonomy.apply_journal_record(record)
+    if loaded_taxonomy.persistence == 'journal':
+        loaded_taxonomy.enable_journal()
+    return loaded_taxonomy
+
+# Helper function returning the numeric counters of a token usage; the prompt tokens read from the provider's prompt
+# cache (OpenAI's prompt_tokens_details.cached_tokens) become the cached_prompt_tokens counter
+def token_usage_counters(token_usage) -> dict:
+    counters = {key: value for key, value in token_usage.items() if isinstance(value, (int, float)) and not isinstance(value, bool)}
+    details = token_usage.get('prompt_tokens_details')
+    if isinstance(details, dict) and details.get('cached_tokens'):
+        counters['cached_prompt_tokens'] = counters.get('cached_prompt_tokens', 0) + details['cached_tokens']
+    return counters
+
+# Function for the token usage update
+# (numeric counters missing from token_usage, e.g. the cache hit counters, are added to the result)
+def update_token_usage(token_usage, token_usage_delta):
+    res = token_usage_counters(token_usage)
+    for key, value in token_usage_counters(token_usage_delta).items():#['completion_tokens', 'prompt_tokens','total_tokens']:
+        res[key] = res.get(key, 0) + value
+    return res
+
+# Function for the update of the token usage broken down by stage ({stage: token usage})
+def update_token_usage_by_stage(token_usage_by_stage, token_usage_by_stage_delta):
+    res = dict(token_usage_by_stage)
+    for stage, token_usage_delta in token_usage_by_stage_delta.items():
+        res[stage] = update_token_usage(res.get(stage, {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}), token_usage_delta)
+    return res
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.taxonomy_model import Concept, Taxonomy, load_taxonomy
+#target_concept = "lumber wood"
+#test_concept = Concept(target_concept, parent = None, taxonomical_rank = 'root', taxonomical_level = 0, taxonomical_ranks_list_number = 'root')
+#test_concept.info()
+#taxonomy_new = Taxonomy(target_concept)
+#taxonomy_new.info()
+
+#taxonomy_path = taxonomy_new.saved_to[0]
+#taxonomy_loaded = load_taxonomy(taxonomy_path)
+#taxonomy_loaded.info()
+#taxonomy_loaded.root.info()
+#______________________
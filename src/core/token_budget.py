@@ -0,0 +1,283 @@
+import math
+import logging
+import threading
+import contextlib
+
+import tiktoken
+
+from src.core.model_wrappers import ChatModelWrapper, get_model_params, serialize_messages, chunk_token_usage
+from src.core.pipeline_context import PipelineInterrupt, current_stage, current_ranks_list
+from src.core.taxonomy_model import token_usage_counters
+
+# Prices in USD per 1M (prompt, completion) tokens, matched on the longest prefix of the model checkpoint
+MODEL_PRICES = {
+    'gpt-4o':           (2.50, 10.00),
+    'gpt-4o-mini':      (0.15, 0.60),
+    'gpt-4-turbo':      (10.00, 30.00),
+    'gpt-4':            (30.00, 60.00),
+    'gpt-3.5-turbo':    (0.50, 1.50),
+}
+
+# Price of the prompt tokens read from the provider's prompt cache, relative to the prompt price
+CACHED_PROMPT_PRICE_RATIO = 0.5
+
+# Raised (before the request is sent) when a request does not fit into one of the budgets
+class BudgetExceededError(PipelineInterrupt):
+    stop_reason = 'budget_exhausted'
+
+    def __init__(self, scope, limit, spent, requested) -> None:
+        super().__init__(f"{scope} budget exhausted: limit {limit}, spent and reserved {spent}, request needs {requested}")
+        self.scope      = scope
+        self.limit      = limit
+        self.spent      = spent
+        self.requested  = requested
+
+# Raised in the 'degrade' mode for the requests of the optional stages once a budget is almost spent.
+# It is an ordinary exception, so the generation function falls back to its no-model result
+# (the postprocessing keeps the candidates, the redundancy filter removes nothing).
+class BudgetDegradedError(Exception):
+    pass
+
+# Encodings per model checkpoint (None if tiktoken has no encoding for it or cannot load it)
+encodings = {}
+
+def get_encoding(model_checkpoint):
+    if model_checkpoint not in encodings:
+        try:
+            encodings[model_checkpoint] = tiktoken.encoding_for_model(model_checkpoint)
+        except KeyError:
+            try:
+                encodings[model_checkpoint] = tiktoken.get_encoding('o200k_base')
+            except Exception:
+                encodings[model_checkpoint] = None
+        except Exception:
+            encodings[model_checkpoint] = None
+    return encodings[model_checkpoint]
+
+# Function to estimate the prompt tokens of a request before it is sent
+# (chat format overhead included; without a tiktoken encoding one token per 3 characters is assumed, which overestimates English text)
+def estimate_prompt_tokens(prompt, model_checkpoint) -> int:
+    encoding = get_encoding(model_checkpoint)
+    tokens = 3
+    for role, content in serialize_messages(prompt):
+        if encoding is not None:
+            tokens += 4 + len(encoding.encode(content, disallowed_special=()))
+        else:
+            tokens += 4 + math.ceil(len(content)/3)
+    return tokens
+
+# Function to estimate the token usage of a stream stopped before its usage was reported
+# (the API streams about one token per chunk, the prompt is estimated like before the request)
+def estimate_stream_token_usage(prompt, model_checkpoint, chunks) -> dict:
+    prompt_tokens = estimate_prompt_tokens(prompt, model_checkpoint)
+    return {'completion_tokens': chunks, 'prompt_tokens': prompt_tokens, 'total_tokens': prompt_tokens + chunks}
+
+# Function returning the (prompt, completion) price per 1M tokens of a model checkpoint
+def get_model_prices(model_checkpoint, prices = None):
+    prices = prices if prices else MODEL_PRICES
+    matches = [name for name in prices if str(model_checkpoint).startswith(name)]
+    if not matches:
+        return (0.0, 0.0)
+    return prices[max(matches, key=len)]
+
+# Class for the token and cost budgets of a run.
+#
+# Every request is checked before it is sent: the prompt tokens are estimated with tiktoken and
+# the request's max_tokens is reserved as its completion, so the spend can never go above a limit
+# even with concurrent requests. After the response the reservation is replaced by the real usage.
+# Limits (None means unlimited):
+#   max_tokens / max_cost               - the whole run (tokens / USD)
+#   stage_max_tokens                    - {stage: tokens}, stages as set by the generation functions
+#   ranks_list_max_tokens               - tokens per ranks list (int) or {ranks list number: tokens}
+#   model_max_tokens / model_max_cost   - {model checkpoint: tokens / USD}
+# When a request does not fit, on_exhausted='stop' raises BudgetExceededError (the expansion saves its
+# progress and returns with taxonomy.stop_reason = 'budget_exhausted'), on_exhausted='degrade' first reduces max_tokens of the request to what is left
+# and, once degrade_at of a limit is spent, skips the optional stages.
+class TokenBudget:
+    def __init__(self, max_tokens = None, max_cost = None, stage_max_tokens = None, ranks_list_max_tokens = None, model_max_tokens = None, model_max_cost = None,
+                 on_exhausted = 'stop', degrade_at = 0.9, optional_stages = ('postprocess', 'redundancy'), min_completion_tokens = 16, default_completion_tokens = 1024, prices = None, log = None) -> None:
+        if on_exhausted not in ('stop', 'degrade'):
+            raise ValueError(f"on_exhausted must be 'stop' or 'degrade', not '{on_exhausted}'")
+        self.max_tokens                 = max_tokens
+        self.max_cost                   = max_cost
+        self.stage_max_tokens           = stage_max_tokens if stage_max_tokens else {}
+        self.ranks_list_max_tokens      = ranks_list_max_tokens
+        self.model_max_tokens           = model_max_tokens if model_max_tokens else {}
+        self.model_max_cost             = model_max_cost if model_max_cost else {}
+        self.on_exhausted               = on_exhausted
+        self.degrade_at                 = degrade_at
+        self.optional_stages            = optional_stages
+        self.min_completion_tokens      = min_completion_tokens
+        self.default_completion_tokens  = default_completion_tokens
+        self.prices                     = prices if prices else MODEL_PRICES
+        self.log                        = log if log else logging.getLogger("TokenBudget")
+        self.lock                       = threading.Lock()
+        self.spent                      = {}
+        self.reserved                   = {}
+        self.requests                   = 0
+        self.rejected                   = 0
+        self.degraded                   = 0
+
+    # Method returning the (token limit, cost limit) of a scope
+    def limits(self, scope):
+        kind, key = scope
+        if kind == 'run':
+            return self.max_tokens, self.max_cost
+        if kind == 'stage':
+            return self.stage_max_tokens.get(key), None
+        if kind == 'ranks_list':
+            if isinstance(self.ranks_list_max_tokens, dict):
+                return self.ranks_list_max_tokens.get(key), None
+            return self.ranks_list_max_tokens, None
+        return self.model_max_tokens.get(key), self.model_max_cost.get(key)
+
+    # Method returning the cost (USD) of the given prompt and completion tokens of a model
+    # (cached_prompt_tokens of the prompt tokens are billed at CACHED_PROMPT_PRICE_RATIO of the prompt price)
+    def cost(self, model_checkpoint, prompt_tokens, completion_tokens, cached_prompt_tokens = 0) -> float:
+        prompt_price, completion_price = get_model_prices(model_checkpoint, self.prices)
+        return ((prompt_tokens - cached_prompt_tokens*(1 - CACHED_PROMPT_PRICE_RATIO))*prompt_price + completion_tokens*completion_price)/1e6
+
+    def used(self, scope):
+        spent = self.spent.get(scope, (0, 0.0))
+        reserved = self.reserved.get(scope, (0, 0.0))
+        return spent[0] + reserved[0], spent[1] + reserved[1]
+
+    def add(self, ledger, scopes, tokens, cost) -> None:
+        for scope in scopes:
+            used_tokens, used_cost = ledger.get(scope, (0, 0.0))
+            ledger[scope] = (used_tokens + tokens, used_cost + cost)
+
+    # Method reserving a request, returns the reservation and the max_tokens the request may use
+    def reserve(self, model_checkpoint, prompt_tokens, max_tokens = None, stage = None, ranks_list = None):
+        scopes = [('run', None), ('model', model_checkpoint)]
+        if stage is not None:
+            scopes.append(('stage', stage))
+        if ranks_list is not None:
+            scopes.append(('ranks_list', ranks_list))
+        requested = max_tokens if max_tokens else self.default_completion_tokens
+        prompt_price, completion_price = get_model_prices(model_checkpoint, self.prices)
+        with self.lock:
+            self.requests += 1
+            allowed = requested
+            nearly_spent = False
+            for scope in scopes:
+                token_limit, cost_limit = self.limits(scope)
+                used_tokens, used_cost = self.used(scope)
+                if token_limit is not None:
+                    allowed = min(allowed, token_limit - used_tokens - prompt_tokens)
+                    nearly_spent = nearly_spent or used_tokens >= token_limit*self.degrade_at
+                    if allowed < requested and (allowed < self.min_completion_tokens or self.on_exhausted == 'stop'):
+                        self.rejected += 1
+                        raise BudgetExceededError(f"{scope[0]} {scope[1]}" if scope[1] is not None else scope[0], token_limit, used_tokens, prompt_tokens + requested)
+                if cost_limit is not None:
+                    left = cost_limit - used_cost - prompt_tokens*prompt_price/1e6
+                    allowed = min(allowed, int(left*1e6/completion_price) if completion_price else allowed)
+                    nearly_spent = nearly_spent or used_cost >= cost_limit*self.degrade_at
+                    if allowed < requested and (allowed < self.min_completion_tokens or self.on_exhausted == 'stop'):
+                        self.rejected += 1
+                        raise BudgetExceededError(f"{scope[0]} {scope[1]} cost" if scope[1] is not None else 'run cost', cost_limit, round(used_cost, 6), round(self.cost(model_checkpoint, prompt_tokens, requested), 6))
+            if self.on_exhausted == 'degrade' and nearly_spent and stage in self.optional_stages:
+                self.degraded += 1
+                raise BudgetDegradedError(f"budget almost spent, optional stage '{stage}' skipped")
+            if allowed < requested:
+                self.degraded += 1
+                self.log.info(f"budget almost spent, max_tokens of the '{stage}' request reduced from {requested} to {allowed}")
+            tokens = prompt_tokens + allowed
+            cost = self.cost(model_checkpoint, prompt_tokens, allowed)
+            self.add(self.reserved, scopes, tokens, cost)
+        reservation = {'scopes': scopes, 'tokens': tokens, 'cost': cost, 'model_checkpoint': model_checkpoint}
+        return reservation, allowed
+
+    # Method replacing a reservation with the real usage of the request (without token usage only the reservation is released)
+    def commit(self, reservation, token_usage = None) -> None:
+        with self.lock:
+            self.add(self.reserved, reservation['scopes'], -reservation['tokens'], -reservation['cost'])
+            if token_usage:
+                token_usage = token_usage_counters(token_usage)
+                prompt_tokens = token_usage.get('prompt_tokens', 0)
+                completion_tokens = token_usage.get('completion_tokens', 0)
+                tokens = token_usage.get('total_tokens', prompt_tokens + completion_tokens)
+                self.add(self.spent, reservation['scopes'], tokens, self.cost(reservation['model_checkpoint'], prompt_tokens, completion_tokens, token_usage.get('cached_prompt_tokens', 0)))
+
+    # Method to get the spend (tokens and USD) per run, stage, ranks list and model checkpoint
+    def usage(self) -> dict:
+        with self.lock:
+            usage = {'run': {'tokens': 0, 'cost': 0.0}, 'stage': {}, 'ranks_list': {}, 'model': {},
+                     'requests': self.requests, 'rejected': self.rejected, 'degraded': self.degraded}
+            for (kind, key), (tokens, cost) in self.spent.items():
+                if kind == 'run':
+                    usage['run'] = {'tokens': tokens, 'cost': round(cost, 6)}
+                else:
+                    usage[kind][key] = {'tokens': tokens, 'cost': round(cost, 6)}
+        return usage
+
+# Class wrapping a chat model with a token budget (the budget can be shared by several models)
+class BudgetedChatModel(ChatModelWrapper):
+    def __init__(self, model, budget: TokenBudget) -> None:
+        super().__init__(model)
+        self.budget = budget
+
+    def reserve(self, prompt, kwargs):
+        model_checkpoint = get_model_params(self.model)['model_checkpoint']
+        prompt_tokens = estimate_prompt_tokens(prompt, model_checkpoint)
+        requested = kwargs.get('max_tokens') or self.budget.default_completion_tokens
+        reservation, max_tokens = self.budget.reserve(model_checkpoint, prompt_tokens, requested, current_stage.get(), current_ranks_list.get())
+        # the completion is always capped by the reserved max_tokens, so the reservation is a hard bound
+        kwargs = dict(kwargs, max_tokens = max_tokens)
+        return reservation, kwargs, max_tokens < requested
+
+    def commit(self, reservation, response, clipped):
+        self.budget.commit(reservation, response.response_metadata.get('token_usage'))
+        if clipped:
+            response.response_metadata['budget_clipped'] = True
+        return response
+
+    def invoke(self, prompt, **kwargs):
+        reservation, kwargs, clipped = self.reserve(prompt, kwargs)
+        try:
+            response = self.model.invoke(prompt, **kwargs)
+        except BaseException:
+            self.budget.commit(reservation)
+            raise
+        return self.commit(reservation, response, clipped)
+
+    async def ainvoke(self, prompt, **kwargs):
+        reservation, kwargs, clipped = self.reserve(prompt, kwargs)
+        try:
+            response = await self.model.ainvoke(prompt, **kwargs)
+        except BaseException:
+            self.budget.commit(reservation)
+            raise
+        return self.commit(reservation, response, clipped)
+
+    async def astream(self, prompt, **kwargs):
+        reservation, kwargs, clipped = self.reserve(prompt, kwargs)
+        token_usage = None
+        chunks = 0
+        try:
+            async with contextlib.aclosing(self.model.astream(prompt, **kwargs)) as stream:
+                async for chunk in stream:
+                    chunks += 1
+                    token_usage = chunk_token_usage(chunk) or token_usage
+                    if clipped:
+                        chunk.response_metadata['budget_clipped'] = True
+                    yield chunk
+        finally:
+            # a stream cut short by the consumer reports no usage, the prompt and the received chunks are spent
+            if not token_usage and chunks:
+                token_usage = estimate_stream_token_usage(prompt, reservation['model_checkpoint'], chunks)
+            self.budget.commit(reservation, token_usage)
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.helper_functions import start_session, init_models
+#from src.core.token_budget import TokenBudget
+#log = start_session(api_key)
+#budget = TokenBudget(max_cost = 5.0, stage_max_tokens = {'redundancy': 200000}, on_exhausted = 'degrade', log = log)
+#model_generate_new, model_re_generate, model_verify = init_models(log, budget = budget)
+#tax_t = iterate_level(tax_t, 0, model_generate_new, model_re_generate, model_verify, log = log)
+#if tax_t.stop_reason == 'budget_exhausted':
+#    log.info("stopped")   # the progress is saved, the unexpanded concepts stay uninspected
+#print(budget.usage())
+#print(tax_t.token_usage_by_stage)
+#______________________
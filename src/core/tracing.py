@@ -0,0 +1,418 @@
+import os
+import json
+import time
+import bisect
+import random
+import asyncio
+import logging
+import functools
+import itertools
+import threading
+import contextlib
+import contextvars
+
+from src.core.model_wrappers import ChatModelWrapper, get_model_params, chunk_token_usage
+from src.core.pipeline_context import PipelineInterrupt, current_stage, current_ranks_list, current_level, current_tracer
+from src.core.taxonomy_model import token_usage_counters
+
+# The span the code runs in (every asyncio task gets its own copy, like the pipeline context)
+current_span = contextvars.ContextVar('current_span', default = None)
+
+# Upper bounds (seconds) of the buckets of the span duration histograms
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Helper function summarizing the result of a traced function: (outcome, items, accepted items)
+#   bool                        - a verification: 'accepted' or 'rejected'
+#   ConceptExpansion            - 'accepted' (subconcepts found), 'rejected' (failed) or 'skipped'
+#   list/dict of the above      - a batch: 'accepted', 'rejected' or 'partial', with the amount of accepted items
+#   list/dict/str               - 'ok' or 'empty' (a generation function returns an empty result when it fails)
+def result_outcome(value):
+    if isinstance(value, bool):
+        return ('accepted' if value else 'rejected'), None, None
+    if hasattr(value, 'failed') and hasattr(value, 'skipped'):
+        return ('skipped' if value.skipped else 'rejected' if value.failed else 'accepted'), len(value.subconcepts or []), None
+    if isinstance(value, str):
+        return ('ok' if value.strip() else 'empty'), None, None
+    if isinstance(value, (list, tuple, dict)):
+        values = list(value.values()) if isinstance(value, dict) else value
+        if values and all(isinstance(item, bool) or hasattr(item, 'failed') for item in values):
+            accepted = sum(1 for item in values if (item is True) or (not isinstance(item, bool) and not item.failed and not item.skipped))
+            return ('accepted' if accepted == len(values) else 'rejected' if not accepted else 'partial'), len(values), accepted
+        return ('ok' if values else 'empty'), len(values), None
+    return ('empty' if value is None else 'ok'), None, None
+
+# Class for one span of the pipeline: a phase (construct_taxonomy, iterate_level, expand_concept, checkpoint...), a call of a
+# generation function (kind 'stage') or a request to a model (kind 'llm'). It records the wall time, the model, the token
+# usage, the model requests and retries, the parse outcome of the answer and the outcome of the result (accepted, rejected...).
+# The stage, ranks list and level are taken from the pipeline context when the span starts (or from the parent span)
+class Span:
+    def __init__(self, tracer, name, kind, parent = None, model = None, **attributes) -> None:
+        self.tracer             = tracer
+        self.name               = name
+        self.kind               = kind
+        self.span_id            = next(tracer.span_ids)
+        self.parent             = parent
+        self.stage              = current_stage.get()
+        self.ranks_list         = current_ranks_list.get()
+        self.level              = current_level.get()
+        if parent is not None and self.ranks_list is None:
+            self.ranks_list, self.level = parent.ranks_list, parent.level
+        self.model              = model
+        self.start_time         = time.time()
+        self.start              = time.perf_counter()
+        self.seconds            = None
+        self.token_usage        = {}
+        self.llm_calls          = 0
+        self.llm_errors         = 0
+        self.retries            = 0
+        self.error              = None
+        self.outcome            = None
+        self.items              = None
+        self.accepted           = None
+        self.parse              = None
+        self.attributes         = attributes
+        # the prompt and response logs of a stage call and of its requests are sampled together
+        if kind == 'stage':
+            self.sampled        = tracer.sample_prompt_log()
+        else:
+            self.sampled        = parent.sampled if parent else True
+
+    # Method setting attributes of the span (the unknown names are stored in its attributes)
+    def annotate(self, **values) -> None:
+        for name, value in values.items():
+            if name in ('model', 'ranks_list', 'level', 'outcome', 'items', 'accepted', 'parse'):
+                setattr(self, name, value)
+            else:
+                self.attributes[name] = value
+
+    def add_usage(self, token_usage) -> None:
+        for key, value in token_usage_counters(token_usage).items() if token_usage else ():
+            self.token_usage[key] = self.token_usage.get(key, 0) + value
+
+    # Method recording the result of the traced function, returns the result. The token usage is the last item of the
+    # result of a generation function, or the usage of the returned ConceptExpansion(s)
+    def set_result(self, result):
+        if isinstance(result, tuple) and len(result) > 1:
+            value, token_usages = result[0], [result[-1]]
+        else:
+            value, token_usages = result, [item.token_usage for item in (result if isinstance(result, list) else [result]) if hasattr(item, 'failed')]
+        for token_usage in token_usages:
+            if isinstance(token_usage, dict):
+                self.add_usage(token_usage)
+        self.outcome, self.items, self.accepted = result_outcome(value)
+        return result
+
+    def to_dict(self) -> dict:
+        record = {
+            'span_id':          self.span_id,
+            'parent_id':        self.parent.span_id if self.parent else None,
+            'name':             self.name,
+            'kind':             self.kind,
+            'stage':            self.stage,
+            'ranks_list':       self.ranks_list,
+            'level':            self.level,
+            'model':            self.model,
+            'start':            round(self.start_time, 6),
+            'seconds':          round(self.seconds, 6) if self.seconds is not None else None,
+            'token_usage':      self.token_usage,
+            'llm_calls':        self.llm_calls,
+            'llm_errors':       self.llm_errors,
+            'retries':          self.retries,
+            'parse':            self.parse,
+            'outcome':          self.outcome,
+            'items':            self.items,
+            'accepted':         self.accepted,
+            'error':            self.error,
+        }
+        record = {key: value for key, value in record.items() if value or value == 0 and key in ('level', 'ranks_list', 'items', 'accepted')}
+        record.update(self.attributes)
+        return record
+
+# Class for the tracer of the pipeline. With an active tracer (the `tracer` argument of construct_taxonomy and iterate_level,
+# or `with tracer.activate():` around any other entry point) every phase of the construction and the expansion and every call
+# of a generation function is a span; with the models of init_models(tracer = ...) every model request is a span too.
+#
+# The finished spans are written as JSON lines to a rotating file (path, max_bytes, backup_count), buffered and appended every
+# buffer_spans spans and on flush()/close(), and aggregated per span, stage, model, ranks list and level. The aggregates are
+# written in the Prometheus text format to prometheus_path (for the node exporter textfile collector) at most every
+# prometheus_interval seconds and on flush()/close(); stats() returns them per level.
+# Only a prompt_log_sample_rate share of the stage calls log their prompts and responses (see log_sampled)
+class Tracer:
+    def __init__(self, path = None, prometheus_path = None, max_bytes = 50*2**20, backup_count = 5, buffer_spans = 256, prometheus_interval = 15.0, prompt_log_sample_rate = 0.05, seed = None, log = None) -> None:
+        if not log:
+            log = logging.getLogger("Tracer")
+            logging.basicConfig(level=logging.INFO)
+        if not path:
+            path = os.path.join(os.getcwd(), 'logs', 'traces', 'spans.jsonl')
+        if not prometheus_path:
+            prometheus_path = os.path.splitext(path)[0]+".prom"
+        for directory in {os.path.dirname(path), os.path.dirname(prometheus_path)}:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.path                   = path
+        self.prometheus_path        = prometheus_path
+        self.max_bytes              = max_bytes
+        self.backup_count           = backup_count
+        self.buffer_spans           = buffer_spans
+        self.prometheus_interval    = prometheus_interval
+        self.prompt_log_sample_rate = prompt_log_sample_rate
+        self.log                    = log
+        self.random                 = random.Random(seed)
+        self.span_ids               = itertools.count(1)
+        self.lock                   = threading.Lock()
+        self.write_lock             = threading.Lock()
+        self.aggregates             = {}
+        self.buffer                 = []
+        self.spans                  = 0
+        self.prometheus_written     = time.monotonic()
+
+    def sample_prompt_log(self) -> bool:
+        return self.prompt_log_sample_rate >= 1 or self.random.random() < self.prompt_log_sample_rate
+
+    # Context manager making the tracer the active one (the spans of the generation functions called inside it are recorded)
+    @contextlib.contextmanager
+    def activate(self):
+        if current_tracer.get() is self:
+            yield self
+            return
+        token = current_tracer.set(self)
+        try:
+            yield self
+        finally:
+            current_tracer.reset(token)
+
+    # Context manager recording a span around its body, nested in the current span
+    @contextlib.contextmanager
+    def span(self, name, kind = 'phase', **attributes):
+        span = self.start_span(name, kind, current_span.get(), **attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            current_span.reset(token)
+            self.end_span(span, e)
+            raise
+        current_span.reset(token)
+        self.end_span(span)
+
+    def start_span(self, name, kind = 'phase', parent = None, **attributes) -> Span:
+        return Span(self, name, kind, parent, **attributes)
+
+    # Method finishing a span: the span is aggregated and written to the JSON lines file
+    def end_span(self, span, error = None) -> None:
+        span.seconds = time.perf_counter() - span.start
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"[:500]
+            span.outcome = 'interrupted' if isinstance(error, (PipelineInterrupt, asyncio.CancelledError)) else 'error'
+        if span.kind == 'llm' and span.parent is not None:
+            span.parent.llm_calls += 1
+            span.parent.llm_errors += int(error is not None)
+            span.parent.model = span.parent.model or span.model
+        labels = (span.kind, span.name, span.stage or '', span.model or '', '' if span.ranks_list is None else str(span.ranks_list), '' if span.level is None else str(span.level))
+        with self.lock:
+            aggregate = self.aggregates.get(labels)
+            if aggregate is None:
+                aggregate = self.aggregates[labels] = {'count': 0, 'seconds': 0.0, 'buckets': [0]*len(DURATION_BUCKETS), 'token_usage': {}, 'llm_calls': 0, 'llm_errors': 0, 'retries': 0, 'outcomes': {}, 'parse': {}}
+            aggregate['count'] += 1
+            aggregate['seconds'] += span.seconds
+            # the buckets are stored per interval, write_prometheus makes them cumulative
+            bucket = bisect.bisect_left(DURATION_BUCKETS, span.seconds)
+            if bucket < len(DURATION_BUCKETS):
+                aggregate['buckets'][bucket] += 1
+            for key, value in span.token_usage.items():
+                aggregate['token_usage'][key] = aggregate['token_usage'].get(key, 0) + value
+            aggregate['llm_calls'] += span.llm_calls
+            aggregate['llm_errors'] += span.llm_errors
+            aggregate['retries'] += span.retries
+            if span.outcome:
+                aggregate['outcomes'][span.outcome] = aggregate['outcomes'].get(span.outcome, 0) + 1
+            if span.parse:
+                aggregate['parse'][span.parse] = aggregate['parse'].get(span.parse, 0) + 1
+            self.spans += 1
+            self.buffer.append(span.to_dict())
+            write_spans = len(self.buffer) >= self.buffer_spans
+            write_prometheus = time.monotonic() - self.prometheus_written >= self.prometheus_interval
+            if write_prometheus:
+                self.prometheus_written = time.monotonic()
+        if write_spans:
+            self.write_spans()
+        if write_prometheus:
+            self.write_prometheus()
+
+    # Method appending the buffered spans to the JSON lines file, rotated (path.1, path.2...) once it has max_bytes
+    def write_spans(self) -> None:
+        with self.lock:
+            spans, self.buffer = self.buffer, []
+        if not spans:
+            return
+        with self.write_lock:
+            with open(self.path, 'a', encoding = 'utf-8') as file:
+                file.write(''.join(json.dumps(span, default = str) + '\n' for span in spans))
+                size = file.tell()
+            if self.max_bytes and size >= self.max_bytes:
+                for i in range(self.backup_count - 1, 0, -1):
+                    if os.path.exists(f"{self.path}.{i}"):
+                        os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+                if self.backup_count:
+                    os.replace(self.path, f"{self.path}.1")
+                else:
+                    os.remove(self.path)
+
+    # Method writing the aggregates in the Prometheus text format (to a temporary file first, so a scrape never reads half of it)
+    def write_prometheus(self) -> str:
+        with self.lock:
+            aggregates = [(labels, dict(aggregate, buckets = list(aggregate['buckets']), token_usage = dict(aggregate['token_usage']), outcomes = dict(aggregate['outcomes']), parse = dict(aggregate['parse'])))
+                          for labels, aggregate in sorted(self.aggregates.items())]
+        def label_text(labels, **extra):
+            values = dict(zip(('kind', 'span', 'stage', 'model', 'ranks_list', 'level'), labels), **extra)
+            return '{' + ','.join(f'{key}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for key, value in values.items()) + '}'
+        lines = ["# HELP taxorank_span_duration_seconds Wall time of the pipeline spans.", "# TYPE taxorank_span_duration_seconds histogram"]
+        for labels, aggregate in aggregates:
+            for bound, count in zip(DURATION_BUCKETS, itertools.accumulate(aggregate['buckets'])):
+                lines.append(f"taxorank_span_duration_seconds_bucket{label_text(labels, le = bound)} {count}")
+            lines.append(f"taxorank_span_duration_seconds_bucket{label_text(labels, le = '+Inf')} {aggregate['count']}")
+            lines.append(f"taxorank_span_duration_seconds_sum{label_text(labels)} {aggregate['seconds']:.6f}")
+            lines.append(f"taxorank_span_duration_seconds_count{label_text(labels)} {aggregate['count']}")
+        lines += ["# HELP taxorank_span_tokens_total Tokens of the spans by type (prompt, completion, cached_prompt...).", "# TYPE taxorank_span_tokens_total counter"]
+        for labels, aggregate in aggregates:
+            for key, value in sorted(aggregate['token_usage'].items()):
+                if key != 'total_tokens':
+                    lines.append(f"taxorank_span_tokens_total{label_text(labels, type = key.replace('_tokens', ''))} {value}")
+        for metric, key, help_text in (('taxorank_span_llm_calls_total', 'llm_calls', 'Model requests made in the spans.'),
+                                       ('taxorank_span_llm_errors_total', 'llm_errors', 'Failed model requests made in the spans.'),
+                                       ('taxorank_span_retries_total', 'retries', 'Retries of the rate limiter in the spans.')):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f"{metric}{label_text(labels)} {aggregate[key]}" for labels, aggregate in aggregates if aggregate[key]]
+        for metric, key, label, help_text in (('taxorank_span_outcomes_total', 'outcomes', 'outcome', 'Spans by outcome (accepted, rejected, empty, error...).'),
+                                              ('taxorank_span_parse_total', 'parse', 'parse', 'Answers by parse outcome (ok, fixed, repaired, failed...).')):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f"{metric}{label_text(labels, **{label: value})} {count}" for labels, aggregate in aggregates for value, count in sorted(aggregate[key].items())]
+        temporary_path = self.prometheus_path + ".tmp"
+        with open(temporary_path, 'w', encoding = 'utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(temporary_path, self.prometheus_path)
+        return self.prometheus_path
+
+    # Method to get the aggregates per ranks list and level ('construction' before the expansion), then per span
+    # ('llm:<model>' for the model requests): count, seconds, token usage, model requests, retries, outcomes, parse outcomes
+    def stats(self) -> dict:
+        report = {}
+        with self.lock:
+            for (kind, name, stage, model, ranks_list, level), aggregate in sorted(self.aggregates.items()):
+                key = f"ranks_list {ranks_list}, level {level}" if ranks_list or level else 'construction'
+                span_name = f"llm:{model}" if kind == 'llm' else name
+                counters = report.setdefault(key, {}).setdefault(span_name, {'count': 0, 'seconds': 0.0, 'token_usage': {}, 'llm_calls': 0, 'llm_errors': 0, 'retries': 0, 'outcomes': {}, 'parse': {}})
+                counters['count'] += aggregate['count']
+                counters['seconds'] = round(counters['seconds'] + aggregate['seconds'], 6)
+                for field in ('token_usage', 'outcomes', 'parse'):
+                    for value, count in aggregate[field].items():
+                        counters[field][value] = counters[field].get(value, 0) + count
+                for field in ('llm_calls', 'llm_errors', 'retries'):
+                    counters[field] += aggregate[field]
+        return report
+
+    def flush(self) -> None:
+        self.write_spans()
+        self.write_prometheus()
+
+    def close(self) -> None:
+        self.flush()
+
+# Helper function setting attributes of the current span (without an active span nothing happens)
+def annotate_span(**values) -> None:
+    span = current_span.get()
+    if span is not None:
+        span.annotate(**values)
+
+# Helper function adding to a counter of the current span (retries...)
+def count_span(counter, amount = 1) -> None:
+    span = current_span.get()
+    if span is not None:
+        setattr(span, counter, getattr(span, counter) + amount)
+
+# Helper function returning a span context manager of the active tracer (a no-op without one)
+def trace_span(name, kind = 'phase', **attributes):
+    tracer = current_tracer.get()
+    return tracer.span(name, kind, **attributes) if tracer else contextlib.nullcontext()
+
+# Decorator recording every call of a (sync or async) phase of the pipeline as a span. The tracer is the `tracer` keyword
+# argument of the call if there is one (it is activated for the call), otherwise the active tracer; without one the call is not traced
+def traced(name = None):
+    def decorator(function):
+        span_name = name or function.__name__
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                tracer = kwargs.get('tracer') or current_tracer.get()
+                if tracer is None:
+                    return await function(*args, **kwargs)
+                with tracer.activate(), tracer.span(span_name) as span:
+                    return span.set_result(await function(*args, **kwargs))
+            return async_wrapper
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = kwargs.get('tracer') or current_tracer.get()
+            if tracer is None:
+                return function(*args, **kwargs)
+            with tracer.activate(), tracer.span(span_name) as span:
+                return span.set_result(function(*args, **kwargs))
+        return wrapper
+    return decorator
+
+# Helper function for the verbose logs of the generation functions (prompts, responses): the message is formatted
+# lazily (only when INFO is enabled) and, with an active tracer, only for the sampled stage calls
+def log_sampled(log, message, *args) -> None:
+    if log.isEnabledFor(logging.INFO):
+        span = current_span.get()
+        if span is None or span.sampled:
+            log.info(message, *args)
+
+# Class wrapping a chat model with the tracer: every request (every attempt of a retried one) is a span of kind 'llm'
+# with the model, the latency (and the time to the first chunk of a stream) and the token usage, nested in the stage span
+class TracedChatModel(ChatModelWrapper):
+    def __init__(self, model, tracer: Tracer) -> None:
+        super().__init__(model)
+        self.tracer             = tracer
+        self.model_checkpoint   = get_model_params(model)['model_checkpoint']
+
+    def invoke(self, prompt, **kwargs):
+        with self.tracer.span('llm', kind = 'llm', model = self.model_checkpoint) as span:
+            response = self.model.invoke(prompt, **kwargs)
+            span.add_usage(response.response_metadata.get('token_usage'))
+        return response
+
+    async def ainvoke(self, prompt, **kwargs):
+        with self.tracer.span('llm', kind = 'llm', model = self.model_checkpoint) as span:
+            response = await self.model.ainvoke(prompt, **kwargs)
+            span.add_usage(response.response_metadata.get('token_usage'))
+        return response
+
+    # the span of a stream is not made the current span: the consumer runs between the chunks
+    async def astream(self, prompt, **kwargs):
+        span = self.tracer.start_span('llm', kind = 'llm', parent = current_span.get(), model = self.model_checkpoint, streamed = True)
+        error = None
+        token_usage = None
+        try:
+            async with contextlib.aclosing(self.model.astream(prompt, **kwargs)) as stream:
+                async for chunk in stream:
+                    if 'first_token_seconds' not in span.attributes and chunk.content:
+                        span.attributes['first_token_seconds'] = round(time.perf_counter() - span.start, 6)
+                    token_usage = chunk_token_usage(chunk) or token_usage
+                    yield chunk
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            span.add_usage(token_usage)
+            self.tracer.end_span(span, error if not isinstance(error, GeneratorExit) else None)
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.tracing import Tracer
+#tracer = Tracer("/var/log/taxorank/spans.jsonl", prometheus_path = "/var/lib/node_exporter/textfile/taxorank.prom", prompt_log_sample_rate = 0.01)
+#model_generate_new, model_re_generate, model_verify = init_models(log, tracer = tracer)
+#tax_t = construct_taxonomy("Art", model_generate_new, model_re_generate, model_verify, log = log, tracer = tracer)
+#tax_t = iterate_level(tax_t, 0, model_generate_new, model_re_generate, model_verify, log = log, tracer = tracer)
+#print(tracer.stats())   # {'ranks_list 0, level 1': {'create_subconcepts_list': {count, seconds, token_usage, llm_calls, retries, outcomes...}}}
+#tracer.close()
+#______________________
@@ -0,0 +1,449 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import sqlite3
+import logging
+import argparse
+import threading
+
+from src.core.taxonomy_model import Concept, update_token_usage
+from src.core.helper_functions import run_sync
+from src.core.pipeline_context import PipelineInterrupt, pipeline_scope
+from src.core.taxonomy_construction import ExpansionConfig, ConceptExpansion, aexpand_concepts_batch
+from src.core.expansion_scheduler import ExpansionScheduler
+
+# States of a task of the work queue (the expansion of one concept of one ranks list):
+#   'queued' - waiting for a worker
+#   'leased' - taken by a worker until its lease expires (an expired lease is taken again by another worker)
+#   'done'   - expanded, the result is stored for the coordinator
+#   'failed' - the expansion raised an error (or its lease expired) max_attempts times
+TASK_STATES = ('queued', 'leased', 'done', 'failed')
+
+# Helper function to build the default worker id (host name, process id and a random suffix)
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+# Class for the durable (SQLite) work queue of the distributed expansion, shared by the coordinator and the worker processes.
+#
+# The coordinator enqueues the frontier concepts with everything a worker needs to expand them without the taxonomy
+# (root, ranks list, taxonomical context, definition, names of the existing children). Workers lease tasks for
+# lease_seconds and extend the leases while they work on them; the lease of a crashed worker expires and its tasks
+# are leased again (up to max_attempts leases per task). Every lease is one IMMEDIATE transaction, so any number of
+# processes can share the file; on several machines put it on a shared file system that supports SQLite locking.
+# The tasks are keyed on the taxonomy id (Taxonomy.taxonomy_id), the ranks list and the concept id, so enqueueing them again is idempotent
+class WorkQueue:
+    def __init__(self, path = None, lease_seconds = 120, max_attempts = 3, log = None) -> None:
+        if not path:
+            path = os.path.join(os.getcwd(), 'data', 'runs', 'work_queue.sqlite')
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path               = path
+        self.lease_seconds      = lease_seconds
+        self.max_attempts       = max_attempts
+        self.log                = log
+        self.lock               = threading.Lock()
+        self.connection         = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS tasks (
+            task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            taxonomy TEXT,
+            ranks_list INTEGER,
+            concept_id INTEGER,
+            level INTEGER,
+            payload TEXT,
+            state TEXT DEFAULT 'queued',
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER DEFAULT 0,
+            requeues INTEGER DEFAULT 0,
+            result TEXT,
+            error TEXT,
+            merged INTEGER DEFAULT 0,
+            created_at REAL,
+            updated_at REAL,
+            UNIQUE (taxonomy, ranks_list, concept_id))''')
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, level, task_id)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS tasks_results ON tasks (taxonomy, merged, state)")
+
+    # Helper method running fn(connection) in one IMMEDIATE transaction (the write lock is taken at the start)
+    def transaction(self, fn):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self.connection)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return result
+
+    # Method to add the concepts of a ranks list to the queue, returns the amount of new tasks.
+    # A task already in the queue is kept; if its result was merged or it failed, it is handed to the coordinator
+    # (or queued) again, because the concept is back in the frontier of the taxonomy (e.g. the coordinator was restarted
+    # from a checkpoint older than the merge)
+    def enqueue(self, taxonomy, rank_number, concepts) -> int:
+        now = time.time()
+        ranks = taxonomy.taxonomical_ranks[rank_number].split(',')
+        rows = []
+        for concept in concepts:
+            payload = {'root': taxonomy.root.name, 'ranks': ranks, 'taxonomical_context': taxonomy.taxonomical_context[rank_number], 'name': concept.name,
+                       'taxonomical_rank': concept.taxonomical_rank, 'taxonomical_level': concept.taxonomical_level, 'definition': concept.definition,
+                       'siblings': [child.name for child in concept.children]}
+            rows.append((taxonomy.taxonomy_id, rank_number, concept.concept_id, concept.taxonomical_level, json.dumps(payload, ensure_ascii = False), now, now))
+
+        def insert(connection):
+            before = connection.execute("SELECT COUNT(*) FROM tasks WHERE taxonomy = ?", (taxonomy.taxonomy_id,)).fetchone()[0]
+            connection.executemany('''INSERT INTO tasks (taxonomy, ranks_list, concept_id, level, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+                                      ON CONFLICT (taxonomy, ranks_list, concept_id) DO UPDATE SET merged = 0,
+                                      state = CASE WHEN tasks.state = 'failed' THEN 'queued' ELSE tasks.state END,
+                                      attempts = CASE WHEN tasks.state = 'failed' THEN 0 ELSE tasks.attempts END''', rows)
+            return connection.execute("SELECT COUNT(*) FROM tasks WHERE taxonomy = ?", (taxonomy.taxonomy_id,)).fetchone()[0] - before
+        return self.transaction(insert) if rows else 0
+
+    # Method to lease up to limit tasks for a worker (shallow concepts first). Expired leases are taken over first;
+    # the tasks whose lease expired max_attempts times fail. Returns the task dicts (task_id, taxonomy, ranks_list, concept_id, payload)
+    def lease(self, worker, limit = 1) -> list:
+        def take(connection):
+            now = time.time()
+            connection.execute("UPDATE tasks SET state = 'failed', error = 'lease expired', updated_at = ? WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                               (now, now, self.max_attempts))
+            task_ids = [row[0] for row in connection.execute("SELECT task_id FROM tasks WHERE state = 'leased' AND lease_expires < ? ORDER BY level, task_id LIMIT ?", (now, limit))]
+            if self.log and task_ids:
+                self.log.info(f"worker {worker} takes over {len(task_ids)} expired leases")
+            connection.executemany("UPDATE tasks SET requeues = requeues + 1 WHERE task_id = ?", [(task_id,) for task_id in task_ids])
+            if len(task_ids) < limit:
+                task_ids += [row[0] for row in connection.execute("SELECT task_id FROM tasks WHERE state = 'queued' ORDER BY level, task_id LIMIT ?", (limit - len(task_ids),))]
+            connection.executemany("UPDATE tasks SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE task_id = ?",
+                                   [(worker, now + self.lease_seconds, now, task_id) for task_id in task_ids])
+            tasks = []
+            for task_id in task_ids:
+                taxonomy, ranks_list, concept_id, payload = connection.execute("SELECT taxonomy, ranks_list, concept_id, payload FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+                tasks.append({'task_id': task_id, 'taxonomy': taxonomy, 'ranks_list': ranks_list, 'concept_id': concept_id, 'payload': json.loads(payload)})
+            return tasks
+        return self.transaction(take)
+
+    # Method to extend the leases of the tasks a worker is still working on
+    def heartbeat(self, worker, task_ids) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.executemany("UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE task_id = ? AND worker = ? AND state = 'leased'",
+                                        [(now + self.lease_seconds, now, task_id, worker) for task_id in task_ids])
+
+    # Method to store the results of finished tasks ((task_id, result dict) pairs). The first result of a task is kept:
+    # a worker whose lease expired while it was working may still deliver it, the later result of the task is ignored
+    def complete(self, worker, results) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.executemany("UPDATE tasks SET state = 'done', worker = ?, result = ?, lease_expires = NULL, updated_at = ? WHERE task_id = ? AND state IN ('queued', 'leased')",
+                                        [(worker, json.dumps(result, ensure_ascii = False), now, task_id) for task_id, result in results])
+
+    # Method to record a failed attempt of a task: it is queued again, or fails after max_attempts attempts
+    def fail(self, worker, task_ids, error) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.executemany('''UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, error = ?, lease_expires = NULL, updated_at = ?
+                                           WHERE task_id = ? AND worker = ? AND state = 'leased' ''', [(self.max_attempts, str(error), now, task_id, worker) for task_id in task_ids])
+
+    # Method to give leased tasks back without counting the attempt (the worker stops, e.g. on an exhausted budget)
+    def release(self, worker, task_ids) -> None:
+        now = time.time()
+        with self.lock:
+            self.connection.executemany("UPDATE tasks SET state = 'queued', attempts = attempts - 1, lease_expires = NULL, updated_at = ? WHERE task_id = ? AND worker = ? AND state = 'leased'",
+                                        [(now, task_id, worker) for task_id in task_ids])
+
+    # Method returning the finished tasks of a taxonomy that are not merged yet: (task_id, ranks_list, concept_id, state, result dict or None, error) tuples
+    def results(self, taxonomy_id) -> list:
+        with self.lock:
+            rows = self.connection.execute("SELECT task_id, ranks_list, concept_id, state, result, error FROM tasks WHERE taxonomy = ? AND merged = 0 AND state IN ('done', 'failed') ORDER BY level, task_id",
+                                           (taxonomy_id,)).fetchall()
+        return [(task_id, ranks_list, concept_id, state, json.loads(result) if result else None, error) for task_id, ranks_list, concept_id, state, result, error in rows]
+
+    def mark_merged(self, task_ids) -> None:
+        with self.lock:
+            self.connection.executemany("UPDATE tasks SET merged = 1 WHERE task_id = ?", [(task_id,) for task_id in task_ids])
+
+    # Method returning the amount of queued and leased tasks of a taxonomy
+    def outstanding(self, taxonomy_id) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM tasks WHERE taxonomy = ? AND state IN ('queued', 'leased')", (taxonomy_id,)).fetchone()[0]
+
+    # Method removing the queued (not leased) tasks of a taxonomy, returns their amount
+    def cancel(self, taxonomy_id) -> int:
+        with self.lock:
+            return self.connection.execute("DELETE FROM tasks WHERE taxonomy = ? AND state = 'queued'", (taxonomy_id,)).rowcount
+
+    # Method to get the amount of tasks per state (of one taxonomy or all of them), of the expired leases taken over and of the workers that delivered results
+    def stats(self, taxonomy_id = None) -> dict:
+        where, parameters = ("WHERE taxonomy = ?", (taxonomy_id,)) if taxonomy_id else ("", ())
+        with self.lock:
+            rows = self.connection.execute(f"SELECT state, COUNT(*) FROM tasks {where} GROUP BY state", parameters).fetchall()
+            requeued, workers = self.connection.execute(f"SELECT COALESCE(SUM(requeues), 0), COUNT(DISTINCT CASE WHEN state = 'done' THEN worker END) FROM tasks {where}", parameters).fetchone()
+        counts = dict.fromkeys(TASK_STATES, 0)
+        counts.update(dict(rows))
+        return dict(counts, requeued = requeued, workers = workers, path = self.path)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+# Helper function building the detached concept of a task (the worker has no taxonomy, the children are only needed for their names)
+def task_concept(task) -> Concept:
+    payload = task['payload']
+    concept = Concept(payload['name'], taxonomical_rank = payload['taxonomical_rank'], taxonomical_level = payload['taxonomical_level'], taxonomical_ranks_list_number = task['ranks_list'])
+    concept.definition = payload['definition']
+    concept.children = [Concept(name) for name in payload['siblings']]
+    return concept
+
+# Function to run a worker (async): it leases tasks from the queue, expands them with the generation functions
+# (up to max_concurrency batches of up to batch_size tasks at once) and stores the results for the coordinator.
+# The worker stops after idle_timeout seconds without tasks (None: runs until it is cancelled) or after max_tasks
+# leased tasks. A PipelineInterrupt (exhausted budget, unavailable model) gives the leased tasks back and stops the worker
+async def arun_worker(queue, model_generate_new, model_re_generate, model_verify, worker_id = None, max_concurrency = 8, batch_size = 1, idle_timeout = None, max_tasks = None, poll_interval = 0.5, log = None,
+                      iteration_amm = 5, max_words_context = 40, max_subconcept_lenght = 80, stream_subconcepts = False, stream_postprocess_chunk = None, redundancy_filter = None, structured_output = None, speculation = None, retry_policy = None) -> dict:
+    if not log:
+        log = logging.getLogger("work_queue_worker")
+        logging.basicConfig(level=logging.INFO)
+    if isinstance(queue, str):
+        queue = WorkQueue(queue, log = log)
+    worker_id = worker_id if worker_id else default_worker_id()
+    config = ExpansionConfig(iteration_amm = iteration_amm, max_words_context = max_words_context, max_subconcept_lenght = max_subconcept_lenght, stream_subconcepts = stream_subconcepts, stream_postprocess_chunk = stream_postprocess_chunk, redundancy_filter = redundancy_filter, structured_output = structured_output, speculation = speculation, retry_policy = retry_policy)
+    stats = {'worker': worker_id, 'leased': 0, 'expanded': 0, 'failed': 0, 'released': 0, 'stop_reason': None, 'token_usage': {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}}
+    in_flight = set()
+    last_activity = [time.time()]
+    stop = asyncio.Event()
+    start_time = time.time()
+    log.info(f"worker {worker_id} started on {queue.path}, max concurrency: {max_concurrency}, batch size: {batch_size}")
+
+    async def expand(tasks):
+        # the leased tasks of a batch are grouped by taxonomy, ranks list and level (one batched expansion per group)
+        groups = {}
+        for task in tasks:
+            groups.setdefault((task['taxonomy'], task['ranks_list'], task['payload']['taxonomical_level']), []).append(task)
+        for (_, ranks_list, level), group in groups.items():
+            task_ids = [task['task_id'] for task in group]
+            payload = group[0]['payload']
+            try:
+                with pipeline_scope(ranks_list = ranks_list, level = level + 1):
+                    expansions = await aexpand_concepts_batch([task_concept(task) for task in group], payload['root'], payload['ranks'], payload['taxonomical_context'],
+                                                              model_generate_new, model_re_generate, model_verify, config = config, log = log)
+                await asyncio.to_thread(queue.complete, worker_id, [(task_id, expansion.result()) for task_id, expansion in zip(task_ids, expansions)])
+                stats['expanded'] += len(expansions)
+                for expansion in expansions:
+                    stats['token_usage'] = update_token_usage(stats['token_usage'], expansion.token_usage)
+            except PipelineInterrupt as e:
+                log.info(f"worker {worker_id} interrupted: {e}")
+                stats['token_usage'] = update_token_usage(stats['token_usage'], e.take_token_usage()[0])
+                await asyncio.to_thread(queue.release, worker_id, [task['task_id'] for task in tasks if task['task_id'] in in_flight])
+                stats['released'] += len([task for task in tasks if task['task_id'] in in_flight])
+                stats['stop_reason'] = e.stop_reason
+                in_flight.difference_update(task['task_id'] for task in tasks)
+                stop.set()
+                return
+            except Exception as e:
+                log.info(f"expansion of tasks {task_ids} failed: {e}")
+                await asyncio.to_thread(queue.fail, worker_id, task_ids, e)
+                stats['failed'] += len(task_ids)
+            in_flight.difference_update(task_ids)
+
+    async def slot():
+        while not stop.is_set():
+            limit = batch_size if max_tasks is None else min(batch_size, max_tasks - stats['leased'])
+            if limit <= 0:
+                stats['stop_reason'] = stats['stop_reason'] or 'max_tasks'
+                return
+            tasks = await asyncio.to_thread(queue.lease, worker_id, limit)
+            if not tasks:
+                if idle_timeout is not None and not in_flight and time.time() - last_activity[0] >= idle_timeout:
+                    stats['stop_reason'] = stats['stop_reason'] or 'idle'
+                    stop.set()
+                    return
+                await asyncio.sleep(poll_interval)
+                continue
+            stats['leased'] += len(tasks)
+            in_flight.update(task['task_id'] for task in tasks)
+            await expand(tasks)
+            last_activity[0] = time.time()
+
+    async def heartbeat():
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout = queue.lease_seconds/3)
+            except asyncio.TimeoutError:
+                if in_flight:
+                    await asyncio.to_thread(queue.heartbeat, worker_id, list(in_flight))
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    try:
+        await asyncio.gather(*[slot() for _ in range(max(1, max_concurrency))])
+    finally:
+        stop.set()
+        await heartbeat_task
+    stats['elapsed_seconds'] = time.time() - start_time
+    log.info(f"worker {worker_id} finished ({stats['stop_reason']}): {stats}")
+    return stats
+
+# Function to run a worker (see arun_worker)
+def run_worker(queue, model_generate_new, model_re_generate, model_verify, **kwargs) -> dict:
+    return run_sync(arun_worker(queue, model_generate_new, model_re_generate, model_verify, **kwargs))
+
+# Helper function run by a worker process: the models are created in the process by models_factory
+def worker_process_main(queue_path, models_factory, lease_seconds, worker_kwargs) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    run_worker(WorkQueue(queue_path, lease_seconds = lease_seconds), *models_factory(), **worker_kwargs)
+
+# Function to start worker processes on this machine, returns the started multiprocessing processes.
+# models_factory is a picklable callable (a module-level function or a functools.partial of one) returning the three models;
+# the worker_kwargs of arun_worker must be picklable as well (e.g. no shared redundancy filter)
+def start_worker_processes(queue_path, workers, models_factory, lease_seconds = 120, **worker_kwargs) -> list:
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target = worker_process_main, args = (queue_path, models_factory, lease_seconds, worker_kwargs), daemon = True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    return processes
+
+# Class for the coordinator of the distributed expansion.
+#
+# It works like the expansion scheduler (breadth first, same stop conditions and stats), but the work units go to the
+# work queue instead of an in-process queue: the workers (other processes or machines) expand them, and the coordinator
+# polls the results and merges them into the taxonomy with deduplication, enqueueing the new subconcepts. The taxonomy is
+# only changed by the coordinator, it is checkpointed after every polled batch of results. When a stop condition is met
+# the queued tasks are removed and the leased ones are still waited for and merged. stall_timeout stops the run when no
+# result arrives for that many seconds while tasks are outstanding (e.g. no worker is running)
+class QueueCoordinator(ExpansionScheduler):
+    def __init__(self, taxonomy, work_queue, max_concepts = None, max_depth = None, deadline = None, stall_timeout = None, log = None) -> None:
+        self.work_queue     = work_queue
+        self.stall_timeout  = stall_timeout
+        self.pending        = {}
+        super().__init__(taxonomy, policy = 'breadth_first', max_concepts = max_concepts, max_depth = max_depth, deadline = deadline, log = log)
+        self.stats.update(failed_tasks = 0, enqueued = 0)
+
+    # Method to add a work unit to the tasks to enqueue (units below max_depth are left in the frontier)
+    def push(self, rank_number, concept) -> None:
+        if self.max_depth is not None and concept.taxonomical_level >= self.max_depth:
+            return
+        self.pending.setdefault(rank_number, []).append(concept)
+
+    # Method to enqueue the pending work units
+    def flush(self) -> None:
+        if self.check_stop():
+            self.pending = {}
+            return
+        for rank_number, concepts in self.pending.items():
+            self.stats['enqueued'] += self.work_queue.enqueue(self.taxonomy, rank_number, concepts)
+        self.pending = {}
+
+    # Method to merge the finished tasks into the taxonomy, returns the amount of merged tasks
+    def merge_results(self) -> int:
+        taxonomy = self.taxonomy
+        rows = self.work_queue.results(taxonomy.taxonomy_id)
+        for task_id, rank_number, concept_id, state, result, error in rows:
+            concept = taxonomy.concepts[concept_id]
+            if state == 'failed':
+                # the task is given up like a failed generation: the concept leaves the frontier for the unknown concepts
+                self.log.info(f"task {task_id} (concept {concept_id}, ranks list {rank_number}) failed: {error}")
+                self.stats['failed_tasks'] += 1
+                result = {'definition': concept.definition, 'failed': True}
+            self.merge(rank_number, ConceptExpansion(concept, **result))
+        if rows:
+            taxonomy.checkpoint()
+            self.work_queue.mark_merged([row[0] for row in rows])
+        return len(rows)
+
+    # Method to run the coordinator until the frontier is exhausted or a stop condition is met
+    def run(self, poll_interval = 0.2):
+        taxonomy = self.taxonomy
+        start_time = time.time()
+        last_result = time.time()
+        self.flush()
+        while True:
+            merged = self.merge_results()
+            self.flush()
+            if self.check_stop():
+                cancelled = self.work_queue.cancel(taxonomy.taxonomy_id)
+                if cancelled:
+                    self.log.info(f"{cancelled} queued tasks removed ({self.stop_reason})")
+            if merged:
+                last_result = time.time()
+                continue
+            if not self.work_queue.outstanding(taxonomy.taxonomy_id):
+                break
+            if self.stall_timeout is not None and time.time() - last_result >= self.stall_timeout:
+                self.stop_reason = self.stop_reason or 'stalled'
+                break
+            time.sleep(poll_interval)
+        if not self.stop_reason:
+            self.stop_reason = 'frontier_exhausted'
+        self.stats['elapsed_seconds'] = time.time() - start_time
+        self.stats['stop_reason'] = self.stop_reason
+        self.stats['queue'] = self.work_queue.stats(taxonomy.taxonomy_id)
+        self.log.info(f"queue coordinator finished ({self.stop_reason}): {self.stats}")
+        taxonomy_path = taxonomy.save()
+        self.log.info(f'taxonomy saved as {taxonomy_path}')
+        return taxonomy
+
+# Function to expand the whole taxonomy with workers of a work queue (the workers are started separately, see run_worker,
+# start_worker_processes and the command line below). The queue is a WorkQueue or the path of its file
+def expand_taxonomy_distributed(taxonomy, work_queue, max_concepts = None, max_depth = None, deadline = None, stall_timeout = None, poll_interval = 0.2, log = None, near_duplicates = False):
+    if not log:
+        log = logging.getLogger("expand_taxonomy_distributed")
+        logging.basicConfig(level=logging.INFO)
+    if isinstance(work_queue, str):
+        work_queue = WorkQueue(work_queue, log = log)
+    log.info(f"expand_taxonomy_distributed() queue: {work_queue.path}, max concepts: {max_concepts}, max depth: {max_depth}, deadline: {deadline}")
+    if near_duplicates:
+        taxonomy.enable_near_duplicate_detection()
+    coordinator = QueueCoordinator(taxonomy, work_queue, max_concepts = max_concepts, max_depth = max_depth, deadline = deadline, stall_timeout = stall_timeout, log = log)
+    return coordinator.run(poll_interval = poll_interval)
+
+# Command line of a worker using the models of init_models (the OpenAI API key is read from OPENAI_API_KEY):
+#   python -m src.core.work_queue path/to/work_queue.sqlite --max-concurrency 8 --idle-timeout 600
+def main(argv = None):
+    from src.core.helper_functions import start_session, init_models
+    parser = argparse.ArgumentParser(description = "Run a worker of the distributed taxonomy expansion")
+    parser.add_argument('queue', help = "path of the work queue file")
+    parser.add_argument('--worker-id', default = None)
+    parser.add_argument('--max-concurrency', type = int, default = 8)
+    parser.add_argument('--batch-size', type = int, default = 1)
+    parser.add_argument('--idle-timeout', type = float, default = None, help = "stop after this many seconds without tasks")
+    parser.add_argument('--lease-seconds', type = float, default = 120)
+    parser.add_argument('--iteration-amm', type = int, default = 5)
+    parser.add_argument('--structured-output', default = None, choices = ['json_schema', 'json_object'])
+    parser.add_argument('--redundancy-filter', default = None, choices = ['active', 'shadow'])
+    parser.add_argument('--adaptive-retries', action = 'store_true', help = "tune the candidate count, max_tokens and retry cap per level and give up early on unlikely concepts")
+    parser.add_argument('--speculation-max-waste', type = float, default = None, help = "overlap the verification with the redundancy call and the next attempt, wasting at most this share of the tokens")
+    args = parser.parse_args(argv)
+    log = start_session(api_key = os.environ.get("OPENAI_API_KEY"))
+    redundancy_filter = None
+    if args.redundancy_filter:
+        from src.core.redundancy_filter import LexicalRedundancyFilter
+        redundancy_filter = LexicalRedundancyFilter(mode = args.redundancy_filter, log = log)
+    speculation = None
+    if args.speculation_max_waste is not None:
+        from src.core.speculation import SpeculationPolicy
+        speculation = SpeculationPolicy(max_waste = args.speculation_max_waste, log = log)
+    retry_policy = None
+    if args.adaptive_retries:
+        from src.core.retry_policy import AdaptiveRetryPolicy
+        retry_policy = AdaptiveRetryPolicy(log = log)
+    model_generate_new, model_re_generate, model_verify = init_models(log)
+    stats = run_worker(WorkQueue(args.queue, lease_seconds = args.lease_seconds, log = log), model_generate_new, model_re_generate, model_verify, worker_id = args.worker_id, max_concurrency = args.max_concurrency,
+                       batch_size = args.batch_size, idle_timeout = args.idle_timeout, log = log, iteration_amm = args.iteration_amm, structured_output = args.structured_output, redundancy_filter = redundancy_filter, speculation = speculation, retry_policy = retry_policy)
+    print(json.dumps(stats, indent = 2))
+
+if __name__ == '__main__':
+    main()
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.work_queue import WorkQueue, expand_taxonomy_distributed
+#work_queue = WorkQueue("/shared/runs/work_queue.sqlite", lease_seconds = 120)
+#...on every worker machine:  python -m src.core.work_queue /shared/runs/work_queue.sqlite --max-concurrency 8 --idle-timeout 600
+#tax_t = expand_taxonomy_distributed(tax_t, work_queue, max_concepts = 100000, log = log)
+#print(work_queue.stats(tax_t.taxonomy_id))
+#______________________
@@ -0,0 +1,155 @@
+import logging
+from urllib.parse import unquote
+
+import numpy as np
+
+from src.core.concept_store import ConceptStore, NO_CONCEPT
+from src.core.taxonomy_model import Concept, Taxonomy
+from src.core.name_normalization import get_name_normalizer
+from src.core.taxonomy_index import TaxonomyIntervalIndex
+
+# Helper function for the label of an OWL class without rdfs:label (the IRI's local name)
+def local_name(iri) -> str:
+    iri = str(iri)
+    return unquote(iri.rsplit('#', 1)[-1].rsplit('/', 1)[-1])
+
+# Function to load a gold taxonomy from an OWL/RDF file into a ConceptStore (root concept id 0).
+# Classes are the owl:Class subjects and the rdfs:subClassOf ends, a class with several superclasses
+# is kept under the first one (sorted by label). If there are several top classes they are put under
+# an unnamed root concept (not counted by the evaluation)
+def load_gold_taxonomy(file_path, format = None, log = None) -> ConceptStore:
+    if not log:
+        log = logging.getLogger("load_gold_taxonomy")
+        logging.basicConfig(level=logging.INFO)
+    from rdflib import Graph, URIRef
+    from rdflib.namespace import RDF, RDFS, OWL
+    g = Graph()
+    g.parse(file_path, format = format)
+    classes = set(c for c in g.subjects(RDF.type, OWL.Class) if isinstance(c, URIRef))
+    edges = [(c, p) for c, p in g.subject_objects(RDFS.subClassOf) if isinstance(c, URIRef) and isinstance(p, URIRef) and p != OWL.Thing]
+    classes.update(c for edge in edges for c in edge)
+    classes.discard(OWL.Thing)
+    labels = {c: str(g.value(c, RDFS.label) or local_name(c)) for c in classes}
+    parents = {}
+    for c, p in sorted(edges, key = lambda edge: labels[edge[1]]):
+        if c != p:
+            parents.setdefault(c, p)
+    children = {}
+    for c, p in parents.items():
+        children.setdefault(p, []).append(c)
+    roots = sorted([c for c in classes if c not in parents], key = lambda c: labels[c])
+
+    store = ConceptStore(Concept)
+    if len(roots) == 1:
+        stack = [(roots[0], NO_CONCEPT, 0)]
+    else:
+        store.add_concept(None)
+        stack = [(root, 0, 1) for root in reversed(roots)]
+    while stack:
+        c, parent_id, level = stack.pop()
+        concept_id = store.add_concept(labels[c], parent_id, 'root' if parent_id == NO_CONCEPT else 'gold', level)
+        stack += [(child, concept_id, level + 1) for child in sorted(children.get(c, []), key = lambda child: labels[child], reverse = True)]
+    log.info(f"gold taxonomy loaded from {file_path}: {len(store)} concepts, {len(roots)} top classes, {len(classes) - len(store) + (len(roots) > 1)} classes unreachable (subclass cycles)")
+    return store
+
+# Helper function returning the concept store and its interval index of a Taxonomy or a ConceptStore (root id 0)
+def get_tree(taxonomy):
+    if isinstance(taxonomy, Taxonomy):
+        return taxonomy.concepts, taxonomy.get_interval_index()
+    return taxonomy, TaxonomyIntervalIndex(taxonomy)
+
+# Helper function for the normalized labels of the reachable concepts,
+# returns ({label: first concept id}, labelled mask) - concepts repeating a label are not counted again
+def get_labels(store, index):
+    reachable = [int(i) for i in index.order]
+    names = [store.get_name(i) for i in reachable]
+    named = [(i, name) for i, name in zip(reachable, names) if name]
+    keys = get_name_normalizer().normalize_batch([name for _, name in named])
+    labels = {}
+    for (concept_id, _), key in zip(named, keys):
+        labels.setdefault(key, concept_id)
+    labelled = np.zeros(index.size, dtype = np.int64)
+    labelled[list(labels.values())] = 1
+    return labels, labelled
+
+# Helper function for the semantic cotopy sizes (labelled ancestors + labelled subtree including the concept) of all concepts
+def get_cotopy_sizes(index, labelled):
+    ancestors = np.zeros(index.size, dtype = np.int64)
+    for descendants, ancestor_ids in index.ancestor_pairs():
+        np.add.at(ancestors, descendants, labelled[ancestor_ids])
+    cumulative = np.concatenate([[0], np.cumsum(labelled[index.order])])
+    subtree = np.zeros(index.size, dtype = np.int64)
+    reached = index.order
+    subtree[reached] = cumulative[index.last[reached] + 1] - cumulative[index.pre[reached]]
+    return ancestors + subtree
+
+def f1_score(precision, recall) -> float:
+    return 2*precision*recall/(precision + recall) if precision + recall else 0.0
+
+# Function to evaluate a generated taxonomy against a gold taxonomy (Taxonomy objects or ConceptStores, e.g. from load_gold_taxonomy).
+#
+# Concepts are matched by their normalized names (case folded and lemmatized).
+# Lexical precision/recall: share of the generated/gold concepts found in the other taxonomy.
+# Taxonomic precision/recall: mean over the common concepts of |sc_gen(c) & sc_gold(c)| / |sc_gen(c)| (resp. |sc_gold(c)|),
+# with the semantic cotopy sc(c) = the concept, its ancestors and its descendants (Dellschaft & Staab).
+# The intersections only need the pairs of common concepts on one root path in both taxonomies: the pairs of the generated
+# taxonomy are enumerated level by level from the interval index and checked against the gold index as vector operations
+# (N x depth pairs instead of N^2 cotopy comparisons)
+def evaluate_taxonomy(generated, gold, log = None) -> dict:
+    if not log:
+        log = logging.getLogger("evaluate_taxonomy")
+        logging.basicConfig(level=logging.INFO)
+    generated_store, generated_index = get_tree(generated)
+    gold_store, gold_index = get_tree(gold)
+    generated_labels, generated_labelled = get_labels(generated_store, generated_index)
+    gold_labels, gold_labelled = get_labels(gold_store, gold_index)
+
+    common = [label for label in generated_labels if label in gold_labels]
+    generated_common = np.array([generated_labels[label] for label in common], dtype = np.int64)
+    gold_common = np.array([gold_labels[label] for label in common], dtype = np.int64)
+    to_gold = np.full(generated_index.size, NO_CONCEPT, dtype = np.int64)
+    to_gold[generated_common] = gold_common
+
+    # |sc_gen(c) & sc_gold(c)|: the concept itself + every other common concept comparable with it in both taxonomies
+    intersection = np.zeros(generated_index.size, dtype = np.int64)
+    intersection[generated_common] = 1
+    for descendants, ancestors in generated_index.ancestor_pairs(generated_common):
+        matched = to_gold[ancestors] != NO_CONCEPT
+        descendants, ancestors = descendants[matched], ancestors[matched]
+        comparable = gold_index.is_comparable(to_gold[descendants], to_gold[ancestors])
+        np.add.at(intersection, descendants[comparable], 1)
+        np.add.at(intersection, ancestors[comparable], 1)
+
+    generated_cotopy = get_cotopy_sizes(generated_index, generated_labelled)
+    gold_cotopy = get_cotopy_sizes(gold_index, gold_labelled)
+    lexical_precision = len(common)/len(generated_labels) if generated_labels else 0.0
+    lexical_recall = len(common)/len(gold_labels) if gold_labels else 0.0
+    if len(common):
+        taxonomic_precision = float(np.mean(intersection[generated_common]/generated_cotopy[generated_common]))
+        taxonomic_recall = float(np.mean(intersection[generated_common]/gold_cotopy[gold_common]))
+    else:
+        taxonomic_precision = taxonomic_recall = 0.0
+    taxonomic_f1 = f1_score(taxonomic_precision, taxonomic_recall)
+    result = {
+        'generated_concepts':   len(generated_labels),
+        'gold_concepts':        len(gold_labels),
+        'common_concepts':      len(common),
+        'lexical_precision':    lexical_precision,
+        'lexical_recall':       lexical_recall,
+        'lexical_f1':           f1_score(lexical_precision, lexical_recall),
+        'taxonomic_precision':  taxonomic_precision,
+        'taxonomic_recall':     taxonomic_recall,
+        'taxonomic_f1':         taxonomic_f1,
+        'taxonomic_f_prime':    f1_score(lexical_recall, taxonomic_f1),
+    }
+    log.info(f"taxonomy evaluation: {result}")
+    return result
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.taxonomy_model import load_taxonomy
+#from src.evaluation.evaluation_functions import load_gold_taxonomy, evaluate_taxonomy
+#tax_t = load_taxonomy(path)
+#gold = load_gold_taxonomy("gold_taxonomy.owl")
+#scores = evaluate_taxonomy(tax_t, gold)
+#______________________
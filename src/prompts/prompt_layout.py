@@ -0,0 +1,57 @@
+import string
+import functools
+
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+
+# Helper function returning the variable names of a template text (in order, without repetitions)
+def template_variables(text) -> tuple:
+    return tuple(dict.fromkeys(field for _, field, _, _ in string.Formatter().parse(text or "") if field))
+
+# Class for a prompt template with a prefix-stable layout, used instead of a ChatPromptTemplate (same format_messages call).
+#
+# A prompt is built from three parts, from the most to the least stable:
+#   system  - the static instructions, no variables: one SystemMessage object shared by all the requests
+#   context - the per-taxonomy part (root concept, taxonomical rank and context of the ranks list...), the start of the
+#             human message; it is rendered once per distinct set of its variables and reused from a memo afterwards
+#   request - the per-request part (concept, candidates, definition...), the rest of the human message
+# and an optional AI prefill (the last message). All the requests of the same template and ranks list level thus share the
+# same leading tokens, which the providers' prompt caches can reuse (OpenAI caches prefixes from 1024 tokens on, the
+# cached tokens are reported as cached_prompt_tokens in token_usage), and rendering a prompt only formats the request part
+class PromptLayout:
+    def __init__(self, system, context = "", request = "", prefill = None, context_cache_size = 4096) -> None:
+        if template_variables(system):
+            raise ValueError(f"the system part of a prompt layout must be static, it has the variables {template_variables(system)}")
+        self.system             = system
+        self.context            = context
+        self.request            = request
+        self.prefill            = prefill
+        self.context_variables  = template_variables(context)
+        self.input_variables    = sorted(set(self.context_variables + template_variables(request) + template_variables(prefill)))
+        self.system_message     = SystemMessage(content = system)
+        self.prefill_message    = AIMessage(content = prefill) if prefill is not None and not template_variables(prefill) else None
+        self.render_context     = functools.lru_cache(maxsize = context_cache_size)(self.render_context_values)
+
+    # Method rendering the context part from the values of its variables (memoized by render_context)
+    def render_context_values(self, values) -> str:
+        return self.context.format(**dict(zip(self.context_variables, values)))
+
+    # Method returning the rendered prompt messages (system, human and the optional AI prefill)
+    def format_messages(self, **kwargs) -> list:
+        context = self.render_context(tuple(kwargs[name] for name in self.context_variables)) if self.context_variables else self.context
+        messages = [self.system_message, HumanMessage(content = context + self.request.format(**kwargs))]
+        if self.prefill is not None:
+            messages.append(self.prefill_message if self.prefill_message else AIMessage(content = self.prefill.format(**kwargs)))
+        return messages
+
+    # Method to get the amount of rendered contexts and how often they were reused
+    def stats(self) -> dict:
+        info = self.render_context.cache_info()
+        return {'contexts': info.currsize, 'context_reuses': info.hits, 'context_renders': info.misses}
+
+#EXAMPLE USAGE:
+#______________________
+#from src.prompts.prompt_layout import PromptLayout
+#chat_template = PromptLayout(system = "You are a taxonomy expert.", context = "Root concept: {root_concept}.\n", request = "List the subconcepts of \"{concept}\".")
+#prompt = chat_template.format_messages(root_concept = "Art", concept = "Painting")
+#print(chat_template.stats())
+#______________________
@@ -0,0 +1,131 @@
+import os
+import json
+
+from src.core.owl_export import escape
+from src.visualisation.taxonomy_layout import TaxonomyLayout
+
+# Supported graph formats and their file extensions
+GRAPH_EXPORT_FORMATS = {'graphml': '.graphml', 'dot': '.dot', 'json': '.json'}
+
+# Helper function for the DOT string literal
+def dot_string(text: str) -> str:
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+# Function yielding the nodes of a layout as (concept id, name, rank, level, parent id or None, definition)
+def iterate_graph_nodes(layout, include_definitions = False):
+    store = layout.taxonomy.concepts
+    for concept_id, parent_id, depth in zip(layout.ids.tolist(), layout.parent.tolist(), layout.depth.tolist()):
+        definition = store.definition.get(concept_id) if include_definitions else None
+        yield concept_id, store.get_name(concept_id) or "", store.get_rank(concept_id).strip(), store.level[concept_id], None if parent_id < 0 else parent_id, definition
+
+# Writers of the formats: header lines, lines of a node (with the edge from its parent), footer lines.
+# The nodes are identified by their concept ids (names are not unique), the name is the node label
+
+def graphml_header(include_definitions) -> list:
+    lines = ['<?xml version="1.0" encoding="utf-8"?>',
+             '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">',
+             '  <key id="label" for="node" attr.name="label" attr.type="string"/>',
+             '  <key id="rank" for="node" attr.name="rank" attr.type="string"/>',
+             '  <key id="level" for="node" attr.name="level" attr.type="int"/>']
+    if include_definitions:
+        lines.append('  <key id="definition" for="node" attr.name="definition" attr.type="string"/>')
+    return lines + ['  <graph id="taxonomy" edgedefault="directed">']
+
+def graphml_node(concept_id, name, rank, level, parent_id, definition) -> list:
+    lines = [f'    <node id="n{concept_id}">', f'      <data key="label">{escape(name)}</data>', f'      <data key="rank">{escape(rank)}</data>', f'      <data key="level">{level}</data>']
+    if definition:
+        lines.append(f'      <data key="definition">{escape(definition)}</data>')
+    lines.append('    </node>')
+    if parent_id is not None:
+        lines.append(f'    <edge source="n{parent_id}" target="n{concept_id}"/>')
+    return lines
+
+def graphml_footer() -> list:
+    return ['  </graph>', '</graphml>']
+
+def dot_header(include_definitions) -> list:
+    return ['digraph taxonomy {', '  rankdir=LR;', '  node [shape=box, style=rounded];']
+
+def dot_node(concept_id, name, rank, level, parent_id, definition) -> list:
+    attributes = f'label={dot_string(name)}, rank_name={dot_string(rank)}, level={level}'
+    if definition:
+        attributes += f', tooltip={dot_string(definition)}'
+    lines = [f'  n{concept_id} [{attributes}];']
+    if parent_id is not None:
+        lines.append(f'  n{parent_id} -> n{concept_id};')
+    return lines
+
+def dot_footer() -> list:
+    return ['}']
+
+# JSON: one object {"directed": true, "nodes": [...], "links": [...]} in the node-link format of networkx/d3
+def json_header(include_definitions) -> list:
+    return ['{"directed": true, "multigraph": false, "graph": {"name": "taxonomy"}, "nodes": [']
+
+def json_node(concept_id, name, rank, level, parent_id, definition) -> str:
+    node = {'id': concept_id, 'label': name, 'rank': rank, 'level': level, 'parent': parent_id}
+    if definition:
+        node['definition'] = definition
+    return json.dumps(node, ensure_ascii = False)
+
+# Helper function writing the items of a JSON array in chunks, returns the amount of written items
+def write_json_items(file, items, chunk_size) -> int:
+    written = 0
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            file.write((',\n' if written else '') + ',\n'.join(chunk))
+            written += len(chunk)
+            chunk = []
+    if chunk:
+        file.write((',\n' if written else '') + ',\n'.join(chunk))
+        written += len(chunk)
+    return written
+
+GRAPH_WRITERS = {
+    'graphml':  (graphml_header,    graphml_node,   graphml_footer),
+    'dot':      (dot_header,        dot_node,       dot_footer),
+}
+
+# Function to export a taxonomy (or a part of it, see TaxonomyLayout for root, max_depth and max_nodes_per_level)
+# as a graph file for external viewers (Gephi, yEd, Cytoscape, Graphviz, d3...): 'graphml', 'dot' or 'json' (node-link).
+# The format is taken from the file extension if not given. The nodes are written in chunks of chunk_size, so the
+# memory does not grow with the taxonomy. Returns the amount of exported concepts
+def export_taxonomy_graph(taxonomy, file_path, format = None, root = None, max_depth = None, max_nodes_per_level = None, seed = 0, include_definitions = False, chunk_size = 10000) -> int:
+    if format is None:
+        extension = os.path.splitext(file_path)[1].lower()
+        format = next((name for name, suffix in GRAPH_EXPORT_FORMATS.items() if suffix == extension), None)
+    if format not in GRAPH_EXPORT_FORMATS:
+        raise ValueError(f"unknown graph export format '{format}', expected one of {list(GRAPH_EXPORT_FORMATS)}")
+    layout = TaxonomyLayout(taxonomy, root = root, max_depth = max_depth, max_nodes_per_level = max_nodes_per_level, seed = seed)
+    exported = 0
+    with open(file_path, 'w', encoding = 'utf-8', newline = '\n') as file:
+        if format == 'json':
+            file.write(json_header(include_definitions)[0] + '\n')
+            exported = write_json_items(file, (json_node(*node) for node in iterate_graph_nodes(layout, include_definitions)), chunk_size)
+            file.write('\n], "links": [\n')
+            sources, targets = layout.edges()
+            write_json_items(file, (f'{{"source": {source}, "target": {target}}}' for source, target in zip(layout.ids[sources].tolist(), layout.ids[targets].tolist())), chunk_size)
+            file.write('\n]}\n')
+            return exported
+        header, node_lines, footer = GRAPH_WRITERS[format]
+        chunk = header(include_definitions)
+        for node in iterate_graph_nodes(layout, include_definitions):
+            chunk += node_lines(*node)
+            exported += 1
+            if exported % chunk_size == 0:
+                file.write('\n'.join(chunk) + '\n')
+                chunk = []
+        chunk += footer()
+        file.write('\n'.join(chunk) + '\n')
+    return exported
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.taxonomy_model import load_taxonomy
+#from src.visualisation.graph_export import export_taxonomy_graph
+#tax_t = load_taxonomy(path)
+#export_taxonomy_graph(tax_t, "taxonomy.graphml")
+#export_taxonomy_graph(tax_t, "painting.json", root = "Painting", max_depth = 2, include_definitions = True)
+#______________________
@@ -0,0 +1,103 @@
+import numpy as np
+
+from src.core.concept_store import NO_CONCEPT
+
+# Helper function returning the concept id of a subtree root given as a Concept, a concept id or a concept name (None: the taxonomy root)
+def resolve_concept_id(taxonomy, concept = None) -> int:
+    if concept is None:
+        return taxonomy.root.concept_id
+    if isinstance(concept, (int, np.integer)):
+        return int(concept)
+    if isinstance(concept, str):
+        found = taxonomy.find_known_concept(concept)
+        if found is None:
+            raise KeyError(f"concept '{concept}' not found in the taxonomy")
+        return found.concept_id
+    return concept.concept_id
+
+# Class for the layered layout of a taxonomy (or of one of its subtrees): one column per level, the concepts of
+# a level spread evenly over the height in their pre-order (left-to-right) order, so siblings stay together.
+#
+# The concepts come from the interval index of the taxonomy (a single DFS, cached between the queries) and
+# the positions of all of them are computed at once with NumPy, so the layout of a million concepts takes
+# a few seconds. Limits for large taxonomies:
+#   root                - concept, concept id or name of the subtree to lay out (the taxonomy root by default)
+#   max_depth           - amount of levels below the root
+#   max_nodes_per_level - levels with more concepts are sampled (seeded, keeping their order). The levels are sampled
+#                         top-down among the children of the kept concepts, so every kept concept keeps its parent;
+#                         the amount of left out concepts per level is kept in `omitted`
+# Arrays (one entry per laid out concept, in pre-order): ids, parent (concept ids, NO_CONCEPT for the root), depth, x, y
+class TaxonomyLayout:
+    def __init__(self, taxonomy, root = None, max_depth = None, max_nodes_per_level = None, seed = 0) -> None:
+        index = taxonomy.get_interval_index()
+        root_id = resolve_concept_id(taxonomy, root)
+        self.taxonomy   = taxonomy
+        self.root_id    = root_id
+        ids = np.concatenate([[root_id], index.descendants(root_id)]).astype(np.int64)
+        depth = index.depth[ids] - index.depth[root_id]
+        if max_depth is not None:
+            keep = depth <= max_depth
+            ids, depth = ids[keep], depth[keep]
+        parent = index.parent[ids]
+        parent[0] = NO_CONCEPT
+        self.omitted = {}
+        if max_nodes_per_level and len(ids) > 1:
+            keep = self.sample_levels(index.size, ids, depth, parent, max_nodes_per_level, np.random.default_rng(seed))
+            ids, depth, parent = ids[keep], depth[keep], parent[keep]
+        self.ids        = ids
+        self.parent     = parent
+        self.depth      = depth
+        self.level_sizes = np.bincount(depth) if len(depth) else np.zeros(0, dtype = np.int64)
+        # position of every concept inside its level: a stable sort by depth keeps the pre-order inside the levels
+        by_level = np.argsort(depth, kind = 'stable')
+        level_starts = np.concatenate([[0], np.cumsum(self.level_sizes)[:-1]])
+        position = np.empty(len(ids), dtype = np.int64)
+        position[by_level] = np.arange(len(ids)) - level_starts[depth[by_level]]
+        self.x          = depth.astype(np.float64)
+        self.y          = 1 - (position + 0.5)/self.level_sizes[depth]
+
+    # Method choosing the kept concepts level by level (mask over the pre-order arrays)
+    def sample_levels(self, size, ids, depth, parent, max_nodes_per_level, rng):
+        kept = np.zeros(size, dtype = bool)
+        kept[ids[0]] = True
+        keep = np.zeros(len(ids), dtype = bool)
+        keep[0] = True
+        for level in range(1, int(depth.max()) + 1):
+            at_level = depth == level
+            candidates = np.flatnonzero(at_level & kept[parent])
+            if len(candidates) > max_nodes_per_level:
+                candidates = np.sort(rng.choice(candidates, max_nodes_per_level, replace = False))
+            if int(at_level.sum()) > len(candidates):
+                self.omitted[level] = int(at_level.sum()) - len(candidates)
+            keep[candidates] = True
+            kept[ids[candidates]] = True
+        return keep
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    # Method returning the names of the laid out concepts
+    def names(self) -> list:
+        store = self.taxonomy.concepts
+        return [store.get_name(int(concept_id)) or "" for concept_id in self.ids]
+
+    # Method returning the (laid out) edges as a pair of index arrays into the layout arrays (parent position, child position)
+    def edges(self):
+        positions = np.full(self.taxonomy.get_interval_index().size, -1, dtype = np.int64)
+        positions[self.ids] = np.arange(len(self.ids))
+        children = np.flatnonzero(self.parent != NO_CONCEPT)
+        return positions[self.parent[children]], children
+
+    # Method returning the taxonomical ranks of every level (the ranks lists may name the same level differently)
+    def level_ranks(self) -> list:
+        store = self.taxonomy.concepts
+        return [list(dict.fromkeys(store.get_rank(int(concept_id)).strip() for concept_id in self.ids[self.depth == level][:1000])) for level in range(len(self.level_sizes))]
+
+#EXAMPLE USAGE:
+#______________________
+#from src.core.taxonomy_model import load_taxonomy
+#from src.visualisation.taxonomy_layout import TaxonomyLayout
+#tax_t = load_taxonomy(path)
+#layout = TaxonomyLayout(tax_t, max_depth = 3, max_nodes_per_level = 200)
+#print(len(layout), layout.level_sizes, layout.omitted)
+#______________________
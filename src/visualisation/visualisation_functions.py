@@ -1,60 +1,104 @@
-import networkx as nx
-import matplotlib.pyplot as plt
 import numpy as np
 
+from src.visualisation.taxonomy_layout import TaxonomyLayout
+
+# matplotlib backends without a window (plt.show() does nothing on them)
+NON_INTERACTIVE_BACKENDS = {'agg', 'cairo', 'pdf', 'pgf', 'ps', 'svg', 'template'}
+
+# Helper function for the figure size (inches) of a layout: wider with the depth, taller with the widest level
+# (a line of text per concept when the names are drawn; without names a larger raster only costs drawing time)
+def layout_figsize(layout, max_labels = 300, max_figsize = (60, 200)) -> tuple:
+    levels = len(layout.level_sizes)
+    widest = int(layout.level_sizes.max()) if levels else 1
+    height = 0.22*widest if len(layout) <= max_labels else min(0.02*widest, 40)
+    return (min(max(8.0, 3.5*levels), max_figsize[0]), min(max(6.0, height), max_figsize[1]))
+
+# Function to draw a taxonomy layout on a matplotlib figure. The edges are one line collection and the concepts one
+# scatter, so the drawing time grows slowly with the size; the names are drawn only up to max_labels concepts (text
+# artists are what makes large drawings slow) and the taxonomical ranks of the levels are the column titles.
+# The margins are fixed (no tight bounding box, which draws the figure twice)
+def draw_taxonomy_layout(layout, figure, max_labels = 300, font_size = 8, title = None):
+    from matplotlib.collections import LineCollection
+    ax = figure.add_subplot(1, 1, 1)
+    height = figure.get_figheight()
+    figure.subplots_adjust(left = 0.02, right = 0.98, bottom = 0.2/height, top = 1 - (1.4 if title else 0.9)/height)
+    sources, targets = layout.edges()
+    segments = np.stack([np.column_stack([layout.x[sources], layout.y[sources]]), np.column_stack([layout.x[targets], layout.y[targets]])], axis = 1)
+    ax.add_collection(LineCollection(segments, colors = 'gray', linewidths = 0.6 if len(layout) < 5000 else 0.2, alpha = 0.8, zorder = 1, antialiaseds = len(layout) < 5000))
+    node_size = 60 if len(layout) <= max_labels else max(1.0, 4000/len(layout))
+    ax.scatter(layout.x, layout.y, s = node_size, c = layout.depth, cmap = 'viridis', zorder = 2, linewidths = 0)
+    if len(layout) <= max_labels:
+        for x, y, name in zip(layout.x, layout.y, layout.names()):
+            ax.text(x + 0.03, y, name, fontsize = font_size, va = 'center', ha = 'left', zorder = 3)
+    for level, ranks in enumerate(layout.level_ranks()):
+        omitted = f"\n(+{layout.omitted[level]} not shown)" if level in layout.omitted else ""
+        ax.text(level, 1.0, ', '.join(ranks[:3]) + (', ...' if len(ranks) > 3 else '') + f"\n{layout.level_sizes[level]} concepts" + omitted,
+                fontsize = font_size + 1, fontweight = 'bold', ha = 'center', va = 'bottom', transform = ax.get_xaxis_transform())
+    ax.set_xlim(-0.3, len(layout.level_sizes) - 0.3 + (0.7 if len(layout) <= max_labels else 0))
+    ax.set_ylim(0, 1)
+    ax.axis('off')
+    if title:
+        figure.suptitle(title)
+    return ax
+
+# Function to render a taxonomy (or a part of it, see TaxonomyLayout for root, max_depth and max_nodes_per_level) to an
+# image file (.png, .svg, .pdf...). No display and no pyplot state are used, so it runs on headless workers and in threads.
+# Returns the layout that was drawn
+def render_taxonomy(taxonomy, file_path, root = None, max_depth = None, max_nodes_per_level = None, seed = 0, max_labels = 300, dpi = 100, max_figsize = (60, 200)):
+    from matplotlib.figure import Figure
+    layout = TaxonomyLayout(taxonomy, root = root, max_depth = max_depth, max_nodes_per_level = max_nodes_per_level, seed = seed)
+    figure = Figure(figsize = layout_figsize(layout, max_labels, max_figsize))
+    draw_taxonomy_layout(layout, figure, max_labels = max_labels, title = taxonomy.root.name if root is None else None)
+    figure.savefig(file_path, dpi = dpi)
+    return layout
+
+# Function to build the networkx graph of a layout (nodes keyed by name with their layer and order, edges labelled with the rank)
+def layout_graph(layout, G = None, order = 0):
+    import networkx as nx
+    G = G if G is not None else nx.DiGraph()
+    store = layout.taxonomy.concepts
+    names = layout.names()
+    for position, (name, depth) in enumerate(zip(names, layout.depth.tolist())):
+        G.add_node(name, order = order + position, layer = depth)
+    sources, targets = layout.edges()
+    for source, target in zip(sources.tolist(), targets.tolist()):
+        G.add_edge(names[source], names[target], label = store.get_rank(int(layout.ids[target])))
+    return G
+
+# Function to add the sub-concepts of a concept to a networkx graph (layers counted from the concept), returns the next order
 def add_concepts_to_graph_with_layers(taxonomy, concept, G, layer = 0, order = 0):
-    order+=1
-    ranks_list = []
-    for ranks in taxonomy.taxonomical_ranks:
-        try:
-            ranks_list.append(ranks.split(',')[layer])
-        except:
-            pass
-    children_stack = []
-    for rank in ranks_list:
-        target_children = [child for child in concept.children if child.taxonomical_rank == rank]
-        if target_children:
-            for child in target_children:
-                G.add_node(child.name, order = order, layer=layer + 1)
-                order+=1
-                G.add_edge(concept.name, child.name, label=child.taxonomical_rank)
-                children_stack.append(child)
-                
-    for child in children_stack:
-            order = add_concepts_to_graph_with_layers(taxonomy, child, G, layer + 1, order)
-            
-    return order
-
-def visualize_taxonomy_as_graph_spaced(taxonomy):
-    G = nx.DiGraph()
-    G.add_node(taxonomy.root.name,order = 0, layer=0)
-
-    add_concepts_to_graph_with_layers(taxonomy, taxonomy.root, G)
-    g = G
-    max_layer = max([d['layer'] for n, d in g.nodes(data=True)])
-    max_nodes_am = 0
-    for i in range(0,max_layer+1):
-        if len([n for n, d in g.nodes(data=True) if d['layer'] == i])>max_nodes_am:
-            max_nodes_am = len([n for n, d in g.nodes(data=True) if d['layer'] == i])
-    pos = nx.multipartite_layout(g, subset_key='layer')
-    layer_0_node = [n for n, d in g.nodes(data=True) if d['layer'] == 0]
-    # For layer '0', I want to sort nodes by the 'order' attribute:
-    pos[layer_0_node[0]][1] = max_nodes_am*5
-
-    target_layer = 1
-    while target_layer <= max_layer:
-        layer_nodes = [n for n, d in g.nodes(data=True) if d['layer'] == target_layer]
-        sorted_layer_nodes = sorted(layer_nodes, key=lambda n: g.nodes[n]['order'])
-        # Adjust the positions manually
-        for i, node in enumerate(sorted_layer_nodes):
-            pos[node][1] =  max_nodes_am/len(sorted_layer_nodes)*i*10  # This changes the vertical position (for a vertical layout)
-        target_layer += 1
-    plt.figure(figsize=(30, 15))
-    # Draw the graph with the adjusted positions
-    nx.draw(g, pos, with_labels=True, node_size=1500, node_color="lightblue", font_size=10, font_weight="bold", edge_color="gray")
-    edge_labels = nx.get_edge_attributes(g, 'label')
-    nx.draw_networkx_edge_labels(g, pos, edge_labels=edge_labels, font_size=10)
-    plt.show()
-    return g
+    layout = TaxonomyLayout(taxonomy, root = concept)
+    layout.depth = layout.depth + layer
+    layout_graph(layout, G, order)
+    return order + len(layout)
 
+# Function to visualize the taxonomy as a layered graph, returns the networkx graph of the drawn concepts.
+# With file_path the drawing is saved to the file; show (by default: without file_path, if the matplotlib backend
+# has a window) opens it with plt.show(). The limits of TaxonomyLayout keep large taxonomies readable
+def visualize_taxonomy_as_graph_spaced(taxonomy, file_path = None, show = None, root = None, max_depth = None, max_nodes_per_level = None, seed = 0, max_labels = 300):
+    import matplotlib
+    layout = TaxonomyLayout(taxonomy, root = root, max_depth = max_depth, max_nodes_per_level = max_nodes_per_level, seed = seed)
+    if show is None:
+        show = file_path is None and matplotlib.get_backend().lower() not in NON_INTERACTIVE_BACKENDS
+    if show:
+        import matplotlib.pyplot as plt
+        figure = plt.figure(figsize = layout_figsize(layout, max_labels))
+    else:
+        from matplotlib.figure import Figure
+        figure = Figure(figsize = layout_figsize(layout, max_labels))
+    draw_taxonomy_layout(layout, figure, max_labels = max_labels)
+    if file_path:
+        figure.savefig(file_path)
+    if show:
+        plt.show()
+    return layout_graph(layout)
 
+#EXAMPLE USAGE:
+#______________________
+#from src.core.taxonomy_model import load_taxonomy
+#from src.visualisation.visualisation_functions import render_taxonomy, visualize_taxonomy_as_graph_spaced
+#tax_t = load_taxonomy(path)
+#render_taxonomy(tax_t, "taxonomy.png")
+#render_taxonomy(tax_t, "taxonomy_top.svg", max_depth = 2, max_nodes_per_level = 100)
+#generated_graph = visualize_taxonomy_as_graph_spaced(tax_t)
+#______________________
@@ -0,0 +1,38 @@
+import logging
+
+import pytest
+
+from src.benchmarks.fake_chat_model import init_fake_models
+
+# Shared helpers of the behavior tests. The fake models of the offline benchmarks answer every prompt deterministically
+# (per seed, prompt and occurrence of the prompt), so two runs with the same seed get the same answers;
+# the simulated prompt cache is off, its cached token counts depend on the requests made before
+FAKE_MODEL_SETTINGS = dict(branching = 4, ranks_per_list = 3, prompt_cache_min_tokens = 10**9)
+SEED                = 7
+LOG                 = logging.getLogger("tests")
+LOG.setLevel(logging.WARNING)
+
+# Helper function creating the three fake models of the pipeline (the test settings updated with settings)
+def fake_models(seed = SEED, **settings):
+    return init_fake_models(seed = seed, **dict(FAKE_MODEL_SETTINGS, **settings))
+
+# Helper function returning the comparable state of a taxonomy (concepts, frontier, unknown concepts, levels and token usage)
+def taxonomy_snapshot(taxonomy) -> dict:
+    concepts = []
+    stack = [taxonomy.root]
+    while stack:
+        concept = stack.pop()
+        concepts.append((concept.concept_id, concept.name, concept.parent.concept_id if concept.parent else None, concept.taxonomical_rank, concept.taxonomical_level))
+        stack.extend(concept.children)
+    return {'concepts': sorted(concepts, key = str),
+            'uninspected_concepts': [[concept.concept_id for concept in concepts] for concepts in taxonomy.uninspected_concepts],
+            'unknown_concepts': [sorted(concept.concept_id for concept in concepts) for concepts in taxonomy.unknown_concepts],
+            'current_level': list(taxonomy.current_level),
+            'token_usage': taxonomy.token_usage,
+            'token_usage_by_stage': taxonomy.token_usage_by_stage}
+
+# Fixture running the test in an empty working directory (the taxonomies are saved under the working directory)
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,73 @@
+from src.core.expansion_scheduler import ExpansionScheduler
+from src.core.helper_functions import run_sync
+from src.core.model_wrappers import ChatModelWrapper
+from src.core.taxonomy_construction import ExpansionConfig, construct_taxonomy, iterate_level, aexpand_concepts_batch
+from src.core.taxonomy_generation_functions import parse_batch_sections, parse_batch_lists_answer, parse_batch_verdicts_answer
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the batched multi-concept prompts: one request per stage for the concepts of a batch, the concepts
+# whose section of a batched answer cannot be parsed fall back to the single-concept request of the stage
+
+# Class wrapping a chat model that drops the section of one concept from the batched answers and records the prompts
+class DroppingChatModel(ChatModelWrapper):
+    def __init__(self, model, dropped_section) -> None:
+        super().__init__(model)
+        self.dropped_section    = dropped_section
+        self.prompts            = []
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.prompts.append(prompt[-1].content)
+        response = await self.model.ainvoke(prompt, **kwargs)
+        response.content = '\n'.join(line for line in response.content.splitlines() if not line.startswith(f"[{self.dropped_section}]"))
+        return response
+
+def test_batch_sections_are_parsed_by_number():
+    assert parse_batch_sections("[1] a, b\n(2) c\n3. d\n[3] e\n[5] f", 3) == {0: "a, b", 1: "c", 2: "d"}
+    assert parse_batch_lists_answer("[1] a, b\n[2] \n[3] c", 3) == {0: ["a", "b"], 2: ["c"]}
+    assert parse_batch_verdicts_answer("[1] +\n[2] -\n[3] maybe", 3) == {0: True, 1: False}
+
+def test_batched_level_expands_every_concept_with_fewer_requests(tmp_path, monkeypatch):
+    calls = {}
+    for batch_size in (1, 4):
+        (tmp_path / str(batch_size)).mkdir()
+        monkeypatch.chdir(tmp_path / str(batch_size))
+        models = fake_models()
+        taxonomy = construct_taxonomy("Art", *models, log = LOG)
+        taxonomy = iterate_level(taxonomy, 0, *models, log = LOG)
+        frontier = list(taxonomy.uninspected_concepts[0])
+        calls_before = sum(model.calls for model in models)
+        taxonomy = iterate_level(taxonomy, 0, *models, batch_size = batch_size, max_concurrency = 2, log = LOG)
+        calls[batch_size] = sum(model.calls for model in models) - calls_before
+        assert all(concept.children or concept in taxonomy.unknown_concepts[0] for concept in frontier)
+        assert not any(concept in taxonomy.uninspected_concepts[0] for concept in frontier)
+    assert calls[4] < calls[1]
+
+def test_unparsed_batch_section_falls_back_to_the_single_request(workdir):
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    taxonomy = iterate_level(taxonomy, 0, *models, log = LOG)
+    batch = list(taxonomy.uninspected_concepts[0])[:3]
+    model_generate_new = DroppingChatModel(models[0], dropped_section = 2)
+    expansions = run_sync(aexpand_concepts_batch(batch, taxonomy.root.name, taxonomy.taxonomical_ranks[0].split(','), taxonomy.taxonomical_context[0],
+                                                 model_generate_new, models[1], models[2], config = ExpansionConfig(), log = LOG))
+    assert [expansion.concept for expansion in expansions] == batch
+    assert all(expansion.subconcepts or expansion.failed for expansion in expansions)
+    assert expansions[1].subconcepts
+    # the second concept got its subconcepts list from a single-concept request
+    single_request = lambda concept: any(f'List only the most important subconcepts of "{concept.name}"' in prompt for prompt in model_generate_new.prompts)
+    assert single_request(batch[1])
+    assert not single_request(batch[0]) and not single_request(batch[2])
+    assert expansions[1].token_usage_by_stage['subconcepts']['total_tokens'] > expansions[0].token_usage_by_stage['subconcepts']['total_tokens']
+
+def test_scheduler_takes_queued_siblings_as_one_batch(workdir):
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    taxonomy = iterate_level(taxonomy, 0, *models, log = LOG)
+    frontier = list(taxonomy.uninspected_concepts[0])
+    scheduler = ExpansionScheduler(taxonomy, batch_size = 3, log = LOG)
+    batches = []
+    while scheduler.queue:
+        batches.append(scheduler.pop_batch()[1])
+    assert [len(batch) for batch in batches] == [3, len(frontier) - 3]
+    assert sum(batches, []) == frontier
@@ -0,0 +1,46 @@
+from src.core.concept_index import ConceptNameIndex
+from src.core.helper_functions import Taxonomy, Concept, normalize_concept_name
+from src.core.taxonomy_construction import ConceptExpansion, construct_taxonomy, iterate_level, merge_concept_expansion
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the normalized name index: exact duplicates (case, spacing, plurals) are always found, the near duplicates
+# (word order, one edit in a long word) only with the near-duplicate detection switched on.
+# The names used do not depend on the lemmatization (the NLTK data may be missing)
+
+def test_exact_duplicates_are_found_after_normalization():
+    index = ConceptNameIndex(normalize_concept_name)
+    index.add("Oil Painting", 3)
+    assert index.find("oil  painting") == 3
+    assert "OIL PAINTING" in index
+    assert index.find("Watercolor Painting") is None
+    assert index.find("Painting Oil") is None
+
+def test_near_duplicates_are_found_only_in_the_near_duplicate_mode():
+    for near_duplicates in (False, True):
+        index = ConceptNameIndex(normalize_concept_name, near_duplicates = near_duplicates)
+        index.add("Modern Art", 1)
+        index.add("Colour Theory", 2)
+        index.add("Type A", 3)
+        assert index.find("Art Modern") == (1 if near_duplicates else None)
+        assert index.find("Color Theory") == (2 if near_duplicates else None)
+        # names differing in a short or numeric token are different concepts
+        assert index.find("Type B") is None
+
+def test_add_concepts_drops_the_duplicates(workdir):
+    taxonomy = Taxonomy("Art")
+    added = taxonomy.add_concepts(taxonomy.root, [Concept(name, parent = taxonomy.root) for name in ["Painting", "Sculpture", "painting", "SCULPTURE"]], deduplicate = True)
+    assert [concept.name for concept in added] == ["Painting", "Sculpture"]
+    assert taxonomy.find_known_concept("sculpture") == added[1]
+    assert taxonomy.find_known_concept("art") == taxonomy.root
+
+def test_near_duplicates_flag_rejects_a_near_duplicate_name(workdir):
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    merge_concept_expansion(taxonomy, 0, ConceptExpansion(taxonomy.root, 'Genre', 1, "", ["Modern Art"]), log = LOG)
+    assert not taxonomy.name_index.near_duplicates
+    taxonomy = iterate_level(taxonomy, 0, *models, near_duplicates = True, log = LOG)
+    assert taxonomy.name_index.near_duplicates
+    # the names of the taxonomy built before the switch are indexed as well
+    new_concepts = merge_concept_expansion(taxonomy, 0, ConceptExpansion(taxonomy.root, 'Genre', 1, "", ["Art Modern", "MODERN ART", "Land Art"]), log = LOG)
+    assert [concept.name for concept in new_concepts] == ["Land Art"]
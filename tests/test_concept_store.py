@@ -0,0 +1,92 @@
+import pickle
+
+import pytest
+
+from src.core.concept_store import ConceptStore
+from src.core.helper_functions import Taxonomy, Concept, load_taxonomy
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+
+from conftest import LOG, fake_models, taxonomy_snapshot
+
+# Behavior tests of the array-backed concept store: the concepts of a taxonomy are views over the store, the list idioms
+# of the former concept objects (children.append, +=, taxonomy.concepts += [...]) write through to the store and are journaled
+
+# Helper function returning the names of the children of a concept
+def child_names(concept) -> list:
+    return [child.name for child in concept.children]
+
+def test_children_list_idioms_write_through(workdir):
+    taxonomy = Taxonomy("Art")
+    painting = Concept("Painting", parent = taxonomy.root, taxonomical_rank = 'Genre', taxonomical_level = 1, taxonomical_ranks_list_number = 0)
+    taxonomy.root.children.append(painting)
+    assert painting.store is taxonomy.concepts
+    assert child_names(taxonomy.root) == ["Painting"]
+
+    children = taxonomy.root.children
+    children += [Concept("Sculpture", parent = taxonomy.root), Concept("Music", parent = taxonomy.root)]
+    assert child_names(taxonomy.root) == ["Painting", "Sculpture", "Music"]
+    taxonomy.root.children.remove(painting)
+    taxonomy.root.children.insert(0, painting)
+    taxonomy.root.children.reverse()
+    assert child_names(taxonomy.root) == ["Music", "Sculpture", "Painting"]
+    assert taxonomy.root.children.pop().name == "Painting"
+    assert painting.parent is None
+    painting.parent = taxonomy.root.children[0]
+    assert child_names(taxonomy.root.children[0]) == ["Painting"]
+    assert taxonomy.find_known_concept("sculpture").name == "Sculpture"
+
+def test_concepts_store_takes_detached_concepts(workdir):
+    taxonomy = Taxonomy("Art")
+    painting = Concept("Painting", parent = taxonomy.root)
+    oil = Concept("Oil Painting", parent = painting)
+    taxonomy.concepts += [painting, oil]
+    taxonomy.concepts.append(Concept("Sculpture", parent = taxonomy.root))
+    assert [concept.name for concept in taxonomy.concepts] == ["Art", "Painting", "Oil Painting", "Sculpture"]
+    assert child_names(taxonomy.root) == ["Painting", "Sculpture"]
+    assert oil.parent == painting
+    # concepts of the store are skipped, concepts of another taxonomy or without a stored parent are rejected
+    taxonomy.concepts += [painting]
+    assert len(taxonomy.concepts) == 4
+    with pytest.raises(ValueError):
+        taxonomy.concepts.append(Concept("Music", parent = Concept("Performing Art")))
+    with pytest.raises(ValueError):
+        taxonomy.concepts.append(Taxonomy("Science").root)
+
+def test_reading_the_texts_does_not_create_entries(workdir):
+    taxonomy = Taxonomy("Art")
+    painting = taxonomy.add_concepts(taxonomy.root, [Concept("Painting", parent = taxonomy.root)])[0]
+    assert list(painting.descriptions) == [] and list(painting.definitions) == []
+    assert taxonomy.concepts.descriptions == {} and taxonomy.concepts.definitions == {}
+    painting.descriptions.append("A visual art")
+    painting.definitions = painting.definitions + ["Art of applying paint to a surface"]
+    assert taxonomy.concepts.descriptions == {painting.concept_id: ["A visual art"]}
+    assert painting.definitions == ["Art of applying paint to a surface"]
+    painting.descriptions.clear()
+    assert taxonomy.concepts.descriptions == {}
+
+def test_list_idioms_are_journaled(workdir):
+    taxonomy = Taxonomy("Art", persistence = 'journal')
+    taxonomy.root.children.append(Concept("Painting", parent = taxonomy.root, taxonomical_rank = 'Genre', taxonomical_level = 1, taxonomical_ranks_list_number = 0))
+    taxonomy.concepts += [Concept("Sculpture", parent = taxonomy.root), Concept("Relief", parent = taxonomy.root)]
+    relief = taxonomy.root.children[2]
+    relief.parent = taxonomy.root.children[1]
+    taxonomy.root.children.reverse()
+    taxonomy.close_journal()
+
+    loaded = load_taxonomy(taxonomy.saved_to[0])
+    assert child_names(loaded.root) == ["Sculpture", "Painting"]
+    assert child_names(loaded.root.children[0]) == ["Relief"]
+    assert loaded.root.children[1].taxonomical_rank == 'Genre'
+    assert taxonomy_snapshot(loaded) == taxonomy_snapshot(taxonomy)
+    loaded.close_journal()
+
+def test_pickled_taxonomy_keeps_the_tree(workdir):
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    for _ in range(2):
+        taxonomy = iterate_level(taxonomy, 0, *models, log = LOG)
+    loaded = pickle.loads(pickle.dumps(taxonomy))
+    assert isinstance(loaded.concepts, ConceptStore)
+    assert taxonomy_snapshot(loaded) == taxonomy_snapshot(taxonomy)
+    assert loaded.concepts.observer is loaded
+    assert [concept.name for concept in loaded.root.get_semantic_cotopy(lemmatized = False)[1]] == [concept.name for concept in taxonomy.root.get_semantic_cotopy(lemmatized = False)[1]]
@@ -0,0 +1,38 @@
+import pytest
+
+from src.benchmarks.fake_chat_model import FakeChatModel
+from src.core.helper_functions import run_sync
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+from src.core.taxonomy_generation_functions import check_accepted_taxonomy, aget_concept_definition
+
+from conftest import LOG, fake_models, taxonomy_snapshot
+
+# Behavior tests of the concurrent expansion mode of iterate_level: the expansions run concurrently but are merged
+# in the frontier order, so the taxonomy matches the one of the sequential path
+
+# Helper function creating a taxonomy and expanding its first two levels in its own directory
+def expand_two_levels(directory, monkeypatch, max_concurrency):
+    directory.mkdir()
+    monkeypatch.chdir(directory)
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    for _ in range(2):
+        taxonomy = iterate_level(taxonomy, 0, *models, max_concurrency = max_concurrency, log = LOG)
+    return taxonomy
+
+@pytest.mark.parametrize('max_concurrency', [4, 16])
+def test_concurrent_levels_match_sequential_levels(tmp_path, monkeypatch, max_concurrency):
+    sequential = expand_two_levels(tmp_path / "sequential", monkeypatch, 1)
+    concurrent = expand_two_levels(tmp_path / "concurrent", monkeypatch, max_concurrency)
+    assert len(sequential.concepts) > 1 + 4
+    assert taxonomy_snapshot(concurrent) == taxonomy_snapshot(sequential)
+
+def test_sequential_level_does_not_print_the_frontier(tmp_path, monkeypatch, capsys):
+    taxonomy = expand_two_levels(tmp_path / "sequential", monkeypatch, 1)
+    assert repr(taxonomy.root.children[0]) not in capsys.readouterr().out
+
+def test_failed_requests_return_the_fallback_without_token_usage():
+    model = FakeChatModel(failure_rate = 1.0, occurrences = {})
+    zero_usage = {'completion_tokens': 0, 'prompt_tokens': 0, 'total_tokens': 0}
+    assert check_accepted_taxonomy("Art", model, log = LOG) == (False, zero_usage)
+    assert run_sync(aget_concept_definition("Painting", "Art", "Genre", "Genre > Style", model, log = LOG)) == ("The definition cannot be generated!", zero_usage)
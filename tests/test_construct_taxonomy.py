@@ -0,0 +1,32 @@
+import pytest
+
+from src.core.taxonomy_construction import construct_taxonomy
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the concurrent fan-out of construct_taxonomy: the descriptions/definitions, the criteria per
+# definition and the ranks per criteria are requested concurrently, their results keep the order of the sequential path
+
+# Helper function returning the state of a constructed taxonomy that the requests determine
+def construction_state(taxonomy) -> dict:
+    return {'descriptions': list(taxonomy.root.descriptions), 'definitions': list(taxonomy.root.definitions), 'criteria': taxonomy.taxonomical_criteria,
+            'ranks': taxonomy.taxonomical_ranks, 'context': taxonomy.taxonomical_context, 'token_usage': taxonomy.token_usage, 'token_usage_by_stage': taxonomy.token_usage_by_stage}
+
+@pytest.mark.parametrize('check_existance', [False, True])
+def test_concurrent_construction_matches_sequential_construction(tmp_path, monkeypatch, check_existance):
+    states = []
+    for max_concurrency in (1, 4):
+        (tmp_path / str(max_concurrency)).mkdir()
+        monkeypatch.chdir(tmp_path / str(max_concurrency))
+        taxonomy = construct_taxonomy("Art", *fake_models(), check_existance = check_existance, max_concurrency = max_concurrency, log = LOG)
+        states.append(construction_state(taxonomy))
+    assert states[1] == states[0]
+    assert len(states[0]['criteria']) > 1
+    assert states[0]['ranks'] and len(states[0]['context']) == len(states[0]['ranks'])
+    assert ('existence_check' in states[0]['token_usage_by_stage']) == check_existance
+
+def test_construction_prepares_every_ranks_list(workdir):
+    taxonomy = construct_taxonomy("Art", *fake_models(ranks_lists = 2), max_concurrency = 4, log = LOG)
+    assert len(taxonomy.taxonomical_ranks) == 2
+    assert taxonomy.current_level == [0, 0]
+    assert taxonomy.uninspected_concepts == [[taxonomy.root], [taxonomy.root]]
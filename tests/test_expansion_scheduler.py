@@ -0,0 +1,52 @@
+import pytest
+
+from src.core.helper_functions import run_sync
+from src.core.expansion_scheduler import ExpansionScheduler, expand_taxonomy
+from src.core.taxonomy_construction import construct_taxonomy
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the whole-taxonomy expansion scheduler: the run ends when the frontier is exhausted or a stop
+# condition is met, the concepts that were not expanded stay in the frontier
+
+# Helper function returning the taxonomical levels of the concepts of a taxonomy
+def concept_levels(taxonomy) -> list:
+    return [concept.taxonomical_level for concept in taxonomy.concepts]
+
+@pytest.mark.parametrize('policy', ['breadth_first', 'depth_limited', 'best_first'])
+def test_run_expands_the_whole_taxonomy(workdir, policy):
+    models = fake_models(branching = 3, ranks_per_list = 2)
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    taxonomy = expand_taxonomy(taxonomy, *models, policy = policy, max_concurrency = 4, log = LOG)
+    assert taxonomy.stop_reason is None
+    # only the concepts of the last rank can stay in the frontier (depth_limited does not schedule them)
+    assert all(concept.taxonomical_level == 2 for concept in taxonomy.uninspected_concepts[0])
+    assert max(concept_levels(taxonomy)) == 2
+    assert all(concept.children or concept.taxonomical_level == 2 or concept in taxonomy.unknown_concepts[0] for concept in taxonomy.concepts)
+
+def test_max_concepts_stops_the_run(workdir):
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    scheduler = ExpansionScheduler(taxonomy, max_concepts = 10, log = LOG)
+    taxonomy = run_sync(scheduler.run(*models, max_concurrency = 1))
+    assert scheduler.stop_reason == 'max_concepts'
+    assert 10 <= len(taxonomy.concepts) < 10 + 4
+    assert scheduler.queue and taxonomy.uninspected_concepts[0]
+
+def test_max_depth_leaves_the_deeper_concepts_in_the_frontier(workdir):
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    taxonomy = expand_taxonomy(taxonomy, *models, max_depth = 1, max_concurrency = 4, log = LOG)
+    assert max(concept_levels(taxonomy)) == 1
+    assert taxonomy.uninspected_concepts[0] == taxonomy.root.children
+
+def test_unknown_policy_is_rejected(workdir):
+    taxonomy = construct_taxonomy("Art", *fake_models(), log = LOG)
+    with pytest.raises(ValueError):
+        ExpansionScheduler(taxonomy, policy = 'random')
+
+def test_near_duplicates_flag_switches_on_the_detection(workdir):
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    taxonomy = expand_taxonomy(taxonomy, *models, max_depth = 1, near_duplicates = True, log = LOG)
+    assert taxonomy.name_index.near_duplicates
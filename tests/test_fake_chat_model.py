@@ -0,0 +1,45 @@
+import pytest
+
+from src.benchmarks.fake_chat_model import FakeChatModel, FakeModelError
+from src.benchmarks.run_benchmarks import SCENARIOS, run_scenario
+from src.core.helper_functions import run_sync, gather_with_concurrency
+from src.prompts.prompt_templates import chat_template_define
+
+from conftest import fake_models
+
+# Behavior tests of the deterministic fake chat model and the offline benchmark scenarios: the answers only depend on
+# the seed, the prompt and the occurrence of the prompt, so the runs are reproducible regardless of the concurrency
+
+PROMPTS = [chat_template_define.format_messages(root_concept = "Art", concept = concept, taxonomical_rank = "Genre", taxonomical_context = "Genre > Style", definition_length = 10)
+           for concept in ["Painting", "Sculpture", "Painting", "Music"]]
+
+def test_answers_depend_on_the_seed_prompt_and_occurrence_only():
+    model = fake_models()[0]
+    sequential = [model.invoke(prompt).content for prompt in PROMPTS]
+    model = fake_models()[0]
+    concurrent = [response.content for response in run_sync(gather_with_concurrency(4, [model.ainvoke(prompt) for prompt in PROMPTS]))]
+    assert concurrent == sequential
+    # the repeated prompt gets a new answer (like a regeneration), another seed other answers
+    assert sequential[2] != sequential[0]
+    assert fake_models(seed = 8)[0].invoke(PROMPTS[0]).content != sequential[0]
+
+def test_responses_report_the_token_usage_like_the_openai_models():
+    response = fake_models()[0].invoke(PROMPTS[0], max_tokens = 3)
+    token_usage = response.response_metadata['token_usage']
+    assert token_usage['total_tokens'] == token_usage['prompt_tokens'] + token_usage['completion_tokens']
+    assert response.response_metadata['finish_reason'] == 'length'
+    assert len(response.content) <= 3*4
+
+def test_injected_failures_and_malformed_answers():
+    with pytest.raises(FakeModelError):
+        FakeChatModel(failure_rate = 1.0, occurrences = {}).invoke(PROMPTS[0])
+    model = fake_models(malformed_rate = 1.0)[0]
+    assert model.malform_text("a, b, c") == "1. a, 2. b, 3. c"
+    assert model.malform_text("+") == "+."
+
+def test_small_scenario_is_reproducible():
+    first = run_scenario('small', SCENARIOS['small'], seed = 0)
+    second = run_scenario('small', SCENARIOS['small'], seed = 0)
+    assert first['concepts'] >= SCENARIOS['small']['target_concepts']
+    assert (second['concepts'], second['llm_calls'], second['token_usage']) == (first['concepts'], first['llm_calls'], first['token_usage'])
+    assert first['owl_file_bytes'] and first['taxonomy_file_bytes']
@@ -0,0 +1,109 @@
+import re
+import json
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from src.core.helper_functions import Concept
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+from src.visualisation.graph_export import export_taxonomy_graph
+from src.visualisation.taxonomy_layout import TaxonomyLayout
+from src.visualisation.visualisation_functions import render_taxonomy, visualize_taxonomy_as_graph_spaced
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the headless rendering and the graph export: the layout places every concept of a level in
+# pre-order, the sampled levels keep the parents of their concepts, every export format gives the concept tree
+
+# Helper function building a two-level taxonomy with a concept name that needs escaping
+def drawn_taxonomy():
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    for _ in range(2):
+        taxonomy = iterate_level(taxonomy, 0, *models, log = LOG)
+    taxonomy.add_concepts(taxonomy.root, [Concept('Rock & "Roll" <Music>', parent = taxonomy.root, taxonomical_level = 1)])
+    return taxonomy
+
+# Helper function returning the (parent id, concept id) edges of a taxonomy
+def tree_edges(taxonomy) -> set:
+    return set((concept.parent.concept_id, concept.concept_id) for concept in taxonomy.concepts if concept.parent)
+
+def test_layout_places_the_levels_in_pre_order(workdir):
+    taxonomy = drawn_taxonomy()
+    layout = TaxonomyLayout(taxonomy)
+    assert len(layout) == len(taxonomy.concepts)
+    assert list(layout.level_sizes) == [1, len(taxonomy.root.children), sum(len(concept.children) for concept in taxonomy.root.children)]
+    assert list(layout.x) == [concept.taxonomical_level for concept in map(lambda i: taxonomy.concepts[i], layout.ids.tolist())]
+    for level in range(len(layout.level_sizes)):
+        y = layout.y[layout.depth == level]
+        assert np.all((0 < y) & (y < 1)) and np.all(np.diff(y) < 0)
+    # the children of a concept are drawn next to each other, in their order
+    level_one = [int(i) for i in layout.ids[layout.depth == 1]]
+    assert level_one == [concept.concept_id for concept in taxonomy.root.children]
+
+def test_layout_limits_keep_the_parents(workdir):
+    taxonomy = drawn_taxonomy()
+    top = TaxonomyLayout(taxonomy, max_depth = 1)
+    assert list(top.ids) == [taxonomy.root.concept_id] + [concept.concept_id for concept in taxonomy.root.children]
+    painting = taxonomy.root.children[0]
+    subtree = TaxonomyLayout(taxonomy, root = painting.name)
+    assert list(subtree.ids) == [painting.concept_id] + [concept.concept_id for concept in painting.children]
+    sampled = TaxonomyLayout(taxonomy, max_nodes_per_level = 3, seed = 1)
+    assert all(size <= 3 for size in sampled.level_sizes)
+    level_sizes = TaxonomyLayout(taxonomy).level_sizes
+    assert sampled.omitted == {1: int(level_sizes[1]) - 3, 2: int(level_sizes[2]) - 3}
+    kept = set(sampled.ids.tolist())
+    assert all(parent in kept for parent in sampled.parent[1:].tolist())
+    assert list(TaxonomyLayout(taxonomy, max_nodes_per_level = 3, seed = 1).ids) == list(sampled.ids)
+    with pytest.raises(KeyError):
+        TaxonomyLayout(taxonomy, root = "Unknown Concept")
+
+@pytest.mark.parametrize('format', ['graphml', 'json', 'dot'])
+def test_every_format_exports_the_concept_tree(workdir, format):
+    taxonomy = drawn_taxonomy()
+    file_path = str(workdir / f"taxonomy.{format}")
+    assert export_taxonomy_graph(taxonomy, file_path, include_definitions = True, chunk_size = 4) == len(taxonomy.concepts)
+    if format == 'graphml':
+        graph = nx.read_graphml(file_path)
+        edges = set((int(source[1:]), int(target[1:])) for source, target in graph.edges())
+        labels = {int(node[1:]): data['label'] for node, data in graph.nodes(data = True)}
+        definitions = {int(node[1:]): data.get('definition') for node, data in graph.nodes(data = True)}
+    elif format == 'json':
+        with open(file_path, encoding = 'utf-8') as file:
+            data = json.load(file)
+        edges = set((link['source'], link['target']) for link in data['links'])
+        labels = {node['id']: node['label'] for node in data['nodes']}
+        definitions = {node['id']: node.get('definition') for node in data['nodes']}
+        assert all(node['parent'] == (taxonomy.concepts[node['id']].parent.concept_id if node['id'] else None) for node in data['nodes'])
+    else:
+        with open(file_path, encoding = 'utf-8') as file:
+            text = file.read()
+        edges = set((int(source), int(target)) for source, target in re.findall(r'n(\d+) -> n(\d+);', text))
+        nodes = re.findall(r'^  n(\d+) \[label=("(?:[^"\\]|\\.)*").*?(?:tooltip=("(?:[^"\\]|\\.)*"))?\];$', text, re.M)
+        labels = {int(node): json.loads(label) for node, label, _ in nodes}
+        definitions = {int(node): json.loads(tooltip) if tooltip else None for node, _, tooltip in nodes}
+    assert edges == tree_edges(taxonomy)
+    assert labels == {concept.concept_id: concept.name for concept in taxonomy.concepts}
+    assert definitions == {concept.concept_id: concept.definition or None for concept in taxonomy.concepts}
+
+def test_export_format_comes_from_the_extension(workdir):
+    taxonomy = drawn_taxonomy()
+    assert export_taxonomy_graph(taxonomy, "top.json", max_depth = 1) == 1 + len(taxonomy.root.children)
+    with pytest.raises(ValueError):
+        export_taxonomy_graph(taxonomy, "taxonomy.txt")
+
+@pytest.mark.parametrize('extension', ['png', 'svg'])
+def test_rendering_writes_the_file(workdir, extension):
+    taxonomy = drawn_taxonomy()
+    layout = render_taxonomy(taxonomy, f"taxonomy.{extension}", max_depth = 1)
+    assert len(layout) == 1 + len(taxonomy.root.children)
+    assert (workdir / f"taxonomy.{extension}").stat().st_size > 0
+
+def test_visualization_saves_without_a_window(workdir):
+    taxonomy = drawn_taxonomy()
+    graph = visualize_taxonomy_as_graph_spaced(taxonomy, file_path = "taxonomy.png")
+    assert (workdir / "taxonomy.png").exists()
+    assert set(graph.nodes) == set(concept.name for concept in taxonomy.concepts)
+    assert graph.number_of_edges() == len(taxonomy.concepts) - 1
+    assert graph.nodes[taxonomy.root.children[0].name]['layer'] == 1
@@ -0,0 +1,28 @@
+import pytest
+
+from src.benchmarks.startup_benchmark import STARTUP_SCENARIOS, create_sample_taxonomy, run_startup_once
+from src.core import helper_functions, taxonomy_model
+
+# Behavior tests of the lazy imports: the load/inspect workflows run in fresh interpreters without importing
+# the LLM clients, NLTK, rdflib or NumPy, the moved names keep working through helper_functions
+
+@pytest.fixture(scope = 'module')
+def sample_taxonomy(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("startup"))
+    return create_sample_taxonomy(directory), directory
+
+@pytest.mark.parametrize('scenario', ['import_taxonomy_model', 'import_helper_functions', 'load_taxonomy', 'load_and_inspect'])
+def test_workflow_imports_no_heavy_module(sample_taxonomy, scenario):
+    taxonomy_path, directory = sample_taxonomy
+    result = run_startup_once(STARTUP_SCENARIOS[scenario], taxonomy_path, cwd = directory)
+    assert result['heavy_modules'] == []
+
+def test_first_use_imports_the_dependency(sample_taxonomy):
+    taxonomy_path, directory = sample_taxonomy
+    code = "from src.core.taxonomy_model import load_taxonomy\ntaxonomy = load_taxonomy(TAXONOMY_PATH)\ntaxonomy.close_journal()\ntaxonomy.get_interval_index()"
+    assert run_startup_once(code, taxonomy_path, cwd = directory)['heavy_modules'] == ['numpy']
+
+def test_moved_names_are_re_exported():
+    for name in ['Concept', 'Taxonomy', 'load_taxonomy']:
+        assert getattr(helper_functions, name) is getattr(taxonomy_model, name)
+    assert taxonomy_model.Taxonomy.__module__ == 'src.core.taxonomy_model'
@@ -0,0 +1,60 @@
+import os
+
+from src.core.llm_cache import LLMResponseCache, CachedChatModel
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+from src.prompts.prompt_templates import chat_template_define
+
+from conftest import LOG, fake_models, taxonomy_snapshot
+
+# Behavior tests of the persistent LLM response cache: the identical requests of a session get successive cache slots
+# (misses that reach the model), a rerun in a new session is replayed from the cache slot by slot
+
+PROMPT = chat_template_define.format_messages(root_concept = "Art", concept = "Painting", taxonomical_rank = "Genre", taxonomical_context = "Genre > Style", definition_length = 10)
+
+def test_default_path_is_under_the_working_directory(workdir):
+    cache = LLMResponseCache()
+    assert cache.path == os.path.join(str(workdir), 'data', 'cache', 'llm_cache.sqlite')
+    assert os.path.exists(cache.path)
+    cache.close()
+
+def test_repeated_requests_miss_then_hit_in_a_new_session(workdir):
+    cache = LLMResponseCache(str(workdir / "cache.sqlite"))
+    model = CachedChatModel(fake_models()[0], cache)
+    first = [model.invoke(PROMPT, max_tokens = 100) for _ in range(2)]
+    assert cache.stats()['misses'] == 2 and cache.stats()['hits'] == 0
+    assert model.calls == 2
+    cache.close()
+
+    cache = LLMResponseCache(str(workdir / "cache.sqlite"))
+    model = CachedChatModel(fake_models()[0], cache)
+    replayed = [model.invoke(PROMPT, max_tokens = 100) for _ in range(2)]
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 0
+    assert model.calls == 0
+    assert [response.content for response in replayed] == [response.content for response in first]
+    assert replayed[0].response_metadata['cache_hit']
+    assert replayed[0].response_metadata['token_usage']['total_tokens'] == 0
+    assert replayed[0].response_metadata['token_usage']['cache_hit_total_tokens'] == first[0].response_metadata['token_usage']['total_tokens']
+
+def test_other_request_parameters_miss(workdir):
+    cache = LLMResponseCache(str(workdir / "cache.sqlite"))
+    model = CachedChatModel(fake_models()[0], cache)
+    model.invoke(PROMPT, max_tokens = 100)
+    model.invoke(PROMPT, max_tokens = 50)
+    CachedChatModel(fake_models(seed = 8)[0], cache).invoke(PROMPT, max_tokens = 100)
+    assert cache.stats()['misses'] == 3 and cache.stats()['entries'] == 3
+
+def test_rerun_is_replayed_from_the_cache(tmp_path, monkeypatch):
+    snapshots = []
+    calls = []
+    for run in ("first", "rerun"):
+        (tmp_path / run).mkdir()
+        monkeypatch.chdir(tmp_path / run)
+        cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+        models = [CachedChatModel(model, cache) for model in fake_models()]
+        taxonomy = construct_taxonomy("Art", *models, log = LOG)
+        taxonomy = iterate_level(taxonomy, 0, *models, log = LOG)
+        snapshots.append([concept[1:] for concept in taxonomy_snapshot(taxonomy)['concepts']])
+        calls.append(sum(model.calls for model in models))
+        cache.close()
+    assert snapshots[1] == snapshots[0]
+    assert calls[0] > 0 and calls[1] == 0
@@ -0,0 +1,73 @@
+import os
+
+from src.core import name_normalization
+from src.core.name_normalization import NameNormalizer
+
+# Behavior tests of the memoized name normalization. The computation of a lemma is replaced by a counting stand-in,
+# so the tests check the memo and the persistent memo regardless of the NLTK data available
+
+NAMES = ["Paintings", "Modern  Sculptures", "paintings", "Paintings", "Art"]
+
+# Class counting the names a normalizer lemmatizes (lemma: lower case, trailing 's' removed)
+class CountingCompute:
+    def __init__(self) -> None:
+        self.names = []
+
+    def __call__(self, name):
+        self.names.append(name)
+        return ' '.join(token.lower().removesuffix('s') for token in name.split())
+
+# Helper function returning a normalizer with the counting computation and the given NLTK data status
+def counting_normalizer(monkeypatch, nltk_available = True, **kwargs):
+    monkeypatch.setattr(name_normalization, 'check_nltk_data', lambda *args, **kwargs: {'punkt_tab': nltk_available, 'wordnet': nltk_available})
+    normalizer = NameNormalizer(**kwargs)
+    normalizer.compute = CountingCompute()
+    return normalizer
+
+def test_lemmas_are_memoized(monkeypatch):
+    normalizer = counting_normalizer(monkeypatch, max_entries = 2)
+    assert normalizer.lemmatize("Paintings") == normalizer.lemmatize("Paintings") == "painting"
+    assert normalizer.compute.names == ["Paintings"]
+    assert normalizer.stats()['hits'] == 1 and normalizer.stats()['misses'] == 1
+    # the memo is bounded, the least recently used name is dropped
+    normalizer.lemmatize("Art")
+    normalizer.lemmatize("Music")
+    normalizer.lemmatize("Paintings")
+    assert normalizer.compute.names == ["Paintings", "Art", "Music", "Paintings"]
+    assert normalizer.stats()['entries'] == 2
+
+def test_batch_equals_the_single_names(monkeypatch):
+    batch = counting_normalizer(monkeypatch)
+    single = counting_normalizer(monkeypatch)
+    assert batch.lemmatize_batch(NAMES) == [single.lemmatize(name) for name in NAMES]
+    # every distinct name is lemmatized once
+    assert batch.compute.names == list(dict.fromkeys(NAMES))
+    assert batch.normalize_batch(NAMES) == [single.normalize(name) for name in NAMES] == ["painting", "modern sculpture", "painting", "painting", "art"]
+
+def test_persistent_memo_is_shared_between_normalizers(monkeypatch, tmp_path):
+    path = os.path.join(str(tmp_path), 'cache', 'lemma_cache.sqlite')
+    first = counting_normalizer(monkeypatch, path = path)
+    lemmas = first.lemmatize_batch(NAMES)
+    first.close()
+    second = counting_normalizer(monkeypatch, path = path)
+    assert second.lemmatize_batch(NAMES) == lemmas
+    assert second.compute.names == []
+    assert second.stats()['hits'] == len(set(NAMES))
+    second.close()
+
+def test_lemmas_without_the_nltk_data_are_not_persisted(monkeypatch, tmp_path):
+    path = os.path.join(str(tmp_path), 'lemma_cache.sqlite')
+    first = counting_normalizer(monkeypatch, nltk_available = False, path = path)
+    first.lemmatize_batch(NAMES)
+    first.close()
+    second = counting_normalizer(monkeypatch, path = path)
+    second.lemmatize_batch(NAMES)
+    assert second.compute.names == list(dict.fromkeys(NAMES))
+    second.close()
+
+def test_failing_lemmatization_keeps_the_name(monkeypatch):
+    normalizer = counting_normalizer(monkeypatch)
+    def failing_compute(name):
+        raise LookupError(name)
+    normalizer.compute = failing_compute
+    assert normalizer.lemmatize_batch([" Art "]) == ["Art"]
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+from rdflib import Graph, Literal, URIRef
+from rdflib.namespace import RDF, RDFS, OWL, SKOS
+
+from src.core.helper_functions import Concept
+from src.core.owl_export import ANNOTATION_PROPERTIES, OWL_EXPORT_FORMATS, concept_iri, export_taxonomy_to_owl
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the streamed OWL export: every format gives the same graph (classes, labels, subclass edges and
+# the optional annotations), independently of the chunk size the concepts are written in
+
+RDFLIB_FORMATS = {'xml': 'xml', 'nt': 'nt', 'turtle': 'turtle'}
+
+# Helper function building a two-level taxonomy with a concept name that needs escaping in every format
+def exported_taxonomy():
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    taxonomy = iterate_level(taxonomy, 0, *models, log = LOG)
+    taxonomy.add_concepts(taxonomy.root, [Concept('Rock & "Roll" <Music>\\', parent = taxonomy.root, taxonomical_rank = taxonomy.root.children[0].taxonomical_rank,
+                                                  taxonomical_level = 1, taxonomical_ranks_list_number = 0)])
+    return taxonomy
+
+# Helper function parsing an exported file
+def parse_export(file_path, format) -> Graph:
+    graph = Graph()
+    graph.parse(file_path, format = RDFLIB_FORMATS[format])
+    return graph
+
+@pytest.mark.parametrize('format', list(OWL_EXPORT_FORMATS))
+def test_every_format_exports_the_concept_tree(workdir, format):
+    taxonomy = exported_taxonomy()
+    file_path = str(workdir / ("taxonomy" + OWL_EXPORT_FORMATS[format]))
+    assert export_taxonomy_to_owl(taxonomy, file_path, format = format) == len(taxonomy.concepts)
+
+    graph = parse_export(file_path, format)
+    assert set(graph.subjects(RDF.type, OWL.Class)) == set(URIRef(concept_iri(concept.name)) for concept in taxonomy.concepts)
+    assert set(str(label) for label in graph.objects(None, RDFS.label)) == set(concept.name for concept in taxonomy.concepts)
+    assert set(graph.subject_objects(RDFS.subClassOf)) == set((URIRef(concept_iri(concept.name)), URIRef(concept_iri(concept.parent.name)))
+                                                              for concept in taxonomy.concepts if concept.parent)
+    assert not list(graph.subjects(RDF.type, OWL.AnnotationProperty))
+
+@pytest.mark.parametrize('format', list(OWL_EXPORT_FORMATS))
+def test_annotations_are_exported(workdir, format):
+    taxonomy = exported_taxonomy()
+    file_path = taxonomy.export_to_owl(format = format, include_annotations = True)
+    assert os.path.exists(file_path) and file_path.endswith(OWL_EXPORT_FORMATS[format])
+
+    graph = parse_export(file_path, format)
+    assert len(list(graph.subjects(RDF.type, OWL.AnnotationProperty))) == len(ANNOTATION_PROPERTIES)
+    for concept in taxonomy.concepts:
+        iri = URIRef(concept_iri(concept.name))
+        assert graph.value(iri, URIRef(ANNOTATION_PROPERTIES['rank'])) == Literal(concept.taxonomical_rank.strip())
+        assert graph.value(iri, URIRef(ANNOTATION_PROPERTIES['level'])).toPython() == concept.taxonomical_level
+        assert graph.value(iri, SKOS.definition) == (Literal(concept.definition) if concept.definition else None)
+    assert any(graph.objects(None, SKOS.definition))
+
+@pytest.mark.parametrize('format', list(OWL_EXPORT_FORMATS))
+def test_chunk_size_does_not_change_the_file(workdir, format):
+    taxonomy = exported_taxonomy()
+    export_taxonomy_to_owl(taxonomy, "whole", format = format, include_annotations = True)
+    export_taxonomy_to_owl(taxonomy, "chunked", format = format, include_annotations = True, chunk_size = 3)
+    with open("whole", encoding = 'utf-8') as whole, open("chunked", encoding = 'utf-8') as chunked:
+        assert whole.read() == chunked.read()
+
+def test_unknown_format_is_rejected(workdir):
+    with pytest.raises(ValueError):
+        export_taxonomy_to_owl(exported_taxonomy(), "taxonomy.json", format = 'json')
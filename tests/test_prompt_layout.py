@@ -0,0 +1,80 @@
+import pytest
+
+from src.core.helper_functions import run_sync
+from src.core.pipeline_context import pipeline_scope
+from src.core.prompt_metrics import PromptMetrics, MeasuredChatModel
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+from src.core.taxonomy_model import token_usage_counters
+from src.prompts.prompt_layout import PromptLayout
+from src.prompts.prompt_templates import chat_template_list_subconcepts
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the prefix-stable prompt layout: the requests of a template share the system message and the
+# memoized context, the prompt tokens read from the provider's cache are reported and measured per stage
+
+CONTEXT = dict(root_concept = "Art", taxonomical_rank = "Style", taxonomical_context = "Genre > Style", subconcepts_amount = 10)
+
+# Helper function rendering the subconcepts list prompt of a concept
+def list_prompt(concept):
+    return chat_template_list_subconcepts.format_messages(concept = concept, context_string = "", **CONTEXT)
+
+def test_system_part_must_be_static():
+    with pytest.raises(ValueError):
+        PromptLayout(system = "You are an expert of {root_concept}.")
+
+def test_requests_share_the_leading_messages():
+    layout = PromptLayout(system = "You are a taxonomy expert.", context = "Root concept: {root_concept}.\n", request = "List the subconcepts of \"{concept}\".",
+                          prefill = "Subconcepts of {concept}: ")
+    assert layout.input_variables == ['concept', 'root_concept']
+    first, second = layout.format_messages(root_concept = "Art", concept = "Painting"), layout.format_messages(root_concept = "Art", concept = "Sculpture")
+    assert first[0] is second[0]
+    assert first[1].content == "Root concept: Art.\nList the subconcepts of \"Painting\"."
+    assert second[1].content.startswith("Root concept: Art.\n") and second[2].content == "Subconcepts of Sculpture: "
+    # the context is rendered once per distinct set of its variables
+    layout.format_messages(root_concept = "Music", concept = "Jazz")
+    assert layout.stats() == {'contexts': 2, 'context_reuses': 1, 'context_renders': 2}
+
+def test_static_prefill_is_shared():
+    layout = PromptLayout(system = "You are a taxonomy expert.", request = "Define \"{concept}\".", prefill = "Definition: ")
+    assert layout.format_messages(concept = "Painting")[-1] is layout.format_messages(concept = "Fresco")[-1]
+
+def test_shared_prefix_is_reported_as_cached_tokens():
+    model = fake_models(prompt_cache_min_tokens = 64, prompt_cache_increment = 16)[0]
+    first, second = model.invoke(list_prompt("Painting")), model.invoke(list_prompt("Sculpture"))
+    assert 'prompt_tokens_details' not in first.response_metadata['token_usage']
+    cached_prompt_tokens = token_usage_counters(second.response_metadata['token_usage'])['cached_prompt_tokens']
+    assert 64 <= cached_prompt_tokens < second.response_metadata['token_usage']['prompt_tokens']
+    # the cached prefix is at most the part the two prompts have in common
+    shared = len(list_prompt("Painting")[0].content) + len(list_prompt("Painting")[1].content.split("Painting")[0])
+    assert cached_prompt_tokens <= shared//4
+
+def test_measured_model_counts_per_stage():
+    metrics = PromptMetrics()
+    model = MeasuredChatModel(fake_models(prompt_cache_min_tokens = 64, prompt_cache_increment = 16)[0], metrics)
+    with pipeline_scope(stage = 'subconcepts'):
+        model.invoke(list_prompt("Painting"))
+        run_sync(model.ainvoke(list_prompt("Sculpture")))
+
+    async def stream():
+        return [chunk async for chunk in model.astream(list_prompt("Drawing"))]
+    chunks = run_sync(stream())
+    assert ''.join(chunk.content for chunk in chunks)
+    stats = metrics.stats()
+    subconcepts, other = stats['stages']['subconcepts'], stats['stages']['other']
+    assert (subconcepts['requests'], subconcepts['streamed'], other['requests'], other['streamed']) == (2, 0, 1, 1)
+    assert subconcepts['cached_prompt_tokens'] > 0 and other['cached_prompt_tokens'] > 0
+    assert stats['total']['requests'] == 3 and stats['total']['prompt_tokens'] == subconcepts['prompt_tokens'] + other['prompt_tokens']
+    assert stats['total']['cached_prompt_share'] == round(stats['total']['cached_prompt_tokens']/stats['total']['prompt_tokens'], 4)
+    metrics.reset()
+    assert metrics.stats()['total']['requests'] == 0
+
+def test_level_cached_tokens_match_the_metrics(workdir):
+    metrics = PromptMetrics()
+    models = [MeasuredChatModel(model, metrics) for model in fake_models(prompt_cache_min_tokens = 64, prompt_cache_increment = 16)]
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    taxonomy = iterate_level(taxonomy, 0, *models, max_concurrency = 4, log = LOG)
+    stats = metrics.stats()
+    assert stats['total']['requests'] == sum(model.calls for model in models)
+    assert stats['total']['prompt_tokens'] == taxonomy.token_usage['prompt_tokens']
+    assert 0 < stats['total']['cached_prompt_tokens'] == taxonomy.token_usage['cached_prompt_tokens']
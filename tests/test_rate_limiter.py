@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+from src.benchmarks.fake_chat_model import FakeChatModel
+from src.core.helper_functions import run_sync, gather_with_concurrency
+from src.core.rate_limiter import TokenBucket, RateLimiter, RateLimitedChatModel, ModelUnavailableError, classify_error, get_retry_after
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+from src.prompts.prompt_templates import chat_template_define
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the shared rate limiter: the token buckets pace the requests of a checkpoint, rate limits and
+# transient errors are retried, a model that stays unavailable stops the expansion with stop_reason = 'model_unavailable'
+
+PROMPT = chat_template_define.format_messages(root_concept = "Art", concept = "Painting", taxonomical_rank = "Genre", taxonomical_context = "Genre > Style", definition_length = 10)
+
+# Class for an API error with a status code and the headers of its response
+class APIError(Exception):
+    def __init__(self, status_code = None, headers = None, code = None) -> None:
+        super().__init__(f"status {status_code}")
+        self.status_code    = status_code
+        self.response       = type('Response', (), {'headers': headers or {}, 'status_code': status_code})()
+        self.code           = code
+
+# Class for a model failing with an error on every request
+class FailingChatModel(FakeChatModel):
+    error: Exception = None
+
+    def invoke(self, prompt, **kwargs):
+        self.calls += 1
+        raise self.error
+
+    async def ainvoke(self, prompt, **kwargs):
+        return self.invoke(prompt, **kwargs)
+
+# Helper function returning a limiter retrying without waiting
+def fast_limiter(**kwargs) -> RateLimiter:
+    return RateLimiter(**dict(dict(rate_limits = {}, base_delay = 0.0, seed = 0, log = LOG), **kwargs))
+
+def test_token_bucket_queues_the_callers():
+    bucket = TokenBucket(60)
+    assert bucket.take(60, now = bucket.updated) == 0.0
+    # every further request waits one second more than the one before it
+    assert [bucket.take(1, now = bucket.updated) for _ in range(3)] == pytest.approx([1.0, 2.0, 3.0])
+    bucket.give_back(3, now = bucket.updated + 3.0)
+    assert bucket.take(3, now = bucket.updated) == 0.0
+
+def test_requests_are_paced_by_the_bucket():
+    limiter = fast_limiter(rate_limits = {'fake-chat-model': (1200, None)})
+    model = RateLimitedChatModel(fake_models()[0], limiter)
+    # the first prompt estimate loads the tokenizer, the bucket must not refill meanwhile
+    model.reserve(PROMPT, {})
+    limiter.acquire('fake-chat-model', 0)
+    # the requests/min bucket is empty: 20 requests per second, the requests wait 0.05, 0.1 and 0.15 seconds
+    limiter.buckets['fake-chat-model'][0].level = 0.0
+    start = time.monotonic()
+    run_sync(gather_with_concurrency(3, [model.ainvoke(PROMPT) for _ in range(3)]))
+    assert time.monotonic() - start >= 0.14
+    assert limiter.stats()['fake-chat-model']['waited_seconds'] == pytest.approx(0.3, abs = 0.02)
+
+def test_transient_errors_are_retried():
+    model = fake_models(failure_rate = 0.5)[0]
+    limiter = fast_limiter(max_retries = 30)
+    limited = RateLimitedChatModel(model, limiter)
+    responses = [limited.invoke(PROMPT) for _ in range(10)] + run_sync(gather_with_concurrency(4, [limited.ainvoke(PROMPT) for _ in range(10)]))
+    assert all(response.content for response in responses)
+    stats = limiter.stats()['fake-chat-model']
+    assert stats['retries'] == stats['transient_errors'] == model.failures > 0
+    assert stats['requests'] == model.calls == 20 + model.failures
+
+def test_errors_are_classified():
+    assert classify_error(APIError(429)) == 'rate_limit'
+    assert classify_error(APIError(503)) == classify_error(TimeoutError()) == 'transient'
+    assert classify_error(APIError(401)) == classify_error(APIError(429, code = 'insufficient_quota')) == 'unavailable'
+    assert classify_error(APIError(400)) == classify_error(ValueError()) == 'fatal'
+    assert get_retry_after(APIError(429, {'retry-after': '2'})) == 2.0
+    assert get_retry_after(APIError(429, {'retry-after-ms': '1500'})) == 1.5
+    assert get_retry_after(APIError(429)) is None
+
+def test_rate_limit_pauses_the_checkpoint():
+    limiter = fast_limiter()
+    assert limiter.on_error('fake-chat-model', APIError(429, {'retry-after': '0.2'}), 0) == 0.2
+    assert limiter.acquire('fake-chat-model', 0) > 0.1
+    assert limiter.stats()['fake-chat-model']['rate_limited'] == 1
+
+def test_fatal_errors_are_not_retried():
+    model = FailingChatModel(error = APIError(400))
+    with pytest.raises(APIError):
+        RateLimitedChatModel(model, fast_limiter()).invoke(PROMPT)
+    assert model.calls == 1
+
+def test_unavailable_model_raises_after_the_retries():
+    model = FailingChatModel(error = APIError(503))
+    with pytest.raises(ModelUnavailableError) as error:
+        RateLimitedChatModel(model, fast_limiter(max_retries = 2)).invoke(PROMPT)
+    assert error.value.attempts == model.calls == 3
+    model = FailingChatModel(error = APIError(401))
+    with pytest.raises(ModelUnavailableError):
+        run_sync(RateLimitedChatModel(model, fast_limiter()).ainvoke(PROMPT))
+    assert model.calls == 1
+
+def test_unavailable_model_stops_the_level(workdir):
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    frontier = list(taxonomy.uninspected_concepts[0])
+    limiter = fast_limiter(max_retries = 1)
+    failing = [RateLimitedChatModel(model, limiter) for model in fake_models(failure_rate = 1.0)]
+    taxonomy = iterate_level(taxonomy, 0, *failing, max_concurrency = 4, log = LOG)
+    assert taxonomy.stop_reason == 'model_unavailable'
+    assert taxonomy.uninspected_concepts[0] == frontier
+    assert not any(concept.children for concept in frontier)
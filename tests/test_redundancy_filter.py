@@ -0,0 +1,67 @@
+import pytest
+
+from src.core.redundancy_filter import LexicalRedundancyFilter
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+
+from conftest import LOG, fake_models, taxonomy_snapshot
+
+# Behavior tests of the local redundancy filter: near-duplicates above the duplicate threshold are removed, the LLM
+# redundancy call is skipped below the skip threshold, the shadow mode only counts and changes nothing
+
+CANDIDATES = ["Oil Painting", "Oil Paintings", "Fresco", "Watercolor Technique"]
+
+def test_near_duplicates_above_the_threshold_are_removed():
+    check = LexicalRedundancyFilter(log = LOG).check(CANDIDATES)
+    assert check.candidates == ["Oil Painting", "Fresco", "Watercolor Technique"]
+    assert check.redundant == ["Oil Paintings"]
+    # with a threshold above every similarity nothing is a duplicate, the two oil paintings are too close to skip the LLM call
+    check = LexicalRedundancyFilter(duplicate_threshold = 1.01, log = LOG).check(CANDIDATES)
+    assert check.candidates == CANDIDATES and check.redundant == []
+    assert check.max_similarity > 0.8 and not check.skip_llm
+
+def test_candidates_duplicating_a_sibling_are_removed():
+    check = LexicalRedundancyFilter(log = LOG).check(["Frescos", "Tempera"], siblings = ["Fresco", "Oil Painting"])
+    assert check.candidates == ["Tempera"] and check.redundant == ["Frescos"]
+
+@pytest.mark.parametrize('skip_below, skip_llm', [(0.35, True), (0.0, False), (None, False)])
+def test_llm_call_is_skipped_below_the_skip_threshold(skip_below, skip_llm):
+    redundancy_filter = LexicalRedundancyFilter(skip_below = skip_below, log = LOG)
+    check = redundancy_filter.check(["Fresco", "Tempera", "Watercolor"])
+    assert check.max_similarity < 0.35
+    assert check.skip_llm == skip_llm
+    assert redundancy_filter.stats()['llm_calls_skipped'] == int(skip_llm)
+
+def test_shadow_mode_only_counts():
+    redundancy_filter = LexicalRedundancyFilter(mode = 'shadow', log = LOG)
+    check = redundancy_filter.check(CANDIDATES)
+    assert check.candidates == CANDIDATES and check.redundant == ["Oil Paintings"] and not check.skip_llm
+    redundancy_filter.compare(check, ["oil paintings", "Fresco"])
+    stats = redundancy_filter.stats()
+    assert stats['duplicates_removed'] == stats['llm_calls_skipped'] == 0
+    assert (stats['shadow_checks'], stats['shadow_local_redundant'], stats['shadow_llm_redundant'], stats['shadow_both_redundant']) == (1, 1, 2, 1)
+    # a list left without near-duplicates in which the LLM still found a redundant candidate is a missed skip
+    assert stats['shadow_skippable'] == stats['shadow_skips_missed'] == 1
+    redundancy_filter.compare(redundancy_filter.check(["Fresco", "Tempera"]), [])
+    assert (redundancy_filter.stats()['shadow_skippable'], redundancy_filter.stats()['shadow_skips_missed']) == (2, 1)
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        LexicalRedundancyFilter(mode = 'off')
+
+@pytest.mark.parametrize('max_concurrency', [1, 4])
+def test_filter_in_the_level_expansion(tmp_path, monkeypatch, max_concurrency):
+    results = {}
+    for mode in (None, 'shadow', 'active'):
+        (tmp_path / str(mode)).mkdir()
+        monkeypatch.chdir(tmp_path / str(mode))
+        models = fake_models()
+        taxonomy = construct_taxonomy("Art", *models, log = LOG)
+        calls_before = models[1].calls
+        redundancy_filter = LexicalRedundancyFilter(mode = mode, log = LOG) if mode else None
+        taxonomy = iterate_level(taxonomy, 0, *models, max_concurrency = max_concurrency, redundancy_filter = redundancy_filter, log = LOG)
+        results[mode] = (taxonomy_snapshot(taxonomy)['concepts'], models[1].calls - calls_before, redundancy_filter.stats() if redundancy_filter else None)
+    # the shadow mode leaves the expansion as it is, the active mode skips the LLM redundancy calls of the distinct candidates
+    assert results['shadow'][:2] == results[None][:2]
+    assert results['shadow'][2]['shadow_checks'] == results['shadow'][2]['checks'] > 0
+    assert results['active'][2]['llm_calls_skipped'] > 0
+    assert results['active'][1] == results[None][1] - results['active'][2]['llm_calls_skipped']
@@ -0,0 +1,85 @@
+import pytest
+
+from src.core.helper_functions import Concept
+from src.core.pipeline_context import pipeline_scope
+from src.core.retry_policy import AdaptiveRetryPolicy
+from src.core.taxonomy_construction import ExpansionConfig, construct_taxonomy, iterate_level
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the adaptive retry policy: the settings of a level are tuned once it has enough observations,
+# the retry cap follows the expansions that went on after failing, the outcomes are kept per ranks list being expanded
+
+# Helper function recording the outcomes of a level in a policy: attempts with their redundant candidates and
+# expansions that failed after iteration_amm attempts or succeeded at their first one
+def observe_level(policy, key, attempts = 20, redundant = 0, failed = 30, succeeded = 2, iteration_amm = 5) -> None:
+    for _ in range(attempts):
+        policy.record_attempt(key, 10, True, 50, redundant = redundant)
+    for _ in range(failed):
+        policy.record_expansion(key, iteration_amm, 0, True, False, 3*iteration_amm)
+    for _ in range(succeeded):
+        policy.record_expansion(key, 1, 10, False, False, 4)
+
+def test_plan_keeps_the_settings_before_min_observations():
+    policy = AdaptiveRetryPolicy(min_observations = 20, log = LOG)
+    observe_level(policy, ('root', 1), attempts = 19)
+    config = ExpansionConfig()
+    plan = policy.plan(Concept("Art"), config)
+    assert plan.key == ('root', 1)
+    assert (plan.config.iteration_amm, plan.config.subconcepts_amount, plan.config.subconcepts_max_tokens) == (5, 10, 2800)
+    assert plan.config is not config
+
+def test_plan_tunes_the_observed_level():
+    policy = AdaptiveRetryPolicy(explore_rate = 0.0, log = LOG)
+    observe_level(policy, ('root', 1), redundant = 5)
+    plan = policy.plan(Concept("Art"), ExpansionConfig())
+    # half of the candidates were redundant, so twice the candidates are asked; 5 completion tokens per candidate
+    assert plan.config.subconcepts_amount == 20 and plan.config.stream_max_candidates == 20
+    assert plan.config.subconcepts_max_tokens == 150
+    # the expansions that went on after a failure almost never succeeded: the expansion gives up after one attempt
+    assert plan.config.iteration_amm == 1
+    plan.record_attempt(["Fresco"], False, {'completion_tokens': 5})
+    assert plan.give_up()
+    plan.finish([], True)
+    assert policy.stats()['levels']['ranks_list root, level 1']['gave_up'] == 1
+
+def test_retry_cap_keeps_the_retries_that_pay_off():
+    policy = AdaptiveRetryPolicy(explore_rate = 0.0, log = LOG)
+    observe_level(policy, ('root', 1), failed = 10, succeeded = 0)
+    for _ in range(10):
+        policy.record_expansion(('root', 1), 3, 10, False, False, 9)
+    # half of the expansions that failed twice succeeded at their third attempt
+    assert policy.plan(Concept("Art"), ExpansionConfig()).config.iteration_amm == 5
+
+def test_outcomes_are_kept_per_expanded_ranks_list():
+    policy = AdaptiveRetryPolicy(explore_rate = 0.0, log = LOG)
+    with pipeline_scope(ranks_list = 1):
+        observe_level(policy, (1, 1))
+        assert policy.plan(Concept("Art"), ExpansionConfig()).config.iteration_amm == 1
+    # the root concept expanded for another ranks list is not tuned by the outcomes of ranks list 1
+    assert policy.plan(Concept("Art"), ExpansionConfig(), rank_number = 0).config.iteration_amm == 5
+    assert policy.plan(Concept("Art"), ExpansionConfig(), rank_number = 0).key == (0, 1)
+
+@pytest.mark.parametrize('max_concurrency', [1, 4])
+def test_levels_record_per_ranks_list(workdir, max_concurrency):
+    models = fake_models(ranks_lists = 2)
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    policy = AdaptiveRetryPolicy(log = LOG)
+    for rank_number in (0, 1):
+        taxonomy = iterate_level(taxonomy, rank_number, *models, max_concurrency = max_concurrency, retry_policy = policy, log = LOG)
+    levels = policy.stats()['levels']
+    assert set(levels) == {'ranks_list 0, level 1', 'ranks_list 1, level 1'}
+    assert all(counters['expansions'] == 1 and counters['attempts'] >= 1 for counters in levels.values())
+    assert sum(counters['accepted_concepts'] for counters in levels.values()) == len(taxonomy.concepts) - 1
+
+@pytest.mark.parametrize('max_concurrency', [1, 4])
+def test_expansion_gives_up_at_the_retry_cap(workdir, max_concurrency):
+    models = fake_models(accept_rate = 0.0)
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    policy = AdaptiveRetryPolicy(explore_rate = 0.0, log = LOG)
+    observe_level(policy, (0, 1))
+    calls_before = models[2].calls
+    taxonomy = iterate_level(taxonomy, 0, *models, max_concurrency = max_concurrency, retry_policy = policy, log = LOG)
+    assert taxonomy.unknown_concepts[0] == [taxonomy.root]
+    assert models[2].calls - calls_before == 1
+    assert policy.stats()['levels']['ranks_list 0, level 1']['gave_up'] == 1
@@ -0,0 +1,151 @@
+import os
+import logging
+import multiprocessing
+
+import pytest
+
+import src.core.taxonomy_construction as taxonomy_construction
+from src.benchmarks.fake_chat_model import init_fake_models
+from src.core.model_wrappers import ChatModelWrapper
+from src.core.run_manager import RunManager
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+from src.core.taxonomy_model import load_taxonomy
+
+from conftest import taxonomy_snapshot
+
+# Crash-resume regression test of the run manager: a run is killed in the middle of a level (the process exits without
+# any cleanup), then the level is resumed in a new process state with the same run manager file. The resumed taxonomy
+# must match the one of an uninterrupted run, and no concept whose expansion was stored before the crash may be expanded again.
+# The fake models answer every prompt deterministically (per prompt and occurrence), so both runs get the same answers;
+# the simulated prompt cache is off, its cached token counts depend on the requests made before
+FAKE_MODEL_SETTINGS = dict(branching = 4, ranks_per_list = 3, latency = 0.002, prompt_cache_min_tokens = 10**9)
+SEED                = 7
+CRASH_EXIT_CODE     = 17
+LOG                 = logging.getLogger("test_run_manager")
+LOG.setLevel(logging.WARNING)
+
+# Class wrapping a chat model that kills the process once the shared call counter reaches crash_after
+class CrashingChatModel(ChatModelWrapper):
+    def __init__(self, model, calls, crash_after) -> None:
+        super().__init__(model)
+        self.calls          = calls
+        self.crash_after    = crash_after
+
+    def crash(self) -> None:
+        self.calls[0] += 1
+        if self.calls[0] >= self.crash_after:
+            os._exit(CRASH_EXIT_CODE)
+
+    def invoke(self, prompt, **kwargs):
+        self.crash()
+        return self.model.invoke(prompt, **kwargs)
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.crash()
+        return await self.model.ainvoke(prompt, **kwargs)
+
+# Helper function creating the taxonomy and expanding its first two levels with a run manager
+def start_taxonomy(run_manager, max_concurrency, persistence):
+    models = init_fake_models(seed = SEED, **FAKE_MODEL_SETTINGS)
+    taxonomy = construct_taxonomy("Art", *models, persistence = persistence, log = LOG)
+    for _ in range(2):
+        taxonomy = iterate_level(taxonomy, 0, *models, run_manager = run_manager, max_concurrency = max_concurrency, log = LOG)
+    return taxonomy, models
+
+# Function run in the child process: the first two levels, then the third one is killed after crash_after model calls
+def crashing_run(directory, max_concurrency, persistence, crash_after):
+    os.chdir(directory)
+    run_manager = RunManager(os.path.join(directory, "run_manager.sqlite"), log = LOG)
+    taxonomy, models = start_taxonomy(run_manager, max_concurrency, persistence)
+    with open(os.path.join(directory, "taxonomy_path.txt"), 'w') as file:
+        file.write(taxonomy.saved_to[-1])
+    calls = [0]
+    iterate_level(taxonomy, 0, *[CrashingChatModel(model, calls, crash_after) for model in models], run_manager = run_manager, max_concurrency = max_concurrency, log = LOG)
+    os._exit(0)
+
+# Fixture recording the concepts expanded by the sequential and the concurrent paths of iterate_level
+@pytest.fixture
+def expanded_concepts(monkeypatch):
+    expanded = []
+    expand_concept = taxonomy_construction.expand_concept
+    aexpand_concepts_batch = taxonomy_construction.aexpand_concepts_batch
+
+    def recording_expand_concept(concept, *args, **kwargs):
+        expanded.append(concept.concept_id)
+        return expand_concept(concept, *args, **kwargs)
+
+    async def recording_aexpand_concepts_batch(concepts, *args, **kwargs):
+        expanded.extend(concept.concept_id for concept in concepts)
+        return await aexpand_concepts_batch(concepts, *args, **kwargs)
+
+    monkeypatch.setattr(taxonomy_construction, 'expand_concept', recording_expand_concept)
+    monkeypatch.setattr(taxonomy_construction, 'aexpand_concepts_batch', recording_aexpand_concepts_batch)
+    return expanded
+
+@pytest.mark.parametrize('persistence', ['pickle', 'journal'])
+@pytest.mark.parametrize('max_concurrency', [1, 4])
+def test_resume_after_crash_matches_uninterrupted_run(tmp_path, monkeypatch, expanded_concepts, max_concurrency, persistence):
+    # uninterrupted run
+    reference_directory = tmp_path / "reference"
+    reference_directory.mkdir()
+    monkeypatch.chdir(reference_directory)
+    run_manager = RunManager(str(reference_directory / "run_manager.sqlite"), log = LOG)
+    taxonomy, models = start_taxonomy(run_manager, max_concurrency, persistence)
+    third_level_calls = -sum(model.calls for model in models)
+    taxonomy = iterate_level(taxonomy, 0, *models, run_manager = run_manager, max_concurrency = max_concurrency, log = LOG)
+    third_level_calls += sum(model.calls for model in models)
+    expected = taxonomy_snapshot(taxonomy)
+    run_manager.close()
+
+    # the same run killed in the middle of the third level
+    crash_directory = tmp_path / "crash"
+    crash_directory.mkdir()
+    process = multiprocessing.get_context('spawn').Process(target = crashing_run, args = (str(crash_directory), max_concurrency, persistence, third_level_calls//2))
+    process.start()
+    process.join(timeout = 300)
+    assert process.exitcode == CRASH_EXIT_CODE
+
+    # resumed with new models and the same run manager file
+    monkeypatch.chdir(crash_directory)
+    taxonomy = load_taxonomy((crash_directory / "taxonomy_path.txt").read_text())
+    run_manager = RunManager(str(crash_directory / "run_manager.sqlite"), log = LOG)
+    run = run_manager.resume_iteration(taxonomy, 0)
+    assert run is not None
+    frontier = [concept.concept_id for concept in run.frontier]
+    finished = {concept_id for concept_id, item in run.items.items() if item['state'] in ('done', 'unknown')}
+    assert 0 < len(finished) < len(frontier)
+    del expanded_concepts[:]
+    taxonomy = iterate_level(taxonomy, 0, *init_fake_models(seed = SEED, **FAKE_MODEL_SETTINGS), run_manager = run_manager, max_concurrency = max_concurrency, log = LOG)
+
+    assert not finished & set(expanded_concepts)
+    assert sorted(expanded_concepts) == sorted(set(frontier) - finished)
+    assert run_manager.restored == len(finished)
+    assert run_manager.resume_iteration(taxonomy, 0) is None
+    assert taxonomy_snapshot(taxonomy) == expected
+    run_manager.close()
+
+def test_default_path_is_under_the_working_directory(workdir):
+    run_manager = RunManager(log = LOG)
+    assert run_manager.path == os.path.join(str(workdir), 'data', 'runs', 'run_manager.sqlite')
+    assert os.path.exists(run_manager.path)
+    run_manager.close()
+
+def test_runs_are_keyed_on_the_taxonomy_identity(tmp_path, monkeypatch):
+    taxonomies = []
+    for directory in ("first", "second"):
+        (tmp_path / directory).mkdir()
+        monkeypatch.chdir(tmp_path / directory)
+        taxonomies.append(construct_taxonomy("Art", *init_fake_models(seed = SEED, **FAKE_MODEL_SETTINGS), log = LOG))
+    first, second = taxonomies
+    # two taxonomies with the same name (created in the same instant) do not share their runs
+    second.name = first.name
+    run_manager = RunManager(str(tmp_path / "run_manager.sqlite"), log = LOG)
+    run_manager.start_iteration(first, 0, first.uninspected_concepts[0])
+    assert run_manager.resume_iteration(second, 0) is None
+    # the identity is kept by the saved taxonomy
+    loaded = load_taxonomy(first.save())
+    assert loaded.taxonomy_id == first.taxonomy_id != second.taxonomy_id
+    run = run_manager.resume_iteration(loaded, 0)
+    assert [concept.concept_id for concept in run.frontier] == [concept.concept_id for concept in first.uninspected_concepts[0]]
+    assert run_manager.stats(second) != run_manager.stats(first)
+    run_manager.close()
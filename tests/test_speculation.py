@@ -0,0 +1,69 @@
+import pytest
+
+from src.core.speculation import SpeculationPolicy
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+
+from conftest import LOG, fake_models, taxonomy_snapshot
+
+# Behavior tests of the speculative expansion: a speculative request only starts within the cost ceiling of the policy,
+# the dropped results are counted as waste and the speculated levels give the taxonomy of the sequential stages
+
+def test_discard_probabilities_start_from_the_prior():
+    speculation = SpeculationPolicy(prior_accept_rate = 0.75, prior_weight = 4, log = LOG)
+    assert speculation.discard_probability('redundancy') == pytest.approx(0.25)
+    assert speculation.discard_probability('regeneration') == pytest.approx(0.75)
+    for accepted in (False, False, False, False):
+        speculation.record_attempt(accepted, accepted)
+    assert speculation.discard_probability('redundancy') == pytest.approx(1 - 3/8)
+    assert speculation.discard_probability('regeneration') == pytest.approx(3/8)
+
+def test_requests_stop_at_the_cost_ceiling():
+    speculation = SpeculationPolicy(max_waste = 0.1, log = LOG)
+    assert speculation.allow('redundancy')
+    speculation.finish('redundancy', 'dropped', 100)
+    speculation.spend({'total_tokens': 1000})
+    # 100 wasted tokens of 1000 spent: the next dropped redundancy call would go above a tenth of the tokens
+    assert not speculation.allow('redundancy')
+    speculation.spend({'total_tokens': 1000})
+    assert speculation.allow('redundancy')
+    stats = speculation.stats()
+    assert (stats['wasted_tokens'], stats['spent_tokens'], stats['waste_share']) == (100, 2000, 0.05)
+    assert (stats['kinds']['redundancy']['started'], stats['kinds']['redundancy']['skipped'], stats['kinds']['redundancy']['dropped']) == (2, 1, 1)
+
+def test_cancelled_request_counts_the_mean_tokens():
+    speculation = SpeculationPolicy(max_waste = 1.0, log = LOG)
+    speculation.finish('regeneration', 'used', 300)
+    speculation.finish('regeneration', 'cancelled')
+    assert speculation.stats()['wasted_tokens'] == 300
+    assert speculation.stats()['kinds']['regeneration']['requests'] == 1
+    speculation.reset()
+    assert speculation.stats()['wasted_tokens'] == 0
+
+def test_zero_ceiling_starts_nothing():
+    speculation = SpeculationPolicy(max_waste = 0.0, log = LOG)
+    speculation.spend({'total_tokens': 1000})
+    assert not speculation.allow('redundancy') and not speculation.allow('regeneration')
+
+@pytest.mark.parametrize('max_waste', [0.0, 0.1, 1.0])
+def test_speculated_levels_give_the_sequential_taxonomy(tmp_path, monkeypatch, max_waste):
+    results = {}
+    for speculated in (False, True):
+        (tmp_path / str(speculated)).mkdir()
+        monkeypatch.chdir(tmp_path / str(speculated))
+        models = fake_models(accept_rate = 0.7)
+        speculation = SpeculationPolicy(max_waste = max_waste, log = LOG) if speculated else None
+        taxonomy = construct_taxonomy("Art", *models, log = LOG)
+        for _ in range(2):
+            taxonomy = iterate_level(taxonomy, 0, *models, max_concurrency = 4, speculation = speculation, log = LOG)
+        results[speculated] = (taxonomy_snapshot(taxonomy)['concepts'], taxonomy.token_usage['total_tokens'], speculation)
+    assert results[True][0] == results[False][0]
+    stats = results[True][2].stats()
+    assert stats['attempts'] > 0
+    # the tokens of the dropped requests are counted in the taxonomy, the waste stays within the ceiling
+    assert results[True][1] >= results[False][1]
+    assert stats['waste_share'] <= max_waste
+    if max_waste == 0.0:
+        assert results[True][1] == results[False][1]
+        assert stats['wasted_tokens'] == 0 and all(counters['started'] == 0 for counters in stats['kinds'].values())
+    else:
+        assert stats['kinds']['redundancy']['used'] > 0
@@ -0,0 +1,66 @@
+import pytest
+
+from src.core.helper_functions import run_sync
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+from src.core.taxonomy_generation_functions import CommaSeparatedStreamParser, astream_subconcepts_list
+from src.prompts.prompt_templates import chat_template_list_subconcepts
+
+from conftest import LOG, fake_models, taxonomy_snapshot
+
+# Behavior tests of the streamed subconcepts lists: the incremental parser gives the items of the whole answer,
+# the stream is cut off once enough candidates are accepted
+
+ARGUMENTS = ("Painting", "Art", "Style", "Genre > Style", "Art of applying paint")
+
+# Helper function returning the complete (not streamed) answer of a fresh model to the streamed prompt
+def complete_answer(**settings) -> str:
+    concept, root_concept, taxonomical_rank, taxonomical_context, definition = ARGUMENTS
+    prompt = chat_template_list_subconcepts.format_messages(root_concept = root_concept, concept = concept, context_string = " " + definition, taxonomical_rank = taxonomical_rank,
+                                                            taxonomical_context = taxonomical_context, subconcepts_amount = 10)
+    return fake_models(**settings)[0].invoke(prompt, max_tokens = 2800)
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 100])
+def test_parser_yields_the_items_of_the_whole_text(chunk_size):
+    for text in ["a, b,c , d", "Oil Painting, Fresco,  Tempera", "", "single", "trailing, ", ",leading"]:
+        parser = CommaSeparatedStreamParser()
+        items = []
+        for i in range(0, len(text), chunk_size):
+            items += parser.feed(text[i:i + chunk_size])
+        items += parser.close()
+        assert items == text.replace(', ', ',').split(',')
+
+def test_stream_gives_the_complete_list():
+    answer = complete_answer(branching = 6)
+    candidates, token_usage = run_sync(astream_subconcepts_list(*ARGUMENTS, fake_models(branching = 6)[0], log = LOG))
+    assert candidates == answer.content.replace(', ', ',').split(',')
+    assert token_usage['total_tokens'] == answer.response_metadata['token_usage']['total_tokens']
+    assert 'stream_cutoffs' not in token_usage
+
+def test_stream_is_cut_off_after_max_candidates():
+    answer = complete_answer(branching = 10)
+    names = answer.content.split(', ')
+    accepted = []
+    candidate_filter = lambda candidate: None if candidate == names[1] else candidate.upper()
+    candidates, token_usage = run_sync(astream_subconcepts_list(*ARGUMENTS, fake_models(branching = 10)[0], max_candidates = 3,
+                                                                candidate_filter = candidate_filter, on_candidate = accepted.append, log = LOG))
+    assert candidates == accepted == [names[0].upper(), names[2].upper(), names[3].upper()]
+    assert token_usage['stream_cutoffs'] == 1
+    # the usage of the cancelled stream is estimated from the received chunks
+    assert 0 < token_usage['completion_tokens'] < answer.response_metadata['token_usage']['completion_tokens']
+
+def test_failed_stream_gives_the_fallback():
+    candidates, token_usage = run_sync(astream_subconcepts_list(*ARGUMENTS, fake_models(failure_rate = 1.0)[0], log = LOG))
+    assert candidates == ["None"]
+    assert token_usage['total_tokens'] == 0
+
+@pytest.mark.parametrize('stream_postprocess_chunk', [None, 2])
+def test_streamed_level_gives_the_taxonomy_of_the_complete_lists(tmp_path, monkeypatch, stream_postprocess_chunk):
+    snapshots = []
+    for stream_subconcepts in (False, True):
+        (tmp_path / str(stream_subconcepts)).mkdir()
+        monkeypatch.chdir(tmp_path / str(stream_subconcepts))
+        models = fake_models()
+        taxonomy = construct_taxonomy("Art", *models, log = LOG)
+        taxonomy = iterate_level(taxonomy, 0, *models, max_concurrency = 4, stream_subconcepts = stream_subconcepts, stream_postprocess_chunk = stream_postprocess_chunk, log = LOG)
+        snapshots.append(taxonomy_snapshot(taxonomy)['concepts'])
+    assert snapshots[0] == snapshots[1]
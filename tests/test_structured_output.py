@@ -0,0 +1,102 @@
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from src.core.helper_functions import run_sync
+from src.core.structured_output import (STRUCTURED_SCHEMAS, api_schema, response_format, parse_structured, validate_structured,
+                                        invoke_structured, ainvoke_structured, structured_output_metrics)
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+from src.prompts.prompt_templates import chat_template_define
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the structured-output mode: the answers are validated locally against their schema, the harmless
+# deviations are fixed locally and the invalid answers get a targeted repair request instead of a regeneration
+
+PROMPT = chat_template_define.format_messages(root_concept = "Art", concept = "Painting", taxonomical_rank = "Genre", taxonomical_context = "Genre > Style", definition_length = 10)
+
+# Class for a model answering with the scripted texts in turn and recording the messages it got
+class ScriptedChatModel:
+    def __init__(self, answers) -> None:
+        self.answers    = list(answers)
+        self.prompts    = []
+
+    def invoke(self, prompt, **kwargs):
+        self.prompts.append((prompt, kwargs))
+        return AIMessage(content = self.answers.pop(0), response_metadata = {'token_usage': {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15}})
+
+    async def ainvoke(self, prompt, **kwargs):
+        return self.invoke(prompt, **kwargs)
+
+@pytest.fixture(autouse = True)
+def metrics():
+    structured_output_metrics.reset()
+    yield structured_output_metrics
+    structured_output_metrics.reset()
+
+def test_validation_reports_every_error():
+    assert validate_structured({'items': ["Oil Painting", "Fresco"]}, STRUCTURED_SCHEMAS['names']) == []
+    errors = validate_structured({'items': ["1. Oil Painting", "", "Two\nLines", 3], 'extra': 1}, STRUCTURED_SCHEMAS['names'])
+    assert errors == ["$: unexpected field 'extra'", '$.items[0]: "1. Oil Painting" is not a single unnumbered name', '$.items[1]: empty string',
+                      '$.items[1]: "" is not a single unnumbered name', '$.items[2]: "Two\\nLines" is not a single unnumbered name', '$.items[3]: expected a string']
+    assert validate_structured({}, STRUCTURED_SCHEMAS['yes_no']) == ["$: missing field 'answer'"]
+    assert validate_structured({'answer': 'yes'}, STRUCTURED_SCHEMAS['yes_no']) == ["$.answer: expected true or false"]
+    assert validate_structured({'ranks_lists': []}, STRUCTURED_SCHEMAS['ranks_lists']) == ["$.ranks_lists: expected at least 1 items, got 0"]
+    assert validate_structured({'ids': [1, True]}, STRUCTURED_SCHEMAS['ids']) == ["$.ids[1]: expected an integer"]
+
+def test_api_schema_leaves_out_the_local_keywords():
+    schema = json.dumps(response_format('names', STRUCTURED_SCHEMAS['names']))
+    assert 'pattern' not in schema and 'minLength' not in schema and '"strict": true' in schema
+    assert api_schema(STRUCTURED_SCHEMAS['names'])['properties']['items']['items'] == {'type': 'string'}
+    assert response_format('names', STRUCTURED_SCHEMAS['names'], mode = 'json_object') == {'type': 'json_object'}
+
+def test_harmless_deviations_are_fixed_locally():
+    assert parse_structured('{"answer": true}') == ({'answer': True}, [], False)
+    assert parse_structured('```json\n{"answer": true}\n```') == ({'answer': True}, [], True)
+    assert parse_structured('Sure! {"answer": false} Hope it helps') == ({'answer': False}, [], True)
+    value, errors, fixed = parse_structured('{"answer": tru')
+    assert value is None and errors[0].startswith("invalid JSON") and not fixed
+
+def test_locally_fixed_answer_needs_no_repair(metrics):
+    model = ScriptedChatModel(['```json\n{"items": ["Oil Painting", "Fresco"]}\n```'])
+    value, token_usage = invoke_structured(model, PROMPT, 'names', 50, log = LOG)
+    assert value == {'items': ["Oil Painting", "Fresco"]}
+    assert len(model.prompts) == 1 and token_usage['total_tokens'] == 15
+    assert model.prompts[0][1]['response_format']['type'] == 'json_schema'
+    counters = metrics.stats()['structured']['unknown']
+    assert (counters['responses'], counters['parse_failures'], counters['local_fixes'], counters['repair_requests']) == (1, 1, 1, 0)
+
+def test_invalid_answer_gets_a_targeted_repair(metrics):
+    model = ScriptedChatModel(['{"items": ["1. Oil Painting", "2. Fresco"]}', '{"items": ["Oil Painting", "Fresco"]}'])
+    value, token_usage = run_sync(ainvoke_structured(model, PROMPT, 'names', 50, mode = 'json_object', log = LOG))
+    assert value == {'items': ["Oil Painting", "Fresco"]}
+    assert token_usage['total_tokens'] == 30 and token_usage['structured_repairs'] == 1
+    # the repair request has the invalid answer and the errors, not the original prompt
+    repair_prompt = '\n'.join(message.content for message in model.prompts[1][0])
+    assert '1. Oil Painting' in repair_prompt and 'is not a single unnumbered name' in repair_prompt
+    assert PROMPT[-1].content not in repair_prompt
+    assert model.prompts[1][1]['response_format'] == {'type': 'json_object'}
+    counters = metrics.stats()['structured']['unknown']
+    assert (counters['repair_requests'], counters['repaired'], counters['unrepaired']) == (1, 1, 0)
+
+def test_unrepaired_answer_gives_none(metrics):
+    model = ScriptedChatModel(['not json', '{"items": ["1. Oil Painting"]}', '{"items": []'])
+    value, token_usage = invoke_structured(model, PROMPT, 'names', 50, max_repairs = 2, log = LOG)
+    assert value is None
+    assert len(model.prompts) == 3 and token_usage['structured_repairs'] == 2
+    counters = metrics.stats()['structured']['total']
+    assert (counters['repair_requests'], counters['repaired'], counters['unrepaired'], counters['calls_saved']) == (2, 0, 1, -2)
+
+@pytest.mark.parametrize('structured_output', ['json_schema', 'json_object'])
+def test_structured_level_with_malformed_answers(workdir, metrics, structured_output):
+    models = fake_models(malformed_rate = 0.3)
+    taxonomy = construct_taxonomy("Art", *models, structured_output = structured_output, log = LOG)
+    frontier = list(taxonomy.uninspected_concepts[0])
+    taxonomy = iterate_level(taxonomy, 0, *models, max_concurrency = 4, structured_output = structured_output, log = LOG)
+    assert all(concept.children or concept in taxonomy.unknown_concepts[0] for concept in frontier)
+    assert sum(len(concept.children) for concept in frontier) > 0
+    counters = metrics.stats()['structured']['total']
+    assert counters['parse_failures'] > 0
+    assert counters['local_fixes'] + counters['repaired'] > 0
+    assert taxonomy.token_usage['structured_repairs'] == counters['repair_requests']
@@ -0,0 +1,104 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from src.core.helper_functions import Taxonomy, Concept
+from src.core.name_normalization import normalize_concept_name
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+from src.evaluation.evaluation_functions import evaluate_taxonomy, f1_score, load_gold_taxonomy
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the interval index and the vectorized evaluation: the index answers the same ancestor/cotopy
+# questions as the concept tree, the evaluation gives the scores of the naive set-based computation
+
+# Helper function building a two-level taxonomy with the fake models
+def generated_taxonomy():
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    for _ in range(2):
+        taxonomy = iterate_level(taxonomy, 0, *models, log = LOG)
+    return taxonomy
+
+# Helper function building a taxonomy from a {name: subtree} dict (the root is the only top key)
+def taxonomy_from_tree(tree):
+    (root_name, subtree), = tree.items()
+    taxonomy = Taxonomy(root_name)
+    stack = [(taxonomy.root, subtree)]
+    while stack:
+        parent, subtree = stack.pop()
+        children = taxonomy.add_concepts(parent, [Concept(name, parent = parent, taxonomical_level = parent.taxonomical_level + 1) for name in subtree])
+        stack += [(child, subtree[child.name]) for child in children]
+    return taxonomy
+
+# Helper function returning the {name: subtree} dict of a concept
+def concept_tree(concept) -> dict:
+    return {concept.name: dict(item for child in concept.children for item in concept_tree(child).items())}
+
+# Helper function computing the scores of the evaluation with the cotopy sets of the concept objects
+def naive_evaluation(generated, gold) -> dict:
+    def cotopies(taxonomy):
+        result = {}
+        for concept in taxonomy.concepts:
+            hypernyms, hyponyms = concept.get_semantic_cotopy(lemmatized = False)
+            result[normalize_concept_name(concept.name)] = set(normalize_concept_name(c.name) for c in hypernyms + hyponyms + [concept])
+        return result
+    generated_cotopies, gold_cotopies = cotopies(generated), cotopies(gold)
+    common = [label for label in generated_cotopies if label in gold_cotopies]
+    precision = np.mean([len(generated_cotopies[c] & gold_cotopies[c])/len(generated_cotopies[c]) for c in common])
+    recall = np.mean([len(generated_cotopies[c] & gold_cotopies[c])/len(gold_cotopies[c]) for c in common])
+    lexical_precision, lexical_recall = len(common)/len(generated_cotopies), len(common)/len(gold_cotopies)
+    return {'common_concepts': len(common), 'lexical_precision': lexical_precision, 'lexical_recall': lexical_recall,
+            'taxonomic_precision': precision, 'taxonomic_recall': recall, 'taxonomic_f_prime': f1_score(lexical_recall, f1_score(precision, recall))}
+
+def test_index_answers_like_the_concept_tree(workdir):
+    taxonomy = generated_taxonomy()
+    index = taxonomy.get_interval_index()
+    concepts = list(taxonomy.concepts)
+    for concept in concepts:
+        hypernyms, hyponyms = concept.get_semantic_cotopy(lemmatized = False)
+        assert list(index.ancestors(concept.concept_id)) == [c.concept_id for c in hypernyms]
+        assert sorted(index.descendants(concept.concept_id)) == sorted(c.concept_id for c in hyponyms)
+        assert sorted(index.cotopy(concept.concept_id)) == sorted(c.concept_id for c in hypernyms + hyponyms)
+        assert index.cotopy_size(concept.concept_id) == len(hypernyms) + len(hyponyms)
+    ancestor_ids = {concept.concept_id: set(c.concept_id for c in concept.get_semantic_cotopy(lemmatized = False)[0]) for concept in concepts}
+    pairs = list(itertools.product(ancestor_ids, repeat = 2))
+    a, d = np.array(pairs).T
+    assert list(index.is_ancestor(a, d)) == [a in ancestor_ids[d] for a, d in pairs]
+    assert list(index.is_comparable(a, d)) == [a == d or a in ancestor_ids[d] or d in ancestor_ids[a] for a, d in pairs]
+
+def test_index_is_rebuilt_after_a_change(workdir):
+    taxonomy = generated_taxonomy()
+    index = taxonomy.get_interval_index()
+    assert taxonomy.get_interval_index() is index
+    leaf = taxonomy.root.children[0].children[0]
+    taxonomy.add_concepts(leaf, [Concept("Leaf Child", parent = leaf, taxonomical_level = 3)])
+    assert not index.is_current(taxonomy.concepts)
+    rebuilt = taxonomy.get_interval_index()
+    assert rebuilt is not index
+    assert list(rebuilt.ancestors(taxonomy.find_known_concept("Leaf Child").concept_id)) == [leaf.concept_id, leaf.parent.concept_id, taxonomy.root.concept_id]
+
+def test_evaluation_equals_the_naive_computation(workdir):
+    generated = generated_taxonomy()
+    tree = concept_tree(generated.root)
+    first, second, third = list(tree["Art"])[:3]
+    # gold: the subconcepts of the first concept moved under the second one, the third subtree missing, an extra branch
+    tree["Art"][second].update(tree["Art"].pop(first))
+    tree["Art"].pop(third)
+    tree["Art"]["Gold Only"] = {"Gold Leaf": {}}
+    gold = taxonomy_from_tree(tree)
+
+    scores = evaluate_taxonomy(generated, gold, log = LOG)
+    expected = naive_evaluation(generated, gold)
+    for key, value in expected.items():
+        assert scores[key] == pytest.approx(value)
+    assert 0 < scores['taxonomic_precision'] < 1 and 0 < scores['lexical_recall'] < 1
+
+def test_exported_taxonomy_evaluates_as_its_own_gold(workdir):
+    generated = generated_taxonomy()
+    gold = load_gold_taxonomy(generated.export_to_owl(format = 'turtle'), format = 'turtle', log = LOG)
+    assert len(gold) == len(generated.concepts)
+    scores = evaluate_taxonomy(generated, gold, log = LOG)
+    assert scores['common_concepts'] == len(generated.concepts)
+    assert scores['taxonomic_f1'] == scores['lexical_f1'] == scores['taxonomic_f_prime'] == 1.0
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from src.core.helper_functions import Taxonomy, load_taxonomy
+from src.core.taxonomy_construction import ConceptExpansion, construct_taxonomy, iterate_level, expand_concept, merge_concept_expansion
+
+from conftest import LOG, fake_models, taxonomy_snapshot
+
+# Behavior tests of the journal persistence mode: the mutations recorded after the last snapshot are replayed by
+# load_taxonomy, a checkpoint compacts the journal into the snapshot once it has journal_compact_every records
+
+# Helper function creating a taxonomy with two ranks lists whose root was expanded by both lists
+def two_ranks_lists_taxonomy(persistence):
+    taxonomy = Taxonomy("Art", persistence = persistence)
+    taxonomy.taxonomical_ranks = ['Genre, Style', 'Period, Movement']
+    taxonomy.taxonomical_context = ['Genre > Style', 'Period > Movement']
+    taxonomy.current_level = [1, 1]
+    taxonomy.uninspected_concepts = [[], []]
+    taxonomy.unknown_concepts = [[], []]
+    for rank_number, (rank, subconcepts) in enumerate([('Genre', ["Painting", "Sculpture"]), ('Period', ["Baroque", "Renaissance"])]):
+        new_concepts = merge_concept_expansion(taxonomy, rank_number, ConceptExpansion(taxonomy.root, rank, 1, "Creative work", subconcepts), log = LOG)
+        taxonomy.set_uninspected_concepts(rank_number, new_concepts)
+    return taxonomy
+
+# Helper function returning the tree of a taxonomy as (name, parent name, ranks list number) tuples
+def taxonomy_tree(taxonomy):
+    return sorted((concept.name, concept.parent.name if concept.parent else None, concept.taxonomical_ranks_list_number) for concept in taxonomy.concepts)
+
+def test_journal_replays_the_mutations_after_the_snapshot(workdir):
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, persistence = 'journal', log = LOG)
+    taxonomy = iterate_level(taxonomy, 0, *models, log = LOG)
+    snapshot_concepts = len(taxonomy.concepts)
+    # the second level is expanded without the final save of iterate_level (the process stops after the checkpoints)
+    ranks = taxonomy.taxonomical_ranks[0].split(',')
+    for concept in list(taxonomy.uninspected_concepts[0]):
+        expansion = expand_concept(concept, taxonomy.root.name, ranks, taxonomy.taxonomical_context[0], *models, log = LOG)
+        taxonomy.update_uninspected_concepts(0, removed = [concept], added = merge_concept_expansion(taxonomy, 0, expansion, log = LOG))
+        taxonomy.checkpoint()
+    taxonomy.close_journal()
+    assert len(taxonomy.concepts) > snapshot_concepts
+    assert os.path.getsize(os.path.splitext(taxonomy.saved_to[0])[0] + '.journal') > 0
+
+    loaded = load_taxonomy(taxonomy.saved_to[0])
+    assert taxonomy_snapshot(loaded) == taxonomy_snapshot(taxonomy)
+    assert loaded.concepts[snapshot_concepts].definition == taxonomy.concepts[snapshot_concepts].definition
+    assert loaded.journal_seq == taxonomy.journal_seq
+    loaded.close_journal()
+
+def test_checkpoints_compact_the_journal(workdir):
+    taxonomy = two_ranks_lists_taxonomy('journal')
+    taxonomy.journal_compact_every = 4
+    for concept in list(taxonomy.root.children):
+        merge_concept_expansion(taxonomy, concept.taxonomical_ranks_list_number, ConceptExpansion(concept, 'Style', 2, "", [concept.name + " A", concept.name + " B"]), log = LOG)
+        taxonomy.checkpoint()
+        assert taxonomy.journal.records < taxonomy.journal_compact_every
+    taxonomy.close_journal()
+    loaded = load_taxonomy(taxonomy.saved_to[0])
+    assert taxonomy_tree(loaded) == taxonomy_tree(taxonomy)
+    assert len(loaded.concepts) == 1 + 4 + 8
+    loaded.close_journal()
+
+@pytest.mark.parametrize('persistence', ['pickle', 'journal'])
+def test_failed_expansion_clears_only_the_children_of_its_ranks_list(workdir, persistence):
+    taxonomy = two_ranks_lists_taxonomy(persistence)
+    taxonomy.save()
+    # the root fails in the first ranks list: its children of the second ranks list stay
+    merge_concept_expansion(taxonomy, 0, ConceptExpansion(taxonomy.root, definition = "Creative work", failed = True), log = LOG)
+    assert [concept.name for concept in taxonomy.root.children] == ["Baroque", "Renaissance"]
+    assert taxonomy.unknown_concepts[0] == [taxonomy.root]
+    # more work after the failure
+    baroque = taxonomy.root.children[0]
+    merge_concept_expansion(taxonomy, 1, ConceptExpansion(baroque, 'Movement', 2, "", ["Rococo"]), log = LOG)
+    if persistence == 'pickle':
+        taxonomy.save()
+    taxonomy.close_journal()
+
+    loaded = load_taxonomy(taxonomy.saved_to[0])
+    assert [concept.name for concept in loaded.root.children] == ["Baroque", "Renaissance"]
+    assert [concept.name for concept in loaded.root.children[0].children] == ["Rococo"]
+    assert taxonomy_snapshot(loaded) == taxonomy_snapshot(taxonomy)
+    loaded.close_journal()
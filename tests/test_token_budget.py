@@ -0,0 +1,62 @@
+import pytest
+
+from src.core.expansion_scheduler import expand_taxonomy
+from src.core.helper_functions import load_taxonomy
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+from src.core.token_budget import TokenBudget, BudgetedChatModel, BudgetExceededError
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the token budget: a request that does not fit stops the expansion, which saves its progress and
+# returns with taxonomy.stop_reason = 'budget_exhausted'; every token spent is counted both by the budget and the taxonomy
+
+# Helper function wrapping the models with one shared budget
+def budgeted_models(models, budget) -> list:
+    return [BudgetedChatModel(model, budget) for model in models]
+
+@pytest.mark.parametrize('max_concurrency', [1, 4])
+def test_exhausted_budget_stops_the_level_and_returns(workdir, max_concurrency):
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    taxonomy = iterate_level(taxonomy, 0, *models, log = LOG)
+    frontier = list(taxonomy.uninspected_concepts[0])
+    tokens_before = taxonomy.token_usage['total_tokens']
+    budget = TokenBudget(max_tokens = 5000, log = LOG)
+
+    taxonomy = iterate_level(taxonomy, 0, *budgeted_models(models, budget), max_concurrency = max_concurrency, log = LOG)
+    assert taxonomy.stop_reason == 'budget_exhausted'
+    assert budget.rejected >= 1
+    assert taxonomy.token_usage['total_tokens'] - tokens_before == budget.usage()['run']['tokens'] <= 5000
+    # the concepts that were not expanded stay in the frontier
+    unexpanded = [concept for concept in frontier if not concept.children and concept not in taxonomy.unknown_concepts[0]]
+    assert unexpanded and all(concept in taxonomy.uninspected_concepts[0] for concept in unexpanded)
+    assert load_taxonomy(taxonomy.saved_to[0]).stop_reason == 'budget_exhausted'
+
+    # the next call starts with a clean stop reason
+    taxonomy = iterate_level(taxonomy, 0, *models, max_concurrency = max_concurrency, log = LOG)
+    assert taxonomy.stop_reason is None
+    assert not any(concept in taxonomy.uninspected_concepts[0] for concept in unexpanded)
+
+def test_exhausted_budget_stops_the_construction(workdir):
+    budget = TokenBudget(max_tokens = 3000, log = LOG)
+    taxonomy = construct_taxonomy("Art", *budgeted_models(fake_models(), budget), log = LOG)
+    assert taxonomy.stop_reason == 'budget_exhausted'
+    assert taxonomy.token_usage['total_tokens'] == budget.usage()['run']['tokens'] > 0
+
+def test_exhausted_budget_stops_the_scheduler(workdir):
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    taxonomy = expand_taxonomy(taxonomy, *budgeted_models(models, TokenBudget(max_tokens = 8000, log = LOG)), max_concurrency = 4, log = LOG)
+    assert taxonomy.stop_reason == 'budget_exhausted'
+    assert taxonomy.uninspected_concepts[0]
+
+def test_stop_mode_rejects_and_degrade_mode_reduces_the_request():
+    stop = TokenBudget(max_tokens = 1000, log = LOG)
+    with pytest.raises(BudgetExceededError):
+        stop.reserve('gpt-4o-mini', 100, 2000)
+    degrade = TokenBudget(max_tokens = 1000, on_exhausted = 'degrade', log = LOG)
+    reservation, max_tokens = degrade.reserve('gpt-4o-mini', 100, 2000)
+    assert max_tokens == 900
+    degrade.commit(reservation, {'prompt_tokens': 100, 'completion_tokens': 50, 'total_tokens': 150})
+    assert degrade.usage()['run']['tokens'] == 150
+    assert degrade.degraded == 1
@@ -0,0 +1,99 @@
+import os
+import json
+import logging
+
+import pytest
+
+from src.core.taxonomy_construction import construct_taxonomy, iterate_level
+from src.core.tracing import Tracer, TracedChatModel, result_outcome, log_sampled
+
+from conftest import LOG, fake_models, taxonomy_snapshot
+
+# Behavior tests of the tracer: the spans of the pipeline are nested and written as JSON lines, the model requests are
+# counted in their stage spans, the aggregates reach the Prometheus file and tracing leaves the taxonomy as it is
+
+# Helper function reading the spans written by a tracer
+def read_spans(path) -> list:
+    with open(path, encoding = 'utf-8') as file:
+        return [json.loads(line) for line in file]
+
+def test_default_paths_are_under_the_working_directory(workdir):
+    tracer = Tracer(log = LOG)
+    assert tracer.path == os.path.join(str(workdir), 'logs', 'traces', 'spans.jsonl')
+    assert tracer.prometheus_path == os.path.join(str(workdir), 'logs', 'traces', 'spans.prom')
+    assert os.path.isdir(os.path.dirname(tracer.path))
+
+def test_spans_are_nested_and_written(workdir):
+    tracer = Tracer(path = "spans.jsonl", buffer_spans = 2, log = LOG)
+    with tracer.activate(), tracer.span('level', level = 1) as level:
+        with tracer.span('expand_concept') as span:
+            span.set_result(([], {'prompt_tokens': 10, 'completion_tokens': 2, 'total_tokens': 12}))
+        with pytest.raises(RuntimeError):
+            with tracer.span('merge'):
+                raise RuntimeError("merge failed")
+    # the full buffer was written before the end of the level span
+    assert [span['name'] for span in read_spans("spans.jsonl")] == ['expand_concept', 'merge']
+    tracer.flush()
+    spans = {span['name']: span for span in read_spans("spans.jsonl")}
+    assert spans['expand_concept']['parent_id'] == spans['merge']['parent_id'] == level.span_id
+    assert spans['expand_concept']['outcome'] == 'empty' and spans['expand_concept']['token_usage']['total_tokens'] == 12
+    assert spans['merge']['outcome'] == 'error' and spans['merge']['error'] == "RuntimeError: merge failed"
+    assert spans['level']['level'] == 1 and 'parent_id' not in spans['level']
+
+def test_result_outcomes():
+    assert result_outcome(True) == ('accepted', None, None)
+    assert result_outcome([True, False, True]) == ('partial', 3, 2)
+    assert result_outcome({'a': False}) == ('rejected', 1, 0)
+    assert result_outcome(" ") == ('empty', None, None)
+    assert result_outcome(["Fresco"]) == ('ok', 1, None)
+
+def test_span_file_is_rotated(workdir):
+    tracer = Tracer(path = "spans.jsonl", max_bytes = 200, backup_count = 2, buffer_spans = 1, log = LOG)
+    for i in range(6):
+        with tracer.span('checkpoint', index = i):
+            pass
+    assert os.path.exists("spans.jsonl.1") and os.path.exists("spans.jsonl.2") and not os.path.exists("spans.jsonl.3")
+
+def test_traced_level(tmp_path, monkeypatch):
+    snapshots = []
+    for traced in (False, True):
+        (tmp_path / str(traced)).mkdir()
+        monkeypatch.chdir(tmp_path / str(traced))
+        models = fake_models()
+        tracer = Tracer(path = "spans.jsonl", log = LOG) if traced else None
+        traced_models = [TracedChatModel(model, tracer) for model in models] if traced else models
+        taxonomy = construct_taxonomy("Art", *traced_models, log = LOG, tracer = tracer)
+        taxonomy = iterate_level(taxonomy, 0, *traced_models, max_concurrency = 4, log = LOG, tracer = tracer)
+        snapshots.append(taxonomy_snapshot(taxonomy)['concepts'])
+    # tracing leaves the taxonomy as it is
+    assert snapshots[0] == snapshots[1]
+    tracer.close()
+    spans = read_spans("spans.jsonl")
+    by_id = {span['span_id']: span for span in spans}
+    llm_spans = [span for span in spans if span['kind'] == 'llm']
+    assert len(llm_spans) == sum(model.calls for model in models)
+    assert all(by_id[span['parent_id']]['kind'] == 'stage' for span in llm_spans)
+    assert sum(span['token_usage']['total_tokens'] for span in llm_spans) == taxonomy.token_usage['total_tokens']
+    # every model request is counted in its stage span, the stage spans of the expansion carry the level
+    stage_spans = [span for span in spans if span['kind'] == 'stage']
+    assert sum(span.get('llm_calls', 0) for span in stage_spans) == len(llm_spans)
+    assert any(span.get('level') == 1 for span in stage_spans)
+    stats = tracer.stats()
+    assert 'construction' in stats and 'ranks_list 0, level 1' in stats
+    assert stats['ranks_list 0, level 1']['llm:fake-chat-model']['count'] == sum(1 for span in llm_spans if span.get('level') == 1)
+    with open(tracer.prometheus_path, encoding = 'utf-8') as file:
+        prometheus = file.read()
+    assert 'taxorank_span_duration_seconds_count{kind="llm",span="llm"' in prometheus
+    assert 'taxorank_span_tokens_total{' in prometheus and 'type="prompt"' in prometheus
+
+@pytest.mark.parametrize('sample_rate, logged', [(0.0, False), (1.0, True)])
+def test_prompt_logs_are_sampled(workdir, caplog, sample_rate, logged):
+    log = logging.getLogger("tests.tracing")
+    log.setLevel(logging.INFO)
+    tracer = Tracer(path = "spans.jsonl", prompt_log_sample_rate = sample_rate, log = LOG)
+    with caplog.at_level(logging.INFO, logger = "tests.tracing"):
+        with tracer.span('define', kind = 'stage'):
+            log_sampled(log, "prompt %s", "sampled")
+        # without a span every message is logged
+        log_sampled(log, "prompt %s", "untraced")
+    assert [record.getMessage() for record in caplog.records] == (["prompt sampled"] if logged else []) + ["prompt untraced"]
@@ -0,0 +1,107 @@
+import os
+import time
+
+from src.core.expansion_scheduler import expand_taxonomy
+from src.core.taxonomy_construction import construct_taxonomy
+from src.core.work_queue import WorkQueue, QueueCoordinator, run_worker
+
+from conftest import LOG, fake_models
+
+# Behavior tests of the durable work queue of the distributed expansion: an expired lease is taken over by another
+# worker, a task fails after max_attempts leases, the coordinator merges the failed tasks terminally (unknown concepts)
+
+# Helper function returning the (name, parent name) pairs of a taxonomy
+def concept_edges(taxonomy) -> set:
+    return set((concept.name, concept.parent.name if concept.parent else None) for concept in taxonomy.concepts)
+
+def test_default_path_is_under_the_working_directory(workdir):
+    work_queue = WorkQueue(log = LOG)
+    assert work_queue.path == os.path.join(str(workdir), 'data', 'runs', 'work_queue.sqlite')
+    assert os.path.exists(work_queue.path)
+    work_queue.close()
+
+def test_expired_lease_is_requeued_until_max_attempts(workdir):
+    taxonomy = construct_taxonomy("Art", *fake_models(), log = LOG)
+    work_queue = WorkQueue(lease_seconds = 0.05, max_attempts = 2, log = LOG)
+    concept = taxonomy.uninspected_concepts[0][0]
+    assert work_queue.enqueue(taxonomy, 0, [concept]) == 1
+    assert work_queue.enqueue(taxonomy, 0, [concept]) == 0
+
+    first = work_queue.lease("first", limit = 4)
+    assert [task['concept_id'] for task in first] == [concept.concept_id]
+    assert first[0]['payload']['name'] == concept.name
+    assert work_queue.lease("second") == []
+    time.sleep(0.06)
+    # the expired lease is taken over by another worker
+    assert [task['task_id'] for task in work_queue.lease("second")] == [first[0]['task_id']]
+    time.sleep(0.06)
+    # the lease expired max_attempts times: the task fails, the late result of the first worker is ignored
+    assert work_queue.lease("third") == []
+    work_queue.complete("first", [(first[0]['task_id'], {'definition': "late"})])
+    stats = work_queue.stats(taxonomy.taxonomy_id)
+    assert (stats['queued'], stats['leased'], stats['done'], stats['failed'], stats['requeued']) == (0, 0, 0, 1, 1)
+    assert work_queue.results(taxonomy.taxonomy_id) == [(first[0]['task_id'], 0, concept.concept_id, 'failed', None, 'lease expired')]
+    assert work_queue.outstanding(taxonomy.taxonomy_id) == 0
+    work_queue.close()
+
+def test_failed_and_released_attempts(workdir):
+    taxonomy = construct_taxonomy("Art", *fake_models(), log = LOG)
+    work_queue = WorkQueue(max_attempts = 2, log = LOG)
+    concept = taxonomy.uninspected_concepts[0][0]
+    work_queue.enqueue(taxonomy, 0, [concept])
+    # a released task does not count the attempt, a failed one is queued again until max_attempts
+    task_ids = [task['task_id'] for task in work_queue.lease("worker")]
+    work_queue.release("worker", task_ids)
+    for _ in range(2):
+        assert work_queue.stats()['queued'] == 1
+        work_queue.fail("worker", [task['task_id'] for task in work_queue.lease("worker")], RuntimeError("model error"))
+    assert work_queue.stats()['failed'] == 1
+    assert work_queue.results(taxonomy.taxonomy_id)[0][3:] == ('failed', None, "model error")
+    # a failed concept back in the frontier is queued again
+    work_queue.mark_merged(task_ids)
+    work_queue.enqueue(taxonomy, 0, [concept])
+    assert work_queue.stats()['queued'] == 1
+    work_queue.close()
+
+def test_coordinator_merges_failed_tasks_terminally(workdir):
+    taxonomy = construct_taxonomy("Art", *fake_models(), log = LOG)
+    frontier = list(taxonomy.uninspected_concepts[0])
+    work_queue = WorkQueue(max_attempts = 1, log = LOG)
+    coordinator = QueueCoordinator(taxonomy, work_queue, log = LOG)
+    coordinator.flush()
+    tasks = work_queue.lease("worker", limit = len(frontier))
+    work_queue.fail("worker", [task['task_id'] for task in tasks], RuntimeError("model error"))
+
+    taxonomy = coordinator.run(poll_interval = 0.01)
+    assert coordinator.stop_reason == 'frontier_exhausted'
+    assert coordinator.stats['failed_tasks'] == len(frontier)
+    assert taxonomy.uninspected_concepts[0] == []
+    assert all(concept in taxonomy.unknown_concepts[0] and not concept.children for concept in frontier)
+    # the failed tasks are neither queued again nor merged twice
+    assert work_queue.outstanding(taxonomy.taxonomy_id) == 0 and work_queue.results(taxonomy.taxonomy_id) == []
+    work_queue.close()
+
+def test_distributed_expansion_matches_the_scheduler(tmp_path, monkeypatch):
+    (tmp_path / "scheduler").mkdir()
+    monkeypatch.chdir(tmp_path / "scheduler")
+    models = fake_models()
+    expected = expand_taxonomy(construct_taxonomy("Art", *models, log = LOG), *models, max_depth = 2, max_concurrency = 1, log = LOG)
+
+    (tmp_path / "distributed").mkdir()
+    monkeypatch.chdir(tmp_path / "distributed")
+    models = fake_models()
+    taxonomy = construct_taxonomy("Art", *models, log = LOG)
+    work_queue = WorkQueue(log = LOG)
+    coordinator = QueueCoordinator(taxonomy, work_queue, max_depth = 2, log = LOG)
+    coordinator.flush()
+    # the worker and the coordinator take turns: the worker expands the queued tasks, the coordinator merges and enqueues
+    while work_queue.outstanding(taxonomy.taxonomy_id):
+        stats = run_worker(work_queue, *models, worker_id = "worker", max_concurrency = 1, idle_timeout = 0, poll_interval = 0.01, log = LOG)
+        assert stats['stop_reason'] == 'idle' and stats['failed'] == 0
+        coordinator.merge_results()
+        coordinator.flush()
+    taxonomy = coordinator.run(poll_interval = 0.01)
+    assert coordinator.stop_reason == 'frontier_exhausted'
+    assert concept_edges(taxonomy) == concept_edges(expected)
+    assert work_queue.stats(taxonomy.taxonomy_id)['done'] == len([concept for concept in taxonomy.concepts if concept.taxonomical_level < 2])
+    work_queue.close()